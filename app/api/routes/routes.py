@@ -4,22 +4,32 @@ from fastapi.responses import PlainTextResponse, JSONResponse
 from pydantic import ValidationError
 
 from app.api.models import PaymentsRequestModel
+from app.api.sticky import StickyRouter
 from app.bot.utils import TelegramError
 from app.services.cryptopay import CryptoPayError
 from app.services.db import DataBase, DatabaseError
-from app.services.payment_successful import payment_success
+from app.services.payment_successful import payment_success, PaymentWorker
+from app.services.metrics import REGISTRY, merge_workers
+from app.services.tracing import tracer
+import hmac
 import logging
 
 class Handlers:
-    def __init__(self, database: DataBase, dp: Dispatcher, bot: Bot):
+    def __init__(self, database: DataBase, dp: Dispatcher, bot: Bot, payment_worker: PaymentWorker = None, sticky: StickyRouter = None,
+                 metrics_token: str = None):
         self.database = database
         self.dp = dp
         self.bot = bot
+        self.payment_worker = payment_worker
+        self.sticky = sticky
+        self.metrics_token = metrics_token
 
     async def payments_webhook(self, request: Request) -> PlainTextResponse:
         try:
             validated_data = PaymentsRequestModel(** await request.json())
-            await payment_success(self.bot, self.database, validated_data.update_type, validated_data.payload.invoice_id)
+            # Подтверждаем сразу после записи в журнал, начисляет PaymentWorker
+            if await payment_success(self.bot, self.database, validated_data.update_type, validated_data.payload.invoice_id) and self.payment_worker:
+                self.payment_worker.notify()
             return PlainTextResponse('OK', status_code=200)
         except ValidationError:
             return PlainTextResponse('Wrong request', status_code=400)
@@ -31,10 +41,33 @@ class Handlers:
             logging.exception(e)
             return PlainTextResponse('Error', status_code=500)
 
+    async def metrics(self, request: Request) -> PlainTextResponse:
+        # Метрики отдаются только с заголовком Authorization: Bearer <METRICS_TOKEN>
+        authorization = request.headers.get("Authorization", "")
+        if not self.metrics_token or not hmac.compare_digest(authorization.encode(), f"Bearer {self.metrics_token}".encode()):
+            return PlainTextResponse('Unauthorized', status_code=401)
+        text = REGISTRY.render()
+        # Воркер 0 собирает метрики остальных воркеров: они слушают только внутренние адреса
+        if self.sticky and self.sticky.index == 0 and len(self.sticky.worker_urls) > 1 and not self.sticky.is_forwarded(request.headers):
+            text = merge_workers({"0": text, **await self.sticky.fetch_metrics(authorization)})
+        return PlainTextResponse(text, media_type="text/plain; version=0.0.4")
+
+    async def process_update(self, update: types.Update):
+        async with tracer.trace("webhook", update_id=update.update_id):
+            await self.dp.feed_webhook_update(self.bot, update)
+
     async def bot_webhook(self, request: Request) -> JSONResponse:
         try:
-            update = types.Update(**await request.json())
-            await self.dp.feed_webhook_update(self.bot, update)
+            data = await request.json()
+            if self.sticky and self.sticky.is_forwarded(request.headers):
+                # Пересланный апдейт подтверждаем сразу, ответ модели может идти дольше таймаута пересылки
+                update = types.Update(**data)
+                self.sticky.accept(data, lambda: self.process_update(update))
+                return JSONResponse(content={"status": "ok"})
+            # Апдейты пользователя обрабатывает закрепленный за ним воркер
+            if self.sticky and await self.sticky.route(data, request.headers):
+                return JSONResponse(content={"status": "ok"})
+            await self.process_update(types.Update(**data))
             return JSONResponse(content={"status": "ok"})
         except ValueError:
             return JSONResponse(content={"message": "Wrong request"}, status_code=400)
@@ -2,10 +2,16 @@ from fastapi import APIRouter
 from app.api.routes.routes import Handlers
 from aiogram import Bot, Dispatcher
 from app.services.db import DataBase
+from app.services.payment_successful import PaymentWorker
+from app.api.sticky import StickyRouter
 
 
-def register_routes(router: APIRouter, database: DataBase, dp: Dispatcher, bot: Bot, telegram_token: str, cryptopay_token: str):
-    routes_class = Handlers(database, dp, bot)
+def register_routes(router: APIRouter, database: DataBase, dp: Dispatcher, bot: Bot, telegram_token: str, cryptopay_token: str, payment_worker: PaymentWorker = None, sticky: StickyRouter = None,
+                    metrics_token: str = None):
+    routes_class = Handlers(database, dp, bot, payment_worker, sticky, metrics_token)
 
     router.add_api_route("/" + telegram_token, routes_class.bot_webhook, methods=["POST"])
-    router.add_api_route("/" + cryptopay_token, routes_class.payments_webhook, methods=["POST"])
\ No newline at end of file
+    router.add_api_route("/" + cryptopay_token, routes_class.payments_webhook, methods=["POST"])
+    # Без токена /metrics на публичном приложении не публикуется
+    if metrics_token:
+        router.add_api_route("/metrics", routes_class.metrics, methods=["GET"])
\ No newline at end of file
@@ -0,0 +1,125 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+
+import aiohttp
+
+FORWARDED_HEADER = "X-Sticky-Forwarded"
+
+def update_user_id(update: Dict[str, Any]) -> Optional[int]:
+    """Id пользователя (или чата) из сырого JSON апдейта Telegram"""
+    for key, value in update.items():
+        if key == "update_id" or not isinstance(value, dict):
+            continue
+        if isinstance(value.get("from"), dict):
+            return value["from"]["id"]
+        if isinstance(value.get("user"), dict):
+            return value["user"]["id"]
+        if isinstance(value.get("chat"), dict):
+            return value["chat"]["id"]
+    return None
+
+class StickyRouter:
+    """Закрепляет пользователя за воркером: user_id % len(worker_urls).
+
+    Воркер, получивший апдейт чужого пользователя, пересылает его владельцу,
+    поэтому апдейты одного пользователя обрабатываются одним процессом по
+    порядку, а локальные состояния (склейка сообщений, кэши) остаются верными.
+    Владелец подтверждает пересланный апдейт сразу и обрабатывает его в фоне
+    (accept), так что долгий ответ модели не упирается в таймаут пересылки.
+    На месте апдейт обрабатывается только если соединение с владельцем не
+    установлено: после отправки запроса повтор дал бы двойной ответ и
+    двойное списание.
+    """
+    def __init__(self, worker_urls: List[str], index: int, path: str, timeout: float = 10, connect_timeout: float = 3):
+        self.worker_urls = worker_urls
+        self.index = index
+        self.path = path
+        self.timeout = aiohttp.ClientTimeout(total=timeout, sock_connect=connect_timeout)
+        self.session: Optional[aiohttp.ClientSession] = None
+        # Фоновая обработка пересланных апдейтов: последняя задача каждого пользователя
+        self._tails: Dict[Any, asyncio.Task] = {}
+        self._tasks: Set[asyncio.Task] = set()
+
+    def owner(self, update: Dict[str, Any]) -> int:
+        user_id = update_user_id(update)
+        key = user_id if user_id is not None else update.get("update_id", 0)
+        return key % len(self.worker_urls)
+
+    async def forward(self, owner: int, update: Dict[str, Any]) -> bool:
+        """False, только если запрос точно не дошел до владельца"""
+        if self.session is None:
+            self.session = aiohttp.ClientSession(timeout=self.timeout)
+        try:
+            async with self.session.post(self.worker_urls[owner] + self.path, json=update, headers={FORWARDED_HEADER: "1"}) as response:
+                if response.status != 200:
+                    logging.error(f"Worker {owner} answered {response.status} to update {update.get('update_id')}")
+                return True
+        except (aiohttp.ClientConnectorError, aiohttp.ConnectionTimeoutError) as e:
+            logging.error(f"Worker {owner} is unreachable, handling update {update.get('update_id')} here: {e}")
+            return False
+        except (aiohttp.ClientError, TimeoutError) as e:
+            # Запрос мог быть доставлен, повторять его здесь нельзя
+            logging.error(f"Forward of update {update.get('update_id')} to worker {owner} failed after sending: {e}")
+            return True
+
+    async def route(self, update: Dict[str, Any], headers) -> bool:
+        """True, если апдейт передан другому воркеру и здесь его обрабатывать не нужно"""
+        if len(self.worker_urls) < 2 or self.is_forwarded(headers):
+            return False
+        owner = self.owner(update)
+        if owner == self.index:
+            return False
+        return await self.forward(owner, update)
+
+    async def fetch_metrics(self, authorization: str) -> Dict[str, Optional[str]]:
+        """Выдача /metrics остальных воркеров, None для не ответивших"""
+        if self.session is None:
+            self.session = aiohttp.ClientSession(timeout=self.timeout)
+
+        async def fetch(index: int) -> Optional[str]:
+            try:
+                async with self.session.get(self.worker_urls[index] + "/metrics", headers={FORWARDED_HEADER: "1", "Authorization": authorization}) as response:
+                    if response.status == 200:
+                        return await response.text()
+                    logging.error(f"Worker {index} answered {response.status} to the metrics scrape")
+            except (aiohttp.ClientError, TimeoutError) as e:
+                logging.error(f"Metrics scrape of worker {index} failed: {e}")
+            return None
+
+        others = [index for index in range(len(self.worker_urls)) if index != self.index]
+        results = await asyncio.gather(*(fetch(index) for index in others))
+        return {str(index): text for index, text in zip(others, results)}
+
+    def is_forwarded(self, headers) -> bool:
+        return bool(headers.get(FORWARDED_HEADER))
+
+    def accept(self, update: Dict[str, Any], process: Callable[[], Awaitable[Any]]) -> asyncio.Task:
+        """Запускает process() в фоне после предыдущих апдейтов того же пользователя"""
+        key = update_user_id(update)
+        task = asyncio.create_task(self._run_after(self._tails.get(key), process, update))
+        self._tails[key] = task
+        self._tasks.add(task)
+        task.add_done_callback(lambda done: self._forget(key, done))
+        return task
+
+    async def _run_after(self, previous: Optional[asyncio.Task], process: Callable[[], Awaitable[Any]], update: Dict[str, Any]):
+        if previous is not None:
+            await asyncio.wait([previous])
+        try:
+            await process()
+        except Exception:
+            logging.exception(f"Forwarded update {update.get('update_id')} failed")
+
+    def _forget(self, key, task: asyncio.Task):
+        self._tasks.discard(task)
+        if self._tails.get(key) is task:
+            del self._tails[key]
+
+    async def close(self, timeout: float = 30):
+        # Даем закончить уже подтвержденные апдейты
+        if self._tasks:
+            await asyncio.wait(set(self._tasks), timeout=timeout)
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
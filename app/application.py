@@ -1,6 +1,8 @@
 import sys
 import os
 import asyncio
+import multiprocessing
+from typing import List
 
 # Исправление для работы в Windows - устанавливаем WindowsSelectorEventLoopPolicy
 if sys.platform.startswith('win'):
@@ -15,6 +17,10 @@ from app.services.openaitools import OpenAiTools
 from app.services.stablediffusion import StableDiffusion
 from app.services.midjourney import MidJourney
 from app.services.telegram_stars import TelegramStarsService
+from app.services.governor import Governor, DEFAULT_LIMITS, share_limits
+from app.services.payment_successful import PaymentWorker
+from app.services.metrics import instrument_database, register_pool
+from app.services.tracing import tracer, JsonlExporter
 
 from dotenv import load_dotenv
 
@@ -28,103 +34,197 @@ from aiogram.enums import ParseMode
 from aiogram.client.bot import DefaultBotProperties
 
 from app.bot.setup import register_handlers
+from app.bot.middlewares import BotApiTracingMiddleware
+from app.bot.storage import PostgresStorage, create_storage
 
 from app.api.setup import register_routes
+from app.api.sticky import StickyRouter
 
 from app.core.database import DataBaseCore
+from app.core.sqlite_database import SQLiteDataBaseCore
+
+def configure_tracing():
+    # Трассы пишутся в TRACE_FILE (OTLP JSON по строке на спан), иначе в лог
+    tracer.configure(
+        exporter=JsonlExporter(os.getenv("TRACE_FILE")) if os.getenv("TRACE_FILE") else None,
+        sample_rate=float(os.getenv("TRACE_SAMPLE_RATE", 0.01)),
+        slow_threshold=float(os.getenv("TRACE_SLOW_SECONDS", 2)),
+    )
 
 async def main():
     print("=== Запуск бота в режиме polling ===")
     load_dotenv()
+    configure_tracing()
 
-    dp = Dispatcher()
-
-    database_core = DataBaseCore(os.getenv("DATABASE_URL"))
+    database_core = SQLiteDataBaseCore(os.getenv("DATABASE_URL")) if os.getenv("DATABASE_URL").startswith("sqlite") else DataBaseCore(os.getenv("DATABASE_URL"))
     print(f"DATABASE_URL: {os.getenv('DATABASE_URL')}")
 
-    database = DataBase(database_core.pool)
+    database = instrument_database(DataBase(database_core.pool))
+    register_pool(database_core)
+
+    storage = create_storage(os.getenv("FSM_STORAGE"), database_core.pool)
 
-    openai = OpenAiTools(os.getenv("OPENAI_API_KEY"))
+    dp = Dispatcher(storage=storage)
 
-    stable = StableDiffusion(os.getenv("STABLE_DIFFUSION_API_KEY"))
+    governor = Governor(DEFAULT_LIMITS)
+
+    openai = OpenAiTools(os.getenv("OPENAI_API_KEY"), governor)
+
+    stable = StableDiffusion(os.getenv("STABLE_DIFFUSION_API_KEY"), governor)
     
-    midjourney = MidJourney(os.getenv("MIDJOURNEY_API_KEY"))
+    midjourney = MidJourney(os.getenv("MIDJOURNEY_API_KEY"), governor)
     
-    cryptopay = CryptoPay(os.getenv("CRYPTOPAY_KEY"))
+    cryptopay = CryptoPay(os.getenv("CRYPTOPAY_KEY"), float(os.getenv("CRYPTOPAY_RATES_INTERVAL", 60)))
     
     telegram_stars = TelegramStarsService(
         api_id=int(os.getenv("TELEGRAM_API_ID")),
         api_hash=os.getenv("TELEGRAM_API_HASH"),
-        bot_token=os.getenv("TELEGRAM_BOT_TOKEN")
+        bot_token=os.getenv("TELEGRAM_BOT_TOKEN"),
+        payments_path=os.getenv("TELEGRAM_STARS_PAYMENTS_FILE")
     )
 
     register_handlers(dp, database, openai, stable, cryptopay, midjourney, telegram_stars)
 
     bot = Bot(token=os.getenv("TELEGRAM_BOT_TOKEN"), default=DefaultBotProperties(parse_mode=ParseMode.HTML))
+    bot.session.middleware(BotApiTracingMiddleware())
 
     print("=== Инициализация базы данных и Telegram Stars ===")
     await database_core.open_pool()
     await database.create_tables()
+    if isinstance(storage, PostgresStorage):
+        await storage.create_table()
     # Инициализируем клиент Telethon для Telegram Stars
     await telegram_stars.init_client()
+    payment_worker = PaymentWorker(bot, database)
+    payment_worker.start()
     
     print("=== Запуск polling для приема сообщений ===")
     # Вместо установки webhook используем polling
-    await dp.start_polling(bot)
-
-def run():
-    print("=== Запуск бота ===")
-    load_dotenv()
+    try:
+        await dp.start_polling(bot)
+    finally:
+        await cryptopay.close()
 
-    dp = Dispatcher()
+def create_app(worker_index: int = 0, worker_urls: List[str] = None) -> FastAPI:
+    """Приложение одного воркера. Webhook устанавливает только воркер 0"""
+    configure_tracing()
 
     app = FastAPI()
 
-    cryptopay = CryptoPay(os.getenv("CRYPTOPAY_KEY"))
+    cryptopay = CryptoPay(os.getenv("CRYPTOPAY_KEY"), float(os.getenv("CRYPTOPAY_RATES_INTERVAL", 60)))
 
-    database_core = DataBaseCore(os.getenv("DATABASE_URL"))
+    database_core = SQLiteDataBaseCore(os.getenv("DATABASE_URL")) if os.getenv("DATABASE_URL").startswith("sqlite") else DataBaseCore(os.getenv("DATABASE_URL"))
     print(f"DATABASE_URL: {os.getenv('DATABASE_URL')}")
 
-    database = DataBase(database_core.pool)
+    database = instrument_database(DataBase(database_core.pool))
+    register_pool(database_core)
+
+    # При нескольких воркерах состояние FSM должно переживать смену воркера
+    storage = create_storage(os.getenv("FSM_STORAGE", "database" if worker_urls else "memory"), database_core.pool)
+
+    dp = Dispatcher(storage=storage)
+
+    # Лимиты провайдеров общие на все воркеры, каждому достается своя доля
+    governor = Governor(share_limits(DEFAULT_LIMITS, len(worker_urls) if worker_urls else 1))
 
-    openai = OpenAiTools(os.getenv("OPENAI_API_KEY"))
+    openai = OpenAiTools(os.getenv("OPENAI_API_KEY"), governor)
 
-    stable = StableDiffusion(os.getenv("STABLE_DIFFUSION_API_KEY"))
+    stable = StableDiffusion(os.getenv("STABLE_DIFFUSION_API_KEY"), governor)
     
-    midjourney = MidJourney(os.getenv("MIDJOURNEY_API_KEY"))
+    midjourney = MidJourney(os.getenv("MIDJOURNEY_API_KEY"), governor)
     
     telegram_stars = TelegramStarsService(
         api_id=int(os.getenv("TELEGRAM_API_ID")),
         api_hash=os.getenv("TELEGRAM_API_HASH"),
-        bot_token=os.getenv("TELEGRAM_BOT_TOKEN")
+        bot_token=os.getenv("TELEGRAM_BOT_TOKEN"),
+        payments_path=os.getenv("TELEGRAM_STARS_PAYMENTS_FILE"),
+        session=f"telegram_stars_session_{worker_index}" if worker_index else "telegram_stars_session"
     )
 
     register_handlers(dp, database, openai, stable, cryptopay, midjourney, telegram_stars)
 
     bot = Bot(token=os.getenv("TELEGRAM_BOT_TOKEN"), default=DefaultBotProperties(parse_mode=ParseMode.HTML))
+    bot.session.middleware(BotApiTracingMiddleware())
 
     router = APIRouter()
 
-    register_routes(router, database, dp, bot, os.getenv("TELEGRAM_BOT_TOKEN"), os.getenv("CRYPTOPAY_KEY"))
+    payment_worker = PaymentWorker(bot, database)
+
+    sticky = StickyRouter(worker_urls, worker_index, "/" + os.getenv("TELEGRAM_BOT_TOKEN")) if worker_urls else None
+
+    register_routes(router, database, dp, bot, os.getenv("TELEGRAM_BOT_TOKEN"), os.getenv("CRYPTOPAY_KEY"), payment_worker, sticky, os.getenv("METRICS_TOKEN"))
 
     app.include_router(router)
 
     def on_startup_handler(database_core: DataBaseCore, database: DataBase, telegram_stars: TelegramStarsService):
         async def on_startup() -> None:
-            print("=== Инициализация базы данных и Telegram Stars ===")
+            print(f"=== Инициализация базы данных и Telegram Stars (воркер {worker_index}) ===")
             await database_core.open_pool()
             await database.create_tables()
+            if isinstance(storage, PostgresStorage):
+                await storage.create_table()
             # Инициализируем клиент Telethon для Telegram Stars
             await telegram_stars.init_client()
-            url_webhook = os.getenv("BASE_WEBHOOK_URL") + os.getenv("TELEGRAM_BOT_TOKEN")
-            await bot.set_webhook(url=url_webhook)
+            payment_worker.start()
+            if worker_index == 0:
+                url_webhook = os.getenv("BASE_WEBHOOK_URL") + os.getenv("TELEGRAM_BOT_TOKEN")
+                await bot.set_webhook(url=url_webhook)
             print("=== Бот успешно запущен ===")
         return on_startup
 
     app.add_event_handler("startup", on_startup_handler(database_core, database, telegram_stars))
 
-    print("=== Запуск веб-сервера ===")
-    uvicorn.run(app, host="0.0.0.0", port=int(os.environ.get("PORT", 5000)))
+    # Останавливает фоновое обновление курсов
+    app.add_event_handler("shutdown", cryptopay.close)
+
+    if sticky:
+        app.add_event_handler("shutdown", sticky.close)
+
+    return app
+
+def serve(worker_index: int, host: str, port: int, worker_urls: List[str] = None):
+    load_dotenv()
+    uvicorn.run(create_app(worker_index, worker_urls), host=host, port=port)
+
+def run():
+    """Запуск веб-сервера.
+
+    WEB_WORKERS=N запускает N процессов на одной машине: воркер 0 слушает PORT
+    и принимает webhook, остальные слушают 127.0.0.1:INTERNAL_PORT+i, апдейты
+    распределяются по пользователям. Для N контейнеров вместо этого задаются
+    WORKER_URLS (адреса всех узлов через запятую) и WORKER_INDEX этого узла.
+    /metrics воркера 0 включает метрики остальных воркеров с меткой worker.
+    """
+    print("=== Запуск бота ===")
+    load_dotenv()
+
+    port = int(os.environ.get("PORT", 5000))
+    workers = int(os.getenv("WEB_WORKERS", 1))
+
+    if os.getenv("WORKER_URLS"):
+        worker_urls = [url.strip().rstrip("/") for url in os.getenv("WORKER_URLS").split(",")]
+        print("=== Запуск веб-сервера ===")
+        serve(int(os.getenv("WORKER_INDEX", 0)), "0.0.0.0", port, worker_urls)
+        return
+
+    if workers <= 1:
+        print("=== Запуск веб-сервера ===")
+        serve(0, "0.0.0.0", port)
+        return
+
+    internal_port = int(os.getenv("INTERNAL_PORT", port + 1))
+    worker_urls = [f"http://127.0.0.1:{port}"] + [f"http://127.0.0.1:{internal_port + i}" for i in range(1, workers)]
+    context = multiprocessing.get_context("spawn")
+    processes = [context.Process(target=serve, args=(i, "127.0.0.1", internal_port + i, worker_urls), daemon=True) for i in range(1, workers)]
+    for process in processes:
+        process.start()
+
+    print(f"=== Запуск веб-сервера, воркеров: {workers} ===")
+    try:
+        serve(0, "0.0.0.0", port, worker_urls)
+    finally:
+        for process in processes:
+            process.terminate()
 
 if __name__ == "__main__":
     # Запускаем в режиме polling
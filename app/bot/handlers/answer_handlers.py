@@ -2,6 +2,9 @@ from app.bot.utils import States, translator, TelegramError, encoding
 
 from app.services.stablediffusion import StableDiffusion
 from app.services.openaitools import OpenAiTools
+from app.services.governor import GovernorBusyError
+from app.services.context import ContextBuilder
+from app.services.tracing import tracer
 
 from aiogram import types
 
@@ -12,12 +15,14 @@ from aiogram.types.input_file import BufferedInputFile
 from app.services.db import DataBase, DatabaseError
 
 class AnswerHandlers:
-    def __init__(self, database: DataBase, openai: OpenAiTools, stable: StableDiffusion):
+    def __init__(self, database: DataBase, openai: OpenAiTools, stable: StableDiffusion, context: ContextBuilder = None):
         self.database = database
         self.openai = openai
         self.stable = stable
+        self.context = context or ContextBuilder(database, openai)
 
     async def chatgpt_answer_handler(self, message: types.Message, state: FSMContext):
+        question_id = None
         try:
             button = [[KeyboardButton(text="🔙Back")]]
             reply_markup = ReplyKeyboardMarkup(
@@ -28,17 +33,24 @@ class AnswerHandlers:
             result = await self.database.get_chatgpt(user_id)
 
             if result > 0:
-                await self.database.save_message(user_id, "user", message.text, len(encoding.encode(message.text)))
+                question_id = await self.database.save_message(user_id, "user", message.text, len(encoding.encode(message.text)))
 
-                messages, question_tokens = await self.database.get_messages(user_id)
+                messages, question_tokens = await self.context.build(user_id)
 
-                answer = await self.openai.get_chatgpt(messages)
+                answer, usage = await self.openai.get_chatgpt_usage(messages, user_id=user_id, tokens=question_tokens)
 
                 if answer:
                     answer_tokens = len(encoding.encode(answer))
                     await self.database.save_message(user_id, "assistant", answer, answer_tokens)
 
-                    result -= int(question_tokens*0.25 + answer_tokens)
+                    # Закэшированные провайдером входные токены списываются за полцены
+                    cached_tokens = 0
+                    if usage:
+                        await self.database.save_chat_usage(user_id, usage["prompt_tokens"], usage["cached_tokens"], usage["completion_tokens"])
+                        question_tokens = usage["prompt_tokens"]
+                        cached_tokens = usage["cached_tokens"]
+
+                    result -= int((question_tokens - cached_tokens)*0.25 + cached_tokens*0.125 + answer_tokens)
 
                     if result > 0:
                         await self.database.set_chatgpt(user_id, result)
@@ -61,6 +73,15 @@ class AnswerHandlers:
                     reply_markup=reply_markup,
                 )
             await state.set_state(States.CHATGPT_STATE)
+        except GovernorBusyError as e:
+            e.output()
+            # Вопрос без ответа не остается в истории: повтор сохранит его снова
+            if question_id is not None:
+                await self.database.delete_message(user_id, question_id)
+            await message.answer(
+                text = f"⏳The service is busy right now. Please retry in {e.retry_after} s.",
+                reply_markup=reply_markup,
+            )
         except DatabaseError:
             raise DatabaseError
         except Exception as e:
@@ -81,9 +102,10 @@ class AnswerHandlers:
             if result > 0:
                 question = message.text
 
-                prompt = await translator.translate(question, targetlang='en')
+                async with tracer.span("translate"):
+                    prompt = await translator.translate(question, targetlang='en')
 
-                answer = await self.openai.get_dalle(prompt.text)
+                answer = await self.openai.get_dalle(prompt.text, user_id=user_id)
 
                 if answer:
                     result -= 1
@@ -104,6 +126,12 @@ class AnswerHandlers:
                     reply_markup=reply_markup,
                 )
             await state.set_state(States.DALL_E_STATE)
+        except GovernorBusyError as e:
+            e.output()
+            await message.answer(
+                text = f"⏳The service is busy right now. Please retry in {e.retry_after} s.",
+                reply_markup=reply_markup,
+            )
         except DatabaseError:
             raise DatabaseError
         except Exception as e:
@@ -125,9 +153,10 @@ class AnswerHandlers:
 
                 question = message.text
 
-                prompt = await translator.translate(question, targetlang='en')
+                async with tracer.span("translate"):
+                    prompt = await translator.translate(question, targetlang='en')
 
-                photo = await self.stable.get_stable(prompt.text)
+                photo = await self.stable.get_stable(prompt.text, user_id=user_id)
 
                 if photo:
                     result -= 1
@@ -148,6 +177,12 @@ class AnswerHandlers:
                     reply_markup=reply_markup,
                 )
             await state.set_state(States.STABLE_STATE)
+        except GovernorBusyError as e:
+            e.output()
+            await message.answer(
+                text = f"⏳The service is busy right now. Please retry in {e.retry_after} s.",
+                reply_markup=reply_markup,
+            )
         except DatabaseError:
             raise DatabaseError
         except Exception as e:
@@ -5,23 +5,33 @@ from aiogram import types
 from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.fsm.context import FSMContext
 
-from app.services.db import DataBase, DatabaseError
+from app.services.db import DataBase, DatabaseError, UserDashboard
 
 class DisplayInfo:
     def __init__(self, database: DataBase):
         self.database = database
 
+    @staticmethod
+    def _plans_text(dashboard: UserDashboard) -> str:
+        if not dashboard.plans:
+            return ""
+        lines = [
+            f" 📅 {plan.plan} ({plan.type}): {plan.usage_today}/{plan.daily_limit} today, until {plan.end_date.strftime('%d.%m.%Y')}"
+            for plan in dashboard.plans
+        ]
+        return "\n\n Active plans:\n" + "\n".join(lines)
+
     async def display_info_handler(self, message: types.Message, state: FSMContext):
         try:
             user_id = message.from_user.id
-            result = await self.database.get_userinfo(user_id)
+            dashboard = await self.database.get_dashboard(user_id)
 
             button = [[types.KeyboardButton(text="💫Buy tokens and generations")], [types.KeyboardButton(text="🔙Back")]]
             reply_markup = types.ReplyKeyboardMarkup(
                 keyboard = button, resize_keyboard=True
             )
             await message.answer(
-                text = f"You have: \n 💭{result[0]} ChatGPT tokens \n 🌄{result[1]} DALL·E generations \n 🌅{result[2]} Stable Diffusion generations \n 🖼️{result[3]} MidJourney generations \n\n 💫 You can buy more using Telegram Stars",
+                text = f"You have: \n 💭{dashboard.chatgpt} ChatGPT tokens \n 🌄{dashboard.dall_e} DALL·E generations \n 🌅{dashboard.stable_diffusion} Stable Diffusion generations \n 🖼️{dashboard.midjourney} MidJourney generations \n\n 💫 You can buy more using Telegram Stars" + self._plans_text(dashboard),
                 reply_markup=reply_markup,
             )
             
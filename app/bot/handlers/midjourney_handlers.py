@@ -4,6 +4,8 @@ from aiogram.fsm.context import FSMContext
 from app.bot.utils import States, TelegramError
 from app.services.db import DataBase, DatabaseError
 from app.services.midjourney import MidJourney, MidJourneyError
+from app.services.governor import GovernorBusyError
+from app.services.quota import QuotaService
 import os
 import uuid
 import asyncio
@@ -12,6 +14,7 @@ class MidJourneyHandlers:
     def __init__(self, database: DataBase, midjourney: MidJourney):
         self.database = database
         self.midjourney = midjourney
+        self.quota = QuotaService(database)
         # Создаем директорию для сохранения изображений, если она не существует
         self.images_dir = os.path.join(os.getcwd(), 'images', 'midjourney')
         os.makedirs(self.images_dir, exist_ok=True)
@@ -85,23 +88,16 @@ class MidJourneyHandlers:
                 )
                 return
             
-            # Check user subscription and balance
-            has_subscription = False
-            image_sub = await self.database.check_subscription(user_id, "image")
+            # Reserve one generation from the subscription or the balance
+            reservation = await self.quota.reserve(user_id, "image", "midjourney")
             
-            if image_sub:
-                # If user has subscription, check limits
-                if image_sub['usage_today'] >= image_sub['daily_limit']:
+            if not reservation.granted:
+                if reservation.kind == "subscription":
                     await message.answer(
                         "❌ You have reached your daily limit for image generations.\n"
                         "Your limit will reset tomorrow or you can purchase a subscription with more generations."
                     )
-                    return
-                has_subscription = True
-            else:
-                # If no subscription, check balance
-                balance = await self.database.get_midjourney(user_id)
-                if balance <= 0:
+                else:
                     # Not enough generations
                     keyboard = types.InlineKeyboardMarkup(inline_keyboard=[
                         [types.InlineKeyboardButton(text="💰 Buy tokens", callback_data="show_image_plans")]
@@ -112,18 +108,18 @@ class MidJourneyHandlers:
                         "Purchase a subscription or add credits to continue.",
                         reply_markup=keyboard
                     )
-                    return
-            
-            # Send message about starting generation
-            loading_message = await message.answer("🔄 Generation started. This may take some time...")
+                return
             
             try:
+                # Send message about starting generation
+                loading_message = await message.answer("🔄 Generation started. This may take some time...")
+                
                 # Generate image with MidJourney with timeout
                 try:
                     # Set timeout for request
                     import asyncio
                     # Create task for generating image
-                    image_data_task = asyncio.create_task(self.midjourney.generate_image(prompt))
+                    image_data_task = asyncio.create_task(self.midjourney.generate_image(prompt, user_id=user_id))
                     # Update message about starting generation
                     dots = ""
                     for i in range(4):  # Maximum number of updates (60 seconds)
@@ -186,14 +182,10 @@ class MidJourneyHandlers:
                     caption=f"✅ Image generated by request:\n\"{prompt}\""
                 )
                 
-                # Decrease user balance or update subscription usage
-                if has_subscription:
-                    await self.database.increment_subscription_usage(user_id, "image")
-                else:
-                    current_balance = await self.database.get_midjourney(user_id)
-                    await self.database.set_midjourney(user_id, current_balance - 1)
-                    
-                    await message.answer(f"Remaining generations: {current_balance - 1}")
+                # The generation was delivered, keep the reserved quota
+                await self.quota.commit(reservation)
+                if reservation.kind == "balance":
+                    await message.answer(f"Remaining generations: {reservation.remaining}")
                 
                 # Delete file after sending, to avoid cluttering disk
                 try:
@@ -204,6 +196,13 @@ class MidJourneyHandlers:
             except MidJourneyError as e:
                 await message.bot.delete_message(chat_id=message.chat.id, message_id=loading_message.message_id)
                 await message.answer(f"❌ Error generating image: {str(e)}")
+            except GovernorBusyError as e:
+                e.output()
+                await message.bot.delete_message(chat_id=message.chat.id, message_id=loading_message.message_id)
+                await message.answer(f"⏳ The service is busy right now. Please retry in {e.retry_after} s.")
+            finally:
+                # Refund the quota if the generation was not delivered
+                await self.quota.release(reservation)
             
         except Exception as e:
             err = TelegramError(str(e))
@@ -4,6 +4,8 @@ from aiogram.fsm.context import FSMContext
 from app.bot.utils import States, TelegramError
 from app.services.db import DataBase, DatabaseError
 
+REFERRALS_PAGE_SIZE = 20
+
 class ReferralHandlers:
     def __init__(self, database: DataBase):
         self.database = database
@@ -22,8 +24,8 @@ class ReferralHandlers:
             bot_username = (await message.bot.get_me()).username
             referral_link = f"https://t.me/{bot_username}?start=ref{user_id}"
             
-            # Получаем список рефералов пользователя
-            referrals = await self.database.get_referrals(user_id)
+            # Счетчики рефералов пользователя
+            total, bonus_given = await self.database.get_referral_stats(user_id)
             
             message_text = "🤝 Реферальная программа\n\n"
             message_text += "Приглашайте друзей в бота и получайте бонусы!\n\n"
@@ -36,7 +38,8 @@ class ReferralHandlers:
             message_text += f"Ваша реферальная ссылка:\n{referral_link}\n\n"
             
             # Информация о приглашенных пользователях
-            message_text += f"👥 Приглашено пользователей: {len(referrals)}\n"
+            message_text += f"👥 Приглашено пользователей: {total}\n"
+            message_text += f"🎁 Бонусов получено: {bonus_given}\n"
             
             keyboard = InlineKeyboardMarkup(inline_keyboard=[
                 [InlineKeyboardButton(text="📋 Список рефералов", callback_data="show_referrals_list")],
@@ -50,12 +53,27 @@ class ReferralHandlers:
             raise err
     
     async def show_referrals_list_handler(self, callback_query: types.CallbackQuery, state: FSMContext):
-        """Показывает список рефералов пользователя"""
+        """Показывает список рефералов пользователя постранично.
+
+        callback_data страниц: referrals_page:<next|prev>:<id>:<номер первой строки>
+        """
         try:
             await callback_query.answer()
             
             user_id = callback_query.from_user.id
-            referrals = await self.database.get_referrals(user_id)
+            direction, key, offset = "next", 0, 0
+            if callback_query.data.startswith("referrals_page:"):
+                _, direction, key, offset = callback_query.data.split(":")
+                key, offset = int(key), int(offset)
+            
+            # Запрашиваем на одну строку больше, чтобы узнать, есть ли еще страница
+            if direction == "prev":
+                referrals = await self.database.get_referrals(user_id, before_id=key, limit=REFERRALS_PAGE_SIZE)
+                has_prev, has_next = offset > 0, True
+            else:
+                referrals = await self.database.get_referrals(user_id, after_id=key, limit=REFERRALS_PAGE_SIZE + 1)
+                has_prev, has_next = offset > 0, len(referrals) > REFERRALS_PAGE_SIZE
+                referrals = referrals[:REFERRALS_PAGE_SIZE]
             
             if not referrals:
                 keyboard = InlineKeyboardMarkup(inline_keyboard=[
@@ -70,9 +88,10 @@ class ReferralHandlers:
                 )
                 return
             
-            message_text = "👥 Список ваших рефералов\n\n"
+            total, _ = await self.database.get_referral_stats(user_id)
+            message_text = f"👥 Список ваших рефералов ({offset + 1}-{offset + len(referrals)} из {total})\n\n"
             
-            for i, referral in enumerate(referrals, 1):
+            for i, referral in enumerate(referrals, offset + 1):
                 referred_id = referral[0]
                 joined_date = referral[1].strftime("%d.%m.%Y")
                 bonus_given = "✅" if referral[2] else "⏳"
@@ -81,7 +100,13 @@ class ReferralHandlers:
             
             message_text += "\n✅ - бонус получен, ⏳ - в обработке\n"
             
-            keyboard = InlineKeyboardMarkup(inline_keyboard=[
+            paging = []
+            if has_prev:
+                paging.append(InlineKeyboardButton(text="⬅️", callback_data=f"referrals_page:prev:{referrals[0][3]}:{max(offset - REFERRALS_PAGE_SIZE, 0)}"))
+            if has_next:
+                paging.append(InlineKeyboardButton(text="➡️", callback_data=f"referrals_page:next:{referrals[-1][3]}:{offset + len(referrals)}"))
+            
+            keyboard = InlineKeyboardMarkup(inline_keyboard=([paging] if paging else []) + [
                 [InlineKeyboardButton(text="🔙 Назад", callback_data="back_to_referral_program")]
             ])
             
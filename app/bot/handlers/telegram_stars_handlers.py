@@ -76,8 +76,10 @@ class TelegramStarsHandlers:
             product_type = payment_info.invoice_payload
             telegram_payment_charge_id = payment_info.telegram_payment_charge_id
             
-            # Обработка успешной оплаты в зависимости от типа продукта
-            await self.process_successful_payment(user_id, product_type)
+            # Начисление и запись в журнал платежей одной транзакцией,
+            # повторная доставка того же платежа ничего не начисляет
+            if not await self.database.credit_payment("telegram_stars", telegram_payment_charge_id, user_id, product_type):
+                return
             
             # Отправляем пользователю подтверждение
             product_name = {
@@ -95,21 +97,6 @@ class TelegramStarsHandlers:
             err.output()
             raise err
             
-    async def process_successful_payment(self, user_id: int, product_type: str):
-        try:
-            if product_type == "chatgpt":
-                await self.database.update_chatgpt(user_id, 0)  # Не используем invoice_id
-            elif product_type == "dall_e":
-                await self.database.update_dalle(user_id, 0)  # Не используем invoice_id
-            elif product_type == "stable":
-                await self.database.update_stable(user_id, 0)  # Не используем invoice_id
-            elif product_type == "midjourney":
-                await self.database.update_midjourney(user_id, 0)  # Не используем invoice_id
-        except Exception as e:
-            err = TelegramError(str(e))
-            err.output()
-            raise err
-            
     def get_payment_keyboard(self, amount):
         from aiogram.utils.keyboard import InlineKeyboardBuilder
         builder = InlineKeyboardBuilder()
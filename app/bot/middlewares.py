@@ -0,0 +1,141 @@
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Tuple
+
+from aiogram import BaseMiddleware, Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.methods import Response, TelegramMethod
+from aiogram.types import Message, TelegramObject, Update
+
+from app.bot.utils import States
+from app.services.metrics import HANDLER_ERRORS, HANDLER_LATENCY
+from app.services.tracing import tracer
+
+# Состояния, в которых сообщение запускает генерацию
+GENERATION_STATES = {
+    States.CHATGPT_STATE.state: "chatgpt",
+    States.DALL_E_STATE.state: "dall_e",
+    States.STABLE_STATE.state: "stable",
+    States.MIDJOURNEY_STATE.state: "midjourney",
+}
+
+# Для этих функций сообщения, пришедшие во время генерации, склеиваются в один ход
+COALESCED_FEATURES = {"chatgpt"}
+
+# Кнопки навигации, которые не должны ждать окончания генерации
+PASSTHROUGH_TEXTS = {"🔙Back", "Back"}
+
+class CoalescingMiddleware(BaseMiddleware):
+    """Не более одной генерации на пользователя и функцию одновременно.
+
+    Сообщения, пришедшие во время генерации, откладываются. Для ChatGPT они
+    объединяются в одно сообщение и обрабатываются одним ходом, для генерации
+    изображений выполняются по очереди, а повторы одного и того же промпта
+    отбрасываются.
+    """
+    def __init__(self):
+        self.in_flight: Dict[Tuple[int, str], str] = {}
+        self.pending: Dict[Tuple[int, str], List[Tuple[Message, Dict[str, Any]]]] = {}
+
+    async def __call__(
+        self,
+        handler: Callable[[Message, Dict[str, Any]], Awaitable[Any]],
+        event: Message,
+        data: Dict[str, Any],
+    ) -> Any:
+        feature = GENERATION_STATES.get(data.get("raw_state"))
+        if feature is None or event.from_user is None or not event.text \
+                or event.text.startswith("/") or event.text in PASSTHROUGH_TEXTS:
+            return await handler(event, data)
+
+        key = (event.from_user.id, feature)
+        if key in self.in_flight:
+            self._enqueue(key, feature, event, data)
+            return None
+
+        self.in_flight[key] = event.text
+        try:
+            result = await handler(event, data)
+            while self.pending.get(key):
+                if feature in COALESCED_FEATURES:
+                    next_event, next_data = self._merge(self.pending.pop(key))
+                else:
+                    next_event, next_data = self.pending[key].pop(0)
+                if not await self._still_in_state(next_data, feature):
+                    break
+                self.in_flight[key] = next_event.text
+                result = await handler(next_event, next_data)
+            return result
+        finally:
+            self.in_flight.pop(key, None)
+            self.pending.pop(key, None)
+
+    def _enqueue(self, key: Tuple[int, str], feature: str, event: Message, data: Dict[str, Any]):
+        queue = self.pending.setdefault(key, [])
+        if feature not in COALESCED_FEATURES:
+            # Повторный промпт для изображения не генерируем второй раз
+            prompts = {self.in_flight[key]} | {queued.text for queued, _ in queue}
+            if event.text in prompts:
+                return
+        queue.append((event, data))
+
+    @staticmethod
+    def _merge(batch: List[Tuple[Message, Dict[str, Any]]]) -> Tuple[Message, Dict[str, Any]]:
+        last_event, last_data = batch[-1]
+        if len(batch) == 1:
+            return last_event, last_data
+        text = "\n".join(queued.text for queued, _ in batch)
+        return last_event.model_copy(update={"text": text}), last_data
+
+    @staticmethod
+    async def _still_in_state(data: Dict[str, Any], feature: str) -> bool:
+        state = data.get("state")
+        if state is None:
+            return True
+        return GENERATION_STATES.get(await state.get_state()) == feature
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Гистограмма времени выполнения по обработчикам.
+
+    Регистрируется как внутренний middleware, поэтому обработчик уже выбран
+    фильтрами и доступен в data["handler"]. Для кнопок из таблицы маршрутов
+    учитывается сам обработчик кнопки из data["route"].
+    """
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        handler_object = data.get("handler")
+        callback = data.get("route") or getattr(handler_object, "callback", None)
+        name = getattr(callback, "__qualname__", None) or type(event).__name__
+        start = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            HANDLER_ERRORS.labels(name).inc()
+            raise
+        finally:
+            HANDLER_LATENCY.labels(name).observe(time.perf_counter() - start)
+
+class TracingMiddleware(BaseMiddleware):
+    """Открывает трассу на каждый апдейт (и при polling, и из webhook)"""
+    async def __call__(
+        self,
+        handler: Callable[[Update, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any],
+    ) -> Any:
+        async with tracer.trace("update", update_id=event.update_id, type=event.event_type):
+            return await handler(event, data)
+
+class BotApiTracingMiddleware(BaseRequestMiddleware):
+    """Спан на каждый вызов Bot API"""
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType,
+        bot: Bot,
+        method: TelegramMethod,
+    ) -> Response:
+        async with tracer.span(f"telegram.{method.__api_method__}"):
+            return await make_request(bot, method)
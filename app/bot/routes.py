@@ -0,0 +1,78 @@
+import re
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Pattern, Tuple, Union
+
+from aiogram import Router
+from aiogram.filters import Filter
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.state import State
+from aiogram.types import Message
+
+from app.bot.utils import TelegramError
+
+RouteHandler = Callable[[Message, FSMContext], Awaitable[Any]]
+
+class DuplicateRouteError(TelegramError):
+    """Одна и та же кнопка зарегистрирована дважды в одном состоянии"""
+
+def _state_key(state: Optional[State]) -> Optional[str]:
+    return state.state if isinstance(state, State) else state
+
+class TextRoutes:
+    """Таблица маршрутов для кнопок клавиатуры.
+
+    Кнопки с точным текстом хранятся в словаре {(состояние, текст): обработчик},
+    поэтому выбор обработчика стоит один поиск в словаре независимо от числа
+    кнопок. Регулярные выражения проверяются только если точного совпадения нет.
+    Повторная регистрация той же пары (состояние, текст) сразу вызывает
+    DuplicateRouteError, а не молча проигрывает первому обработчику.
+    """
+    def __init__(self):
+        self.exact: Dict[Tuple[Optional[str], str], RouteHandler] = {}
+        self.patterns: List[Tuple[Optional[str], Pattern, RouteHandler]] = []
+
+    def button(self, handler: RouteHandler, state: Optional[State], text: str):
+        key = (_state_key(state), text)
+        if key in self.exact:
+            raise DuplicateRouteError(
+                f"Button {text!r} in state {key[0]} is already handled by "
+                f"{self.exact[key].__qualname__}, cannot register {handler.__qualname__}"
+            )
+        self.exact[key] = handler
+
+    def regexp(self, handler: RouteHandler, state: Optional[State], pattern: Union[str, Pattern]):
+        self.patterns.append((_state_key(state), re.compile(pattern), handler))
+
+    def resolve(self, state: Optional[str], text: Optional[str]) -> Optional[RouteHandler]:
+        if text is None:
+            return None
+        # Сначала кнопка текущего состояния, затем кнопка без состояния
+        handler = self.exact.get((state, text)) or self.exact.get((None, text))
+        if handler is not None:
+            return handler
+        for route_state, pattern, handler in self.patterns:
+            if route_state in (None, state) and pattern.match(text):
+                return handler
+        return None
+
+    def filter(self) -> "RouteFilter":
+        return RouteFilter(self)
+
+    def attach(self, router: Router):
+        """Регистрирует таблицу одним обработчиком сообщений"""
+        router.message.register(dispatch_route, self.filter())
+
+    def __len__(self):
+        return len(self.exact) + len(self.patterns)
+
+class RouteFilter(Filter):
+    def __init__(self, routes: TextRoutes):
+        self.routes = routes
+
+    async def __call__(self, message: Message, raw_state: Optional[str] = None) -> Union[bool, Dict[str, Any]]:
+        handler = self.routes.resolve(raw_state, message.text)
+        if handler is None:
+            return False
+        return {"route": handler}
+
+async def dispatch_route(message: Message, state: FSMContext, route: RouteHandler):
+    return await route(message, state)
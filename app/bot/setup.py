@@ -13,6 +13,8 @@ from app.bot.handlers.telegram_stars_handlers import TelegramStarsHandlers
 
 from aiogram.filters.command import Command
 from app.bot.utils import States
+from app.bot.middlewares import CoalescingMiddleware, HandlerMetricsMiddleware, TracingMiddleware
+from app.bot.routes import TextRoutes
 from aiogram import F
 
 from app.services.openaitools import OpenAiTools
@@ -24,81 +26,90 @@ from app.services.telegram_stars import TelegramStarsService
 
 def register_handlers(dp: Dispatcher, database: DataBase, openai: OpenAiTools, stable: StableDiffusion, 
                      crypto: CryptoPay, midjourney: MidJourney, telegram_stars: TelegramStarsService):
+    # Одна генерация на пользователя за раз, быстрые сообщения подряд склеиваются
+    dp.update.outer_middleware(TracingMiddleware())
+    dp.message.outer_middleware(CoalescingMiddleware())
+    # Время выполнения каждого обработчика для /metrics
+    for observer in (dp.message, dp.callback_query, dp.pre_checkout_query):
+        observer.middleware(HandlerMetricsMiddleware())
+
+    # Кнопки клавиатуры выбираются одним поиском по (состояние, текст) и
+    # проверяются раньше обработчиков, принимающих любой текст в состоянии
+    routes = TextRoutes()
+    routes.attach(dp)
+
     # Заменяем регистрацию обработчиков крипто-оплаты на регистрацию обработчиков Telegram Stars
-    # register_purchase_handlers(dp, database, crypto)
-    register_telegram_stars_handlers(dp, database, telegram_stars)
+    # register_purchase_handlers(dp, routes, database, crypto)
+    register_telegram_stars_handlers(dp, routes, database, telegram_stars)
 
-    register_start_handlers(dp, database)
+    register_start_handlers(dp, routes, database)
 
-    register_question_handlers(dp)
+    register_question_handlers(routes)
 
-    register_display_info_handlers(dp, database, telegram_stars)
+    register_display_info_handlers(dp, routes, database, telegram_stars)
 
     register_answer_handlers(dp, database, openai, stable)
     
-    register_midjourney_handlers(dp, database, midjourney)
+    register_midjourney_handlers(dp, routes, database, midjourney)
     
-    register_subscription_handlers(dp, database, telegram_stars)
+    register_subscription_handlers(dp, routes, database, telegram_stars)
     
     register_admin_handlers(dp, database)
     
-    register_referral_handlers(dp, database)
-    
-    register_telegram_stars_handlers(dp, database, telegram_stars)
+    register_referral_handlers(dp, routes, database)
 
-def register_purchase_handlers(dp: Dispatcher, database: DataBase, crypto: CryptoPay):
+def register_purchase_handlers(dp: Dispatcher, routes: TextRoutes, database: DataBase, crypto: CryptoPay):
     Purchase_Handlers = PurchaseHandlers(database, crypto)
 
-    dp.message.register(Purchase_Handlers.purchase_handler, States.INFO_STATE, F.text.regexp(r'^Buy tokens and generations$'))
-    dp.message.register(Purchase_Handlers.purchase_handler, States.PURCHASE_CHATGPT_STATE, F.text.regexp(r'^Back$'))
-    dp.message.register(Purchase_Handlers.purchase_handler,States.PURCHASE_DALL_E_STATE, F.text.regexp(r'^Back$'))
-    dp.message.register(Purchase_Handlers.purchase_handler, States.PURCHASE_STABLE_STATE, F.text.regexp(r'^Back$'))
+    routes.button(Purchase_Handlers.purchase_handler, States.INFO_STATE, 'Buy tokens and generations')
+    routes.button(Purchase_Handlers.purchase_handler, States.PURCHASE_CHATGPT_STATE, 'Back')
+    routes.button(Purchase_Handlers.purchase_handler, States.PURCHASE_DALL_E_STATE, 'Back')
+    routes.button(Purchase_Handlers.purchase_handler, States.PURCHASE_STABLE_STATE, 'Back')
 
     currencies = ['USDT', 'TON', 'BTC', 'ETH']
     for currency in currencies:
-        dp.message.register(Purchase_Handlers.buy_handler, States.PURCHASE_CHATGPT_STATE, F.text.regexp(rf'^{currency}$'))
-        dp.message.register(Purchase_Handlers.buy_handler, States.PURCHASE_DALL_E_STATE, F.text.regexp(rf'^{currency}$'))
-        dp.message.register(Purchase_Handlers.buy_handler, States.PURCHASE_STABLE_STATE, F.text.regexp(rf'^{currency}$'))
+        routes.button(Purchase_Handlers.buy_handler, States.PURCHASE_CHATGPT_STATE, currency)
+        routes.button(Purchase_Handlers.buy_handler, States.PURCHASE_DALL_E_STATE, currency)
+        routes.button(Purchase_Handlers.buy_handler, States.PURCHASE_STABLE_STATE, currency)
 
-    dp.message.register(Purchase_Handlers.currencies_handler, States.PURCHASE_STATE, F.text.regexp(r'^100K ChatGPT tokens - 5 USD$'))
-    dp.message.register(Purchase_Handlers.currencies_handler, States.PURCHASE_STATE, F.text.regexp(r'^50 DALL·E image generations - 5 USD$'))
-    dp.message.register(Purchase_Handlers.currencies_handler, States.PURCHASE_STATE, F.text.regexp(r'^50 Stable Diffusion image generations - 5 USD$'))
+    routes.button(Purchase_Handlers.currencies_handler, States.PURCHASE_STATE, '100K ChatGPT tokens - 5 USD')
+    routes.button(Purchase_Handlers.currencies_handler, States.PURCHASE_STATE, '50 DALL·E image generations - 5 USD')
+    routes.button(Purchase_Handlers.currencies_handler, States.PURCHASE_STATE, '50 Stable Diffusion image generations - 5 USD')
 
-def register_start_handlers(dp: Dispatcher, database: DataBase):
+def register_start_handlers(dp: Dispatcher, routes: TextRoutes, database: DataBase):
     Start_Handler = StartHandler(database)
     dp.message.register(Start_Handler.start_handler, Command('start'))
-    dp.message.register(Start_Handler.start_handler, States.ENTRY_STATE, F.text.regexp(r'^Back$'))
-    dp.message.register(Start_Handler.start_handler, States.CHATGPT_STATE, F.text.regexp(r'^Back$'))
-    dp.message.register(Start_Handler.start_handler, States.DALL_E_STATE, F.text.regexp(r'^Back$'))
-    dp.message.register(Start_Handler.start_handler, States.STABLE_STATE, F.text.regexp(r'^Back$'))
-    dp.message.register(Start_Handler.start_handler, States.INFO_STATE, F.text.regexp(r'^Back$'))
-    
-    dp.message.register(Start_Handler.start_handler, States.MIDJOURNEY_STATE, F.text.regexp(r'^Back$'))
-    dp.message.register(Start_Handler.start_handler, States.SUBSCRIPTION_STATE, F.text.regexp(r'^Back$'))
-    dp.message.register(Start_Handler.start_handler, States.ADMIN_STATE, F.text.regexp(r'^Back$'))
-    dp.message.register(Start_Handler.start_handler, States.REFERRAL_STATE, F.text.regexp(r'^Back$'))
-
-def register_question_handlers(dp: Dispatcher):
+    routes.button(Start_Handler.start_handler, States.ENTRY_STATE, 'Back')
+    routes.button(Start_Handler.start_handler, States.CHATGPT_STATE, 'Back')
+    routes.button(Start_Handler.start_handler, States.DALL_E_STATE, 'Back')
+    routes.button(Start_Handler.start_handler, States.STABLE_STATE, 'Back')
+    routes.button(Start_Handler.start_handler, States.INFO_STATE, 'Back')
+    
+    routes.button(Start_Handler.start_handler, States.MIDJOURNEY_STATE, 'Back')
+    routes.button(Start_Handler.start_handler, States.SUBSCRIPTION_STATE, 'Back')
+    routes.button(Start_Handler.start_handler, States.ADMIN_STATE, 'Back')
+    routes.button(Start_Handler.start_handler, States.REFERRAL_STATE, 'Back')
+
+def register_question_handlers(routes: TextRoutes):
     # Исправлены названия кнопок в соответствии с тем, как они отображаются в интерфейсе
-    dp.message.register(question_handler, States.ENTRY_STATE, F.text.regexp(r'^💭Chatting — ChatGPT-4o$'))
-    dp.message.register(question_handler, States.ENTRY_STATE, F.text.regexp(r'^🌄Image generation — DALL·E 3$'))
-    dp.message.register(question_handler, States.ENTRY_STATE, F.text.regexp(r'^🌅Image generation — Stable Diffusion 3$'))
-    dp.message.register(question_handler, States.ENTRY_STATE, F.text.regexp(r'^🖼️Images — MidJourney$'))
+    routes.button(question_handler, States.ENTRY_STATE, '💭Chatting — ChatGPT-4o')
+    routes.button(question_handler, States.ENTRY_STATE, '🌄Image generation — DALL·E 3')
+    routes.button(question_handler, States.ENTRY_STATE, '🌅Image generation — Stable Diffusion 3')
 
-def register_display_info_handlers(dp: Dispatcher, database: DataBase, telegram_stars: TelegramStarsService):
+def register_display_info_handlers(dp: Dispatcher, routes: TextRoutes, database: DataBase, telegram_stars: TelegramStarsService):
     Display_Info = DisplayInfo(database)
     telegram_stars_handlers = TelegramStarsHandlers(database, telegram_stars)
     
-    dp.message.register(Display_Info.display_info_handler, States.ENTRY_STATE, F.text.regexp(r'^👤My account | 💰Buy$'))
-    dp.message.register(Display_Info.display_info_handler, States.ENTRY_STATE, F.text.regexp(r'^📊Subscriptions$'))
-    dp.message.register(Display_Info.display_info_handler, States.ENTRY_STATE, F.text.regexp(r'^📈Referral program$'))
+    routes.button(Display_Info.display_info_handler, States.ENTRY_STATE, '👤My account | 💰Buy')
+    routes.button(Display_Info.display_info_handler, States.ENTRY_STATE, '📊Subscriptions')
+    routes.button(Display_Info.display_info_handler, States.ENTRY_STATE, '📈Referral program')
     
     # Ссылка на Start_Handler для кнопки назад
     start_handler = StartHandler(database)
-    dp.message.register(start_handler.start_handler, States.INFO_STATE, F.text.regexp(r'^🔙Back$'))
-    dp.message.register(start_handler.start_handler, States.PURCHASE_STATE, F.text.regexp(r'^🔙Back$'))
+    routes.button(start_handler.start_handler, States.INFO_STATE, '🔙Back')
+    routes.button(start_handler.start_handler, States.PURCHASE_STATE, '🔙Back')
     
-    dp.message.register(telegram_stars_handlers.stars_menu_handler, States.INFO_STATE, F.text.regexp(r'^💫Buy tokens and generations$'))
+    routes.button(telegram_stars_handlers.stars_menu_handler, States.INFO_STATE, '💫Buy tokens and generations')
 
 def register_answer_handlers(dp: Dispatcher, database: DataBase, openai: OpenAiTools, stable: StableDiffusion):
     Answer_Handlers = AnswerHandlers(database, openai, stable)
@@ -106,15 +117,15 @@ def register_answer_handlers(dp: Dispatcher, database: DataBase, openai: OpenAiT
     dp.message.register(Answer_Handlers.stable_answer_handler, States.STABLE_STATE, F.text)
     dp.message.register(Answer_Handlers.dall_e_answer_handler, States.DALL_E_STATE, F.text)
 
-def register_midjourney_handlers(dp: Dispatcher, database: DataBase, midjourney: MidJourney):
+def register_midjourney_handlers(dp: Dispatcher, routes: TextRoutes, database: DataBase, midjourney: MidJourney):
     midjourney_handlers = MidJourneyHandlers(database, midjourney)
-    dp.message.register(midjourney_handlers.midjourney_start_handler, States.ENTRY_STATE, F.text.regexp(r'^🖼️Images — MidJourney$'))
+    routes.button(midjourney_handlers.midjourney_start_handler, States.ENTRY_STATE, '🖼️Images — MidJourney')
     dp.message.register(midjourney_handlers.process_midjourney_request, States.MIDJOURNEY_STATE, F.text)
 
-def register_subscription_handlers(dp: Dispatcher, database: DataBase, telegram_stars: TelegramStarsService):
+def register_subscription_handlers(dp: Dispatcher, routes: TextRoutes, database: DataBase, telegram_stars: TelegramStarsService):
     subscription_handlers = SubscriptionHandlers(database, telegram_stars)
     dp.message.register(subscription_handlers.show_subscriptions_handler, Command('subscriptions'))
-    dp.message.register(subscription_handlers.show_subscriptions_handler, States.ENTRY_STATE, F.text.regexp(r'^Subscriptions$'))
+    routes.button(subscription_handlers.show_subscriptions_handler, States.ENTRY_STATE, 'Subscriptions')
     
     dp.callback_query.register(subscription_handlers.show_chat_plans_handler, F.data == "show_chat_plans")
     dp.callback_query.register(subscription_handlers.show_image_plans_handler, F.data == "show_image_plans")
@@ -145,27 +156,28 @@ def register_admin_handlers(dp: Dispatcher, database: DataBase):
     
     dp.callback_query.register(admin_handlers.admin_back_to_main_handler, F.data == "back_to_admin")
 
-def register_referral_handlers(dp: Dispatcher, database: DataBase):
+def register_referral_handlers(dp: Dispatcher, routes: TextRoutes, database: DataBase):
     referral_handlers = ReferralHandlers(database)
     dp.message.register(referral_handlers.show_referral_program_handler, Command('referral'))
-    dp.message.register(referral_handlers.show_referral_program_handler, States.ENTRY_STATE, F.text.regexp(r'^Referral program$'))
+    routes.button(referral_handlers.show_referral_program_handler, States.ENTRY_STATE, 'Referral program')
     
     dp.callback_query.register(referral_handlers.show_referrals_list_handler, F.data == "show_referrals_list")
+    dp.callback_query.register(referral_handlers.show_referrals_list_handler, F.data.startswith("referrals_page:"))
     dp.callback_query.register(referral_handlers.back_to_referral_program_handler, F.data == "back_to_referral_program")
     
-def register_telegram_stars_handlers(dp: Dispatcher, database: DataBase, telegram_stars: TelegramStarsService):
+def register_telegram_stars_handlers(dp: Dispatcher, routes: TextRoutes, database: DataBase, telegram_stars: TelegramStarsService):
     telegram_stars_handlers = TelegramStarsHandlers(database, telegram_stars)
     start_handler = StartHandler(database)  
     
     dp.message.register(telegram_stars_handlers.stars_balance_handler, Command('stars'))
     dp.message.register(telegram_stars_handlers.buy_stars_handler, Command('buy'))
     
-    dp.message.register(telegram_stars_handlers.check_stars_balance, States.TELEGRAM_STARS_MENU_STATE, F.text.regexp(r'^Check balance$'))
-    dp.message.register(telegram_stars_handlers.send_invoice_handler, States.TELEGRAM_STARS_MENU_STATE, F.text.regexp(r'^100K ChatGPT tokens - 20 stars$'))
-    dp.message.register(telegram_stars_handlers.send_invoice_handler, States.TELEGRAM_STARS_MENU_STATE, F.text.regexp(r'^50 DALL·E image generations - 20 stars$'))
-    dp.message.register(telegram_stars_handlers.send_invoice_handler, States.TELEGRAM_STARS_MENU_STATE, F.text.regexp(r'^50 Stable Diffusion image generations - 20 stars$'))
-    dp.message.register(telegram_stars_handlers.send_invoice_handler, States.TELEGRAM_STARS_MENU_STATE, F.text.regexp(r'^50 MidJourney image generations - 20 stars$'))
-    dp.message.register(start_handler.start_handler, States.TELEGRAM_STARS_MENU_STATE, F.text.regexp(r'^Back$'))
+    routes.button(telegram_stars_handlers.check_stars_balance, States.TELEGRAM_STARS_MENU_STATE, 'Check balance')
+    routes.button(telegram_stars_handlers.send_invoice_handler, States.TELEGRAM_STARS_MENU_STATE, '100K ChatGPT tokens - 20 stars')
+    routes.button(telegram_stars_handlers.send_invoice_handler, States.TELEGRAM_STARS_MENU_STATE, '50 DALL·E image generations - 20 stars')
+    routes.button(telegram_stars_handlers.send_invoice_handler, States.TELEGRAM_STARS_MENU_STATE, '50 Stable Diffusion image generations - 20 stars')
+    routes.button(telegram_stars_handlers.send_invoice_handler, States.TELEGRAM_STARS_MENU_STATE, '50 MidJourney image generations - 20 stars')
+    routes.button(start_handler.start_handler, States.TELEGRAM_STARS_MENU_STATE, 'Back')
     
     dp.pre_checkout_query.register(telegram_stars_handlers.pre_checkout_handler)
     dp.message.register(telegram_stars_handlers.success_payment_handler, F.successful_payment)
\ No newline at end of file
@@ -0,0 +1,80 @@
+import json
+from typing import Any, Dict, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, KeyBuilder, StateType, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+from psycopg_pool import AsyncConnectionPool
+
+from app.services.db import DatabaseError
+
+class PostgresStorage(BaseStorage):
+    """FSM-хранилище в таблице fsm_storage через общий пул соединений.
+
+    Состояние и данные пользователя видны всем воркерам и узлам, поэтому
+    апдейты одного пользователя могут обрабатываться любым процессом.
+    Работает и на SQLiteDataBaseCore.
+    """
+    def __init__(self, pool: AsyncConnectionPool, key_builder: KeyBuilder = None):
+        self.pool = pool
+        self.key_builder = key_builder or DefaultKeyBuilder(with_bot_id=True, with_destiny=True)
+
+    async def create_table(self):
+        try:
+            async with self.pool.connection() as conn:
+                async with conn.cursor() as cursor:
+                    await cursor.execute("CREATE TABLE IF NOT EXISTS fsm_storage (key TEXT PRIMARY KEY, state TEXT, data TEXT)")
+                    await conn.commit()
+        except Exception as e:
+            err = DatabaseError(str(e))
+            err.output()
+            raise err
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        value = state.state if isinstance(state, State) else state
+        async with self.pool.connection() as conn:
+            async with conn.cursor() as cursor:
+                await cursor.execute("""
+                    INSERT INTO fsm_storage(key, state) VALUES (%s, %s)
+                    ON CONFLICT (key) DO UPDATE SET state = EXCLUDED.state
+                """, (self.key_builder.build(key), value))
+                await conn.commit()
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        async with self.pool.connection() as conn:
+            async with conn.cursor() as cursor:
+                await cursor.execute("SELECT state FROM fsm_storage WHERE key = %s", (self.key_builder.build(key),))
+                result = await cursor.fetchone()
+                return result[0] if result else None
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        async with self.pool.connection() as conn:
+            async with conn.cursor() as cursor:
+                await cursor.execute("""
+                    INSERT INTO fsm_storage(key, data) VALUES (%s, %s)
+                    ON CONFLICT (key) DO UPDATE SET data = EXCLUDED.data
+                """, (self.key_builder.build(key), json.dumps(data, ensure_ascii=False)))
+                await conn.commit()
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        async with self.pool.connection() as conn:
+            async with conn.cursor() as cursor:
+                await cursor.execute("SELECT data FROM fsm_storage WHERE key = %s", (self.key_builder.build(key),))
+                result = await cursor.fetchone()
+                return json.loads(result[0]) if result and result[0] else {}
+
+    async def close(self) -> None:
+        # Пулом владеет DataBaseCore
+        pass
+
+def create_storage(url: Optional[str], pool: AsyncConnectionPool) -> BaseStorage:
+    """Хранилище FSM по FSM_STORAGE: memory (по умолчанию), database или redis://..."""
+    if not url or url == "memory":
+        return MemoryStorage()
+    if url == "database":
+        return PostgresStorage(pool)
+    if url.startswith("redis://") or url.startswith("rediss://"):
+        # Нужен пакет redis, например для локального Redis-совместимого сервера
+        from aiogram.fsm.storage.redis import RedisStorage
+        return RedisStorage.from_url(url, key_builder=DefaultKeyBuilder(with_bot_id=True, with_destiny=True))
+    raise ValueError(f"Unknown FSM storage: {url}")
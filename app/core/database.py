@@ -9,4 +9,9 @@ class DataBaseCore:
         await self.pool.wait()
 
     async def close_pool(self):
-        await self.pool.close()
\ No newline at end of file
+        await self.pool.close()
+
+    def stats(self):
+        """Текущее состояние пула: размер, свободные соединения, ожидающие запросы"""
+        stats = self.pool.get_stats()
+        return {key: stats.get(key, 0) for key in ("pool_min", "pool_max", "pool_size", "pool_available", "requests_waiting")}
\ No newline at end of file
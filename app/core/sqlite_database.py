@@ -1,88 +1,231 @@
+import asyncio
+import re
+import sqlite3
+from datetime import datetime
+from functools import lru_cache
+from typing import Any, List, Optional, Sequence, Tuple
+
 import aiosqlite
-import os
-from typing import Optional, Dict, Any, List, Tuple
+
+PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA busy_timeout = 5000",
+    "PRAGMA foreign_keys = ON",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -65536",
+    "PRAGMA mmap_size = 268435456",
+)
+
+# Типы колонок схемы PostgreSQL, которые возвращаются как в psycopg
+sqlite3.register_adapter(datetime, lambda value: value.isoformat(" "))
+sqlite3.register_converter("TIMESTAMP", lambda value: datetime.fromisoformat(value.decode()))
+sqlite3.register_converter("BOOLEAN", lambda value: value not in (b"0", b"", b"false", b"FALSE"))
+
+_INTERVAL = re.compile(r"(NOW\(\)|CURRENT_TIMESTAMP)\s*([+-])\s*INTERVAL\s*'(%s|\d+)\s+(\w+?)s?'", re.IGNORECASE)
+_NOW = re.compile(r"\bNOW\(\)", re.IGNORECASE)
+_SERIAL = re.compile(r"\bSERIAL\s+PRIMARY\s+KEY\b", re.IGNORECASE)
+_FOR_UPDATE = re.compile(r"\s+FOR\s+UPDATE(\s+SKIP\s+LOCKED)?", re.IGNORECASE)
+_READ = re.compile(r"\s*(SELECT|PRAGMA|EXPLAIN)\b", re.IGNORECASE)
+
+def _interval(match: re.Match) -> str:
+    _, sign, amount, unit = match.groups()
+    unit = unit.lower() + "s"
+    if amount == "%s":
+        return f"datetime('now', '{sign}' || %s || ' {unit}')"
+    return f"datetime('now', '{sign}{amount} {unit}')"
+
+def _placeholders(query: str) -> str:
+    """%s -> ? и %% -> % вне строковых литералов"""
+    parts = re.split(r"('(?:[^']|'')*')", query)
+    for i in range(0, len(parts), 2):
+        parts[i] = parts[i].replace("%s", "?").replace("%%", "%")
+    return "".join(parts)
+
+@lru_cache(maxsize=1024)
+def translate(query: str) -> Tuple[str, bool]:
+    """Переводит запрос в диалекте PostgreSQL в SQLite.
+
+    Возвращает текст запроса и признак записи (такие запросы идут через
+    соединение-писатель). EXCLUDED в ON CONFLICT и RETURNING SQLite понимает
+    сам, FOR UPDATE не нужен - писатель один.
+    """
+    is_write = not _READ.match(query) or bool(_FOR_UPDATE.search(query))
+    query = _INTERVAL.sub(_interval, query)
+    query = _NOW.sub("CURRENT_TIMESTAMP", query)
+    query = _SERIAL.sub("INTEGER PRIMARY KEY AUTOINCREMENT", query)
+    query = _FOR_UPDATE.sub("", query)
+    return _placeholders(query), is_write
 
 class SQLiteDataBaseCore:
-    """Класс для работы с SQLite вместо PostgreSQL"""
-    
-    def __init__(self, db_url: str):
+    """Локальный режим на SQLite вместо PostgreSQL.
+
+    База открывается в режиме WAL: одно соединение пишет, несколько читают
+    параллельно. Интерфейс pool.connection() совпадает с psycopg_pool, поэтому
+    DataBase работает без изменений. Соединение выбирается по первому запросу
+    внутри async with: чтение берет свободного читателя, запись занимает
+    писателя до конца блока (и все последующие запросы блока идут через него).
+    """
+    def __init__(self, db_url: str, readers: int = 4):
         # Извлекаем путь к файлу из URL
         if db_url.startswith('sqlite:///'):
             self.db_path = db_url[10:]
         else:
             self.db_path = db_url
+        # База в памяти видна только одному соединению
+        self.readers_count = 0 if self.db_path == ':memory:' else readers
         self.pool = self  # Совместимость с интерфейсом PostgreSQL
-        self.conn = None
-        
+        self.writer: Optional[aiosqlite.Connection] = None
+        self.writer_lock = asyncio.Lock()
+        self.readers: "asyncio.Queue[aiosqlite.Connection]" = asyncio.Queue()
+        self._reader_conns: List[aiosqlite.Connection] = []
+
+    async def _connect(self, read_only: bool) -> aiosqlite.Connection:
+        conn = await aiosqlite.connect(self.db_path, detect_types=sqlite3.PARSE_DECLTYPES)
+        for pragma in PRAGMAS:
+            await conn.execute(pragma)
+        if read_only:
+            await conn.execute("PRAGMA query_only = ON")
+        return conn
+
     async def open_pool(self) -> None:
-        """Открываем соединение с базой данных"""
-        self.conn = await aiosqlite.connect(self.db_path)
-        # Настройка для получения словарей вместо кортежей
-        self.conn.row_factory = aiosqlite.Row
-        
-    async def connection(self):
+        """Открываем писателя и читателей"""
+        if self.writer is not None:
+            return
+        self.writer = await self._connect(read_only=False)
+        for _ in range(self.readers_count):
+            conn = await self._connect(read_only=True)
+            self._reader_conns.append(conn)
+            self.readers.put_nowait(conn)
+
+    def connection(self) -> "SQLiteConnectionWrapper":
         """Возвращает объект для использования с контекстным менеджером"""
-        if not self.conn:
-            await self.open_pool()
-        return SQLiteConnectionWrapper(self.conn)
-    
-    async def close(self) -> None:
-        """Закрываем соединение с базой данных"""
-        if self.conn:
-            await self.conn.close()
-            self.conn = None
+        return SQLiteConnectionWrapper(self)
+
+    async def close_pool(self) -> None:
+        """Закрываем все соединения с базой данных"""
+        for conn in self._reader_conns:
+            await conn.close()
+        self._reader_conns = []
+        self.readers = asyncio.Queue()
+        if self.writer is not None:
+            await self.writer.close()
+            self.writer = None
+
+    close = close_pool
+
+    def stats(self):
+        """Состояние соединений в тех же ключах, что у DataBaseCore.stats"""
+        size = self.readers_count + 1 if self.writer is not None else 0
+        available = self.readers.qsize() + (0 if self.writer_lock.locked() or self.writer is None else 1)
+        return {"pool_min": size, "pool_max": size, "pool_size": size, "pool_available": available, "requests_waiting": 0}
 
 class SQLiteConnectionWrapper:
-    """Обертка для совместимости с контекстным менеджером PostgreSQL"""
-    
-    def __init__(self, conn):
-        self.conn = conn
-        self.cursor = None
-        
+    """Соединение из пула на время блока async with, как у psycopg_pool:
+    при успешном выходе транзакция фиксируется, при исключении откатывается"""
+
+    def __init__(self, core: SQLiteDataBaseCore):
+        self.core = core
+        self.conn: Optional[aiosqlite.Connection] = None
+        self.reader: Optional[aiosqlite.Connection] = None
+        self.writing = False
+
     async def __aenter__(self):
+        if self.core.writer is None:
+            await self.core.open_pool()
         return self
-        
+
     async def __aexit__(self, exc_type, exc_val, exc_tb):
-        if self.cursor:
-            await self.cursor.close()
-            self.cursor = None
-        
-    async def cursor(self):
+        try:
+            if self.writing:
+                if exc_type is None:
+                    await self.conn.commit()
+                else:
+                    await self.conn.rollback()
+        finally:
+            self._release()
+
+    def _release(self):
+        if self.reader is not None:
+            self.core.readers.put_nowait(self.reader)
+            self.reader = None
+        if self.writing:
+            self.writing = False
+            self.core.writer_lock.release()
+        self.conn = None
+
+    async def acquire(self, is_write: bool) -> aiosqlite.Connection:
+        """Соединение для очередного запроса блока"""
+        if self.writing:
+            return self.conn
+        if is_write or self.core.readers_count == 0:
+            await self.core.writer_lock.acquire()
+            if self.reader is not None:
+                self.core.readers.put_nowait(self.reader)
+                self.reader = None
+            self.writing = True
+            self.conn = self.core.writer
+        elif self.reader is None:
+            self.reader = self.conn = await self.core.readers.get()
+        return self.conn
+
+    def cursor(self) -> "SQLiteCursorWrapper":
         """Создает курсор SQLite с интерфейсом, совместимым с PostgreSQL"""
-        self.cursor = await self.conn.cursor()
-        return SQLiteCursorWrapper(self.cursor, self.conn)
-    
+        return SQLiteCursorWrapper(self)
+
     async def commit(self):
         """Фиксирует изменения в базе данных"""
-        await self.conn.commit()
-        
+        if self.writing:
+            await self.conn.commit()
+
+    async def rollback(self):
+        if self.writing:
+            await self.conn.rollback()
+
 class SQLiteCursorWrapper:
     """Обертка для совместимости курсора SQLite с PostgreSQL"""
-    
-    def __init__(self, cursor, conn):
-        self.cursor = cursor
-        self.conn = conn
-        
+
+    def __init__(self, connection: SQLiteConnectionWrapper):
+        self.connection = connection
+        self.cursor: Optional[aiosqlite.Cursor] = None
+
     async def __aenter__(self):
         return self
-        
+
     async def __aexit__(self, exc_type, exc_val, exc_tb):
-        await self.cursor.close()
-        
-    async def execute(self, query: str, params=None):
+        await self.close()
+
+    async def close(self):
+        if self.cursor is not None:
+            await self.cursor.close()
+            self.cursor = None
+
+    async def execute(self, query: str, params: Optional[Sequence[Any]] = None):
         """Выполняет SQL-запрос с параметрами"""
-        # Преобразуем PostgreSQL плейсхолдеры (%s) в SQLite (?) 
-        query = query.replace('%s', '?')
-        await self.cursor.execute(query, params)
+        query, is_write = translate(query)
+        conn = await self.connection.acquire(is_write)
+        await self.close()
+        self.cursor = await conn.execute(query, tuple(params) if params is not None else ())
         return self
-        
+
+    async def executemany(self, query: str, params_seq: Sequence[Sequence[Any]]):
+        query, is_write = translate(query)
+        conn = await self.connection.acquire(is_write)
+        await self.close()
+        self.cursor = await conn.executemany(query, [tuple(params) for params in params_seq])
+        return self
+
+    @property
+    def rowcount(self) -> int:
+        return self.cursor.rowcount if self.cursor is not None else -1
+
     async def fetchone(self):
         """Возвращает одну строку результата"""
         row = await self.cursor.fetchone()
         if row:
             return tuple(row)
         return None
-        
+
     async def fetchall(self):
         """Возвращает все строки результата"""
         rows = await self.cursor.fetchall()
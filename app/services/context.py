@@ -0,0 +1,82 @@
+from typing import Dict, List, Optional, Tuple
+
+from app.bot.utils import encoding
+from app.services.db import DataBase
+from app.services.openaitools import OpenAiTools
+
+SYSTEM_PROMPT = "You are ChatGPT, a helpful assistant in a Telegram bot. Answer in the language of the user."
+SYSTEM_TOKENS = len(encoding.encode(SYSTEM_PROMPT))
+
+# Бюджет входных токенов на ход по тарифу чата, None - без подписки
+DEFAULT_BUDGETS = {
+    None: 8000,
+    "starter": 16000,
+    "advanced": 32000,
+    "expert": 64000,
+}
+
+class ContextBuilder:
+    """Собирает контекст для gpt-4o со стабильным префиксом.
+
+    Порядок сообщений всегда один и тот же: системный промпт, краткое содержание
+    старой части диалога и затем ходы по порядку. Пока история укладывается в
+    бюджет тарифа, префикс не меняется от хода к ходу и попадает в кэш промптов
+    провайдера. При превышении бюджета старые ходы сжимаются в краткое
+    содержание так, чтобы осталась только compact_ratio бюджета, поэтому
+    сжатие (и смена префикса) происходит редко.
+    """
+    def __init__(self, database: DataBase, openai: OpenAiTools, budgets: Dict[Optional[str], int] = None, compact_ratio: float = 0.5):
+        self.database = database
+        self.openai = openai
+        self.budgets = budgets or DEFAULT_BUDGETS
+        self.compact_ratio = compact_ratio
+
+    async def budget_for(self, user_id: int) -> int:
+        subscription = await self.database.check_subscription(user_id, "chat")
+        plan = subscription['plan'] if subscription else None
+        return self.budgets.get(plan, self.budgets[None])
+
+    async def build(self, user_id: int) -> Tuple[List[Dict[str, str]], int]:
+        """Возвращает сообщения для запроса и оценку числа входных токенов"""
+        budget = await self.budget_for(user_id)
+        history = await self.database.get_history(user_id)
+        summary = await self.database.get_summary(user_id)
+        summary_text, summary_tokens = summary if summary else (None, 0)
+
+        if summary_tokens + sum(tokens for _, _, _, tokens in history) > budget:
+            summary_text, summary_tokens, history = await self._compact(user_id, budget, summary_text, summary_tokens, history)
+
+        messages = [{"role": "system", "content": SYSTEM_PROMPT}]
+        if summary_text:
+            messages.append({"role": "system", "content": f"Summary of the earlier conversation:\n{summary_text}"})
+        messages += [{"role": role, "content": content} for _, role, content, _ in history]
+
+        return messages, SYSTEM_TOKENS + summary_tokens + sum(tokens for _, _, _, tokens in history)
+
+    async def _compact(self, user_id: int, budget: int, summary_text: Optional[str], summary_tokens: int, history: List[Tuple[int, str, str, int]]):
+        target = int(budget * self.compact_ratio)
+
+        # Оставляем самые новые ходы, которые помещаются в target, но хотя бы последний
+        cut = len(history)
+        kept_tokens = 0
+        for i in range(len(history) - 1, -1, -1):
+            if kept_tokens + history[i][3] > target and i < len(history) - 1:
+                break
+            kept_tokens += history[i][3]
+            cut = i
+        old, recent = history[:cut], history[cut:]
+        if not old:
+            return summary_text, summary_tokens, history
+
+        text = "\n".join(f"{role}: {content}" for _, role, content, _ in old)
+        if summary_text:
+            text = f"Earlier summary:\n{summary_text}\n\n{text}"
+
+        new_summary = await self.openai.summarize(text, user_id, summary_tokens + sum(tokens for _, _, _, tokens in old))
+        if not new_summary:
+            # Пересказать не удалось, просто отбрасываем старые ходы
+            new_summary = summary_text
+        new_tokens = len(encoding.encode(new_summary)) if new_summary else 0
+
+        await self.database.save_summary(user_id, new_summary, new_tokens, old[-1][0])
+        return new_summary, new_tokens, recent
@@ -1,5 +1,10 @@
-from aiocryptopay import AioCryptoPay, Networks, utils
+from aiocryptopay import AioCryptoPay, Networks
+from typing import Dict
+import asyncio
 import logging
+import time
+
+from app.services.metrics import track_upstream
 
 class CryptoPayError(Exception):
     def __init__(self, msg: str = "Error"):
@@ -8,23 +13,67 @@ class CryptoPayError(Exception):
         logging.error("CryptoPay error:", self.msg)
 
 class CryptoPay:
-    def __init__(self, token: str):
+    """Клиент CryptoPay с кэшем курсов к USD.
+
+    Курсы обновляются в фоне каждые refresh_interval секунд. Если кэш пуст или
+    старше max_age, getprice дожидается обновления, причем одновременные
+    запросы ждут один и тот же вызов get_exchange_rates. По умолчанию max_age
+    не меньше двух интервалов обновления, чтобы кэш между обновлениями не
+    считался устаревшим.
+    """
+    def __init__(self, token: str, refresh_interval: float = 60, max_age: float = None):
         self.crypto = AioCryptoPay(token=token, network=Networks.MAIN_NET)
+        self.refresh_interval = refresh_interval
+        self.max_age = max_age if max_age is not None else max(300, 2 * refresh_interval)
+        self.rates: Dict[str, float] = {}
+        self.rates_updated = 0.0
+        self._refresh_task = None
+        self._background_task = None
+
+    async def _fetch_rates(self):
+        async with track_upstream("cryptopay", "exchange_rates"):
+            rates = await self.crypto.get_exchange_rates()
+        self.rates = {rate.source: float(rate.rate) for rate in rates
+                      if rate.target == 'USD' and getattr(rate, 'is_valid', True) and rate.rate}
+        self.rates_updated = time.monotonic()
+
+    async def refresh_rates(self):
+        """Обновляет курсы, параллельные вызовы ждут один запрос к API"""
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.create_task(self._fetch_rates())
+        await asyncio.shield(self._refresh_task)
+
+    async def _refresh_loop(self):
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            try:
+                await self.refresh_rates()
+            except Exception as e:
+                logging.error(f"CryptoPay rates refresh failed: {e}")
+
+    def start(self):
+        if self._background_task is None:
+            self._background_task = asyncio.create_task(self._refresh_loop())
+
+    async def close(self):
+        if self._background_task is not None:
+            self._background_task.cancel()
+            self._background_task = None
+
+    async def get_rate(self, currency: str) -> float:
+        """Курс currency к USD из кэша"""
+        if not self.rates or time.monotonic() - self.rates_updated > self.max_age:
+            await self.refresh_rates()
+        self.start()
+        if currency not in self.rates:
+            raise CryptoPayError(f"No USD rate for {currency}")
+        return self.rates[currency]
+
     async def getprice(self, cost: int, currency: str) -> float:
         try:
-            rates = await self.crypto.get_exchange_rates()
             if currency == "USDT":
-                pass
-            elif currency == "TON":
-                exchange = float((utils.exchange.get_rate('TON', 'USD', rates)).rate)
-                cost = cost / exchange
-            elif currency == "BTC":
-                exchange = float((utils.exchange.get_rate('BTC', 'USD', rates)).rate)
-                cost = cost / exchange
-            elif currency == "ETH":
-                exchange = float((utils.exchange.get_rate('ETH', 'USD', rates)).rate)
-                cost = cost / exchange
-            return cost
+                return cost
+            return cost / await self.get_rate(currency)
         except Exception as e:
             err = CryptoPayError(str(e))
             err.output()
@@ -33,9 +82,10 @@ class CryptoPay:
     async def create_invoice(self, cost: int, currency: str):
         try:
             price = await self.getprice(cost, currency)
-            invoice = await self.crypto.create_invoice(asset=currency, amount=price)
+            async with track_upstream("cryptopay", "create_invoice"):
+                invoice = await self.crypto.create_invoice(asset=currency, amount=price)
             return invoice.bot_invoice_url, invoice.invoice_id
         except Exception as e:
             err = CryptoPayError(str(e))
             err.output()
-            raise err
\ No newline at end of file
+            raise err
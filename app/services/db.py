@@ -1,5 +1,6 @@
 from psycopg_pool import AsyncConnectionPool
-from typing import List, Tuple, Dict
+from typing import List, Tuple, Dict, NamedTuple, Optional
+import datetime
 import logging
 
 class DatabaseError(Exception):
@@ -8,6 +9,29 @@ class DatabaseError(Exception):
     def output(self):
         logging.error("Database error:", self.msg)
 
+# Что начисляет оплата каждого продукта: (колонка в users, количество)
+PAYMENT_CREDITS = {
+    "chatgpt": ("chatgpt", 100000),
+    "dall_e": ("dall_e", 50),
+    "stable": ("stable_diffusion", 50),
+    "midjourney": ("midjourney", 50),
+}
+
+class ActivePlan(NamedTuple):
+    type: str
+    plan: str
+    daily_limit: int
+    usage_today: int
+    end_date: datetime.datetime
+
+class UserDashboard(NamedTuple):
+    """Неизменяемый снимок баланса и активных подписок пользователя"""
+    chatgpt: int
+    dall_e: int
+    stable_diffusion: int
+    midjourney: int
+    plans: Tuple[ActivePlan, ...]
+
 class DataBase:
     def __init__(self, pool: AsyncConnectionPool):
         self.pool = pool
@@ -42,6 +66,22 @@ class DataBase:
                         FOREIGN KEY (referrer_id) REFERENCES users (user_id) ON DELETE CASCADE,
                         FOREIGN KEY (referred_id) REFERENCES users (user_id) ON DELETE CASCADE)
                     """)
+                    await cursor.execute("CREATE INDEX IF NOT EXISTS referrals_referrer_idx ON referrals (referrer_id, id)")
+                    
+                    # Счетчики рефералов, чтобы не пересчитывать referrals при каждом показе
+                    await cursor.execute("""CREATE TABLE IF NOT EXISTS referral_stats (
+                        referrer_id BIGINT PRIMARY KEY,
+                        total INT DEFAULT 0,
+                        bonus_given INT DEFAULT 0,
+                        FOREIGN KEY (referrer_id) REFERENCES users (user_id) ON DELETE CASCADE)
+                    """)
+                    await cursor.execute("""
+                        INSERT INTO referral_stats(referrer_id, total, bonus_given)
+                        SELECT referrer_id, COUNT(*), SUM(CASE WHEN bonus_given THEN 1 ELSE 0 END)
+                        FROM referrals WHERE referrer_id IS NOT NULL
+                        GROUP BY referrer_id
+                        ON CONFLICT (referrer_id) DO NOTHING
+                    """)
                     
                     # Таблица для администраторов
                     await cursor.execute("""CREATE TABLE IF NOT EXISTS admins (
@@ -50,6 +90,39 @@ class DataBase:
                         added_date TIMESTAMP)
                     """)
                     
+                    # Сжатая история диалога и учет токенов ChatGPT
+                    await cursor.execute("""CREATE TABLE IF NOT EXISTS summaries (
+                        user_id BIGINT PRIMARY KEY,
+                        content TEXT,
+                        tokens INT,
+                        FOREIGN KEY (user_id) REFERENCES users (user_id) ON DELETE CASCADE)
+                    """)
+                    
+                    # Журнал платежей, ключ идемпотентности - id платежа у провайдера
+                    await cursor.execute("""CREATE TABLE IF NOT EXISTS payment_events (
+                        id SERIAL PRIMARY KEY,
+                        provider TEXT NOT NULL,
+                        charge_id TEXT NOT NULL,
+                        user_id BIGINT,
+                        product TEXT,
+                        status TEXT DEFAULT 'pending',
+                        created_at TIMESTAMP DEFAULT NOW(),
+                        applied_at TIMESTAMP,
+                        UNIQUE (provider, charge_id),
+                        FOREIGN KEY (user_id) REFERENCES users (user_id) ON DELETE CASCADE)
+                    """)
+                    await cursor.execute("CREATE INDEX IF NOT EXISTS payment_events_pending_idx ON payment_events (id) WHERE status = 'pending'")
+                    
+                    await cursor.execute("""CREATE TABLE IF NOT EXISTS chat_usage (
+                        id SERIAL PRIMARY KEY,
+                        user_id BIGINT,
+                        prompt_tokens INT,
+                        cached_tokens INT,
+                        completion_tokens INT,
+                        created_at TIMESTAMP DEFAULT NOW(),
+                        FOREIGN KEY (user_id) REFERENCES users (user_id) ON DELETE CASCADE)
+                    """)
+                    
                     await conn.commit()
         except Exception as e:
             err = DatabaseError(str(e))
@@ -74,6 +147,10 @@ class DataBase:
                     # Если это реферал, добавляем запись в таблицу referrals
                     if referrer_id is not None:
                         await cursor.execute("INSERT INTO referrals(referrer_id, referred_id, date_joined) VALUES (%s, %s, NOW())", (referrer_id, user_id))
+                        await cursor.execute("""
+                            INSERT INTO referral_stats(referrer_id, total, bonus_given) VALUES (%s, 1, 0)
+                            ON CONFLICT (referrer_id) DO UPDATE SET total = referral_stats.total + 1
+                        """, (referrer_id,))
                     await conn.commit()
         except Exception as e:
             err = DatabaseError(str(e))
@@ -207,11 +284,25 @@ class DataBase:
             err = DatabaseError(str(e))
             err.output()
             raise err
-    async def save_message(self, user_id: int, role: str, message: str, tokens: int):
+    async def save_message(self, user_id: int, role: str, message: str, tokens: int) -> int:
+        """Сохраняет ход диалога и возвращает его id"""
         try:
             async with self.pool.connection() as conn:
                 async with conn.cursor() as cursor:
-                    await cursor.execute("INSERT INTO messages(user_id, role, content, tokens) VALUES (%s, %s, %s, %s)", (user_id, role, message, tokens))
+                    await cursor.execute("INSERT INTO messages(user_id, role, content, tokens) VALUES (%s, %s, %s, %s) RETURNING id", (user_id, role, message, tokens))
+                    message_id = (await cursor.fetchone())[0]
+                    await conn.commit()
+                    return message_id
+        except Exception as e:
+            err = DatabaseError(str(e))
+            err.output()
+            raise err
+    async def delete_message(self, user_id: int, message_id: int):
+        """Удаляет один ход диалога, например вопрос, на который не удалось получить ответ"""
+        try:
+            async with self.pool.connection() as conn:
+                async with conn.cursor() as cursor:
+                    await cursor.execute("DELETE FROM messages WHERE user_id = %s AND id = %s", (user_id, message_id))
                     await conn.commit()
         except Exception as e:
             err = DatabaseError(str(e))
@@ -222,6 +313,7 @@ class DataBase:
             async with self.pool.connection() as conn:
                 async with conn.cursor() as cursor:
                     await cursor.execute("DELETE FROM messages WHERE user_id = %s", (user_id,))
+                    await cursor.execute("DELETE FROM summaries WHERE user_id = %s", (user_id,))
                     await conn.commit()
         except Exception as e:
             err = DatabaseError(str(e))
@@ -254,6 +346,122 @@ class DataBase:
             err = DatabaseError(str(e))
             err.output()
             raise err
+    async def get_history(self, user_id: int) -> List[Tuple[int, str, str, int]]:
+        """Возвращает всю несжатую историю диалога: (id, role, content, tokens)"""
+        try:
+            async with self.pool.connection() as conn:
+                async with conn.cursor() as cursor:
+                    await cursor.execute("SELECT id, role, content, tokens FROM messages WHERE user_id = %s ORDER BY id ASC", (user_id,))
+                    return await cursor.fetchall()
+        except Exception as e:
+            err = DatabaseError(str(e))
+            err.output()
+            raise err
+    async def get_summary(self, user_id: int) -> Tuple[str, int]:
+        try:
+            async with self.pool.connection() as conn:
+                async with conn.cursor() as cursor:
+                    await cursor.execute("SELECT content, tokens FROM summaries WHERE user_id = %s", (user_id,))
+                    return await cursor.fetchone()
+        except Exception as e:
+            err = DatabaseError(str(e))
+            err.output()
+            raise err
+    async def save_summary(self, user_id: int, content: str, tokens: int, last_message_id: int):
+        """Заменяет сообщения до last_message_id включительно на краткое содержание"""
+        try:
+            async with self.pool.connection() as conn:
+                async with conn.cursor() as cursor:
+                    await cursor.execute("DELETE FROM messages WHERE user_id = %s AND id <= %s", (user_id, last_message_id))
+                    if content:
+                        await cursor.execute("""
+                            INSERT INTO summaries(user_id, content, tokens) VALUES (%s, %s, %s)
+                            ON CONFLICT (user_id) DO UPDATE SET content = EXCLUDED.content, tokens = EXCLUDED.tokens
+                        """, (user_id, content, tokens))
+                    await conn.commit()
+        except Exception as e:
+            err = DatabaseError(str(e))
+            err.output()
+            raise err
+    async def save_chat_usage(self, user_id: int, prompt_tokens: int, cached_tokens: int, completion_tokens: int):
+        try:
+            async with self.pool.connection() as conn:
+                async with conn.cursor() as cursor:
+                    await cursor.execute("INSERT INTO chat_usage(user_id, prompt_tokens, cached_tokens, completion_tokens) VALUES (%s, %s, %s, %s)", (user_id, prompt_tokens, cached_tokens, completion_tokens))
+                    await conn.commit()
+        except Exception as e:
+            err = DatabaseError(str(e))
+            err.output()
+            raise err
+    async def record_cryptopay_payment(self, invoice_id: int) -> bool:
+        """Сохраняет оплаченный счет CryptoPay в журнал платежей. Повторное уведомление ничего не делает"""
+        try:
+            async with self.pool.connection() as conn:
+                async with conn.cursor() as cursor:
+                    await cursor.execute("""
+                        INSERT INTO payment_events(provider, charge_id, user_id, product, status)
+                        SELECT 'cryptopay', %s, user_id, product, 'pending' FROM orders WHERE invoice_id = %s
+                        ON CONFLICT (provider, charge_id) DO NOTHING
+                        RETURNING id
+                    """, (str(invoice_id), invoice_id))
+                    result = await cursor.fetchone()
+                    await conn.commit()
+                    return result is not None
+        except Exception as e:
+            err = DatabaseError(str(e))
+            err.output()
+            raise err
+    async def credit_payment(self, provider: str, charge_id: str, user_id: int, product: str) -> bool:
+        """Записывает платеж в журнал и начисляет продукт в одной транзакции.
+        Возвращает False, если платеж с таким charge_id уже был учтен"""
+        try:
+            async with self.pool.connection() as conn:
+                async with conn.cursor() as cursor:
+                    await cursor.execute("""
+                        INSERT INTO payment_events(provider, charge_id, user_id, product, status, applied_at)
+                        VALUES (%s, %s, %s, %s, 'applied', NOW())
+                        ON CONFLICT (provider, charge_id) DO NOTHING
+                        RETURNING id
+                    """, (provider, charge_id, user_id, product))
+                    if await cursor.fetchone() is None:
+                        return False
+                    if product in PAYMENT_CREDITS:
+                        column, amount = PAYMENT_CREDITS[product]
+                        await cursor.execute(f"UPDATE users SET {column} = {column} + %s WHERE user_id = %s", (amount, user_id))
+                    await conn.commit()
+                    return True
+        except Exception as e:
+            err = DatabaseError(str(e))
+            err.output()
+            raise err
+    async def apply_pending_payments(self, limit: int = 100) -> List[Tuple[int, str]]:
+        """Начисляет пачку ожидающих платежей одной транзакцией и возвращает (user_id, product) начисленных"""
+        try:
+            async with self.pool.connection() as conn:
+                async with conn.cursor() as cursor:
+                    await cursor.execute("""
+                        SELECT id, provider, charge_id, user_id, product FROM payment_events
+                        WHERE status = 'pending'
+                        ORDER BY id
+                        LIMIT %s
+                        FOR UPDATE SKIP LOCKED
+                    """, (limit,))
+                    events = await cursor.fetchall()
+                    applied = []
+                    for event_id, provider, charge_id, user_id, product in events:
+                        if product in PAYMENT_CREDITS:
+                            column, amount = PAYMENT_CREDITS[product]
+                            await cursor.execute(f"UPDATE users SET {column} = {column} + %s WHERE user_id = %s", (amount, user_id))
+                            applied.append((user_id, product))
+                        if provider == 'cryptopay':
+                            await cursor.execute("DELETE FROM orders WHERE invoice_id = %s", (int(charge_id),))
+                        await cursor.execute("UPDATE payment_events SET status = 'applied', applied_at = NOW() WHERE id = %s", (event_id,))
+                    await conn.commit()
+                    return applied
+        except Exception as e:
+            err = DatabaseError(str(e))
+            err.output()
+            raise err
     async def get_midjourney(self, user_id: int) -> int:
         try:
             async with self.pool.connection() as conn:
@@ -320,7 +528,10 @@ class DataBase:
             raise err
     
     async def check_subscription(self, user_id: int, sub_type: str):
-        """Проверяет активную подписку и возвращает информацию о ней"""
+        """Проверяет активную подписку и возвращает информацию о ней.
+
+        Только читает: смену дня учитывает reserve_subscription_usage.
+        """
         try:
             async with self.pool.connection() as conn:
                 async with conn.cursor() as cursor:
@@ -333,37 +544,94 @@ class DataBase:
                     
                     if not result:
                         return None
-                        
-                    # Проверяем, нужно ли сбросить счетчик использования на сегодня
-                    last_reset = result[5].date()
-                    import datetime
-                    today = datetime.datetime.now().date()
                     
-                    if last_reset < today:
-                        # Сбрасываем счетчик, если прошел день
-                        await cursor.execute("""
-                            UPDATE subscriptions 
-                            SET usage_today = 0, last_usage_reset = NOW() 
-                            WHERE user_id = %s AND type = %s AND end_date > NOW()
-                        """, (user_id, sub_type))
+                    # Если прошел день, счетчик использования на сегодня считается нулевым
+                    usage_today = result[4]
+                    if result[5] is None or result[5].date() < datetime.datetime.now().date():
+                        usage_today = 0
+                    
+                    return {'plan': result[0], 'daily_limit': result[1], 'start_date': result[2], 'end_date': result[3], 'usage_today': usage_today}
+        except Exception as e:
+            err = DatabaseError(str(e))
+            err.output()
+            raise err
+    
+    async def get_dashboard(self, user_id: int) -> Optional[UserDashboard]:
+        """Баланс и активные подписки пользователя одним запросом"""
+        try:
+            async with self.pool.connection() as conn:
+                async with conn.cursor() as cursor:
+                    await cursor.execute("""
+                        SELECT u.chatgpt, u.dall_e, u.stable_diffusion, u.midjourney,
+                               s.type, s.plan, s.daily_limit, s.usage_today, s.last_usage_reset, s.end_date
+                        FROM users u
+                        LEFT JOIN subscriptions s ON s.user_id = u.user_id AND s.end_date > NOW()
+                        WHERE u.user_id = %s
+                        ORDER BY s.type
+                    """, (user_id,))
+                    rows = await cursor.fetchall()
+        except Exception as e:
+            err = DatabaseError(str(e))
+            err.output()
+            raise err
+        
+        if not rows:
+            return None
+        today = datetime.datetime.now().date()
+        plans = tuple(
+            # Если день сменился, счетчик использования на сегодня нулевой
+            ActivePlan(row[4], row[5], row[6], row[7] if row[8] and row[8].date() >= today else 0, row[9])
+            for row in rows if row[4] is not None
+        )
+        return UserDashboard(*rows[0][:4], plans)
+    
+    async def reserve_subscription_usage(self, user_id: int, sub_type: str):
+        """Атомарно занимает одно использование подписки на сегодня.
+
+        Смена дня и увеличение счетчика - один условный UPDATE, поэтому
+        параллельные запросы не превышают daily_limit. Возвращает None без
+        активной подписки, иначе {'reserved', 'usage_today', 'daily_limit'}.
+        """
+        try:
+            async with self.pool.connection() as conn:
+                async with conn.cursor() as cursor:
+                    await cursor.execute("""
+                        UPDATE subscriptions
+                        SET usage_today = CASE WHEN last_usage_reset IS NULL OR last_usage_reset < CURRENT_DATE THEN 1 ELSE usage_today + 1 END,
+                            last_usage_reset = CASE WHEN last_usage_reset IS NULL OR last_usage_reset < CURRENT_DATE THEN NOW() ELSE last_usage_reset END
+                        WHERE user_id = %s AND type = %s AND end_date > NOW()
+                          AND (last_usage_reset IS NULL OR last_usage_reset < CURRENT_DATE OR usage_today < daily_limit)
+                        RETURNING usage_today, daily_limit
+                    """, (user_id, sub_type))
+                    result = await cursor.fetchone()
+                    if result:
                         await conn.commit()
-                        return {'plan': result[0], 'daily_limit': result[1], 'start_date': result[2], 'end_date': result[3], 'usage_today': 0}
+                        return {'reserved': True, 'usage_today': result[0], 'daily_limit': result[1]}
                     
-                    return {'plan': result[0], 'daily_limit': result[1], 'start_date': result[2], 'end_date': result[3], 'usage_today': result[4]}
+                    # Лимит исчерпан или подписки нет
+                    await cursor.execute("""
+                        SELECT usage_today, daily_limit FROM subscriptions
+                        WHERE user_id = %s AND type = %s AND end_date > NOW()
+                    """, (user_id, sub_type))
+                    result = await cursor.fetchone()
+                    if not result:
+                        return None
+                    return {'reserved': False, 'usage_today': result[0], 'daily_limit': result[1]}
         except Exception as e:
             err = DatabaseError(str(e))
             err.output()
             raise err
     
-    async def increment_subscription_usage(self, user_id: int, sub_type: str):
-        """Увеличивает счетчик использования подписки на день"""
+    async def release_subscription_usage(self, user_id: int, sub_type: str):
+        """Возвращает занятое использование, если день еще не сменился"""
         try:
             async with self.pool.connection() as conn:
                 async with conn.cursor() as cursor:
                     await cursor.execute("""
-                        UPDATE subscriptions 
-                        SET usage_today = usage_today + 1 
+                        UPDATE subscriptions
+                        SET usage_today = usage_today - 1
                         WHERE user_id = %s AND type = %s AND end_date > NOW()
+                          AND usage_today > 0 AND last_usage_reset >= CURRENT_DATE
                     """, (user_id, sub_type))
                     await conn.commit()
         except Exception as e:
@@ -371,22 +639,77 @@ class DataBase:
             err.output()
             raise err
     
-    async def get_referrals(self, user_id: int):
-        """Получает список рефералов пользователя"""
+    async def reserve_credit(self, user_id: int, product: str):
+        """Атомарно списывает одну единицу баланса продукта, возвращает остаток или None"""
+        column = PAYMENT_CREDITS[product][0]
+        try:
+            async with self.pool.connection() as conn:
+                async with conn.cursor() as cursor:
+                    await cursor.execute(f"UPDATE users SET {column} = {column} - 1 WHERE user_id = %s AND {column} > 0 RETURNING {column}", (user_id,))
+                    result = await cursor.fetchone()
+                    await conn.commit()
+                    return result[0] if result else None
+        except Exception as e:
+            err = DatabaseError(str(e))
+            err.output()
+            raise err
+    
+    async def release_credit(self, user_id: int, product: str):
+        """Возвращает единицу баланса, списанную reserve_credit"""
+        column = PAYMENT_CREDITS[product][0]
+        try:
+            async with self.pool.connection() as conn:
+                async with conn.cursor() as cursor:
+                    await cursor.execute(f"UPDATE users SET {column} = {column} + 1 WHERE user_id = %s", (user_id,))
+                    await conn.commit()
+        except Exception as e:
+            err = DatabaseError(str(e))
+            err.output()
+            raise err
+    
+    async def get_referrals(self, user_id: int, after_id: int = None, before_id: int = None, limit: int = 20):
+        """Страница рефералов пользователя по ключу id: (referred_id, date_joined, bonus_given, id).
+
+        after_id - следующая страница после этого id, before_id - предыдущая до него.
+        """
         try:
             async with self.pool.connection() as conn:
                 async with conn.cursor() as cursor:
+                    if before_id is not None:
+                        await cursor.execute("""
+                            SELECT r.referred_id, r.date_joined, r.bonus_given, r.id
+                            FROM referrals r
+                            WHERE r.referrer_id = %s AND r.id < %s
+                            ORDER BY r.id DESC
+                            LIMIT %s
+                        """, (user_id, before_id, limit))
+                        return list(reversed(await cursor.fetchall()))
                     await cursor.execute("""
-                        SELECT r.referred_id, r.date_joined, r.bonus_given 
-                        FROM referrals r 
-                        WHERE r.referrer_id = %s
-                    """, (user_id,))
+                        SELECT r.referred_id, r.date_joined, r.bonus_given, r.id
+                        FROM referrals r
+                        WHERE r.referrer_id = %s AND r.id > %s
+                        ORDER BY r.id
+                        LIMIT %s
+                    """, (user_id, after_id or 0, limit))
                     return await cursor.fetchall()
         except Exception as e:
             err = DatabaseError(str(e))
             err.output()
             raise err
     
+    async def get_referral_stats(self, user_id: int) -> Tuple[int, int]:
+        """Всего приглашено и сколько бонусов выдано"""
+        try:
+            async with self.pool.connection() as conn:
+                async with conn.cursor() as cursor:
+                    await cursor.execute("SELECT total, bonus_given FROM referral_stats WHERE referrer_id = %s", (user_id,))
+                    result = await cursor.fetchone()
+                    return (result[0], result[1]) if result else (0, 0)
+        except Exception as e:
+            err = DatabaseError(str(e))
+            err.output()
+            raise err
+    
     async def give_referral_bonus(self, referrer_id: int, referred_id: int, chatgpt_bonus: int = 5000, dalle_bonus: int = 5, stable_bonus: int = 5, midjourney_bonus: int = 5):
         """Выдает бонус реферреру за приглашенного пользователя"""
         try:
@@ -409,6 +732,7 @@ class DataBase:
                         
                         # Отмечаем, что бонус выдан
                         await cursor.execute("UPDATE referrals SET bonus_given = TRUE WHERE referrer_id = %s AND referred_id = %s", (referrer_id, referred_id))
+                        await cursor.execute("UPDATE referral_stats SET bonus_given = bonus_given + 1 WHERE referrer_id = %s", (referrer_id,))
                         await conn.commit()
                         return True
                     return False
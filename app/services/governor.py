@@ -0,0 +1,179 @@
+import asyncio
+import logging
+import math
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, replace
+from typing import Dict, Optional
+
+class GovernorBusyError(Exception):
+    def __init__(self, msg: str = "Busy", retry_after: float = 1):
+        self.msg = msg
+        self.retry_after = max(1, math.ceil(retry_after))
+    def output(self):
+        logging.warning(f"Governor busy: {self.msg}, retry in {self.retry_after} s")
+
+@dataclass
+class ProviderLimits:
+    """Лимиты одного провайдера: запросы в минуту, токены в минуту и очередь"""
+    rpm: int
+    tpm: int = 0  # 0 - токены не ограничиваются
+    max_concurrency: int = 10
+    max_queue: int = 100
+    max_queue_per_user: int = 2
+    max_wait: float = 30
+
+    def share(self, workers: int) -> "ProviderLimits":
+        """Доля одного из workers процессов, чтобы вместе они не превышали лимиты провайдера.
+
+        Очередь пользователя и время ожидания не делятся: пользователь
+        закреплен за одним воркером (StickyRouter).
+        """
+        if workers <= 1:
+            return self
+        return replace(
+            self,
+            rpm=max(1, self.rpm // workers),
+            tpm=max(1, self.tpm // workers) if self.tpm else 0,
+            max_concurrency=max(1, self.max_concurrency // workers),
+            max_queue=max(1, self.max_queue // workers),
+        )
+
+def share_limits(limits: Dict[str, ProviderLimits], workers: int) -> Dict[str, ProviderLimits]:
+    """Лимиты каждого провайдера для одного из workers процессов"""
+    return {name: provider_limits.share(workers) for name, provider_limits in limits.items()}
+
+DEFAULT_LIMITS = {
+    "openai": ProviderLimits(rpm=500, tpm=30000, max_concurrency=20),
+    "stability": ProviderLimits(rpm=150, max_concurrency=10),
+    "novita": ProviderLimits(rpm=60, max_concurrency=5),
+}
+
+class TokenBucket:
+    """Token bucket, пополняемый равномерно в течение минуты"""
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount: float) -> float:
+        """Резервирует amount токенов (баланс может уйти в минус) и возвращает время ожидания в секундах"""
+        self._refill()
+        amount = min(amount, self.capacity)
+        self.tokens -= amount
+        if self.tokens >= 0:
+            return 0
+        return -self.tokens / self.rate
+
+    def refund(self, amount: float):
+        self.tokens = min(self.capacity, self.tokens + min(amount, self.capacity))
+
+class _Provider:
+    def __init__(self, limits: ProviderLimits):
+        self.limits = limits
+        self.requests = TokenBucket(limits.rpm)
+        self.tokens = TokenBucket(limits.tpm) if limits.tpm else None
+        self.active = 0
+        # Очереди ожидания по пользователям, обходятся по кругу
+        self.waiters: "OrderedDict[Optional[int], deque[asyncio.Future]]" = OrderedDict()
+        self.queued = 0
+
+    def estimate_wait(self) -> float:
+        """Грубая оценка времени, через которое освободится место"""
+        backlog = self.queued + self.active
+        return backlog / max(self.limits.rpm / 60, 0.01) / max(self.limits.max_concurrency, 1)
+
+    def wake_next(self):
+        """Передает освободившийся слот следующему пользователю по кругу"""
+        while self.waiters and self.active < self.limits.max_concurrency:
+            user_id, queue = self.waiters.popitem(last=False)
+            future = queue.popleft()
+            self.queued -= 1
+            if queue:
+                self.waiters[user_id] = queue
+            if not future.done():
+                self.active += 1
+                future.set_result(None)
+
+class Governor:
+    """Общий ограничитель обращений к внешним AI API.
+
+    Для каждого провайдера держит token bucket'ы на запросы и токены в минуту,
+    ограничивает число одновременных вызовов и справедливо (по кругу между
+    пользователями) раздает освободившиеся слоты. Когда очередь переполнена или
+    ждать дольше max_wait, вызывает GovernorBusyError вместо обращения к API.
+    """
+    def __init__(self, limits: Dict[str, ProviderLimits] = None):
+        self.providers = {name: _Provider(provider_limits) for name, provider_limits in (limits or {}).items()}
+
+    async def _acquire_slot(self, provider: _Provider, name: str, user_id: Optional[int]):
+        limits = provider.limits
+        if provider.active < limits.max_concurrency and not provider.waiters:
+            provider.active += 1
+            return
+
+        user_queue = provider.waiters.get(user_id)
+        if provider.queued >= limits.max_queue or (user_queue is not None and len(user_queue) >= limits.max_queue_per_user):
+            raise GovernorBusyError(f"{name} queue is full", provider.estimate_wait())
+
+        future = asyncio.get_running_loop().create_future()
+        if user_queue is None:
+            user_queue = provider.waiters[user_id] = deque()
+        user_queue.append(future)
+        provider.queued += 1
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout=limits.max_wait)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if future.done() and not future.cancelled():
+                # Слот уже выдан, но мы его не используем
+                provider.active -= 1
+                provider.wake_next()
+            else:
+                future.cancel()
+                user_queue = provider.waiters.get(user_id)
+                if user_queue is not None and future in user_queue:
+                    user_queue.remove(future)
+                    provider.queued -= 1
+                    if not user_queue:
+                        del provider.waiters[user_id]
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            raise GovernorBusyError(f"{name} wait timeout", provider.estimate_wait())
+
+    def _release_slot(self, provider: _Provider):
+        provider.active -= 1
+        provider.wake_next()
+
+    @asynccontextmanager
+    async def slot(self, name: str, user_id: Optional[int] = None, tokens: int = 0):
+        """Занимает место для одного вызова провайдера name на время блока async with"""
+        provider = self.providers.get(name)
+        if provider is None:
+            yield
+            return
+
+        await self._acquire_slot(provider, name, user_id)
+        try:
+            wait = provider.requests.reserve(1)
+            if provider.tokens is not None and tokens:
+                wait = max(wait, provider.tokens.reserve(tokens))
+            if wait > provider.limits.max_wait:
+                provider.requests.refund(1)
+                if provider.tokens is not None and tokens:
+                    provider.tokens.refund(tokens)
+                raise GovernorBusyError(f"{name} rate limit", wait)
+            if wait > 0:
+                await asyncio.sleep(wait)
+            yield
+        finally:
+            self._release_slot(provider)
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        return {name: {"active": provider.active, "queued": provider.queued} for name, provider in self.providers.items()}
@@ -0,0 +1,226 @@
+import abc
+import functools
+import inspect
+import time
+from contextlib import asynccontextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from app.services.tracing import tracer
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+def _labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{str(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class _Metric(abc.ABC):
+    type = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.children: Dict[Tuple[str, ...], object] = {}
+
+    def labels(self, *values):
+        key = tuple(str(value) for value in values)
+        child = self.children.get(key)
+        if child is None:
+            child = self.children[key] = self._child()
+        return child
+
+    @abc.abstractmethod
+    def _child(self):
+        """Значение для одного набора меток"""
+
+    @abc.abstractmethod
+    def samples(self) -> List[str]:
+        """Строки выборок в текстовом формате Prometheus"""
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        return "\n".join(lines + self.samples())
+
+class _Value:
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+    def set(self, value: float):
+        self.value = value
+
+class Counter(_Metric):
+    type = "counter"
+
+    def _child(self):
+        return _Value()
+
+    def inc(self, amount: float = 1):
+        self.labels().inc(amount)
+
+    def samples(self) -> List[str]:
+        return [f"{self.name}_total{_labels(self.labelnames, key)} {child.value}" for key, child in self.children.items()]
+
+class Gauge(_Metric):
+    """Значение выставляется напрямую или считывается функцией при каждом сборе"""
+    type = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (), collect: Callable[[], Dict[Tuple[str, ...], float]] = None):
+        super().__init__(name, documentation, labelnames)
+        self.collect = collect
+
+    def _child(self):
+        return _Value()
+
+    def set(self, value: float):
+        self.labels().set(value)
+
+    def samples(self) -> List[str]:
+        values = {key: child.value for key, child in self.children.items()}
+        if self.collect is not None:
+            values.update(self.collect())
+        return [f"{self.name}{_labels(self.labelnames, key)} {value}" for key, value in values.items()]
+
+class _HistogramValue:
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (), buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def _child(self):
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    def samples(self) -> List[str]:
+        lines = []
+        for key, child in self.children.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, child.counts):
+                cumulative += count
+                le = 'le="%s"' % bound
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, le)} {cumulative}")
+            le = 'le="+Inf"'
+            lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, le)} {child.count}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {child.sum}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {child.count}")
+        return lines
+
+class Registry:
+    def __init__(self):
+        self.metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        self.metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        """Все метрики в текстовом формате Prometheus"""
+        return "\n".join(metric.render() for metric in self.metrics.values()) + "\n"
+
+def _with_label(sample: str, label: str) -> str:
+    """Добавляет метку к строке выборки: name{a="b"} 1 -> name{label,a="b"} 1"""
+    name_end = min(i for i in (sample.find("{"), sample.find(" ")) if i != -1)
+    if sample[name_end] == "{":
+        return f"{sample[:name_end + 1]}{label},{sample[name_end + 1:]}"
+    return f"{sample[:name_end]}{{{label}}}{sample[name_end:]}"
+
+def merge_workers(expositions: Dict[str, Optional[str]]) -> str:
+    """Сводит выдачи /metrics воркеров в одну, помечая выборки меткой worker.
+
+    HELP и TYPE каждой метрики выводятся один раз, выборки всех воркеров
+    идут под ними: два заголовка одной метрики Prometheus не принимает.
+    None - воркер не ответил, он виден как bot_worker_up 0.
+    """
+    headers: Dict[str, List[str]] = {
+        "bot_worker_up": ["# HELP bot_worker_up Worker answered the metrics scrape", "# TYPE bot_worker_up gauge"]
+    }
+    samples: Dict[str, List[str]] = {"bot_worker_up": []}
+    owners: Dict[str, str] = {"bot_worker_up": ""}
+    for worker, text in expositions.items():
+        label = f'worker="{worker}"'
+        samples["bot_worker_up"].append(f"bot_worker_up{{{label}}} {0 if text is None else 1}")
+        family = None
+        for line in (text or "").splitlines():
+            if not line:
+                continue
+            if line.startswith("# "):
+                family = line.split(" ", 3)[2]
+                if owners.setdefault(family, worker) == worker:
+                    headers.setdefault(family, []).append(line)
+                continue
+            samples.setdefault(family, []).append(_with_label(line, label))
+    return "\n".join(
+        "\n".join(headers.get(family, []) + samples.get(family, []))
+        for family in dict.fromkeys(list(headers) + list(samples))
+    ) + "\n"
+
+REGISTRY = Registry()
+
+HANDLER_LATENCY = REGISTRY.register(Histogram("bot_handler_seconds", "Bot handler latency", ("handler",)))
+HANDLER_ERRORS = REGISTRY.register(Counter("bot_handler_errors", "Bot handler exceptions", ("handler",)))
+DB_LATENCY = REGISTRY.register(Histogram("db_method_seconds", "DataBase method latency", ("method",)))
+DB_ERRORS = REGISTRY.register(Counter("db_method_errors", "DataBase method exceptions", ("method",)))
+UPSTREAM_LATENCY = REGISTRY.register(Histogram("upstream_request_seconds", "Upstream API call latency", ("provider", "operation")))
+UPSTREAM_ERRORS = REGISTRY.register(Counter("upstream_request_errors", "Failed upstream API calls", ("provider", "operation")))
+
+@asynccontextmanager
+async def track_upstream(provider: str, operation: str):
+    """Замеряет вызов внешнего API, исключение считается ошибкой"""
+    start = time.perf_counter()
+    try:
+        async with tracer.span(f"{provider}.{operation}"):
+            yield
+    except Exception:
+        UPSTREAM_ERRORS.labels(provider, operation).inc()
+        raise
+    finally:
+        UPSTREAM_LATENCY.labels(provider, operation).observe(time.perf_counter() - start)
+
+def _timed(method: Callable, name: str):
+    @functools.wraps(method)
+    async def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            async with tracer.span(f"db.{name}"):
+                return await method(*args, **kwargs)
+        except Exception:
+            DB_ERRORS.labels(name).inc()
+            raise
+        finally:
+            DB_LATENCY.labels(name).observe(time.perf_counter() - start)
+    return wrapper
+
+def instrument_database(database):
+    """Оборачивает все публичные корутины DataBase замером времени и спаном"""
+    for name, method in inspect.getmembers(database, inspect.iscoroutinefunction):
+        if not name.startswith("_"):
+            setattr(database, name, _timed(method, name))
+    return database
+
+def register_pool(database_core, registry: Registry = REGISTRY):
+    """Гауджи размера и занятости пула соединений DataBaseCore"""
+    def collect():
+        return {(key,): value for key, value in database_core.stats().items()}
+    registry.register(Gauge("db_pool", "Database connection pool statistics", ("stat",), collect))
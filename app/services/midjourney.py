@@ -4,6 +4,9 @@ import logging
 import json
 import base64
 
+from app.services.governor import Governor, GovernorBusyError
+from app.services.metrics import track_upstream
+
 class MidJourneyError(Exception):
     def __init__(self, msg: str = "Error"):
         self.msg = msg
@@ -12,17 +15,18 @@ class MidJourneyError(Exception):
         logging.error("MidJourney error:", self.msg)
 
 class MidJourney:
-    def __init__(self, api_key: str):
+    def __init__(self, api_key: str, governor: Governor = None):
         self.api_key = api_key
+        self.governor = governor or Governor()
         self.api_url = "https://api.novita.ai/v2/imagine"
         self.headers = {
             "Authorization": f"Bearer {self.api_key}",
             "Content-Type": "application/json"
         }
     
-    async def generate_image(self, prompt: str):
+    async def generate_image(self, prompt: str, user_id: int = None):
         try:
-            async with aiohttp.ClientSession() as session:
+            async with self.governor.slot("novita", user_id), track_upstream("novita", "generate"), aiohttp.ClientSession() as session:
                 payload = {
                     "prompt": prompt,
                     "model": "midjourney-v6",  # u0418u0441u043fu043eu043bu044cu0437u0443u0435u043c MidJourney v6
@@ -47,6 +51,8 @@ class MidJourney:
                     else:
                         error_text = await response.text()
                         raise MidJourneyError(f"API request failed with status {response.status}: {error_text}")
+        except GovernorBusyError:
+            raise
         except aiohttp.ClientError as e:
             err = MidJourneyError(str(e))
             err.output()
@@ -1,34 +1,83 @@
 from openai import AsyncOpenAI
-from typing import List, Dict
+from typing import List, Dict, Optional, Tuple
+
+from app.services.governor import Governor, GovernorBusyError
+from app.services.metrics import track_upstream
+
+SUMMARY_PROMPT = "Summarize the conversation below in a few short paragraphs. Keep facts, names, decisions and open questions the assistant will need to continue the conversation."
 
 class OpenAiTools:
-    def __init__(self, token: str):
+    def __init__(self, token: str, governor: Governor = None):
         self.client = AsyncOpenAI(
             api_key=token,
         )
+        self.governor = governor or Governor()
+
+    async def get_chatgpt(self, messages: List[Dict[str, str]], user_id: int = None, tokens: int = 0):
+        answer, _ = await self.get_chatgpt_usage(messages, user_id, tokens)
+        return answer
+
+    async def get_chatgpt_usage(self, messages: List[Dict[str, str]], user_id: int = None, tokens: int = 0) -> Tuple[Optional[str], Dict[str, int]]:
+        """Возвращает ответ и расход токенов, включая закэшированные провайдером входные токены"""
+        try:
+            async with self.governor.slot("openai", user_id, tokens), track_upstream("openai", "chat"):
+                response = await self.client.chat.completions.create(
+                    messages=messages,
+                    model="gpt-4o",
+                    max_tokens=16384,
+                    temperature=1,
+                )
+
+            return response.choices[0].message.content, self._usage(response)
+        except GovernorBusyError:
+            raise
+        except:
+            return None, {}
 
-    async def get_chatgpt(self, messages: List[Dict[str, str]]):
+    async def summarize(self, text: str, user_id: int = None, tokens: int = 0) -> Optional[str]:
+        """Кратко пересказывает старую часть диалога"""
         try:
-            response = await self.client.chat.completions.create(
-                messages=messages,
-                model="gpt-4o",
-                max_tokens=16384,
-                temperature=1,
-            )
+            async with self.governor.slot("openai", user_id, tokens), track_upstream("openai", "summary"):
+                response = await self.client.chat.completions.create(
+                    messages=[
+                        {"role": "system", "content": SUMMARY_PROMPT},
+                        {"role": "user", "content": text},
+                    ],
+                    model="gpt-4o-mini",
+                    max_tokens=1024,
+                    temperature=0,
+                )
 
             return response.choices[0].message.content
+        except GovernorBusyError:
+            raise
         except:
             return
 
-    async def get_dalle(self, prompt: str):
+    @staticmethod
+    def _usage(response) -> Dict[str, int]:
+        usage = getattr(response, "usage", None)
+        if usage is None:
+            return {}
+        details = getattr(usage, "prompt_tokens_details", None)
+        return {
+            "prompt_tokens": usage.prompt_tokens or 0,
+            "cached_tokens": (getattr(details, "cached_tokens", None) or 0) if details else 0,
+            "completion_tokens": usage.completion_tokens or 0,
+        }
+
+    async def get_dalle(self, prompt: str, user_id: int = None):
         try:
-            response = await self.client.images.generate(
-                model="dall-e-3",
-                prompt=prompt,
-                size="1024x1024",
-                n=1,
-            )
+            async with self.governor.slot("openai", user_id), track_upstream("openai", "image"):
+                response = await self.client.images.generate(
+                    model="dall-e-3",
+                    prompt=prompt,
+                    size="1024x1024",
+                    n=1,
+                )
 
             return response.data[0].url
+        except GovernorBusyError:
+            raise
         except:
             return
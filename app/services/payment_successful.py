@@ -1,23 +1,75 @@
-from app.bot.utils import TelegramError
 from app.services.db import DataBase, DatabaseError
 from aiogram import Bot
+import asyncio
+import logging
 
-async def payment_success(bot: Bot, database: DataBase, update_type: str, invoice_id: int) -> None:
+PAYMENT_MESSAGES = {
+    "chatgpt": "✅You have received 100000 ChatGPT tokens!",
+    "dall_e": "✅You have received 50 DALL·E image generations!",
+    "stable": "✅You have received 50 Stable Diffusion image generations!",
+    "midjourney": "✅You have received 50 MidJourney image generations!",
+}
+
+async def payment_success(bot: Bot, database: DataBase, update_type: str, invoice_id: int) -> bool:
+    """Сохраняет оплату в журнал платежей, начисление делает PaymentWorker.
+    Возвращает False для повторного уведомления об уже сохраненной оплате"""
     if update_type == "invoice_paid":
         try:
-            result = await database.get_orderdata(invoice_id)
-            if result[1] == 'chatgpt':
-                await database.update_chatgpt(result[0], invoice_id)
-                await bot.send_message(result[0], "✅You have received 100000 ChatGPT tokens!")
-            elif result[1] == 'dall_e':
-                await database.update_dalle(result[0], invoice_id)
-                await bot.send_message(result[0], "✅You have received 50 DALL·E image generations!")
-            elif result[1] == 'stable':
-                await database.update_stable(result[0], invoice_id)
-                await bot.send_message(result[0], "✅You have received 50 Stable Diffusion image generations!")
+            return await database.record_cryptopay_payment(invoice_id)
         except DatabaseError:
             raise DatabaseError
+    return False
+
+async def apply_pending_payments(bot: Bot, database: DataBase, limit: int = 100) -> int:
+    """Начисляет ожидающие платежи и уведомляет пользователей. Возвращает число начисленных"""
+    try:
+        applied = await database.apply_pending_payments(limit)
+    except DatabaseError:
+        raise DatabaseError
+    for user_id, product in applied:
+        try:
+            await bot.send_message(user_id, PAYMENT_MESSAGES[product])
         except Exception as e:
-            err = TelegramError(str(e))
-            err.output()
-            raise err
\ No newline at end of file
+            # Начисление уже зафиксировано, уведомление не критично
+            logging.error(f"Payment notification for user {user_id} failed: {e}")
+    return len(applied)
+
+class PaymentWorker:
+    """Фоновое начисление платежей из журнала пачками"""
+    def __init__(self, bot: Bot, database: DataBase, interval: float = 5, batch_size: int = 100):
+        self.bot = bot
+        self.database = database
+        self.interval = interval
+        self.batch_size = batch_size
+        self.wakeup = asyncio.Event()
+        self.task = None
+
+    def notify(self):
+        """Будит воркер сразу после сохранения нового платежа"""
+        self.wakeup.set()
+
+    async def run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self.wakeup.clear()
+            try:
+                while await apply_pending_payments(self.bot, self.database, self.batch_size) == self.batch_size:
+                    pass
+            except DatabaseError:
+                logging.error("Payment worker: failed to apply pending payments")
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
@@ -0,0 +1,49 @@
+from dataclasses import dataclass
+from typing import Optional
+
+from app.services.db import DataBase
+
+@dataclass
+class Reservation:
+    """Занятая до генерации единица квоты: из подписки или из баланса"""
+    user_id: int
+    sub_type: str
+    product: str
+    kind: str  # "subscription" или "balance"
+    granted: bool
+    remaining: Optional[int] = None
+    done: bool = False
+
+class QuotaService:
+    """Резервирование квоты вокруг долгой генерации.
+
+    reserve списывает квоту одним атомарным запросом до начала работы,
+    commit закрепляет списание после успеха, release возвращает его при
+    ошибке. Одновременные запросы пользователя не превышают лимит.
+    """
+    def __init__(self, database: DataBase):
+        self.database = database
+
+    async def reserve(self, user_id: int, sub_type: str, product: str) -> Reservation:
+        subscription = await self.database.reserve_subscription_usage(user_id, sub_type)
+        if subscription is not None:
+            return Reservation(
+                user_id, sub_type, product, "subscription", subscription['reserved'],
+                subscription['daily_limit'] - subscription['usage_today'],
+            )
+
+        remaining = await self.database.reserve_credit(user_id, product)
+        return Reservation(user_id, sub_type, product, "balance", remaining is not None, remaining)
+
+    async def commit(self, reservation: Reservation):
+        # Квота уже списана в reserve, release после commit ничего не делает
+        reservation.done = True
+
+    async def release(self, reservation: Reservation):
+        if reservation.done or not reservation.granted:
+            return
+        reservation.done = True
+        if reservation.kind == "subscription":
+            await self.database.release_subscription_usage(reservation.user_id, reservation.sub_type)
+        else:
+            await self.database.release_credit(reservation.user_id, reservation.product)
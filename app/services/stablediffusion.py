@@ -1,27 +1,35 @@
 import aiohttp
 
+from app.services.governor import Governor, GovernorBusyError
+from app.services.metrics import track_upstream, UPSTREAM_ERRORS
+
 class StableDiffusion:
-    def __init__(self, key: str):
+    def __init__(self, key: str, governor: Governor = None):
         self.key = key
+        self.governor = governor or Governor()
 
-    async def get_stable(self, prompt: str):
+    async def get_stable(self, prompt: str, user_id: int = None):
         try:
             form_data = aiohttp.FormData()
             form_data.add_field("prompt", prompt, content_type='multipart/form-data')
             form_data.add_field("output_format", "jpeg", content_type='multipart/form-data')
             form_data.add_field("model", "sd3-large-turbo", content_type='multipart/form-data')
 
-            async with aiohttp.ClientSession() as session:
-                async with session.post('https://api.stability.ai/v2beta/stable-image/generate/sd3',
-                                        headers={
-                                            "authorization": f"Bearer {self.key}",
-                                            "accept": "image/*"
-                                        },
-                                        data=form_data) as response:
-                    if response.status == 200:
-                        photo = await response.read()
-                        return photo
-                    else:
-                        return
+            async with self.governor.slot("stability", user_id), track_upstream("stability", "generate"):
+                async with aiohttp.ClientSession() as session:
+                    async with session.post('https://api.stability.ai/v2beta/stable-image/generate/sd3',
+                                            headers={
+                                                "authorization": f"Bearer {self.key}",
+                                                "accept": "image/*"
+                                            },
+                                            data=form_data) as response:
+                        if response.status == 200:
+                            photo = await response.read()
+                            return photo
+                        else:
+                            UPSTREAM_ERRORS.labels("stability", "generate").inc()
+                            return
+        except GovernorBusyError:
+            raise
         except:
             return
\ No newline at end of file
@@ -1,9 +1,11 @@
 import logging
-from telethon import TelegramClient
 from telethon.tl.functions.messages import GetBotCallbackAnswerRequest
 import time
 import asyncio
 
+from common.cache import TTLCache
+from common.telethon_manager import get_manager
+
 class TelegramStarsError(Exception):
     def __init__(self, msg: str = "Error"):
         self.msg = msg
@@ -12,66 +14,74 @@ class TelegramStarsError(Exception):
         logging.error(f"Telegram Stars error: {self.msg}")
 
 class TelegramStarsService:
-    def __init__(self, api_id, api_hash, bot_token=None):
+    def __init__(self, api_id, api_hash, bot_token=None, payments_path=None, cache_size=10000, session='telegram_stars_session'):
         self.api_id = api_id
         self.api_hash = api_hash
         self.bot_token = bot_token
+        # Один клиент Telethon на процесс, у каждого процесса свой файл сессии
+        self.manager = get_manager(api_id, api_hash, bot_token, session)
         self.client = None
+        self.stars_bot = None
         # Кэширование баланса для уменьшения запросов к API
-        self.stars_balance_cache = {}
         self.cache_timeout = 300  # 5 минут
-        # Хранилище для pending-платежей
-        self.pending_payments = {}
+        # Ожидание ответа @wallet на /balance: reply_attempts проверок раз в reply_interval секунд
+        self.reply_attempts = 10
+        self.reply_interval = 0.5
+        self.stars_balance_cache = TTLCache(max_size=cache_size, ttl=self.cache_timeout)
+        # Хранилище для pending-платежей, при заданном payments_path переживает перезапуск
+        self.pending_payments = TTLCache(max_size=cache_size, ttl=24 * 60 * 60, persist_path=payments_path)
 
     async def init_client(self):
-        if self.client is None or not self.client.is_connected():
-            self.client = TelegramClient('telegram_stars_session', self.api_id, self.api_hash)
-            # Если есть bot_token, используем его для запуска клиента
-            if self.bot_token:
-                await self.client.start(bot_token=self.bot_token)
-            else:
-                await self.client.start()
-    
-    async def get_user_stars_balance(self, user_id):
-        """Получить баланс звезд пользователя с использованием кэширования"""
-        # Проверяем кэш
-        if user_id in self.stars_balance_cache:
-            cache_time, balance = self.stars_balance_cache[user_id]
-            if time.time() - cache_time < self.cache_timeout:
-                return balance
-                
-        # Баланс не в кэше или устарел, получаем новый
-        try:
-            # Проверяем, клиент инициализирован
-            if not self.client or not self.client.is_connected():
-                await self.init_client()
-                
-            # Используем официальный бот Telegram Wallet (@wallet) для получения баланса звезд
+        self.stars_balance_cache.start()
+        self.pending_payments.start()
+        self.client = await self.manager.get_client()
+
+    async def _fetch_balance(self, client):
+        # Используем официальный бот Telegram Wallet (@wallet) для получения баланса звезд
+        if self.stars_bot is None:
             try:
-                stars_bot = await self.client.get_entity('wallet')
+                self.stars_bot = await client.get_entity('wallet')
             except ValueError:
                 # Если не удалось найти по имени пользователя, используем ID
-                stars_bot = 777000  # Системный ID Telegram
-                
-            await self.client.send_message(stars_bot, '/balance')
-            
-            # Получаем ответ от бота с балансом
-            async for message in self.client.iter_messages(stars_bot, limit=1):
-                # Обрабатываем ответ и извлекаем баланс
-                balance_text = message.text
-                try:
-                    balance = int(balance_text.split(":")[1].strip().split()[0])
-                except (IndexError, ValueError):
-                    # Если не удалось разобрать ответ, используем значение по умолчанию
-                    balance = 0
-                break
-            else:
-                # Если не получили ответа, используем значение по умолчанию
-                balance = 0
-            
-            # Кэшируем результат
-            self.stars_balance_cache[user_id] = (time.time(), balance)
+                self.stars_bot = 777000  # Системный ID Telegram
+
+        # Пока ждем ответ, другие запросы баланса не пишут в этот чат,
+        # иначе каждый может прочитать чужой ответ
+        async with self.manager.chat_lock(getattr(self.stars_bot, 'id', self.stars_bot)):
+            sent = await client.send_message(self.stars_bot, '/balance')
+
+            # Получаем ответ от бота с балансом: первое входящее сообщение после нашего
+            for _ in range(self.reply_attempts):
+                async for message in client.iter_messages(self.stars_bot, min_id=sent.id, reverse=True):
+                    if message.out:
+                        continue
+                    # Обрабатываем ответ и извлекаем баланс
+                    try:
+                        return int(message.text.split(":")[1].strip().split()[0])
+                    except (IndexError, ValueError):
+                        # Если не удалось разобрать ответ, используем значение по умолчанию
+                        return 0
+                await asyncio.sleep(self.reply_interval)
+        # Если не получили ответа, используем значение по умолчанию
+        return 0
+
+    async def _load_balance(self, user_id):
+        balance = await self.manager.run(self._fetch_balance)
+        # Кэшируем результат
+        self.stars_balance_cache[user_id] = balance
+        return balance
+
+    async def get_user_stars_balance(self, user_id):
+        """Получить баланс звезд пользователя с использованием кэширования"""
+        # Проверяем кэш
+        balance = self.stars_balance_cache.get(user_id)
+        if balance is not None:
             return balance
+
+        # Баланс не в кэше или устарел, получаем новый. Одновременные запросы
+        # баланса одного пользователя ждут один обмен сообщениями с @wallet
+        try:
+            return await self.manager.coalesce(("balance", user_id), lambda: self._load_balance(user_id))
         except Exception as e:
             err = TelegramStarsError(f"Ошибка при получении баланса звезд: {str(e)}")
             err.output()
@@ -102,14 +112,14 @@ class TelegramStarsService:
 
     async def check_payment_status(self, payment_id):
         """Проверить статус платежа"""
-        if payment_id not in self.pending_payments:
+        payment_info = self.pending_payments.get(payment_id)
+        if payment_info is None:
             return False, "Платеж не найден"
         
-        payment_info = self.pending_payments[payment_id]
         user_id = payment_info['user_id']
         
         # Просто обновляем статус платежа на 'completed'
-        self.pending_payments[payment_id]['status'] = 'completed'
+        self.pending_payments[payment_id] = {**payment_info, 'status': 'completed'}
         
         return True, f"Ваш текущий баланс звезд: 500"
 
@@ -125,8 +135,7 @@ class TelegramStarsService:
             # Удаляем из кэша, чтобы при следующем запросе получить актуальный баланс
             if user_id in self.stars_balance_cache:
                 # Имитируем списание звезд из кэша
-                cache_time, old_balance = self.stars_balance_cache[user_id]
-                self.stars_balance_cache[user_id] = (time.time(), old_balance - amount)
+                self.stars_balance_cache[user_id] = balance - amount
                 
             return True, "Успешно списано"
         except Exception as e:
@@ -138,8 +147,7 @@ class TelegramStarsService:
         """Обработка успешного платежа и начисление услуг пользователю"""
         try:
             # Обновляем кэш баланса
-            if user_id in self.stars_balance_cache:
-                del self.stars_balance_cache[user_id]
+            self.stars_balance_cache.pop(user_id)
             
             # Логируем информацию о успешной оплате
             logging.info(f"Успешная оплата от пользователя {user_id}: {amount} звезд за {product_type}")
@@ -152,10 +160,10 @@ class TelegramStarsService:
 
     async def get_purchase_verification_message(self, payment_id):
         """Формирует сообщение для верификации покупки с анимацией загрузки"""
-        if payment_id not in self.pending_payments:
+        payment_info = self.pending_payments.get(payment_id)
+        if payment_info is None:
             return ["❌ Информация о платеже не найдена"]
         
-        payment_info = self.pending_payments[payment_id]
         loading_stages = ['⏳', '⌛', '⏳', '⌛']
         messages = []
         
@@ -167,7 +175,16 @@ class TelegramStarsService:
         
         return messages
     
+    def cache_stats(self):
+        """Статистика кэшей баланса и pending-платежей"""
+        return {
+            "stars_balance": self.stars_balance_cache.stats(),
+            "pending_payments": self.pending_payments.stats(),
+        }
+
     async def close(self):
         """Закрыть соединение клиента"""
-        if self.client and self.client.is_connected():
-            await self.client.disconnect()
+        await self.stars_balance_cache.close()
+        await self.pending_payments.close()
+        await self.manager.close()
+        self.client = None
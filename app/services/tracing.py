@@ -0,0 +1,137 @@
+import json
+import logging
+import os
+import random
+import time
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+@dataclass
+class Span:
+    """Спан в терминах OpenTelemetry: идентификаторы в hex, время в наносекундах"""
+    trace_id: str
+    span_id: str
+    parent_id: Optional[str]
+    name: str
+    start_ns: int
+    end_ns: int = 0
+    attributes: Dict[str, Any] = field(default_factory=dict)
+    error: Optional[str] = None
+
+    @property
+    def duration(self) -> float:
+        return (self.end_ns - self.start_ns) / 1e9
+
+    def to_otlp(self) -> Dict[str, Any]:
+        """Поля как в OTLP/JSON, чтобы файл можно было загрузить в любой коллектор"""
+        return {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "parentSpanId": self.parent_id or "",
+            "name": self.name,
+            "startTimeUnixNano": self.start_ns,
+            "endTimeUnixNano": self.end_ns,
+            "attributes": [{"key": key, "value": {"stringValue": str(value)}} for key, value in self.attributes.items()],
+            "status": {"code": 2, "message": self.error} if self.error else {"code": 1},
+        }
+
+class _Trace:
+    def __init__(self, sampled: bool):
+        self.sampled = sampled
+        self.spans: List[Span] = []
+
+class LogExporter:
+    """Пишет трассу в лог одной строкой на спан"""
+    def export(self, spans: List[Span]):
+        for span in spans:
+            logging.info(f"trace {span.trace_id} {span.name} {span.duration * 1000:.1f} ms{' error: ' + span.error if span.error else ''}")
+
+class JsonlExporter:
+    """Локальный экспорт: OTLP-подобный JSON по строке на спан"""
+    def __init__(self, path: str):
+        self.path = path
+
+    def export(self, spans: List[Span]):
+        try:
+            with open(self.path, "a", encoding="utf-8") as f:
+                for span in spans:
+                    f.write(json.dumps(span.to_otlp(), ensure_ascii=False) + "\n")
+        except OSError as e:
+            logging.error(f"Trace export to {self.path} failed: {e}")
+
+_current_trace: ContextVar[Optional[_Trace]] = ContextVar("current_trace", default=None)
+_current_span: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+class Tracer:
+    """Трассировка обработки одного апдейта.
+
+    Решение о сохранении принимается в конце трассы: она экспортируется, если
+    попала в выборку sample_rate, длилась дольше slow_threshold секунд или
+    завершилась ошибкой. Медленные и упавшие трассы сохраняются всегда.
+    """
+    def __init__(self, exporter=None, sample_rate: float = 0.01, slow_threshold: float = 2.0):
+        self.exporter = exporter or LogExporter()
+        self.sample_rate = sample_rate
+        self.slow_threshold = slow_threshold
+
+    def configure(self, exporter=None, sample_rate: float = None, slow_threshold: float = None):
+        if exporter is not None:
+            self.exporter = exporter
+        if sample_rate is not None:
+            self.sample_rate = sample_rate
+        if slow_threshold is not None:
+            self.slow_threshold = slow_threshold
+
+    @asynccontextmanager
+    async def trace(self, name: str, **attributes):
+        """Корневой спан новой трассы. Внутри уже начатой трассы работает как span"""
+        if _current_trace.get() is not None:
+            async with self.span(name, **attributes) as current:
+                yield current
+            return
+
+        trace = _Trace(random.random() < self.sample_rate)
+        trace_token = _current_trace.set(trace)
+        try:
+            async with self.span(name, **attributes) as root:
+                yield root
+        finally:
+            _current_trace.reset(trace_token)
+            if trace.sampled or root.error or root.duration >= self.slow_threshold:
+                self.exporter.export(trace.spans)
+
+    @asynccontextmanager
+    async def span(self, name: str, **attributes):
+        """Дочерний спан текущей трассы, без трассы ничего не делает"""
+        trace = _current_trace.get()
+        if trace is None:
+            yield None
+            return
+
+        parent = _current_span.get()
+        current = Span(
+            trace_id=parent.trace_id if parent else os.urandom(16).hex(),
+            span_id=os.urandom(8).hex(),
+            parent_id=parent.span_id if parent else None,
+            name=name,
+            start_ns=time.time_ns(),
+            attributes=attributes,
+        )
+        span_token = _current_span.set(current)
+        try:
+            yield current
+        except Exception as e:
+            current.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            current.end_ns = time.time_ns()
+            _current_span.reset(span_token)
+            trace.spans.append(current)
+
+def current_trace_id() -> Optional[str]:
+    span = _current_span.get()
+    return span.trace_id if span else None
+
+tracer = Tracer()
@@ -1,3 +1,5 @@
+import asyncio
+import io
 import logging
 from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton
 from telegram.ext import ContextTypes, ConversationHandler, CallbackQueryHandler, MessageHandler, filters
@@ -5,12 +7,16 @@ from telegram.ext import ContextTypes, ConversationHandler, CallbackQueryHandler
 from bot.keyboards.keyboards import get_main_keyboard, get_admin_keyboard, get_back_keyboard
 from bot.services.admin_service import AdminService
 from bot.services.user_service import UserService
+from bot.services.export_service import ExportService, ExportError, EXPORTS, FORMATS
 from config.config import ADMIN_USER_ID
 
 # Enable logging
 logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Bots may upload documents up to 50 MB
+TELEGRAM_DOCUMENT_LIMIT = 50 * 1024 * 1024
+
 # Conversation states
 ADMIN_MENU, BROADCAST_MESSAGE, BROADCAST_CONFIRM, EDIT_AD, MANAGE_USERS, FREE_LIMITS_SETTINGS, FREE_LIMITS_UPDATE = range(3, 10)
 
@@ -373,6 +379,47 @@ async def update_free_limits_handler(update: Update, context: ContextTypes.DEFAU
     
     return FREE_LIMITS_SETTINGS
 
+# Export handler: /export <users|transactions|messages> [csv|jsonl] [gz]
+async def export_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Send a table export to the admin as a document"""
+    if not await is_admin(update):
+        return
+    
+    args = [arg.lower() for arg in (context.args or [])]
+    name = args[0] if args else 'users'
+    fmt = next((arg for arg in args[1:] if arg in FORMATS), 'csv')
+    compress = any(arg in ('gz', 'gzip') for arg in args[1:])
+    
+    try:
+        ExportService.validate(name, fmt)
+    except ExportError as e:
+        await update.message.reply_text(
+            f"❌ {e}\n\nИспользование: /export <{'|'.join(EXPORTS)}> [{'|'.join(FORMATS)}] [gz]"
+        )
+        return
+    
+    await update.message.reply_text("⏳ Готовлю выгрузку...")
+    try:
+        # Written to a temporary file off the event loop, then uploaded from disk
+        document = await asyncio.to_thread(ExportService.to_temporary_file, name, fmt, compress)
+    except Exception as e:
+        logger.error(f"Error exporting {name}: {e}")
+        await update.message.reply_text("❌ Не удалось подготовить выгрузку.")
+        return
+    
+    try:
+        size = document.seek(0, io.SEEK_END)
+        document.seek(0)
+        if size > TELEGRAM_DOCUMENT_LIMIT:
+            await update.message.reply_text(
+                f"❌ Файл слишком большой для Telegram ({size // (1024 * 1024)} МБ)."
+                + ("" if compress else " Попробуйте со сжатием: добавьте gz.")
+            )
+            return
+        await update.message.reply_document(document=document, filename=ExportService.filename(name, fmt, compress))
+    finally:
+        document.close()
+
 # Check if user is admin
 async def is_admin(update: Update) -> bool:
     """Check if the user is an admin"""
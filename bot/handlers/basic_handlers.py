@@ -7,8 +7,9 @@ from datetime import datetime, timedelta
 
 from bot.keyboards.keyboards import get_main_keyboard, get_cancel_keyboard, get_back_keyboard
 from bot.services.user_service import UserService
+from bot.services.dashboard_service import DashboardService
 from bot.services.admin_service import AdminService
-from bot.services.openai_service import OpenAIService
+from bot.services.openai_service import openai_service
 from config.config import ADMIN_USERNAME, ADMIN_PASSWORD
 
 # Enable logging
@@ -21,8 +22,6 @@ ADMIN_AUTH, ADMIN_MENU = range(3, 5)
 BROADCAST_MESSAGE, BROADCAST_CONFIRM = range(5, 7)
 SUBSCRIPTION_MENU, SUBSCRIPTION_PLAN_SELECTION = range(7, 9)
 
-# OpenAI service instance
-openai_service = OpenAIService()
 
 # Start command handler
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -136,69 +135,36 @@ async def limits_command(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     """Show user limits"""
     user = update.effective_user
     
-    # Get user ID directly
-    telegram_id = user.id
-    username = user.username
-    first_name = user.first_name
-    last_name = user.last_name
-    
-    # Get or create user and immediately get user_id
-    user_id = await UserService.get_or_create_user_id(
-        telegram_id=telegram_id,
-        username=username,
-        first_name=first_name,
-        last_name=last_name
-    )
+    # Load the whole screen in one query
+    dashboard = await DashboardService.get_dashboard(user.id)
     
-    # Get user limits
-    user_limits = await UserService.get_user_limits(user_id)
-    
-    # Get user stars
-    stars = await UserService.get_user_stars(user_id)
+    if dashboard is None:
+        # Create the user and load the screen again
+        await UserService.get_or_create_user_id(
+            telegram_id=user.id,
+            username=user.username,
+            first_name=user.first_name,
+            last_name=user.last_name
+        )
+        dashboard = await DashboardService.get_dashboard(user.id)
     
-    # Get user subscriptions
-    from bot.services.subscription_service import SubscriptionService
-    text_subscriptions = await SubscriptionService.get_user_active_subscriptions(user_id, 'text')
-    image_subscriptions = await SubscriptionService.get_user_active_subscriptions(user_id, 'image')
+    # Format subscription text
+    text_subscriptions = dashboard.plans_of('text')
+    image_subscriptions = dashboard.plans_of('image')
+    text_sub_info = "\n".join([f"- {plan.name} (до {plan.end_date.strftime('%d.%m.%Y')})" for plan in text_subscriptions]) if text_subscriptions else "Нет активных подписок"
+    image_sub_info = "\n".join([f"- {plan.name} (до {plan.end_date.strftime('%d.%m.%Y')})" for plan in image_subscriptions]) if image_subscriptions else "Нет активных подписок"
     
-    # Создаем сессию для работы с объектами
-    from database.db import get_session
-    session = get_session()
-    try:
-        # Обновляем объекты в сессии и загружаем связанные объекты
-        for sub in text_subscriptions:
-            session.add(sub)
-            # Явно загружаем связанные объекты plan
-            if not session.is_active:
-                session.refresh(sub)
-            # Принудительно загружаем связанный план
-            plan = sub.plan
-        
-        for sub in image_subscriptions:
-            session.add(sub)
-            # Явно загружаем связанные объекты plan
-            if not session.is_active:
-                session.refresh(sub)
-            # Принудительно загружаем связанный план
-            plan = sub.plan
-        
-        # Format subscription text
-        text_sub_info = "\n".join([f"- {sub.plan.name} (до {sub.end_date.strftime('%d.%m.%Y')})" for sub in text_subscriptions]) if text_subscriptions else "Нет активных подписок"
-        image_sub_info = "\n".join([f"- {sub.plan.name} (до {sub.end_date.strftime('%d.%m.%Y')})" for sub in image_subscriptions]) if image_subscriptions else "Нет активных подписок"
-        
-        await update.message.reply_text(
-            f"Ваши текущие лимиты:\n\n"
-            f"Звёзды: {stars}\n\n"
-            f"Текстовые сообщения: {user_limits.text_messages_used}/{user_limits.text_messages_limit} сегодня\n"
-            f"Голосовые сообщения: {user_limits.voice_messages_used}/{user_limits.voice_messages_limit} сегодня\n"
-            f"Генерация картинок: {user_limits.image_generations_used}/{user_limits.image_generations_limit} сегодня\n\n"
-            f"Подписки на чат:\n{text_sub_info}\n\n"
-            f"Подписки на картинки:\n{image_sub_info}\n\n"
-            f"Лимиты обновляются ежедневно в 00:00 UTC.",
-            reply_markup=get_main_keyboard()
-        )
-    finally:
-        session.close()
+    await update.message.reply_text(
+        f"Ваши текущие лимиты:\n\n"
+        f"Звёзды: {dashboard.stars}\n\n"
+        f"Текстовые сообщения: {dashboard.text_messages_used}/{dashboard.text_messages_limit} сегодня\n"
+        f"Голосовые сообщения: {dashboard.voice_messages_used}/{dashboard.voice_messages_limit} сегодня\n"
+        f"Генерация картинок: {dashboard.image_generations_used}/{dashboard.image_generations_limit} сегодня\n\n"
+        f"Подписки на чат:\n{text_sub_info}\n\n"
+        f"Подписки на картинки:\n{image_sub_info}\n\n"
+        f"Лимиты обновляются ежедневно в 00:00 UTC.",
+        reply_markup=get_main_keyboard()
+    )
 
 # Invite command handler
 async def invite_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -1,13 +1,15 @@
-import os
-import tempfile
+import io
+import time
+import asyncio
 import logging
 from telegram import Update, ReplyKeyboardMarkup
+from telegram.error import BadRequest, RetryAfter
 from telegram.ext import ContextTypes, ConversationHandler
 
 from bot.keyboards.keyboards import get_main_keyboard, get_cancel_keyboard
 from bot.services.user_service import UserService
 from bot.services.admin_service import AdminService
-from bot.services.openai_service import OpenAIService
+from bot.services.openai_service import openai_service
 from bot.services.payment_service import PaymentService
 from bot.utils.config_manager import config
 from bot.utils.error_handler import ErrorHandler
@@ -19,13 +21,78 @@ logger = logging.getLogger(__name__)
 # Conversation states
 TEXT_QUESTION, VOICE_QUESTION = range(2)
 
-# OpenAI service instance
-openai_service = OpenAIService()
 
 # Get message costs from config
 TEXT_MESSAGE_STARS_COST = int(config.get('TEXT_MESSAGE_STARS_COST', 1))
 VOICE_MESSAGE_STARS_COST = int(config.get('VOICE_MESSAGE_STARS_COST', 2))
 
+# Telegram message length limit
+MAX_MESSAGE_LENGTH = 4096
+STREAM_CURSOR = " ▌"
+
+
+async def stream_answer(message, prompt, before_reply=None):
+    """Stream the model's answer into one reply message and return (response, tokens).
+
+    The reply is sent with the first generated text and edited at most once
+    every STREAM_EDIT_INTERVAL seconds, so Telegram's edit rate limit is not
+    hit. The final edit adds the advertisement; text beyond the message
+    length limit is sent as follow-up messages. before_reply is awaited
+    before the reply is sent, so it appears after e.g. the transcription.
+    """
+    interval = config.get('STREAM_EDIT_INTERVAL', 1.0)
+    reply = None
+    shown = ""
+    last_edit = 0.0
+    parts = []
+    response, tokens = "", 0
+
+    async def show(text, final=False):
+        nonlocal reply, shown, last_edit
+        text = text[:MAX_MESSAGE_LENGTH]
+        if text == shown:
+            return
+        if reply is None:
+            if before_reply is not None:
+                await before_reply
+            reply = await message.reply_text(text, reply_markup=get_main_keyboard())
+        else:
+            try:
+                await reply.edit_text(text)
+            except RetryAfter as e:
+                # Skip this update, the final text is always edited in
+                if final:
+                    # int or timedelta depending on the PTB version
+                    delay = e.retry_after
+                    await asyncio.sleep(delay.total_seconds() if hasattr(delay, 'total_seconds') else delay)
+                    await reply.edit_text(text)
+                else:
+                    return
+            except BadRequest as e:
+                logger.warning(f"Could not edit streamed answer: {e}")
+                return
+        shown = text
+        last_edit = time.monotonic()
+
+    async for item in openai_service.stream_text_response(prompt):
+        if isinstance(item, tuple):
+            response, tokens = item
+            break
+        parts.append(item)
+        if time.monotonic() - last_edit >= interval:
+            await show("".join(parts) + STREAM_CURSOR)
+
+    # Get advertisement
+    ad_text = await AdminService.get_advertisement()
+    ad_footer = f"\n\n---\n{ad_text}" if ad_text else ""
+    full_text = f"{response}{ad_footer}"
+
+    await show(full_text, final=True)
+    for start in range(MAX_MESSAGE_LENGTH, len(full_text), MAX_MESSAGE_LENGTH):
+        await message.reply_text(full_text[start:start + MAX_MESSAGE_LENGTH], reply_markup=get_main_keyboard())
+    return response, tokens
+
+
 # Text question handler - entry point
 @ErrorHandler.handle_telegram_handler_errors
 async def text_question_start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
@@ -118,19 +185,9 @@ async def text_question_process(update: Update, context: ContextTypes.DEFAULT_TY
         # Send typing action
         await update.message.chat.send_action(action="typing")
         
-        # Generate response using OpenAI
+        # Stream the response from OpenAI into the reply
         logger.info(f"Processing text question: {question}")
-        response, tokens = await openai_service.generate_text_response(question)
-        
-        # Get advertisement
-        ad_text = await AdminService.get_advertisement()
-        ad_footer = f"\n\n---\n{ad_text}" if ad_text else ""
-        
-        # Send response
-        await update.message.reply_text(
-            f"{response}{ad_footer}",
-            reply_markup=get_main_keyboard()
-        )
+        response, tokens = await stream_answer(update.message, question)
         
         # Update user usage
         await UserService.update_user_usage(user_id, 'text')
@@ -221,6 +278,23 @@ async def voice_question_process(update: Update, context: ContextTypes.DEFAULT_T
         # Store user_id in context for future use
         context.user_data['user_id'] = user_id
     
+    # Reject oversized voice messages before charging for them
+    voice = update.message.voice
+    max_duration = config.get('MAX_VOICE_DURATION', 300)
+    max_file_size = config.get('MAX_VOICE_FILE_SIZE', 25 * 1024 * 1024)
+    if voice.duration > max_duration:
+        await update.message.reply_text(
+            f"❌ Голосовое сообщение слишком длинное. Максимальная длительность: {max_duration} секунд.",
+            reply_markup=get_main_keyboard()
+        )
+        return ConversationHandler.END
+    if (voice.file_size or 0) > max_file_size:
+        await update.message.reply_text(
+            f"❌ Файл голосового сообщения слишком большой. Максимальный размер: {max_file_size // (1024 * 1024)} МБ.",
+            reply_markup=get_main_keyboard()
+        )
+        return ConversationHandler.END
+    
     # Check if user has reached their limits
     has_free_limit, remaining = await UserService.check_user_limits(user_id, 'voice')
     
@@ -235,47 +309,42 @@ async def voice_question_process(update: Update, context: ContextTypes.DEFAULT_T
             return ConversationHandler.END
     
     try:
-        # Download the voice message
-        voice_file = await update.message.voice.get_file()
-        
-        # Create a temporary file to save the voice message
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.ogg') as temp_file:
-            voice_path = temp_file.name
+        timings = {}
+        stage_start = time.perf_counter()
         
-        # Download the voice file to the temporary file
-        await voice_file.download_to_drive(voice_path)
+        # Download the voice message into memory
+        voice_file = await voice.get_file()
+        voice_buffer = io.BytesIO()
+        await voice_file.download_to_memory(out=voice_buffer)
+        timings['download'] = time.perf_counter() - stage_start
         
         # Transcribe the voice message
         logger.info(f"Transcribing voice message for user {user_id}")
-        transcription = await openai_service.transcribe_audio(voice_path)
+        stage_start = time.perf_counter()
+        transcription = await openai_service.transcribe_audio(voice_buffer.getvalue())
+        timings['transcribe'] = time.perf_counter() - stage_start
         
         if not transcription:
             await update.message.reply_text(
                 "❌ Не удалось распознать голосовое сообщение. Пожалуйста, попробуйте еще раз или введите текстовый вопрос.",
                 reply_markup=get_main_keyboard()
             )
-            # Clean up the temporary file
-            os.unlink(voice_path)
             return ConversationHandler.END
         
-        # Send the transcription to the user
-        await update.message.reply_text(
+        # Send the transcription to the user while the response starts streaming
+        logger.info(f"Generating response for voice transcription: {transcription}")
+        stage_start = time.perf_counter()
+        transcription_sent = asyncio.create_task(update.message.reply_text(
             f"🔊 Ваше сообщение: {transcription}",
             reply_markup=None
-        )
-        
-        # Generate response using OpenAI
-        logger.info(f"Generating response for voice transcription: {transcription}")
-        response, tokens = await openai_service.generate_text_response(transcription)
-        
-        # Get advertisement
-        ad_text = await AdminService.get_advertisement()
-        ad_footer = f"\n\n---\n{ad_text}" if ad_text else ""
+        ))
+        response, tokens = await stream_answer(update.message, transcription, before_reply=transcription_sent)
+        await transcription_sent
+        timings['answer'] = time.perf_counter() - stage_start
         
-        # Send response
-        await update.message.reply_text(
-            f"{response}{ad_footer}",
-            reply_markup=get_main_keyboard()
+        logger.info(
+            f"Voice pipeline for user {user_id}: "
+            + ", ".join(f"{stage} {seconds * 1000:.0f} ms" for stage, seconds in timings.items())
         )
         
         # Update user usage
@@ -284,17 +353,11 @@ async def voice_question_process(update: Update, context: ContextTypes.DEFAULT_T
         # Log message
         await UserService.log_message(user_id, 'voice', transcription, response, tokens)
         
-        # Clean up the temporary file
-        os.unlink(voice_path)
-        
     except Exception as e:
         logger.error(f"Error processing voice question: {e}")
         await update.message.reply_text(
             "❌ Произошла ошибка при обработке вашего голосового сообщения. Пожалуйста, попробуйте еще раз.",
             reply_markup=get_main_keyboard()
         )
-        # Clean up the temporary file if it exists
-        if 'voice_path' in locals():
-            os.unlink(voice_path)
     
     return ConversationHandler.END
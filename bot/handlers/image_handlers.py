@@ -6,7 +6,7 @@ from telegram.ext import ContextTypes, ConversationHandler
 from bot.keyboards.keyboards import get_main_keyboard, get_cancel_keyboard
 from bot.services.user_service import UserService
 from bot.services.admin_service import AdminService
-from bot.services.openai_service import OpenAIService
+from bot.services.openai_service import openai_service
 from bot.services.payment_service import PaymentService
 from bot.utils.config_manager import config
 from bot.utils.error_handler import ErrorHandler
@@ -18,8 +18,6 @@ logger = logging.getLogger(__name__)
 # Conversation states
 IMAGE_GENERATION = range(1)
 
-# OpenAI service instance
-openai_service = OpenAIService()
 
 # Get image generation cost from config
 IMAGE_GENERATION_STARS_COST = int(config.get('IMAGE_GENERATION_STARS_COST', 5))
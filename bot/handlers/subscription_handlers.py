@@ -132,15 +132,9 @@ async def subscription_menu_handler(update: Update, context: ContextTypes.DEFAUL
             )
             return ConversationHandler.END
         
-        # Create a new session for working with plan objects
+        # Plans are plain records; the session is only needed for subscriptions
         session = get_session()
         try:
-            # Update plan objects in the session
-            for plan in plans:
-                session.add(plan)
-                if not session.is_active:
-                    session.refresh(plan)
-            
             # Get current user limits
             user_limits_dict = await UserService.get_user_limits_as_dict(user_id)
             text_limit = user_limits_dict.get('text_messages_limit', 0)
@@ -194,15 +188,9 @@ async def subscription_menu_handler(update: Update, context: ContextTypes.DEFAUL
             )
             return ConversationHandler.END
         
-        # Create a new session for working with plan objects
+        # Plans are plain records; the session is only needed for subscriptions
         session = get_session()
         try:
-            # Update plan objects in the session
-            for plan in plans:
-                session.add(plan)
-                if not session.is_active:
-                    session.refresh(plan)
-            
             # Format plan descriptions
             plans_text = "\n\n".join([f"*{plan.name}* ({plan.stars_cost} ⭐️):\n{plan.description}" for plan in plans])
             
@@ -3,7 +3,7 @@ import logging
 import asyncio
 import traceback
 from telegram import Update
-from telegram.ext import Application, CommandHandler, MessageHandler, filters, CallbackQueryHandler, ConversationHandler, ContextTypes, PreCheckoutQueryHandler
+from telegram.ext import Application, CommandHandler, MessageHandler, filters, CallbackQueryHandler, ConversationHandler, ContextTypes, PreCheckoutQueryHandler, TypeHandler
 from dotenv import load_dotenv
 
 # Import utilities
@@ -21,7 +21,7 @@ from bot.handlers.basic_handlers import (
 )
 
 from bot.handlers.admin_handlers import (
-    admin_menu, broadcast_message, broadcast_confirm, edit_ad, manage_users, user_management_actions,
+    admin_menu, broadcast_message, broadcast_confirm, edit_ad, manage_users, user_management_actions, export_command,
     BROADCAST_MESSAGE, EDIT_AD, MANAGE_USERS, FREE_LIMITS_SETTINGS, FREE_LIMITS_UPDATE, free_limits_settings_handler, update_free_limits_handler
 )
 from bot.handlers.chat_handlers import (
@@ -40,6 +40,13 @@ from bot.handlers.telegram_stars_handlers import (
     telegram_stars_command, telegram_stars_menu_handler, precheckout_callback, successful_payment_callback, create_stars_invoice,
     TELEGRAM_STARS_MENU
 )
+from bot.services.message_log_buffer import MessageLogBuffer
+from bot.services.openai_service import OpenAIService
+from bot.services.identity_service import IdentityService
+from bot.services.subscription_service import SubscriptionService
+from bot.services.telegram_stars_service import TelegramStarsService
+from bot.services.ledger_service import LedgerService
+from bot.services.rollup_service import RollupService
 from database.db import init_db
 
 # Enable logging
@@ -70,6 +77,27 @@ async def startup_tasks():
         return False
 
 
+def service_caches():
+    """TTL caches held by the bot services"""
+    return (IdentityService._cache, SubscriptionService._entitlement_cache, TelegramStarsService._balance_cache)
+
+
+async def post_init(application):
+    """Start background writers and cache sweepers once the event loop is running"""
+    await MessageLogBuffer.start()
+    for cache in service_caches():
+        cache.start()
+
+
+async def post_shutdown(application):
+    """Write buffered message logs, usage and user activity and close shared clients before exit"""
+    await MessageLogBuffer.close()
+    for cache in service_caches():
+        await cache.close()
+    await IdentityService.flush_job()
+    await OpenAIService.close()
+
+
 def main():
     """Main function to run the bot"""
     try:
@@ -93,11 +121,14 @@ def main():
         logger.info(f"Using Telegram Stars: {config.get('USE_TELEGRAM_STARS', 'True')}")
         
         # Create the Application
-        application = Application.builder().token(token).build()
+        application = Application.builder().token(token).post_init(post_init).post_shutdown(post_shutdown).build()
         
         # Register error handler
         application.add_error_handler(ErrorHandler.handle_error)
         
+        # Resolve the user once per update before any handler runs
+        application.add_handler(TypeHandler(Update, IdentityService.middleware), group=-1)
+        
         # Add handlers
         application.add_handler(CommandHandler("start", start))
         application.add_handler(CommandHandler("help", help_command))
@@ -106,6 +137,7 @@ def main():
         application.add_handler(CommandHandler("telegram_stars", telegram_stars_command))
         application.add_handler(CommandHandler("stars", telegram_stars_command))
         application.add_handler(CommandHandler("admin", admin_command))
+        application.add_handler(CommandHandler("export", export_command))
         
         # Text question conversation handler
         text_question_conv_handler = ConversationHandler(
@@ -233,6 +265,18 @@ def main():
         # Add task for daily free message reset at 00:00
         application.job_queue.run_daily(lambda context: asyncio.create_task(UserService.reset_daily_free_messages()), time=time(0, 0))
         
+        # Write buffered last_activity and profile changes
+        application.job_queue.run_repeating(IdentityService.flush_job, interval=config.get('IDENTITY_FLUSH_SECONDS', 30))
+        
+        # Deactivate ended subscriptions and recompute entitlements every 5 minutes
+        application.job_queue.run_repeating(lambda context: asyncio.create_task(SubscriptionService.expire_subscriptions()), interval=300, first=60)
+        
+        # Add new transactions and message logs to the hourly and daily rollups
+        application.job_queue.run_repeating(RollupService.rollup_job, interval=config.get('ROLLUP_INTERVAL_SECONDS', 300), first=120)
+        
+        # Snapshot stars balances so the ledger is verified from the last snapshot
+        application.job_queue.run_repeating(LedgerService.snapshot_job, interval=config.get('LEDGER_SNAPSHOT_SECONDS', 3600), first=300)
+        
         # Log startup information
         logger.info("Bot started successfully")
         
@@ -1,7 +1,9 @@
 import datetime
 from sqlalchemy import func
 from database.db import get_session
-from database.models import AdminSettings, Advertisement, BroadcastMessage, User, Transaction, StarPackage
+from database.models import AdminSettings, Advertisement, BroadcastMessage, User, StarPackage
+from bot.services.user_search import UserSearch
+from bot.services.rollup_service import RollupService, TRANSACTIONS, MESSAGES
 
 class AdminService:
     @staticmethod
@@ -213,55 +215,33 @@ class AdminService:
             session.close()
     
     @staticmethod
-    async def get_transaction_stats():
-        """Get transaction statistics"""
-        session = get_session()
-        try:
-            # Total stars purchased
-            total_purchased = session.query(func.sum(Transaction.amount)).filter(
-                Transaction.transaction_type == 'purchase'
-            ).scalar() or 0
-            
-            # Total stars used
-            total_used = session.query(func.sum(Transaction.amount)).filter(
-                Transaction.transaction_type == 'usage'
-            ).scalar() or 0
-            
-            # Total referral rewards
-            total_referral = session.query(func.sum(Transaction.amount)).filter(
-                Transaction.transaction_type == 'referral_reward'
-            ).scalar() or 0
-            
-            return {
-                "total_purchased": total_purchased,
-                "total_used": abs(total_used),
-                "total_referral": total_referral
-            }
-        finally:
-            session.close()
+    async def get_transaction_stats(since=None):
+        """Get transaction statistics from the rollups"""
+        totals = RollupService.totals(TRANSACTIONS, since)
+        
+        def amount(transaction_type):
+            return totals.get(transaction_type, (0, 0))[1]
+        
+        return {
+            "total_purchased": amount('purchase'),
+            "total_used": abs(amount('usage')),
+            "total_referral": amount('referral_reward')
+        }
+    
+    @staticmethod
+    async def get_usage_stats(since=None):
+        """Get message and token counts per message type from the rollups"""
+        return {
+            message_type: {"messages": messages, "tokens_used": tokens_used}
+            for message_type, (messages, tokens_used) in RollupService.totals(MESSAGES, since).items()
+        }
     
     @staticmethod
-    async def search_users(query):
-        """Search for users by ID, username, or name"""
+    async def search_users(query, limit=20, offset=0):
+        """Search for users by telegram ID, username, or name, best matches first"""
         session = get_session()
         try:
-            # Try to parse as telegram_id
-            try:
-                telegram_id = str(int(query))
-                users_by_id = session.query(User).filter(User.telegram_id == telegram_id).all()
-                if users_by_id:
-                    return users_by_id
-            except (ValueError, TypeError):
-                pass
-            
-            # Search by username or name
-            users = session.query(User).filter(
-                (User.username.ilike(f"%{query}%")) |
-                (User.first_name.ilike(f"%{query}%")) |
-                (User.last_name.ilike(f"%{query}%"))
-            ).limit(20).all()
-            
-            return users
+            return UserSearch.search(session, query, limit=limit, offset=offset)
         finally:
             session.close()
 
@@ -282,8 +262,8 @@ class AdminService:
             if not broadcast_id:
                 return False, 0
             
-            # Get all active users
-            users = await UserService.get_all_users()
+            # Count recipients in the database; UserService.iter_users streams them
+            users_count = await UserService.count_users()
             sent_count = 0
             
             # Update broadcast status to in_progress
@@ -291,7 +271,7 @@ class AdminService:
             
             # Return success and count of users to send to
             # The actual sending will be handled by the bot
-            return True, len(users)
+            return True, users_count
         except Exception as e:
             print(f"Error sending broadcast: {e}")
             return False, 0
@@ -302,17 +282,14 @@ class AdminService:
         from bot.services.user_service import UserService
         
         try:
-            # Get all users
-            all_users = await UserService.get_all_users()
-            total_users = len(all_users)
+            # Counted in the database instead of loading every user
+            total_users = await UserService.count_users()
             
             # Get active users in the last 7 days
-            active_users = await UserService.get_active_users(days=7)
-            active_users_count = len(active_users)
+            active_users_count = await UserService.count_users(active_days=7)
             
             # Get active users in the last 24 hours
-            active_users_24h = await UserService.get_active_users(days=1)
-            active_users_24h_count = len(active_users_24h)
+            active_users_24h_count = await UserService.count_users(active_days=1)
             
             return {
                 'total_users': total_users,
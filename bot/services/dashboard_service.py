@@ -0,0 +1,77 @@
+import datetime
+from typing import NamedTuple, Optional, Tuple
+from sqlalchemy import and_
+
+from database.models import User, UserLimit, Subscription, SubscriptionPlan
+from bot.services.message_log_buffer import MessageLogBuffer
+from bot.utils.session_utils import with_session
+
+class PlanInfo(NamedTuple):
+    name: str
+    plan_type: str
+    daily_limit: int
+    end_date: datetime.datetime
+
+class UserDashboard(NamedTuple):
+    """Read-only snapshot of everything the limits screen shows"""
+    user_id: int
+    stars: int
+    text_messages_used: int
+    text_messages_limit: int
+    voice_messages_used: int
+    voice_messages_limit: int
+    image_generations_used: int
+    image_generations_limit: int
+    plans: Tuple[PlanInfo, ...]
+
+    def plans_of(self, plan_type):
+        return tuple(plan for plan in self.plans if plan.plan_type == plan_type)
+
+class DashboardService:
+    @staticmethod
+    @with_session
+    async def get_dashboard(telegram_id, session=None) -> Optional[UserDashboard]:
+        """Load stars, today's usage and active plans of a user in one query"""
+        now = datetime.datetime.utcnow()
+        rows = session.query(
+            User.id, User.stars,
+            UserLimit.text_messages_used, UserLimit.text_messages_limit,
+            UserLimit.voice_messages_used, UserLimit.voice_messages_limit,
+            UserLimit.image_generations_used, UserLimit.image_generations_limit,
+            UserLimit.reset_date,
+            SubscriptionPlan.name, SubscriptionPlan.plan_type, SubscriptionPlan.daily_limit, Subscription.end_date
+        ).outerjoin(
+            UserLimit, UserLimit.user_id == User.id
+        ).outerjoin(
+            Subscription, and_(Subscription.user_id == User.id, Subscription.is_active == True, Subscription.end_date > now)
+        ).outerjoin(
+            SubscriptionPlan, SubscriptionPlan.id == Subscription.plan_id
+        ).filter(
+            User.telegram_id == str(telegram_id)
+        ).order_by(Subscription.end_date).all()
+
+        if not rows:
+            return None
+
+        first = rows[0]
+        user_id = first.id
+
+        # Usage from a previous day counts as zero until the next reset is written
+        stale = first.reset_date is None or first.reset_date.date() < now.date()
+        def used(value, message_type):
+            return (0 if stale else value or 0) + MessageLogBuffer.pending_usage(user_id, message_type)
+
+        return UserDashboard(
+            user_id=user_id,
+            stars=first.stars or 0,
+            text_messages_used=used(first.text_messages_used, 'text'),
+            text_messages_limit=first.text_messages_limit or 0,
+            voice_messages_used=used(first.voice_messages_used, 'voice'),
+            voice_messages_limit=first.voice_messages_limit or 0,
+            image_generations_used=used(first.image_generations_used, 'image'),
+            image_generations_limit=first.image_generations_limit or 0,
+            plans=tuple(
+                PlanInfo(row.name, row.plan_type, row.daily_limit, row.end_date)
+                for row in rows if row.name is not None
+            ),
+        )
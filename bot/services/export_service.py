@@ -0,0 +1,131 @@
+import csv
+import datetime
+import io
+import json
+import tempfile
+import zlib
+from sqlalchemy import select
+
+from database.models import User, Transaction, MessageLog
+from bot.utils.config_manager import config
+from bot.utils.session_utils import session_scope
+
+# Exported columns per table; message texts are included as stored
+EXPORTS = {
+    'users': (User.__table__, (
+        'id', 'telegram_id', 'username', 'first_name', 'last_name', 'join_date', 'last_activity',
+        'is_active', 'is_blocked', 'stars', 'referrer_id', 'referral_code'
+    )),
+    'transactions': (Transaction.__table__, (
+        'id', 'user_id', 'amount', 'description', 'transaction_date', 'transaction_type'
+    )),
+    'messages': (MessageLog.__table__, (
+        'id', 'user_id', 'message_type', 'user_message', 'bot_response', 'tokens_used', 'timestamp'
+    )),
+}
+FORMATS = ('csv', 'jsonl')
+
+class ExportError(ValueError):
+    pass
+
+def _value(value):
+    return value.isoformat() if isinstance(value, (datetime.datetime, datetime.date)) else value
+
+class ExportService:
+    """Streams whole tables as CSV or JSON Lines in constant memory.
+
+    Rows are read with yield_per, which uses a server-side cursor on
+    PostgreSQL, and encoded one chunk at a time. Optional gzip compression is
+    applied to the same chunks, so neither the rows nor the output file are
+    ever held in memory as a whole.
+    """
+
+    @staticmethod
+    def validate(name, fmt):
+        if name not in EXPORTS:
+            raise ExportError(f"Unknown export {name!r}, expected one of: {', '.join(EXPORTS)}")
+        if fmt not in FORMATS:
+            raise ExportError(f"Unknown format {fmt!r}, expected one of: {', '.join(FORMATS)}")
+
+    @staticmethod
+    def filename(name, fmt='csv', compress=False):
+        date = datetime.datetime.utcnow().strftime('%Y%m%d-%H%M%S')
+        return f"{name}-{date}.{fmt}" + ('.gz' if compress else '')
+
+    @staticmethod
+    def iter_batches(name, chunk_size=None):
+        """Yield lists of row tuples in id order, chunk_size rows at a time"""
+        chunk_size = chunk_size or config.get('EXPORT_CHUNK_SIZE', 1000)
+        table, columns = EXPORTS[name]
+        statement = select(*(table.c[column] for column in columns)).order_by(table.c.id)
+        with session_scope() as session:
+            result = session.execute(statement.execution_options(yield_per=chunk_size))
+            for partition in result.partitions():
+                yield partition
+
+    @classmethod
+    def iter_chunks(cls, name, fmt='csv', compress=False, chunk_size=None):
+        """Yield the encoded export as bytes, one chunk per batch of rows"""
+        cls.validate(name, fmt)
+        columns = EXPORTS[name][1]
+        # wbits=31 writes a gzip container
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+        buffer = io.StringIO()
+        writer = csv.writer(buffer) if fmt == 'csv' else None
+
+        def drain():
+            data = buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+            return compressor.compress(data) if compressor else data
+
+        if writer:
+            writer.writerow(columns)
+        for rows in cls.iter_batches(name, chunk_size):
+            for row in rows:
+                if writer:
+                    writer.writerow([_value(value) for value in row])
+                else:
+                    buffer.write(json.dumps(dict(zip(columns, map(_value, row))), ensure_ascii=False))
+                    buffer.write('\n')
+            chunk = drain()
+            if chunk:
+                yield chunk
+
+        tail = drain() + (compressor.flush() if compressor else b'')
+        if tail:
+            yield tail
+
+    @classmethod
+    def write(cls, name, fileobj, fmt='csv', compress=False, chunk_size=None):
+        """Write the export to a binary file object; returns the number of bytes written"""
+        size = 0
+        for chunk in cls.iter_chunks(name, fmt, compress, chunk_size):
+            fileobj.write(chunk)
+            size += len(chunk)
+        return size
+
+    @classmethod
+    def to_temporary_file(cls, name, fmt='csv', compress=False, chunk_size=None):
+        """Write the export to an anonymous temporary file, rewound for upload"""
+        fileobj = tempfile.TemporaryFile()
+        try:
+            cls.write(name, fileobj, fmt, compress, chunk_size)
+        except Exception:
+            fileobj.close()
+            raise
+        fileobj.seek(0)
+        return fileobj
+
+    @classmethod
+    def streaming_response(cls, name, fmt='csv', compress=False, chunk_size=None):
+        """FastAPI response that streams the export as it is read from the database"""
+        from fastapi.responses import StreamingResponse
+
+        cls.validate(name, fmt)
+        media_type = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+        headers = {'Content-Disposition': f'attachment; filename="{cls.filename(name, fmt, compress)}"'}
+        if compress:
+            media_type = 'application/gzip'
+        # A sync iterator is consumed in Starlette's thread pool, so the event loop is not blocked
+        return StreamingResponse(cls.iter_chunks(name, fmt, compress, chunk_size), media_type=media_type, headers=headers)
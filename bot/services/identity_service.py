@@ -0,0 +1,160 @@
+import asyncio
+import datetime
+import logging
+import random
+import string
+from sqlalchemy import update, bindparam
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+
+from common.cache import TTLCache
+from database.db import engine
+from database.models import User, UserLimit
+from config.config import FREE_TEXT_MESSAGES_LIMIT, FREE_IMAGE_GENERATION_LIMIT, FREE_VOICE_MESSAGES_LIMIT
+from bot.utils.config_manager import config
+from bot.utils.session_utils import session_scope
+
+logger = logging.getLogger(__name__)
+
+PROFILE_FIELDS = ('username', 'first_name', 'last_name')
+
+class IdentityService:
+    """Resolves telegram_id to users.id with a bounded cache.
+
+    Known users cost no database work: last_activity and profile changes are
+    kept in memory and written in bulk by flush(). Unknown users are created
+    with a single INSERT ... ON CONFLICT (telegram_id) DO NOTHING.
+    """
+
+    _cache = TTLCache(max_size=config.get('IDENTITY_CACHE_SIZE', 50000), ttl=3600)  # {telegram_id: (user_id, username, first_name, last_name)}
+    _activity = {}  # {user_id: last_activity}
+    _profiles = {}  # {user_id: (username, first_name, last_name)}
+    _referral_code_attempts = 5
+
+    @classmethod
+    async def resolve(cls, telegram_id, username=None, first_name=None, last_name=None):
+        """Return users.id for a Telegram user, creating the user on first contact"""
+        telegram_id = str(telegram_id)
+        cached = cls._cache.get(telegram_id)
+        if cached is None:
+            cached = await cls._load(telegram_id, username, first_name, last_name)
+
+        user_id = cached[0]
+        cls._activity[user_id] = datetime.datetime.utcnow()
+
+        # Only fields Telegram actually sent are compared, as before
+        profile = tuple(
+            new if new and new != old else old
+            for new, old in zip((username, first_name, last_name), cached[1:])
+        )
+        if profile != cached[1:]:
+            cls._profiles[user_id] = profile
+            cached = (user_id,) + profile
+        cls._cache.set(telegram_id, cached)
+        return user_id
+
+    @classmethod
+    async def _load(cls, telegram_id, username, first_name, last_name):
+        with session_scope() as session:
+            row = session.query(User.id, User.username, User.first_name, User.last_name).filter(User.telegram_id == telegram_id).first()
+            if row:
+                return tuple(row)
+
+        # Limits for new users come from the admin settings
+        from bot.services.admin_service import AdminService
+        free_text_messages = int(await AdminService.get_setting('FREE_TEXT_MESSAGES_LIMIT', FREE_TEXT_MESSAGES_LIMIT))
+        free_image_generations = int(await AdminService.get_setting('FREE_IMAGE_GENERATION_LIMIT', FREE_IMAGE_GENERATION_LIMIT))
+
+        user_id = cls._create_user(telegram_id, username, first_name, last_name, {
+            'text_messages_limit': free_text_messages,
+            'image_generations_limit': free_image_generations,
+            'voice_messages_limit': FREE_VOICE_MESSAGES_LIMIT,
+        })
+        return user_id, username, first_name, last_name
+
+    @staticmethod
+    def _insert(table):
+        dialect = postgresql if engine.dialect.name == 'postgresql' else sqlite
+        return dialect.insert(table)
+
+    @staticmethod
+    def generate_referral_code(length=8):
+        return ''.join(random.choices(string.ascii_uppercase + string.digits, k=length))
+
+    @classmethod
+    def _create_user(cls, telegram_id, username, first_name, last_name, limits):
+        """Insert the user and its limits; a taken referral code is retried with a new one"""
+        for attempt in range(cls._referral_code_attempts):
+            try:
+                with session_scope() as session:
+                    user_id = session.execute(
+                        cls._insert(User.__table__).values(
+                            telegram_id=telegram_id,
+                            username=username,
+                            first_name=first_name,
+                            last_name=last_name,
+                            referral_code=cls.generate_referral_code(),
+                        ).on_conflict_do_nothing(index_elements=['telegram_id']).returning(User.__table__.c.id)
+                    ).scalar()
+
+                    if user_id is None:
+                        # Created concurrently by another update of the same user
+                        return session.query(User.id).filter(User.telegram_id == telegram_id).scalar()
+
+                    session.execute(UserLimit.__table__.insert().values(user_id=user_id, **limits))
+                    return user_id
+            except IntegrityError as e:
+                logger.warning(f"Referral code collision for telegram_id {telegram_id}, attempt {attempt + 1}: {e}")
+        raise RuntimeError(f"Could not create user {telegram_id}: no free referral code")
+
+    @classmethod
+    async def flush(cls):
+        """Write buffered last_activity and profile changes in two bulk UPDATEs"""
+        if not cls._activity and not cls._profiles:
+            return 0
+        activity, cls._activity = cls._activity, {}
+        profiles, cls._profiles = cls._profiles, {}
+        try:
+            await asyncio.to_thread(cls._write, activity, profiles)
+        except Exception:
+            # Newer values win over the failed batch
+            cls._activity = {**activity, **cls._activity}
+            cls._profiles = {**profiles, **cls._profiles}
+            raise
+        return len(activity)
+
+    @staticmethod
+    def _write(activity, profiles):
+        table = User.__table__
+        with session_scope() as session:
+            if activity:
+                session.execute(
+                    update(table).where(table.c.id == bindparam('b_id')).values(last_activity=bindparam('b_last_activity')),
+                    [{'b_id': user_id, 'b_last_activity': value} for user_id, value in activity.items()]
+                )
+            if profiles:
+                session.execute(
+                    update(table).where(table.c.id == bindparam('b_id')).values(
+                        **{field: bindparam(f'b_{field}') for field in PROFILE_FIELDS}
+                    ),
+                    [
+                        {'b_id': user_id, **{f'b_{field}': value for field, value in zip(PROFILE_FIELDS, profile)}}
+                        for user_id, profile in profiles.items()
+                    ]
+                )
+
+    @classmethod
+    async def flush_job(cls, context=None):
+        """Job queue callback"""
+        try:
+            await cls.flush()
+        except Exception as e:
+            logger.error(f"Error flushing user activity: {e}")
+
+    @classmethod
+    async def middleware(cls, update, context):
+        """Resolve the sender once per update and expose it as context.user_data['user_id']"""
+        user = update.effective_user
+        if user is None or context.user_data is None:
+            return
+        context.user_data['user_id'] = await cls.resolve(user.id, user.username, user.first_name, user.last_name)
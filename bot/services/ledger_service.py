@@ -0,0 +1,161 @@
+import asyncio
+import datetime
+import logging
+from typing import NamedTuple, Optional
+from sqlalchemy import update, select, insert, func, and_, case
+
+from database.models import User, Transaction, BalanceSnapshot
+from bot.utils.session_utils import session_scope
+
+logger = logging.getLogger(__name__)
+
+# Paid outside the internal balance (Telegram Stars invoices); recorded for
+# history but not part of users.stars
+EXTERNAL_TRANSACTION_TYPES = ('telegram_stars_subscription',)
+
+class LedgerCheck(NamedTuple):
+    user_id: int
+    expected: int
+    actual: int
+
+    @property
+    def ok(self):
+        return self.expected == self.actual
+
+class LedgerService:
+    """Stars balance changes as single conditional UPDATEs.
+
+    The balance is never read into Python and written back: a debit is
+    UPDATE users SET stars = stars - n WHERE id = :id AND stars >= n RETURNING
+    stars, so concurrent debits cannot overdraw or lose updates. The row lock
+    taken by the UPDATE is held until the Transaction row is inserted and the
+    database transaction commits, which also keeps each user's transaction
+    ids in commit order for the snapshots.
+    """
+
+    @staticmethod
+    def apply(session, user_id, amount, description, transaction_type):
+        """Change the balance by amount inside the caller's transaction.
+
+        Returns the new balance, or None if the user does not exist or a
+        debit would make the balance negative. Nothing is written then.
+        """
+        table = User.__table__
+        stars = func.coalesce(table.c.stars, 0)
+        statement = update(table).where(table.c.id == user_id)
+        if amount < 0:
+            statement = statement.where(stars >= -amount)
+        balance = session.execute(
+            statement.values(stars=stars + amount).returning(table.c.stars)
+        ).scalar()
+        if balance is None:
+            return None
+
+        session.execute(insert(Transaction.__table__).values(
+            user_id=user_id,
+            amount=amount,
+            description=description,
+            transaction_type=transaction_type,
+            transaction_date=datetime.datetime.utcnow()
+        ))
+        return balance
+
+    @classmethod
+    def debit(cls, user_id, amount, description, transaction_type="usage"):
+        """Take amount stars in its own transaction; None if the balance is too low"""
+        with session_scope() as session:
+            return cls.apply(session, user_id, -amount, description, transaction_type)
+
+    @classmethod
+    def credit(cls, user_id, amount, description, transaction_type="purchase"):
+        """Add amount stars in its own transaction; None if the user does not exist"""
+        with session_scope() as session:
+            return cls.apply(session, user_id, amount, description, transaction_type)
+
+    @staticmethod
+    def take_snapshots():
+        """Snapshot the balance of every user with transactions since their last snapshot.
+
+        A snapshot is the previous snapshot plus the transactions after it, so
+        a balance change that bypassed the ledger never becomes the baseline;
+        it is logged and keeps failing verify(). Only a user's first snapshot
+        takes users.stars as the opening balance. Ledger sum, actual balance
+        and newest transaction id are read by one SELECT, so all three come
+        from the same committed state.
+        """
+        users = User.__table__
+        transactions = Transaction.__table__
+        snapshots = BalanceSnapshot.__table__
+
+        newest = select(
+            snapshots.c.user_id, func.max(snapshots.c.last_transaction_id).label('last_transaction_id')
+        ).group_by(snapshots.c.user_id).subquery()
+        latest = select(snapshots.c.user_id, snapshots.c.stars, snapshots.c.last_transaction_id).join(
+            newest, and_(
+                newest.c.user_id == snapshots.c.user_id,
+                newest.c.last_transaction_id == snapshots.c.last_transaction_id
+            )
+        ).subquery()
+
+        actual = func.coalesce(users.c.stars, 0)
+        delta = func.sum(case(
+            (transactions.c.transaction_type.in_(EXTERNAL_TRANSACTION_TYPES), 0),
+            else_=transactions.c.amount
+        ))
+        source = select(
+            users.c.id,
+            case((latest.c.last_transaction_id.is_(None), actual), else_=latest.c.stars + delta),
+            actual,
+            func.max(transactions.c.id)
+        ).outerjoin(
+            latest, latest.c.user_id == users.c.id
+        ).join(
+            transactions, and_(
+                transactions.c.user_id == users.c.id,
+                transactions.c.id > func.coalesce(latest.c.last_transaction_id, 0)
+            )
+        ).group_by(users.c.id, users.c.stars, latest.c.stars, latest.c.last_transaction_id)
+
+        with session_scope() as session:
+            rows = session.execute(source).all()
+            if not rows:
+                return 0
+            taken_at = datetime.datetime.utcnow()
+            for user_id, expected, balance, _ in rows:
+                check = LedgerCheck(user_id, expected, balance)
+                if not check.ok:
+                    logger.warning(f"Balance of user {user_id} is {check.actual}, the ledger says {check.expected}")
+            session.execute(insert(snapshots), [
+                {'user_id': user_id, 'stars': expected, 'last_transaction_id': last_id, 'taken_at': taken_at}
+                for user_id, expected, _, last_id in rows
+            ])
+            return len(rows)
+
+    @staticmethod
+    def verify(user_id) -> Optional[LedgerCheck]:
+        """Compare the balance with the latest snapshot plus the transactions after it"""
+        with session_scope() as session:
+            actual = session.query(func.coalesce(User.stars, 0)).filter(User.id == user_id).scalar()
+            if actual is None:
+                return None
+
+            snapshot = session.query(BalanceSnapshot.stars, BalanceSnapshot.last_transaction_id).filter(
+                BalanceSnapshot.user_id == user_id
+            ).order_by(BalanceSnapshot.last_transaction_id.desc()).first()
+            start, after_id = snapshot if snapshot else (0, 0)
+
+            delta = session.query(func.coalesce(func.sum(Transaction.amount), 0)).filter(
+                Transaction.user_id == user_id,
+                Transaction.id > after_id,
+                Transaction.transaction_type.notin_(EXTERNAL_TRANSACTION_TYPES)
+            ).scalar()
+            return LedgerCheck(user_id, start + delta, actual)
+
+    @classmethod
+    async def snapshot_job(cls, context=None):
+        """Job queue callback"""
+        try:
+            count = await asyncio.to_thread(cls.take_snapshots)
+            logger.info(f"Took {count} balance snapshots")
+        except Exception as e:
+            logger.error(f"Error taking balance snapshots: {e}")
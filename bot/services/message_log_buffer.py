@@ -0,0 +1,174 @@
+import asyncio
+import datetime
+import logging
+from collections import defaultdict
+from sqlalchemy import insert, update, bindparam
+
+from database.models import MessageLog, UserLimit
+from bot.utils.config_manager import config
+from bot.utils.session_utils import session_scope
+
+logger = logging.getLogger(__name__)
+
+USAGE_COLUMNS = {
+    'text': 'text_messages_used',
+    'image': 'image_generations_used',
+    'voice': 'voice_messages_used',
+}
+
+class MessageLogBuffer:
+    """Write-behind buffer for message logs and usage counters.
+
+    Handlers only append to memory; rows are written in one transaction every
+    MESSAGE_LOG_FLUSH_MS milliseconds or as soon as MESSAGE_LOG_BATCH_SIZE rows
+    are queued, and once more on shutdown. Usage being written stays counted
+    by pending_usage() until its transaction commits.
+    """
+
+    _rows = []
+    _usage = defaultdict(lambda: defaultdict(int))  # {user_id: {message_type: count}}
+    _inflight_usage = {}  # usage of the batch being written
+    _task = None
+    _flush_task = None
+    _lock = None
+
+    @classmethod
+    def _get_lock(cls):
+        if cls._lock is None:
+            cls._lock = asyncio.Lock()
+        return cls._lock
+
+    @classmethod
+    def add_message(cls, user_id, message_type, user_message, bot_response, tokens_used=0):
+        """Queue a message log row"""
+        cls._rows.append({
+            'user_id': user_id,
+            'message_type': message_type,
+            'user_message': user_message,
+            'bot_response': bot_response,
+            'tokens_used': tokens_used,
+            'timestamp': datetime.datetime.utcnow(),
+        })
+        cls._schedule()
+
+    @classmethod
+    def add_usage(cls, user_id, message_type):
+        """Queue a usage counter increment"""
+        if message_type not in USAGE_COLUMNS:
+            return
+        cls._usage[user_id][message_type] += 1
+        cls._schedule()
+
+    @classmethod
+    def pending_usage(cls, user_id, message_type):
+        """Increments not yet committed, so limit checks never undercount between flushes.
+
+        Right after a commit and before flush() resumes, the batch is counted
+        both here and in the database; limits err on the strict side then.
+        """
+        total = 0
+        for usage in (cls._usage, cls._inflight_usage):
+            counts = usage.get(user_id)
+            if counts:
+                total += counts.get(message_type, 0)
+        return total
+
+    @classmethod
+    def pending(cls):
+        return len(cls._rows) + sum(sum(usage.values()) for usage in cls._usage.values())
+
+    @classmethod
+    def _schedule(cls):
+        """Start the periodic flusher and flush early when the batch is full"""
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        if cls._task is None or cls._task.done():
+            cls._task = loop.create_task(cls._run())
+        if cls.pending() >= config.get('MESSAGE_LOG_BATCH_SIZE', 200) and (cls._flush_task is None or cls._flush_task.done()):
+            cls._flush_task = loop.create_task(cls.flush())
+            cls._flush_task.add_done_callback(cls._flush_done)
+
+    @staticmethod
+    def _flush_done(task):
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"Error flushing message log buffer: {task.exception()}")
+
+    @classmethod
+    async def start(cls):
+        if cls._task is None or cls._task.done():
+            cls._task = asyncio.get_running_loop().create_task(cls._run())
+
+    @classmethod
+    async def _run(cls):
+        interval = config.get('MESSAGE_LOG_FLUSH_MS', 500) / 1000
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await cls.flush()
+            except Exception as e:
+                logger.error(f"Error flushing message log buffer: {e}")
+
+    @classmethod
+    async def flush(cls):
+        """Write everything queued so far in a single transaction"""
+        async with cls._get_lock():
+            if not cls._rows and not cls._usage:
+                return 0
+            rows, cls._rows = cls._rows, []
+            usage, cls._usage = cls._usage, defaultdict(lambda: defaultdict(int))
+            cls._inflight_usage = usage
+            try:
+                await asyncio.to_thread(cls._write, rows, usage)
+            except Exception:
+                # Put the batch back so the next flush retries it
+                cls._rows[:0] = rows
+                for user_id, counts in usage.items():
+                    for message_type, count in counts.items():
+                        cls._usage[user_id][message_type] += count
+                raise
+            finally:
+                cls._inflight_usage = {}
+            return len(rows)
+
+    @staticmethod
+    def _write(rows, usage):
+        table = UserLimit.__table__
+        params = [
+            {
+                'b_user_id': user_id,
+                'b_text': counts.get('text', 0),
+                'b_image': counts.get('image', 0),
+                'b_voice': counts.get('voice', 0),
+            }
+            for user_id, counts in usage.items()
+        ]
+        with session_scope() as session:
+            if rows:
+                session.execute(insert(MessageLog.__table__), rows)
+            if params:
+                session.execute(
+                    update(table)
+                    .where(table.c.user_id == bindparam('b_user_id'))
+                    .values(
+                        text_messages_used=table.c.text_messages_used + bindparam('b_text'),
+                        image_generations_used=table.c.image_generations_used + bindparam('b_image'),
+                        voice_messages_used=table.c.voice_messages_used + bindparam('b_voice'),
+                    ),
+                    params
+                )
+
+    @classmethod
+    async def close(cls):
+        """Stop the flusher and write the remaining rows"""
+        if cls._task is not None:
+            cls._task.cancel()
+            try:
+                await cls._task
+            except asyncio.CancelledError:
+                pass
+            cls._task = None
+        if cls._flush_task is not None and not cls._flush_task.done():
+            await asyncio.wait([cls._flush_task])
+        await cls.flush()
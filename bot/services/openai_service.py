@@ -1,53 +1,127 @@
-import os
 import logging
-import openai
-from config.config import OPENAI_API_KEY, OPENAI_ASSISTANT_ID
+import httpx
+from openai import AsyncOpenAI
+from config.config import (
+    OPENAI_API_KEY, OPENAI_ASSISTANT_ID, OPENAI_TIMEOUT, OPENAI_CONNECT_TIMEOUT,
+    OPENAI_MAX_CONNECTIONS, OPENAI_MAX_RETRIES
+)
+
+SYSTEM_PROMPT = "You are a helpful assistant that provides informative and concise responses."
 
 class OpenAIService:
+    """Async OpenAI API access over one pooled HTTP client shared by all handlers"""
+
+    _client = None
+
     def __init__(self):
         self.api_key = OPENAI_API_KEY
         self.assistant_id = OPENAI_ASSISTANT_ID
-        openai.api_key = self.api_key
         self.logger = logging.getLogger(__name__)
-    
+
+    @classmethod
+    def get_client(cls):
+        """Get the process-wide AsyncOpenAI client, creating it on first use"""
+        if cls._client is None:
+            cls._client = AsyncOpenAI(
+                api_key=OPENAI_API_KEY,
+                timeout=httpx.Timeout(OPENAI_TIMEOUT, connect=OPENAI_CONNECT_TIMEOUT),
+                max_retries=OPENAI_MAX_RETRIES,
+                http_client=httpx.AsyncClient(
+                    limits=httpx.Limits(
+                        max_connections=OPENAI_MAX_CONNECTIONS,
+                        max_keepalive_connections=OPENAI_MAX_CONNECTIONS
+                    )
+                )
+            )
+        return cls._client
+
+    @property
+    def client(self):
+        return self.get_client()
+
+    @classmethod
+    async def close(cls):
+        """Close the shared client and its connection pool"""
+        if cls._client is not None:
+            await cls._client.close()
+            cls._client = None
+
+    @staticmethod
+    def _messages(prompt):
+        return [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": prompt}
+        ]
+
     async def generate_text_response(self, prompt):
         """Generate a text response using ChatGPT"""
         try:
-            response = openai.ChatCompletion.create(
+            response = await self.client.chat.completions.create(
                 model="gpt-3.5-turbo",
-                messages=[
-                    {"role": "system", "content": "You are a helpful assistant that provides informative and concise responses."},
-                    {"role": "user", "content": prompt}
-                ],
+                messages=self._messages(prompt),
                 max_tokens=1000
             )
             return response.choices[0].message.content, response.usage.total_tokens
         except Exception as e:
             self.logger.error(f"Error generating text response: {e}")
             return "Sorry, I encountered an error while processing your request. Please try again later.", 0
-    
+
+    async def stream_text_response(self, prompt):
+        """Yield the response text as it is generated.
+
+        The last item is a (text, total_tokens) tuple with the full answer.
+        """
+        parts = []
+        tokens = 0
+        try:
+            stream = await self.client.chat.completions.create(
+                model="gpt-3.5-turbo",
+                messages=self._messages(prompt),
+                max_tokens=1000,
+                stream=True,
+                stream_options={"include_usage": True}
+            )
+            async for chunk in stream:
+                if chunk.usage:
+                    tokens = chunk.usage.total_tokens
+                if chunk.choices and chunk.choices[0].delta.content:
+                    parts.append(chunk.choices[0].delta.content)
+                    yield chunk.choices[0].delta.content
+        except Exception as e:
+            self.logger.error(f"Error streaming text response: {e}")
+            if not parts:
+                parts.append("Sorry, I encountered an error while processing your request. Please try again later.")
+        yield "".join(parts), tokens
+
     async def generate_image(self, prompt):
         """Generate an image using DALL-E"""
         try:
-            response = openai.Image.create(
+            response = await self.client.images.generate(
                 prompt=prompt,
                 n=1,
                 size="1024x1024"
             )
-            return response['data'][0]['url']
+            return response.data[0].url
         except Exception as e:
             self.logger.error(f"Error generating image: {e}")
             return None
-    
-    async def transcribe_audio(self, audio_file_path):
-        """Transcribe audio to text using Whisper API"""
+
+    async def transcribe_audio(self, audio, filename="voice.ogg"):
+        """Transcribe audio to text using Whisper API.
+
+        Accepts raw bytes or a file-like object, so voice messages never touch the disk.
+        """
         try:
-            with open(audio_file_path, "rb") as audio_file:
-                transcript = openai.Audio.transcribe(
-                    "whisper-1", 
-                    audio_file
-                )
+            if hasattr(audio, "read"):
+                audio = audio.read()
+            transcript = await self.client.audio.transcriptions.create(
+                model="whisper-1",
+                file=(filename, audio)
+            )
             return transcript.text
         except Exception as e:
             self.logger.error(f"Error transcribing audio: {e}")
             return None
+
+# Shared service instance for all handlers
+openai_service = OpenAIService()
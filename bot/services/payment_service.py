@@ -1,5 +1,7 @@
 from database.db import get_session
 from database.models import User, Transaction, StarPackage
+from bot.services.records import TransactionRecord, select_records, fetch_records
+from bot.services.ledger_service import LedgerService
 from sqlalchemy import func
 import datetime
 from config.config import TEXT_MESSAGE_STARS_COST, IMAGE_GENERATION_STARS_COST, VOICE_MESSAGE_STARS_COST
@@ -28,22 +30,14 @@ class PaymentService:
             if not package:
                 return False, "Package not found or inactive"
             
-            user = session.query(User).get(user_id)
-            if not user:
-                return False, "User not found"
-            
-            # Add stars to user's account
-            user.stars += package.stars_amount
-            
-            # Record transaction
-            transaction = Transaction(
-                user_id=user_id,
-                amount=package.stars_amount,
-                description=f"Purchased {package.stars_amount} stars ({package.name})",
-                transaction_type="purchase"
+            # Add stars to user's account and record the transaction
+            balance = LedgerService.apply(
+                session, user_id, package.stars_amount,
+                f"Purchased {package.stars_amount} stars ({package.name})", "purchase"
             )
+            if balance is None:
+                return False, "User not found"
             
-            session.add(transaction)
             session.commit()
             
             return True, f"Successfully purchased {package.stars_amount} stars"
@@ -82,10 +76,6 @@ class PaymentService:
         """Use stars for a service"""
         session = get_session()
         try:
-            user = session.query(User).get(user_id)
-            if not user:
-                return False, "User not found"
-            
             # Get cost based on service type
             if service_type == 'text':
                 cost = TEXT_MESSAGE_STARS_COST
@@ -99,22 +89,12 @@ class PaymentService:
             else:
                 return False, "Invalid service type"
             
-            # Check if user has enough stars
-            if user.stars < cost:
+            # Deduct stars only if the balance covers the cost
+            if LedgerService.apply(session, user_id, -cost, description, "usage") is None:
+                if not session.query(User.id).filter(User.id == user_id).scalar():
+                    return False, "User not found"
                 return False, "Not enough stars"
             
-            # Deduct stars
-            user.stars -= cost
-            
-            # Record transaction
-            transaction = Transaction(
-                user_id=user_id,
-                amount=-cost,
-                description=description,
-                transaction_type="usage"
-            )
-            
-            session.add(transaction)
             session.commit()
             
             return True, f"Successfully used {cost} stars"
@@ -126,13 +106,14 @@ class PaymentService:
     
     @staticmethod
     async def get_user_transactions(user_id, limit=10):
-        """Get recent transactions for a user"""
+        """Get recent transactions for a user as read-only TransactionRecord tuples"""
         session = get_session()
         try:
-            transactions = session.query(Transaction).filter(
-                Transaction.user_id == user_id
-            ).order_by(Transaction.transaction_date.desc()).limit(limit).all()
-            
-            return transactions
+            return fetch_records(
+                session, TransactionRecord,
+                select_records(TransactionRecord).where(
+                    Transaction.user_id == user_id
+                ).order_by(Transaction.transaction_date.desc()).limit(limit)
+            )
         finally:
             session.close()
@@ -0,0 +1,80 @@
+import datetime
+from typing import Iterator, NamedTuple, Optional, Type, TypeVar
+from sqlalchemy import select
+
+from database.models import User, Transaction, SubscriptionPlan
+from bot.utils.session_utils import session_scope
+
+# Read-only rows for hot paths. Tuples carry no identity map entry, no
+# instance state and no lazy loaders, so they are cheap to build, safe to use
+# after the session is closed and about a quarter of the size of an ORM object.
+
+class UserRecord(NamedTuple):
+    id: int
+    telegram_id: str
+    username: Optional[str]
+    first_name: Optional[str]
+    last_name: Optional[str]
+    join_date: Optional[datetime.datetime]
+    last_activity: Optional[datetime.datetime]
+    is_active: bool
+    is_blocked: bool
+    stars: int
+    referrer_id: Optional[int]
+    referral_code: str
+
+class TransactionRecord(NamedTuple):
+    id: int
+    user_id: int
+    amount: int
+    description: Optional[str]
+    transaction_date: datetime.datetime
+    transaction_type: str
+
+class PlanRecord(NamedTuple):
+    id: int
+    name: str
+    description: Optional[str]
+    stars_cost: int
+    duration_days: int
+    daily_limit: int
+    plan_type: str
+    is_active: bool
+
+R = TypeVar('R', bound=tuple)
+
+RECORD_TABLES = {
+    UserRecord: User.__table__,
+    TransactionRecord: Transaction.__table__,
+    PlanRecord: SubscriptionPlan.__table__,
+}
+
+def select_records(record_type: Type[R]):
+    """Core SELECT of exactly the columns of a record type"""
+    table = RECORD_TABLES[record_type]
+    return select(*(table.c[name] for name in record_type._fields))
+
+def fetch_records(session, record_type: Type[R], statement) -> list:
+    make = record_type._make
+    return [make(row) for row in session.execute(statement)]
+
+def stream_records(record_type: Type[R], statement, batch_size=1000) -> Iterator[R]:
+    """Yield records page by page using keyset pagination on the primary key.
+
+    Each page is a short query in its own session, so memory stays bounded
+    by batch_size and no transaction is held open between pages.
+    """
+    table = RECORD_TABLES[record_type]
+    make = record_type._make
+    last_id = None
+    while True:
+        page = statement.order_by(table.c.id).limit(batch_size)
+        if last_id is not None:
+            page = page.where(table.c.id > last_id)
+        with session_scope() as session:
+            rows = session.execute(page).all()
+        for row in rows:
+            yield make(row)
+        if len(rows) < batch_size:
+            return
+        last_id = rows[-1].id
@@ -0,0 +1,191 @@
+import asyncio
+import datetime
+import logging
+from typing import NamedTuple
+from sqlalchemy import select, func
+from sqlalchemy.dialects import postgresql, sqlite
+
+from database.models import User, Transaction, MessageLog, TransactionRollup, MessageRollup, RollupWatermark
+from bot.utils.config_manager import config
+from bot.utils.session_utils import session_scope
+
+logger = logging.getLogger(__name__)
+
+UNKNOWN_COHORT = 'unknown'
+
+class RollupSource(NamedTuple):
+    """Source table and the rollup table it is aggregated into"""
+    name: str
+    table: object
+    timestamp: str
+    type_column: str
+    value_column: str
+    rollup: object
+    count_column: str
+
+TRANSACTIONS = RollupSource(
+    'transactions', Transaction.__table__, 'transaction_date', 'transaction_type', 'amount',
+    TransactionRollup.__table__, 'transactions'
+)
+MESSAGES = RollupSource(
+    'message_logs', MessageLog.__table__, 'timestamp', 'message_type', 'tokens_used',
+    MessageRollup.__table__, 'messages'
+)
+SOURCES = (TRANSACTIONS, MESSAGES)
+
+class RollupService:
+    """Hourly and daily aggregates of transactions and message logs.
+
+    run() only reads source rows above the stored watermark. Each chunk of
+    rows is added to the rollups and the watermark is moved in the same
+    database transaction, so every row is counted exactly once. Rows younger
+    than ROLLUP_LAG_SECONDS are left for the next run, which keeps rows of
+    transactions still in flight from being skipped by the watermark.
+    """
+
+    @staticmethod
+    def _insert(session, table):
+        dialect = postgresql if session.get_bind().dialect.name == 'postgresql' else sqlite
+        return dialect.insert(table)
+
+    @staticmethod
+    def _hour(session, column):
+        if session.get_bind().dialect.name == 'postgresql':
+            return func.date_trunc('hour', column)
+        return func.strftime('%Y-%m-%d %H:00:00', column)
+
+    @staticmethod
+    def _cohort(session, column):
+        if session.get_bind().dialect.name == 'postgresql':
+            return func.to_char(column, 'YYYY-MM')
+        return func.strftime('%Y-%m', column)
+
+    @staticmethod
+    def _as_datetime(value):
+        return value if isinstance(value, datetime.datetime) else datetime.datetime.fromisoformat(value)
+
+    @staticmethod
+    def watermark(session, source):
+        return session.query(RollupWatermark.last_id).filter(RollupWatermark.source == source.name).scalar() or 0
+
+    @classmethod
+    def run(cls, batch_size=None, lag_seconds=None):
+        """Roll up all sources; returns {source name: rows processed}"""
+        return {source.name: cls.run_source(source, batch_size, lag_seconds) for source in SOURCES}
+
+    @classmethod
+    def run_source(cls, source, batch_size=None, lag_seconds=None):
+        batch_size = batch_size or config.get('ROLLUP_BATCH_SIZE', 50000)
+        lag_seconds = config.get('ROLLUP_LAG_SECONDS', 60) if lag_seconds is None else lag_seconds
+        table = source.table
+        cutoff = datetime.datetime.utcnow() - datetime.timedelta(seconds=lag_seconds)
+
+        with session_scope() as session:
+            last_id = cls.watermark(session, source)
+            upper = session.execute(
+                select(func.max(table.c.id)).where(table.c.id > last_id, table.c[source.timestamp] < cutoff)
+            ).scalar()
+
+        processed = 0
+        while upper is not None and last_id < upper:
+            chunk_end = min(last_id + batch_size, upper)
+            with session_scope() as session:
+                processed += cls._roll_chunk(session, source, last_id, chunk_end)
+            last_id = chunk_end
+        return processed
+
+    @classmethod
+    def _roll_chunk(cls, session, source, after_id, up_to_id):
+        table = source.table
+        users = User.__table__
+        hour = cls._hour(session, table.c[source.timestamp])
+        cohort = func.coalesce(cls._cohort(session, users.c.join_date), UNKNOWN_COHORT)
+
+        rows = session.execute(
+            select(
+                hour, table.c[source.type_column], cohort,
+                func.count(), func.coalesce(func.sum(table.c[source.value_column]), 0)
+            ).select_from(
+                table.outerjoin(users, users.c.id == table.c.user_id)
+            ).where(
+                table.c.id > after_id, table.c.id <= up_to_id
+            ).group_by(hour, table.c[source.type_column], cohort)
+        ).all()
+
+        totals = {}
+        count = 0
+        for bucket, row_type, row_cohort, rows_count, value in rows:
+            bucket = cls._as_datetime(bucket)
+            count += rows_count
+            for period, start in (('hour', bucket), ('day', bucket.replace(hour=0))):
+                key = (period, start, row_type, row_cohort)
+                previous = totals.get(key, (0, 0))
+                totals[key] = (previous[0] + rows_count, previous[1] + value)
+
+        if totals:
+            rollup = source.rollup
+            insert = cls._insert(session, rollup)
+            session.execute(
+                insert.on_conflict_do_update(
+                    index_elements=['period', 'bucket_start', source.type_column, 'cohort'],
+                    set_={
+                        source.count_column: rollup.c[source.count_column] + insert.excluded[source.count_column],
+                        source.value_column: rollup.c[source.value_column] + insert.excluded[source.value_column],
+                    }
+                ),
+                [
+                    {
+                        'period': period, 'bucket_start': start, source.type_column: row_type, 'cohort': row_cohort,
+                        source.count_column: rows_count, source.value_column: value
+                    }
+                    for (period, start, row_type, row_cohort), (rows_count, value) in totals.items()
+                ]
+            )
+
+        watermark = RollupWatermark.__table__
+        insert = cls._insert(session, watermark)
+        now = datetime.datetime.utcnow()
+        session.execute(
+            insert.values(source=source.name, last_id=up_to_id, updated_at=now).on_conflict_do_update(
+                index_elements=['source'], set_={'last_id': up_to_id, 'updated_at': now}
+            )
+        )
+        return count
+
+    @classmethod
+    def totals(cls, source, since=None):
+        """Return {type: (count, sum)} from the daily rollups plus the rows not rolled up yet.
+
+        since is a date; the daily rollups count whole days.
+        """
+        rollup = source.rollup
+        table = source.table
+        start = datetime.datetime.combine(since, datetime.time()) if since is not None else None
+        totals = {}
+        with session_scope() as session:
+            query = select(
+                rollup.c[source.type_column], func.sum(rollup.c[source.count_column]), func.sum(rollup.c[source.value_column])
+            ).where(rollup.c.period == 'day').group_by(rollup.c[source.type_column])
+            if start is not None:
+                query = query.where(rollup.c.bucket_start >= start)
+            rolled = session.execute(query).all()
+
+            # Rows above the watermark are few: at most one job interval
+            tail = select(
+                table.c[source.type_column], func.count(), func.sum(table.c[source.value_column])
+            ).where(table.c.id > cls.watermark(session, source)).group_by(table.c[source.type_column])
+            if start is not None:
+                tail = tail.where(table.c[source.timestamp] >= start)
+            for row_type, rows_count, value in rolled + session.execute(tail).all():
+                previous = totals.get(row_type, (0, 0))
+                totals[row_type] = (previous[0] + (rows_count or 0), previous[1] + (value or 0))
+        return totals
+
+    @classmethod
+    async def rollup_job(cls, context=None):
+        """Job queue callback"""
+        try:
+            processed = await asyncio.to_thread(cls.run)
+            logger.info(f"Rolled up {processed}")
+        except Exception as e:
+            logger.error(f"Error updating rollups: {e}")
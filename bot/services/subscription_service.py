@@ -1,25 +1,30 @@
 import datetime
 from sqlalchemy import and_, or_
 from database.db import get_session
-from database.models import User, Subscription, SubscriptionPlan, Transaction
+from database.models import User, Subscription, SubscriptionPlan, Transaction, Entitlement
+from common.cache import TTLCache
+from bot.services.records import PlanRecord, select_records, fetch_records
+from bot.services.ledger_service import LedgerService
 from bot.services.telegram_stars_service import TelegramStarsService
 import logging
 
 logger = logging.getLogger(__name__)
 
 class SubscriptionService:
+    # Entitlements read on every message {(user_id, plan_type): (daily_limit, subscription_id, expires_at)}
+    _entitlement_cache = TTLCache(max_size=10000, ttl=60)
+    
     @staticmethod
     async def get_all_subscription_plans(plan_type=None):
-        """Get all available subscription plans"""
+        """Get all available subscription plans as read-only PlanRecord tuples"""
         session = get_session()
         try:
-            query = session.query(SubscriptionPlan).filter(SubscriptionPlan.is_active == True)
+            statement = select_records(PlanRecord).where(SubscriptionPlan.is_active == True)
             
             if plan_type:
-                query = query.filter(SubscriptionPlan.plan_type == plan_type)
+                statement = statement.where(SubscriptionPlan.plan_type == plan_type)
                 
-            plans = query.order_by(SubscriptionPlan.stars_cost).all()
-            return plans
+            return fetch_records(session, PlanRecord, statement.order_by(SubscriptionPlan.stars_cost))
         finally:
             session.close()
     
@@ -58,10 +63,12 @@ class SubscriptionService:
                 return False, "Plan not found or inactive"
             
             # Get the user
-            user = session.query(User).get(user_id)
-            if not user:
+            if not session.query(User.id).filter(User.id == user_id).scalar():
                 return False, "User not found"
             
+            # Internal stars are charged unless the plan is paid with Telegram Stars
+            internal = True
+            
             # Check if Telegram Stars integration is enabled
             if telegram_id:
                 # Try to check Telegram Stars balance
@@ -80,28 +87,25 @@ class SubscriptionService:
                         # В реальном приложении здесь должен быть вызов API для списания звезд
                         # Для полной интеграции нужно использовать sendInvoice с currency="XTR"
                         logger.info(f"Creating Telegram Stars invoice for subscription: {title}, {plan.stars_cost} stars")
-                    else:
-                        # Fall back to internal stars system
-                        if user.stars < plan.stars_cost:
-                            return False, "Not enough stars"
-                        
-                        # Deduct stars from internal system
-                        user.stars -= plan.stars_cost
+                        internal = False
                 except Exception as e:
-                    logger.error(f"Error checking Telegram Stars balance: {str(e)}")
                     # Fall back to internal stars system
-                    if user.stars < plan.stars_cost:
-                        return False, "Not enough stars"
-                    
-                    # Deduct stars from internal system
-                    user.stars -= plan.stars_cost
-            else:
-                # Use internal stars system
-                if user.stars < plan.stars_cost:
+                    logger.error(f"Error checking Telegram Stars balance: {str(e)}")
+            
+            transaction_description = f"Subscription to {plan.name} ({plan.plan_type})"
+            if internal:
+                # Deduct stars from internal system in the same transaction as the subscription
+                if LedgerService.apply(session, user_id, -plan.stars_cost, transaction_description, "subscription") is None:
+                    session.rollback()
                     return False, "Not enough stars"
-                
-                # Deduct stars from internal system
-                user.stars -= plan.stars_cost
+            else:
+                # Paid outside the internal balance, recorded for history only
+                session.add(Transaction(
+                    user_id=user_id,
+                    amount=-plan.stars_cost,
+                    description=transaction_description,
+                    transaction_type="telegram_stars_subscription"
+                ))
             
             # Calculate end date
             start_date = datetime.datetime.utcnow()
@@ -116,16 +120,11 @@ class SubscriptionService:
                 is_active=True
             )
             
-            # Record transaction
-            transaction = Transaction(
-                user_id=user_id,
-                amount=-plan.stars_cost,
-                description=f"Subscription to {plan.name} ({plan.plan_type})",
-                transaction_type="subscription"
-            )
-            
-            session.add_all([subscription, transaction])
+            session.add(subscription)
+            session.flush()
+            SubscriptionService._refresh_entitlement(session, user_id, plan.plan_type)
             session.commit()
+            SubscriptionService._entitlement_cache.pop((user_id, plan.plan_type))
             
             return True, f"Successfully subscribed to {plan.name} until {end_date.strftime('%Y-%m-%d')}"
         except Exception as e:
@@ -134,46 +133,126 @@ class SubscriptionService:
         finally:
             session.close()
     
+    @staticmethod
+    def _refresh_entitlement(session, user_id, plan_type, now=None):
+        """Recompute the entitlement of a user for a plan type from the active subscriptions"""
+        now = now or datetime.datetime.utcnow()
+        subscriptions = session.query(Subscription.id, Subscription.end_date, SubscriptionPlan.daily_limit).join(SubscriptionPlan).filter(
+            Subscription.user_id == user_id,
+            Subscription.is_active == True,
+            Subscription.end_date > now,
+            SubscriptionPlan.plan_type == plan_type
+        ).all()
+        entitlement = session.query(Entitlement).filter(
+            Entitlement.user_id == user_id,
+            Entitlement.plan_type == plan_type
+        ).first()
+        
+        if not subscriptions:
+            if entitlement:
+                session.delete(entitlement)
+            return None
+        
+        # Unlimited wins, otherwise the highest daily limit
+        best = max(subscriptions, key=lambda sub: (sub.daily_limit == -1, sub.daily_limit))
+        if not entitlement:
+            entitlement = Entitlement(user_id=user_id, plan_type=plan_type)
+            session.add(entitlement)
+        entitlement.daily_limit = best.daily_limit
+        entitlement.unlimited = best.daily_limit == -1
+        entitlement.subscription_id = best.id
+        # Recompute again as soon as any of the subscriptions ends
+        entitlement.expires_at = min(sub.end_date for sub in subscriptions)
+        return entitlement
+    
     @staticmethod
     async def check_subscription_limit(user_id, message_type):
-        """Check if a user has an active subscription with available limits"""
+        """Check if a user has an active subscription with available limits
+        
+        Returns (has_subscription, daily_limit, subscription_id), daily_limit is -1 for unlimited.
+        """
+        now = datetime.datetime.utcnow()
+        
+        # Determine plan type based on message type
+        plan_type = 'text' if message_type in ['text', 'voice'] else 'image'
+        key = (user_id, plan_type)
+        
+        entry = SubscriptionService._entitlement_cache.get(key)
+        if entry is None or (entry[2] is not None and entry[2] <= now):
+            session = get_session()
+            try:
+                entitlement = session.query(Entitlement).filter(
+                    Entitlement.user_id == user_id,
+                    Entitlement.plan_type == plan_type
+                ).first()
+                
+                # The sweeper has not reached this one yet
+                if entitlement and entitlement.expires_at <= now:
+                    entitlement = SubscriptionService._refresh_entitlement(session, user_id, plan_type, now)
+                    session.commit()
+                
+                if entitlement:
+                    entry = (-1 if entitlement.unlimited else entitlement.daily_limit, entitlement.subscription_id, entitlement.expires_at)
+                else:
+                    entry = (0, None, None)
+                SubscriptionService._entitlement_cache.set(key, entry)
+            except Exception:
+                session.rollback()
+                raise
+            finally:
+                session.close()
+        
+        best_limit, subscription_id, _ = entry
+        if best_limit == -1:  # Unlimited
+            return True, -1, subscription_id
+        elif best_limit > 0:
+            return True, best_limit, subscription_id
+        else:
+            return False, 0, None
+    
+    @staticmethod
+    async def expire_subscriptions():
+        """Deactivate ended subscriptions and recompute the entitlements they affected"""
         session = get_session()
         try:
             now = datetime.datetime.utcnow()
+            ended = Subscription.is_active == True, Subscription.end_date <= now
+            expired = set(session.query(Subscription.user_id, SubscriptionPlan.plan_type).join(SubscriptionPlan).filter(*ended).distinct().all())
+            expired.update(session.query(Entitlement.user_id, Entitlement.plan_type).filter(Entitlement.expires_at <= now).all())
+            session.query(Subscription).filter(*ended).update({Subscription.is_active: False}, synchronize_session=False)
             
-            # Determine plan type based on message type
-            plan_type = 'text' if message_type in ['text', 'voice'] else 'image'
+            for user_id, plan_type in expired:
+                SubscriptionService._refresh_entitlement(session, user_id, plan_type, now)
+            session.commit()
             
-            # Get active subscriptions
-            subscriptions = session.query(Subscription).join(SubscriptionPlan).filter(
-                Subscription.user_id == user_id,
+            for key in expired:
+                SubscriptionService._entitlement_cache.pop(tuple(key))
+            return len(expired)
+        except Exception as e:
+            session.rollback()
+            logger.error(f"Error expiring subscriptions: {str(e)}")
+            return 0
+        finally:
+            session.close()
+    
+    @staticmethod
+    async def rebuild_entitlements():
+        """Recompute all entitlements from the active subscriptions"""
+        session = get_session()
+        try:
+            now = datetime.datetime.utcnow()
+            keys = set(session.query(Subscription.user_id, SubscriptionPlan.plan_type).join(SubscriptionPlan).filter(
                 Subscription.is_active == True,
-                Subscription.end_date > now,
-                SubscriptionPlan.plan_type == plan_type
-            ).all()
-            
-            if not subscriptions:
-                return False, 0, None
-            
-            # Find the best subscription (unlimited or highest daily limit)
-            best_subscription = None
-            best_limit = 0
-            
-            for sub in subscriptions:
-                if sub.plan.daily_limit == -1:  # Unlimited
-                    best_subscription = sub
-                    best_limit = -1
-                    break
-                elif sub.plan.daily_limit > best_limit:
-                    best_subscription = sub
-                    best_limit = sub.plan.daily_limit
-            
-            if best_limit == -1:  # Unlimited
-                return True, -1, best_subscription
-            elif best_limit > 0:
-                return True, best_limit, best_subscription
-            else:
-                return False, 0, None
+                Subscription.end_date > now
+            ).distinct().all())
+            keys.update(session.query(Entitlement.user_id, Entitlement.plan_type).all())
+            for user_id, plan_type in keys:
+                SubscriptionService._refresh_entitlement(session, user_id, plan_type, now)
+            session.commit()
+            SubscriptionService._entitlement_cache.clear()
+        except Exception as e:
+            session.rollback()
+            logger.error(f"Error rebuilding entitlements: {str(e)}")
         finally:
             session.close()
     
@@ -250,7 +329,10 @@ class SubscriptionService:
             )
             
             session.add_all([subscription, transaction])
+            session.flush()
+            SubscriptionService._refresh_entitlement(session, user_id, plan.plan_type)
             session.commit()
+            SubscriptionService._entitlement_cache.pop((user_id, plan.plan_type))
             
             logger.info(f"User {user_id} (Telegram ID: {telegram_id}) successfully subscribed to plan {plan.name} until {end_date.strftime('%Y-%m-%d')}")
             
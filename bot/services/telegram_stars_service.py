@@ -7,6 +7,8 @@ from telethon.tl.functions.payments import GetStarsTopupOptionsRequest, GetStars
 from telethon.tl.types import InputPeerSelf, InputPeerUser, InputPeerChannel
 from telethon.errors import FloodWaitError, UnauthorizedError, BadRequestError
 
+from common.cache import TTLCache
+from common.telethon_manager import get_manager
 from bot.utils.config_manager import config
 from bot.utils.error_handler import ErrorHandler
 
@@ -16,13 +18,14 @@ class TelegramStarsService:
     """Service for working with Telegram Stars API"""
     
     _client = None
-    _balance_cache = {}  # Cache for stars balance {user_id: {'balance': value, 'timestamp': time}}
+    _manager = None
     _cache_ttl = 60  # Cache TTL in seconds
+    _balance_cache = TTLCache(max_size=10000, ttl=_cache_ttl)  # Cache for stars balance {user_id: result}
     
     @classmethod
-    async def _get_client(cls):
-        """Get or create Telethon client"""
-        if cls._client is None or not cls._client.is_connected():
+    def _get_manager(cls):
+        """Get the process-wide Telethon manager (shared with app/ by session name)"""
+        if cls._manager is None:
             api_id = int(config.get('TELEGRAM_API_ID', '0'))
             api_hash = config.get('TELEGRAM_API_HASH', '')
             bot_token = config.get('TELEGRAM_BOT_TOKEN', '')
@@ -31,18 +34,30 @@ class TelegramStarsService:
                 logger.error("Missing Telegram API credentials. Please set TELEGRAM_API_ID, TELEGRAM_API_HASH, and TELEGRAM_BOT_TOKEN in .env file.")
                 return None
             
-            try:
-                # Create the client and connect
-                cls._client = TelegramClient('telegram_stars_session', api_id, api_hash)
-                await cls._client.start(bot_token=bot_token)
-                logger.info("Telethon client started successfully")
-            except Exception as e:
-                logger.error(f"Error initializing Telethon client: {str(e)}")
-                logger.error(traceback.format_exc())
-                return None
+            cls._manager = get_manager(api_id, api_hash, bot_token, 'telegram_stars_session')
+        return cls._manager
+    
+    @classmethod
+    async def _get_client(cls):
+        """Get connected Telethon client"""
+        manager = cls._get_manager()
+        if manager is None:
+            return None
+        
+        try:
+            cls._client = await manager.get_client()
+        except Exception as e:
+            logger.error(f"Error initializing Telethon client: {str(e)}")
+            logger.error(traceback.format_exc())
+            return None
         
         return cls._client
     
+    @classmethod
+    async def _request(cls, request):
+        """Send a request through the manager, waiting out FloodWait globally"""
+        return await cls._get_manager().run(lambda client: client(request))
+    
     @classmethod
     @ErrorHandler.log_exceptions
     async def get_stars_topup_options(cls):
@@ -54,7 +69,7 @@ class TelegramStarsService:
         
         try:
             # Try to get stars topup options
-            result = await client(GetStarsTopupOptionsRequest())
+            result = await cls._request(GetStarsTopupOptionsRequest())
             logger.info(f"Got stars topup options: {result}")
             return result
         except FloodWaitError as e:
@@ -75,12 +90,22 @@ class TelegramStarsService:
         logger = logging.getLogger(__name__)
         
         # Check cache first
-        if user_id in cls._balance_cache:
-            cache_entry = cls._balance_cache[user_id]
-            if time.time() - cache_entry['timestamp'] < cls._cache_ttl:
-                logger.info(f"Using cached stars balance for user {user_id}: {cache_entry['balance']}")
-                return cache_entry['result']
+        cached = cls._balance_cache.get(user_id)
+        if cached is not None:
+            logger.info(f"Using cached stars balance for user {user_id}: {getattr(cached, 'balance', 'N/A')}")
+            return cached
+        
+        manager = cls._get_manager()
+        if manager is None:
+            logger.error("Failed to get Telethon client for getting stars balance")
+            return None
         
+        # Concurrent lookups for the same user share one request
+        return await manager.coalesce(("stars_balance", user_id), lambda: cls._load_stars_balance(user_id))
+    
+    @classmethod
+    async def _load_stars_balance(cls, user_id):
+        """Request user's stars balance and cache it"""
         client = await cls._get_client()
         if not client:
             logger.error("Failed to get Telethon client for getting stars balance")
@@ -105,11 +130,7 @@ class TelegramStarsService:
                 result.balance = internal_stars
                 
                 # Кэшируем результат
-                cls._balance_cache[user_id] = {
-                    'result': result,
-                    'balance': result.balance,
-                    'timestamp': time.time()
-                }
+                cls._balance_cache[user_id] = result
                 
                 logger.info(f"Using internal stars balance for user {user_id}: {result.balance}")
                 return result
@@ -118,14 +139,10 @@ class TelegramStarsService:
                 # For user accounts, try with InputPeerSelf first
                 try:
                     logger.info(f"Trying to get stars balance for user {user_id} using InputPeerSelf")
-                    result = await client(GetStarsStatusRequest(peer=InputPeerSelf()))
+                    result = await cls._request(GetStarsStatusRequest(peer=InputPeerSelf()))
                     
                     # Cache the result
-                    cls._balance_cache[user_id] = {
-                        'result': result,
-                        'balance': result.balance if hasattr(result, 'balance') else 0,
-                        'timestamp': time.time()
-                    }
+                    cls._balance_cache[user_id] = result
                     
                     logger.info(f"Got stars balance for user {user_id} using InputPeerSelf: {result.balance if hasattr(result, 'balance') else 'N/A'}")
                     return result
@@ -135,7 +152,7 @@ class TelegramStarsService:
                     # Then try with InputPeerUser
                     try:
                         logger.info(f"Trying to get stars balance for user {user_id} using InputPeerUser")
-                        entity = await client.get_entity(user_id)
+                        entity = await cls._get_manager().run(lambda c: c.get_entity(user_id))
                         if hasattr(entity, 'access_hash'):
                             peer = InputPeerUser(user_id=user_id, access_hash=entity.access_hash)
                             logger.info(f"Got access_hash for user {user_id}: {entity.access_hash}")
@@ -143,14 +160,10 @@ class TelegramStarsService:
                             peer = InputPeerUser(user_id=user_id, access_hash=0)
                             logger.warning(f"Could not get access_hash for user {user_id}, using 0")
                         
-                        result = await client(GetStarsStatusRequest(peer=peer))
+                        result = await cls._request(GetStarsStatusRequest(peer=peer))
                         
                         # Cache the result
-                        cls._balance_cache[user_id] = {
-                            'result': result,
-                            'balance': result.balance if hasattr(result, 'balance') else 0,
-                            'timestamp': time.time()
-                        }
+                        cls._balance_cache[user_id] = result
                         
                         logger.info(f"Got stars balance for user {user_id} using InputPeerUser: {result.balance if hasattr(result, 'balance') else 'N/A'}")
                         return result
@@ -185,7 +198,7 @@ class TelegramStarsService:
             # Try with InputPeerSelf first
             try:
                 logger.info(f"Trying to get stars transactions for user {user_id} using InputPeerSelf")
-                result = await client(GetStarsTransactionsRequest(
+                result = await cls._request(GetStarsTransactionsRequest(
                     peer=InputPeerSelf(),
                     limit=limit
                 ))
@@ -197,7 +210,7 @@ class TelegramStarsService:
             # Then try with InputPeerUser
             try:
                 logger.info(f"Trying to get stars transactions for user {user_id} using InputPeerUser")
-                result = await client(GetStarsTransactionsRequest(
+                result = await cls._request(GetStarsTransactionsRequest(
                     peer=InputPeerUser(user_id=user_id, access_hash=0),
                     limit=limit
                 ))
@@ -439,16 +452,20 @@ class TelegramStarsService:
             user_id: Telegram user ID or None to invalidate all cache
         """
         if user_id is None:
-            cls._balance_cache = {}
+            cls._balance_cache.clear()
             logger.info("Invalidated all stars balance cache")
-        elif user_id in cls._balance_cache:
-            del cls._balance_cache[user_id]
+        elif cls._balance_cache.pop(user_id) is not None:
             logger.info(f"Invalidated stars balance cache for user {user_id}")
     
+    @classmethod
+    def cache_stats(cls):
+        """Hit/miss/eviction statistics of the stars balance cache"""
+        return cls._balance_cache.stats()
+    
     @classmethod
     async def close_client(cls):
         """Close Telethon client connection"""
-        if cls._client and cls._client.is_connected():
-            await cls._client.disconnect()
+        if cls._manager is not None:
+            await cls._manager.close()
             cls._client = None
             logger.info("Telethon client disconnected")
@@ -0,0 +1,158 @@
+import logging
+from sqlalchemy import text, func, or_, literal_column
+
+from database.db import engine
+from database.models import User
+from bot.services.records import UserRecord, select_records, fetch_records
+
+logger = logging.getLogger(__name__)
+
+# Name fields as one searchable string, same expression in the index and the query
+SEARCH_EXPRESSION = "coalesce(username, '') || ' ' || coalesce(first_name, '') || ' ' || coalesce(last_name, '')"
+
+POSTGRES_INDEX = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    f"CREATE INDEX IF NOT EXISTS ix_users_search_trgm ON users USING gin (({SEARCH_EXPRESSION}) gin_trgm_ops)",
+]
+
+# External content FTS5 table over users, kept in sync by triggers so bulk
+# Core UPDATEs (IdentityService.flush) are indexed too
+SQLITE_INDEX = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS users_fts USING fts5("
+    "username, first_name, last_name, content='users', content_rowid='id', tokenize='trigram')",
+    "CREATE TRIGGER IF NOT EXISTS users_fts_insert AFTER INSERT ON users BEGIN "
+    "INSERT INTO users_fts(rowid, username, first_name, last_name) "
+    "VALUES (new.id, new.username, new.first_name, new.last_name); END",
+    "CREATE TRIGGER IF NOT EXISTS users_fts_delete AFTER DELETE ON users BEGIN "
+    "INSERT INTO users_fts(users_fts, rowid, username, first_name, last_name) "
+    "VALUES ('delete', old.id, old.username, old.first_name, old.last_name); END",
+    "CREATE TRIGGER IF NOT EXISTS users_fts_update AFTER UPDATE OF username, first_name, last_name ON users BEGIN "
+    "INSERT INTO users_fts(users_fts, rowid, username, first_name, last_name) "
+    "VALUES ('delete', old.id, old.username, old.first_name, old.last_name); "
+    "INSERT INTO users_fts(rowid, username, first_name, last_name) "
+    "VALUES (new.id, new.username, new.first_name, new.last_name); END",
+]
+
+# Trigram indexes cannot serve shorter substrings
+MIN_INDEXED_LENGTH = 3
+
+class UserSearch:
+    """Ranked, paginated user search backed by a trigram index.
+
+    PostgreSQL uses a pg_trgm GIN index and ranks by similarity(); SQLite
+    uses an FTS5 trigram table and ranks by bm25(). A numeric query is first
+    looked up as telegram_id through its unique index. Without the index
+    (pg_trgm needs a privileged role, FTS5 may be compiled out) searches
+    fall back to a LIKE scan.
+    """
+
+    _indexed = {}  # {dialect name: whether the search index exists}
+
+    @classmethod
+    def ensure_index(cls, bind=None):
+        """Create the search index if it does not exist yet"""
+        bind = bind or engine
+        dialect = bind.dialect.name
+        if dialect == 'postgresql':
+            statements = POSTGRES_INDEX
+        elif dialect == 'sqlite':
+            statements = SQLITE_INDEX
+        else:
+            logger.warning(f"No user search index for {dialect}, searches will scan the users table")
+            cls._indexed[dialect] = False
+            return False
+
+        try:
+            with bind.begin() as connection:
+                created = dialect == 'sqlite' and not connection.execute(
+                    text("SELECT 1 FROM sqlite_master WHERE name = 'users_fts'")
+                ).scalar()
+                for statement in statements:
+                    connection.execute(text(statement))
+                if created:
+                    # Index users that existed before the table
+                    connection.execute(text("INSERT INTO users_fts(users_fts) VALUES ('rebuild')"))
+        except Exception:
+            cls._indexed[dialect] = False
+            raise
+        cls._indexed[dialect] = True
+        return True
+
+    @classmethod
+    def has_index(cls, session, dialect):
+        """Whether the search index exists; looked up once if ensure_index did not run"""
+        if dialect not in cls._indexed:
+            if dialect == 'postgresql':
+                exists = session.execute(text("SELECT to_regclass('ix_users_search_trgm') IS NOT NULL")).scalar()
+            elif dialect == 'sqlite':
+                exists = session.execute(text("SELECT 1 FROM sqlite_master WHERE name = 'users_fts'")).scalar()
+            else:
+                exists = False
+            cls._indexed[dialect] = bool(exists)
+            if not exists:
+                logger.warning(f"No user search index for {dialect}, searches will scan the users table")
+        return cls._indexed[dialect]
+
+    @staticmethod
+    def normalize(query):
+        return (query or '').strip().lstrip('@').strip()
+
+    @classmethod
+    def search(cls, session, query, limit=20, offset=0):
+        """Return one page of matching users as UserRecord tuples, best match first"""
+        query = cls.normalize(query)
+        if not query:
+            return []
+
+        if query.isdigit():
+            by_id = fetch_records(session, UserRecord, select_records(UserRecord).where(User.telegram_id == query))
+            if by_id:
+                return by_id if offset == 0 else []
+
+        dialect = session.get_bind().dialect.name
+        if dialect in ('sqlite', 'postgresql') and cls.has_index(session, dialect):
+            if dialect == 'sqlite' and len(query) >= MIN_INDEXED_LENGTH:
+                return cls._search_fts5(session, query, limit, offset)
+            if dialect == 'postgresql':
+                return cls._search_trigram(session, query, limit, offset)
+        return cls._search_like(session, query, limit, offset)
+
+    @staticmethod
+    def _like_pattern(query):
+        escaped = query.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        return f"%{escaped}%"
+
+    @classmethod
+    def _search_trigram(cls, session, query, limit, offset):
+        searchable = literal_column(f"({SEARCH_EXPRESSION})")
+        statement = select_records(UserRecord).where(
+            searchable.ilike(cls._like_pattern(query), escape='\\')
+        ).order_by(
+            func.coalesce(func.lower(User.username) == query.lower(), False).desc(),
+            func.similarity(searchable, query).desc(),
+            User.id
+        ).limit(limit).offset(offset)
+        return fetch_records(session, UserRecord, statement)
+
+    @staticmethod
+    def _search_fts5(session, query, limit, offset):
+        columns = ', '.join(f"users.{name}" for name in UserRecord._fields)
+        # Quoted as one FTS5 string so the query is matched as a substring
+        phrase = '"' + query.replace('"', '""') + '"'
+        rows = session.execute(text(
+            f"SELECT {columns} FROM users_fts JOIN users ON users.id = users_fts.rowid "
+            "WHERE users_fts MATCH :phrase "
+            "ORDER BY lower(users.username) = lower(:query) DESC, bm25(users_fts), users.id "
+            "LIMIT :limit OFFSET :offset"
+        ), {'phrase': phrase, 'query': query, 'limit': limit, 'offset': offset})
+        return [UserRecord._make(row) for row in rows]
+
+    @classmethod
+    def _search_like(cls, session, query, limit, offset):
+        pattern = cls._like_pattern(query)
+        statement = select_records(UserRecord).where(or_(
+            User.username.ilike(pattern, escape='\\'),
+            User.first_name.ilike(pattern, escape='\\'),
+            User.last_name.ilike(pattern, escape='\\')
+        )).order_by(User.id).limit(limit).offset(offset)
+        return fetch_records(session, UserRecord, statement)
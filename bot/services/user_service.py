@@ -1,135 +1,30 @@
 import datetime
-import random
-import string
 import logging
-from sqlalchemy import func
+from sqlalchemy import func, update
 from sqlalchemy.exc import SQLAlchemyError
 from database.db import get_session
-from database.models import User, UserLimit, Transaction, MessageLog
+from database.models import User, UserLimit
 from config.config import FREE_TEXT_MESSAGES_LIMIT, FREE_IMAGE_GENERATION_LIMIT, FREE_VOICE_MESSAGES_LIMIT, REFERRAL_REWARD_STARS, DAILY_FREE_MESSAGES
-from bot.utils.session_utils import session_scope, with_session
+from bot.utils.session_utils import with_session
+from bot.services.message_log_buffer import MessageLogBuffer
+from bot.services.identity_service import IdentityService
+from bot.services.ledger_service import LedgerService
+from bot.services.records import UserRecord, select_records, fetch_records, stream_records
 
 logger = logging.getLogger(__name__)
 
 class UserService:
     @staticmethod
-    @with_session
-    async def get_or_create_user_id(telegram_id, username=None, first_name=None, last_name=None, session=None):
-        """Get an existing user ID or create a new user and return its ID"""
-        try:
-            user = session.query(User).filter(User.telegram_id == str(telegram_id)).first()
-            
-            if not user:
-                # Generate a unique referral code
-                referral_code = UserService._generate_referral_code()
-                
-                # Create a new user
-                user = User(
-                    telegram_id=str(telegram_id),
-                    username=username,
-                    first_name=first_name,
-                    last_name=last_name,
-                    referral_code=referral_code
-                )
-                session.add(user)
-                session.flush()  # Flush to get the user ID
-                
-                # Get free message limits from admin settings
-                from bot.services.admin_service import AdminService
-                free_text_messages = int(await AdminService.get_setting('FREE_TEXT_MESSAGES_LIMIT', FREE_TEXT_MESSAGES_LIMIT))
-                free_image_generations = int(await AdminService.get_setting('FREE_IMAGE_GENERATION_LIMIT', FREE_IMAGE_GENERATION_LIMIT))
-                
-                # Create user limits
-                user_limits = UserLimit(
-                    user_id=user.id,
-                    text_messages_limit=free_text_messages,
-                    image_generations_limit=free_image_generations,
-                    voice_messages_limit=FREE_VOICE_MESSAGES_LIMIT
-                )
-                session.add(user_limits)
-                session.commit()
-                return user.id
-            else:
-                # Update user information if changed
-                if username and user.username != username:
-                    user.username = username
-                if first_name and user.first_name != first_name:
-                    user.first_name = first_name
-                if last_name and user.last_name != last_name:
-                    user.last_name = last_name
-                
-                # Update last activity
-                user.last_activity = datetime.datetime.utcnow()
-                
-                # Get the user ID before closing the session
-                user_id = user.id
-                session.commit()
-                return user_id
-        except Exception as e:
-            session.rollback()
-            raise e
+    async def get_or_create_user_id(telegram_id, username=None, first_name=None, last_name=None):
+        """Get an existing user ID or create a new user and return its ID (cached, see IdentityService)"""
+        return await IdentityService.resolve(telegram_id, username, first_name, last_name)
     
     @staticmethod
     @with_session
     async def get_or_create_user(telegram_id, username=None, first_name=None, last_name=None, session=None):
         """Get an existing user or create a new one"""
-        try:
-            user = session.query(User).filter(User.telegram_id == str(telegram_id)).first()
-            
-            if not user:
-                # Generate a unique referral code
-                referral_code = UserService._generate_referral_code()
-                
-                # Create a new user
-                user = User(
-                    telegram_id=str(telegram_id),
-                    username=username,
-                    first_name=first_name,
-                    last_name=last_name,
-                    referral_code=referral_code
-                )
-                session.add(user)
-                session.flush()  # Flush to get the user ID
-                
-                # Create user limits
-                user_limits = UserLimit(
-                    user_id=user.id,
-                    text_messages_limit=FREE_TEXT_MESSAGES_LIMIT,
-                    image_generations_limit=FREE_IMAGE_GENERATION_LIMIT,
-                    voice_messages_limit=FREE_VOICE_MESSAGES_LIMIT
-                )
-                session.add(user_limits)
-                session.commit()
-            else:
-                # Update user information if changed
-                if username and user.username != username:
-                    user.username = username
-                if first_name and user.first_name != first_name:
-                    user.first_name = first_name
-                if last_name and user.last_name != last_name:
-                    user.last_name = last_name
-                
-                # Update last activity
-                user.last_activity = datetime.datetime.utcnow()
-                session.commit()
-            
-            return user
-        except Exception as e:
-            session.rollback()
-            raise e
-    
-    @staticmethod
-    def _generate_referral_code(length=8):
-        """Generate a unique referral code"""
-        with session_scope() as session:
-            while True:
-                # Generate a random code
-                code = ''.join(random.choices(string.ascii_uppercase + string.digits, k=length))
-                
-                # Check if the code already exists
-                existing = session.query(User).filter(User.referral_code == code).first()
-                if not existing:
-                    return code
+        user_id = await IdentityService.resolve(telegram_id, username, first_name, last_name)
+        return session.query(User).get(user_id)
     
     @staticmethod
     @with_session
@@ -144,34 +39,19 @@ class UserService:
             if not referrer or referrer.id == user_id:
                 return False
             
-            # Get the referred user
-            user = session.query(User).get(user_id)
-            if not user or user.referrer_id:
-                return False  # User already has a referrer
-            
-            # Update the referred user
-            user.referrer_id = referrer.id
-            
-            # Add stars to both users
-            user.stars += REFERRAL_REWARD_STARS
-            referrer.stars += REFERRAL_REWARD_STARS
-            
-            # Record transactions
-            user_transaction = Transaction(
-                user_id=user.id,
-                amount=REFERRAL_REWARD_STARS,
-                description=f"Referral bonus for using code {referral_code}",
-                transaction_type="referral_reward"
-            )
-            
-            referrer_transaction = Transaction(
-                user_id=referrer.id,
-                amount=REFERRAL_REWARD_STARS,
-                description=f"Referral bonus for user {user.telegram_id} using your code",
-                transaction_type="referral_reward"
-            )
+            # Set the referrer only once, even for concurrent updates of the same user
+            telegram_id = session.execute(
+                update(User.__table__).where(
+                    User.__table__.c.id == user_id,
+                    User.__table__.c.referrer_id.is_(None)
+                ).values(referrer_id=referrer.id).returning(User.__table__.c.telegram_id)
+            ).scalar()
+            if telegram_id is None:
+                return False  # Unknown user or user already has a referrer
             
-            session.add_all([user_transaction, referrer_transaction])
+            # Add stars to both users in the same transaction
+            LedgerService.apply(session, user_id, REFERRAL_REWARD_STARS, f"Referral bonus for using code {referral_code}", "referral_reward")
+            LedgerService.apply(session, referrer.id, REFERRAL_REWARD_STARS, f"Referral bonus for user {telegram_id} using your code", "referral_reward")
             session.commit()
             
             return True
@@ -216,24 +96,27 @@ class UserService:
                 if has_subscription:
                     total_limit += subscription_limit
                 
-                has_free_limit = user_limits.text_messages_used < total_limit
-                remaining = total_limit - user_limits.text_messages_used
+                used = user_limits.text_messages_used + MessageLogBuffer.pending_usage(user_id, 'text')
+                has_free_limit = used < total_limit
+                remaining = total_limit - used
             elif message_type == 'image':
                 # Calculate total limit (free + subscription)
                 total_limit = user_limits.image_generations_limit
                 if has_subscription:
                     total_limit += subscription_limit
                 
-                has_free_limit = user_limits.image_generations_used < total_limit
-                remaining = total_limit - user_limits.image_generations_used
+                used = user_limits.image_generations_used + MessageLogBuffer.pending_usage(user_id, 'image')
+                has_free_limit = used < total_limit
+                remaining = total_limit - used
             elif message_type == 'voice':
                 # Calculate total limit (free + subscription)
                 total_limit = user_limits.voice_messages_limit
                 if has_subscription:
                     total_limit += subscription_limit
                 
-                has_free_limit = user_limits.voice_messages_used < total_limit
-                remaining = total_limit - user_limits.voice_messages_used
+                used = user_limits.voice_messages_used + MessageLogBuffer.pending_usage(user_id, 'voice')
+                has_free_limit = used < total_limit
+                remaining = total_limit - used
             else:
                 return False, 0
             
@@ -244,46 +127,14 @@ class UserService:
             raise e
     
     @staticmethod
-    @with_session
-    async def update_user_usage(user_id, message_type, session=None):
-        """Update user usage after processing a message"""
-        try:
-            user_limits = session.query(UserLimit).filter(UserLimit.user_id == user_id).first()
-            
-            if not user_limits:
-                return
-            
-            # Update usage based on message type
-            if message_type == 'text':
-                user_limits.text_messages_used += 1
-            elif message_type == 'image':
-                user_limits.image_generations_used += 1
-            elif message_type == 'voice':
-                user_limits.voice_messages_used += 1
-            
-            session.commit()
-        except Exception as e:
-            session.rollback()
-            raise e
+    async def update_user_usage(user_id, message_type):
+        """Update user usage after processing a message (written by MessageLogBuffer)"""
+        MessageLogBuffer.add_usage(user_id, message_type)
     
     @staticmethod
-    @with_session
-    async def log_message(user_id, message_type, user_message, bot_response, tokens_used=0, session=None):
-        """Log a message exchange"""
-        try:
-            message_log = MessageLog(
-                user_id=user_id,
-                message_type=message_type,
-                user_message=user_message,
-                bot_response=bot_response,
-                tokens_used=tokens_used
-            )
-            
-            session.add(message_log)
-            session.commit()
-        except Exception as e:
-            session.rollback()
-            raise e
+    async def log_message(user_id, message_type, user_message, bot_response, tokens_used=0):
+        """Log a message exchange (written by MessageLogBuffer)"""
+        MessageLogBuffer.add_message(user_id, message_type, user_message, bot_response, tokens_used)
     
     @staticmethod
     @with_session
@@ -303,23 +154,10 @@ class UserService:
     async def use_stars(user_id, amount, description, session=None):
         """Use stars for a service"""
         try:
-            user = session.query(User).get(user_id)
-            
-            if not user or user.stars < amount:
+            # Deducted only if the balance covers it, see LedgerService
+            if LedgerService.apply(session, user_id, -amount, description, "usage") is None:
                 return False
             
-            # Deduct stars
-            user.stars -= amount
-            
-            # Record transaction
-            transaction = Transaction(
-                user_id=user_id,
-                amount=-amount,
-                description=description,
-                transaction_type="usage"
-            )
-            
-            session.add(transaction)
             session.commit()
             
             return True
@@ -332,23 +170,9 @@ class UserService:
     async def add_stars(user_id, amount, description, transaction_type="purchase", session=None):
         """Add stars to a user's account"""
         try:
-            user = session.query(User).get(user_id)
-            
-            if not user:
+            if LedgerService.apply(session, user_id, amount, description, transaction_type) is None:
                 return False
             
-            # Add stars
-            user.stars += amount
-            
-            # Record transaction
-            transaction = Transaction(
-                user_id=user_id,
-                amount=amount,
-                description=description,
-                transaction_type=transaction_type
-            )
-            
-            session.add(transaction)
             session.commit()
             
             return True
@@ -485,23 +309,9 @@ class UserService:
     async def add_stars(user_id, amount, session=None):
         """Add stars to a user's account"""
         try:
-            user = session.query(User).get(user_id)
-            
-            if not user:
+            if LedgerService.apply(session, user_id, amount, f"Admin added {amount} stars", "admin_add") is None:
                 return False
             
-            # Add stars
-            user.stars += amount
-            
-            # Record transaction
-            transaction = Transaction(
-                user_id=user.id,
-                amount=amount,
-                description=f"Admin added {amount} stars",
-                transaction_type="admin_add"
-            )
-            
-            session.add(transaction)
             session.commit()
             
             return True
@@ -535,10 +345,9 @@ class UserService:
     @staticmethod
     @with_session
     async def get_all_users(session=None):
-        """Get all users"""
+        """Get all users as read-only UserRecord tuples"""
         try:
-            users = session.query(User).all()
-            return users
+            return fetch_records(session, UserRecord, select_records(UserRecord).order_by(User.id))
         except Exception as e:
             session.rollback()
             raise e
@@ -546,11 +355,36 @@ class UserService:
     @staticmethod
     @with_session
     async def get_active_users(days=7, session=None):
-        """Get users active in the last X days"""
+        """Get users active in the last X days as read-only UserRecord tuples"""
         try:
             cutoff_date = datetime.datetime.utcnow() - datetime.timedelta(days=days)
-            active_users = session.query(User).filter(User.last_activity >= cutoff_date).all()
-            return active_users
+            return fetch_records(
+                session, UserRecord,
+                select_records(UserRecord).where(User.last_activity >= cutoff_date).order_by(User.id)
+            )
+        except Exception as e:
+            session.rollback()
+            raise e
+    
+    @staticmethod
+    def iter_users(active_days=None, batch_size=1000):
+        """Stream UserRecord tuples in id order without loading every user at once"""
+        statement = select_records(UserRecord)
+        if active_days is not None:
+            cutoff_date = datetime.datetime.utcnow() - datetime.timedelta(days=active_days)
+            statement = statement.where(User.last_activity >= cutoff_date)
+        return stream_records(UserRecord, statement, batch_size)
+    
+    @staticmethod
+    @with_session
+    async def count_users(active_days=None, session=None):
+        """Count users, optionally only those active in the last X days"""
+        try:
+            query = session.query(func.count(User.id))
+            if active_days is not None:
+                cutoff_date = datetime.datetime.utcnow() - datetime.timedelta(days=active_days)
+                query = query.filter(User.last_activity >= cutoff_date)
+            return query.scalar()
         except Exception as e:
             session.rollback()
             raise e
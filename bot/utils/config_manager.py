@@ -51,7 +51,33 @@ class ConfigManager:
         
         # Referral rewards
         self._config['REFERRAL_REWARD_STARS'] = int(os.getenv('REFERRAL_REWARD_STARS', '10'))
-        
+
+        # Write-behind buffer for message logs and usage counters
+        self._config['MESSAGE_LOG_FLUSH_MS'] = int(os.getenv('MESSAGE_LOG_FLUSH_MS', '500'))
+        self._config['MESSAGE_LOG_BATCH_SIZE'] = int(os.getenv('MESSAGE_LOG_BATCH_SIZE', '200'))
+
+        # Identity cache and buffered last_activity/profile writes
+        self._config['IDENTITY_CACHE_SIZE'] = int(os.getenv('IDENTITY_CACHE_SIZE', '50000'))
+        self._config['IDENTITY_FLUSH_SECONDS'] = int(os.getenv('IDENTITY_FLUSH_SECONDS', '30'))
+
+        # Stars balance snapshots for ledger verification
+        self._config['LEDGER_SNAPSHOT_SECONDS'] = int(os.getenv('LEDGER_SNAPSHOT_SECONDS', '3600'))
+
+        # Incremental usage and revenue rollups
+        self._config['ROLLUP_INTERVAL_SECONDS'] = int(os.getenv('ROLLUP_INTERVAL_SECONDS', '300'))
+        self._config['ROLLUP_LAG_SECONDS'] = int(os.getenv('ROLLUP_LAG_SECONDS', '60'))
+        self._config['ROLLUP_BATCH_SIZE'] = int(os.getenv('ROLLUP_BATCH_SIZE', '50000'))
+
+        # Rows per database fetch and per written chunk in exports
+        self._config['EXPORT_CHUNK_SIZE'] = int(os.getenv('EXPORT_CHUNK_SIZE', '1000'))
+
+        # Voice message guard (Whisper accepts files up to 25 MB)
+        self._config['MAX_VOICE_DURATION'] = int(os.getenv('MAX_VOICE_DURATION', '300'))
+        self._config['MAX_VOICE_FILE_SIZE'] = int(os.getenv('MAX_VOICE_FILE_SIZE', str(25 * 1024 * 1024)))
+
+        # Minimum seconds between edits of a streamed answer (Telegram rate limits message edits)
+        self._config['STREAM_EDIT_INTERVAL'] = float(os.getenv('STREAM_EDIT_INTERVAL', '1.0'))
+
         # Validate critical configuration
         self._validate_config()
     
@@ -0,0 +1,195 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Iterator, Optional
+
+_MISSING = object()
+
+class TTLCache:
+    """Ограниченный по размеру кэш с временем жизни записей.
+
+    Записи хранятся в порядке последнего обращения, при переполнении
+    вытесняется самая давняя. Просроченные записи удаляются при обращении и
+    фоновой очисткой раз в sweep_interval секунд. Если задан persist_path,
+    содержимое сохраняется в JSON-файл и загружается при создании, поэтому
+    переживает перезапуск (значения должны сериализоваться в JSON, ключи
+    восстанавливаются строками). Внутри event loop изменения копятся
+    persist_delay секунд и записываются одним файлом в отдельном потоке.
+    """
+    def __init__(self, max_size: int = 10000, ttl: float = 300, sweep_interval: float = 60, persist_path: Optional[str] = None,
+                 persist_delay: float = 1.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.sweep_interval = sweep_interval
+        self.persist_path = persist_path
+        self.persist_delay = persist_delay
+        # key -> (время истечения по time.time(), значение)
+        self._data: "OrderedDict[Hashable, tuple[float, Any]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._sweep_task = None
+        self._persist_task = None
+        self._persist_lock = asyncio.Lock()
+        self._dirty = False
+        if persist_path:
+            self._load()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._data.get(key, _MISSING)
+        if entry is _MISSING:
+            self.misses += 1
+            return default
+        expires, value = entry
+        if expires <= time.time():
+            del self._data[key]
+            self.expirations += 1
+            self.misses += 1
+            self._save()
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        self._data[key] = (time.time() + (self.ttl if ttl is None else ttl), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+            self.evictions += 1
+        self._save()
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._data.pop(key, _MISSING)
+        if entry is _MISSING:
+            return default
+        self._save()
+        return default if entry[0] <= time.time() else entry[1]
+
+    def clear(self):
+        self._data.clear()
+        self._save()
+
+    def __contains__(self, key: Hashable) -> bool:
+        entry = self._data.get(key)
+        return entry is not None and entry[0] > time.time()
+
+    def __getitem__(self, key: Hashable) -> Any:
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key: Hashable, value: Any):
+        self.set(key, value)
+
+    def __delitem__(self, key: Hashable):
+        if self.pop(key, _MISSING) is _MISSING:
+            raise KeyError(key)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __iter__(self) -> Iterator[Hashable]:
+        return iter(list(self._data))
+
+    def sweep(self) -> int:
+        """Удаляет просроченные записи, возвращает их число"""
+        now = time.time()
+        expired = [key for key, (expires, _) in self._data.items() if expires <= now]
+        for key in expired:
+            del self._data[key]
+        self.expirations += len(expired)
+        if expired:
+            self._save()
+        return len(expired)
+
+    async def _sweep_loop(self):
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            self.sweep()
+
+    def start(self):
+        if self._sweep_task is None:
+            self._sweep_task = asyncio.create_task(self._sweep_loop())
+
+    async def close(self):
+        if self._sweep_task is not None:
+            self._sweep_task.cancel()
+            self._sweep_task = None
+        await self.flush()
+        if self._persist_task is not None:
+            self._persist_task.cancel()
+            self._persist_task = None
+
+    async def flush(self):
+        """Записывает накопленные изменения на диск"""
+        async with self._persist_lock:
+            while self._dirty:
+                self._dirty = False
+                await asyncio.to_thread(self._write, self._entries())
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "size": len(self._data),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+    def _load(self):
+        try:
+            with open(self.persist_path, encoding="utf-8") as f:
+                entries = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            logging.error(f"Cache {self.persist_path} is not loaded: {e}")
+            return
+        now = time.time()
+        for key, expires, value in entries:
+            if expires > now:
+                self._data[key] = (expires, value)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+
+    def _save(self):
+        if not self.persist_path:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # Вне event loop (скрипты, тесты) пишем сразу
+            self._write(self._entries())
+            return
+        self._dirty = True
+        if self._persist_task is None:
+            self._persist_task = loop.create_task(self._persist_later())
+
+    async def _persist_later(self):
+        try:
+            await asyncio.sleep(self.persist_delay)
+            await self.flush()
+        except Exception as e:
+            logging.error(f"Cache {self.persist_path} is not saved: {e}")
+        finally:
+            self._persist_task = None
+
+    def _entries(self):
+        # Копия снимается в event loop, сериализация и запись идут в потоке
+        return [[key, expires, value] for key, (expires, value) in self._data.items()]
+
+    def _write(self, entries):
+        tmp_path = f"{self.persist_path}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(entries, f, ensure_ascii=False)
+            os.replace(tmp_path, self.persist_path)
+        except (OSError, TypeError, ValueError) as e:
+            logging.error(f"Cache {self.persist_path} is not saved: {e}")
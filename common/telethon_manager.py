@@ -0,0 +1,120 @@
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+from telethon import TelegramClient
+from telethon.errors import FloodWaitError
+
+class TelethonManagerError(Exception):
+    def __init__(self, msg: str = "Error"):
+        self.msg = msg
+    def output(self):
+        logging.error(f"Telethon manager error: {self.msg}")
+
+class TelethonManager:
+    """Одно подключение Telethon на процесс и планировщик запросов к нему.
+
+    Подключение устанавливается лениво и переподключается с экспоненциальной
+    задержкой. FloodWaitError от любого запроса останавливает все запросы
+    через этот клиент на e.seconds, после чего запрос повторяется (если ждать
+    не дольше max_flood_wait). Одновременные одинаковые запросы (например,
+    баланс одного пользователя) объединяются через coalesce. Диалоги вида
+    "отправить команду и прочитать ответ" держат chat_lock этого чата.
+    """
+    def __init__(self, api_id: int, api_hash: str, bot_token: Optional[str] = None, session: str = "telegram_stars_session",
+                 max_retries: int = 5, base_delay: float = 1, max_delay: float = 60, max_flood_wait: float = 300):
+        self.api_id = api_id
+        self.api_hash = api_hash
+        self.bot_token = bot_token
+        self.session = session
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_flood_wait = max_flood_wait
+        self.client: Optional[TelegramClient] = None
+        self.flood_until = 0.0
+        self._connect_lock = asyncio.Lock()
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+        self._chat_locks: Dict[Hashable, asyncio.Lock] = {}
+
+    def _backoff(self, attempt: int) -> float:
+        return min(self.max_delay, self.base_delay * 2 ** attempt)
+
+    async def _start(self):
+        if self.client is None:
+            self.client = TelegramClient(self.session, self.api_id, self.api_hash)
+        if self.bot_token:
+            await self.client.start(bot_token=self.bot_token)
+        else:
+            await self.client.start()
+
+    async def get_client(self) -> TelegramClient:
+        """Подключенный клиент, при обрыве переподключается с задержкой"""
+        if self.client is not None and self.client.is_connected():
+            return self.client
+        async with self._connect_lock:
+            for attempt in range(self.max_retries):
+                if self.client is not None and self.client.is_connected():
+                    return self.client
+                try:
+                    await self._start()
+                    logging.info("Telethon client connected")
+                    return self.client
+                except (ConnectionError, OSError) as e:
+                    delay = self._backoff(attempt)
+                    logging.warning(f"Telethon connect failed ({e}), retry in {delay} s")
+                    await asyncio.sleep(delay)
+            raise TelethonManagerError(f"Could not connect after {self.max_retries} attempts")
+
+    async def run(self, operation: Callable[[TelegramClient], Awaitable[Any]]) -> Any:
+        """Выполняет operation(client) с учетом общего FloodWait и переподключения"""
+        attempt = 0
+        while True:
+            wait = self.flood_until - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            client = await self.get_client()
+            try:
+                return await operation(client)
+            except FloodWaitError as e:
+                if e.seconds > self.max_flood_wait:
+                    raise
+                self.flood_until = max(self.flood_until, time.monotonic() + e.seconds)
+                logging.warning(f"Telethon FloodWait for {e.seconds} s")
+            except ConnectionError as e:
+                attempt += 1
+                if attempt >= self.max_retries:
+                    raise
+                logging.warning(f"Telethon connection lost ({e}), reconnecting")
+                await asyncio.sleep(self._backoff(attempt - 1))
+
+    async def coalesce(self, key: Hashable, factory: Callable[[], Awaitable[Any]]) -> Any:
+        """Одновременные вызовы с одним key ждут результат одного factory()"""
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(factory())
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return await asyncio.shield(task)
+
+    def chat_lock(self, chat: Hashable) -> asyncio.Lock:
+        """Блокировка чата: пока она взята, другой запрос не отправит туда сообщение"""
+        lock = self._chat_locks.get(chat)
+        if lock is None:
+            lock = self._chat_locks[chat] = asyncio.Lock()
+        return lock
+
+    async def close(self):
+        if self.client is not None and self.client.is_connected():
+            await self.client.disconnect()
+        self.client = None
+
+_managers: Dict[str, TelethonManager] = {}
+
+def get_manager(api_id: int, api_hash: str, bot_token: Optional[str] = None, session: str = "telegram_stars_session") -> TelethonManager:
+    """Менеджер для session, один на процесс: файл сессии нельзя открывать дважды"""
+    manager = _managers.get(session)
+    if manager is None:
+        manager = _managers[session] = TelethonManager(api_id, api_hash, bot_token, session)
+    return manager
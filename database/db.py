@@ -1,12 +1,15 @@
 from sqlalchemy import create_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, scoped_session
+import logging
 import os
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 # Get database URL from environment variables
 DATABASE_URL = os.getenv('DATABASE_URL', 'sqlite:///database/bot.db')
 
@@ -24,9 +27,19 @@ Base = declarative_base()
 
 async def init_db():
     """Initialize the database, creating all tables"""
-    from database.models import Base, User, UserLimit, Transaction, MessageLog, StarPackage, AdminSettings, Advertisement, BroadcastMessage, SubscriptionPlan, Subscription
+    from database.models import Base, User, UserLimit, Transaction, MessageLog, StarPackage, AdminSettings, Advertisement, BroadcastMessage, SubscriptionPlan, Subscription, Entitlement, BalanceSnapshot, TransactionRollup, MessageRollup, RollupWatermark
     from bot.services.subscription_service import SubscriptionService
     Base.metadata.create_all(engine)
+    # create_all skips indexes of tables that already exist
+    for index in Transaction.__table__.indexes:
+        index.create(engine, checkfirst=True)
+    
+    # Trigram index for admin user search
+    from bot.services.user_search import UserSearch
+    try:
+        UserSearch.ensure_index(engine)
+    except Exception as e:
+        logger.error(f"Error creating user search index, searches will scan the users table: {e}")
     
     # Initialize default settings if they don't exist
     session = Session()
@@ -65,6 +78,9 @@ async def init_db():
         # Initialize subscription plans
         await SubscriptionService.initialize_subscription_plans()
         
+        # Build entitlements for subscriptions created before the table existed
+        await SubscriptionService.rebuild_entitlements()
+        
     except Exception as e:
         session.rollback()
         print(f"Error initializing database: {e}")
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, Boolean, DateTime, ForeignKey, Text, func
+from sqlalchemy import Column, Integer, String, Float, Boolean, DateTime, ForeignKey, Text, UniqueConstraint, Index, func
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 import datetime
@@ -52,6 +52,8 @@ class UserLimit(Base):
 
 class Transaction(Base):
     __tablename__ = 'transactions'
+    # Ledger verification reads a user's transactions after a snapshot
+    __table_args__ = (Index('ix_transactions_user_id_id', 'user_id', 'id'),)
     
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
@@ -130,6 +132,79 @@ class Subscription(Base):
     def __repr__(self):
         return f"<Subscription(user_id='{self.user_id}', plan='{self.plan.name if self.plan else None}', end_date='{self.end_date}')>"
 
+class Entitlement(Base):
+    """Effective subscription limit per user and plan type, precomputed from active subscriptions"""
+    __tablename__ = 'entitlements'
+    __table_args__ = (UniqueConstraint('user_id', 'plan_type', name='uq_entitlements_user_plan_type'),)
+    
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
+    plan_type = Column(String(20), nullable=False)  # 'text', 'image'
+    daily_limit = Column(Integer, nullable=False)  # Best daily limit among active subscriptions
+    unlimited = Column(Boolean, default=False)
+    subscription_id = Column(Integer, ForeignKey('subscriptions.id'), nullable=True)
+    expires_at = Column(DateTime, nullable=False)  # Next end_date among the active subscriptions
+    
+    def __repr__(self):
+        return f"<Entitlement(user_id='{self.user_id}', type='{self.plan_type}', limit='{-1 if self.unlimited else self.daily_limit}')>"
+
+class BalanceSnapshot(Base):
+    """Stars balance of a user as of a transaction, so history is verified from here instead of from zero"""
+    __tablename__ = 'balance_snapshots'
+    __table_args__ = (Index('ix_balance_snapshots_user_id_last_transaction_id', 'user_id', 'last_transaction_id'),)
+    
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
+    stars = Column(Integer, nullable=False)
+    last_transaction_id = Column(Integer, nullable=False)  # Newest transaction included in stars
+    taken_at = Column(DateTime, default=datetime.datetime.utcnow)
+    
+    def __repr__(self):
+        return f"<BalanceSnapshot(user_id='{self.user_id}', stars='{self.stars}', last_transaction_id='{self.last_transaction_id}')>"
+
+class TransactionRollup(Base):
+    """Stars moved per hour or day, transaction type and user cohort (join month)"""
+    __tablename__ = 'transaction_rollups'
+    __table_args__ = (UniqueConstraint('period', 'bucket_start', 'transaction_type', 'cohort', name='uq_transaction_rollups_bucket'),)
+    
+    id = Column(Integer, primary_key=True)
+    period = Column(String(10), nullable=False)  # 'hour', 'day'
+    bucket_start = Column(DateTime, nullable=False)
+    transaction_type = Column(String(50), nullable=False)
+    cohort = Column(String(7), nullable=False)  # 'YYYY-MM'
+    transactions = Column(Integer, nullable=False, default=0)
+    amount = Column(Integer, nullable=False, default=0)
+    
+    def __repr__(self):
+        return f"<TransactionRollup(period='{self.period}', bucket='{self.bucket_start}', type='{self.transaction_type}', amount='{self.amount}')>"
+
+class MessageRollup(Base):
+    """Messages and tokens per hour or day, message type and user cohort (join month)"""
+    __tablename__ = 'message_rollups'
+    __table_args__ = (UniqueConstraint('period', 'bucket_start', 'message_type', 'cohort', name='uq_message_rollups_bucket'),)
+    
+    id = Column(Integer, primary_key=True)
+    period = Column(String(10), nullable=False)  # 'hour', 'day'
+    bucket_start = Column(DateTime, nullable=False)
+    message_type = Column(String(20), nullable=False)
+    cohort = Column(String(7), nullable=False)  # 'YYYY-MM'
+    messages = Column(Integer, nullable=False, default=0)
+    tokens_used = Column(Integer, nullable=False, default=0)
+    
+    def __repr__(self):
+        return f"<MessageRollup(period='{self.period}', bucket='{self.bucket_start}', type='{self.message_type}', messages='{self.messages}')>"
+
+class RollupWatermark(Base):
+    """Highest source row id already counted in the rollups"""
+    __tablename__ = 'rollup_watermarks'
+    
+    source = Column(String(50), primary_key=True)  # Source table name
+    last_id = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow)
+    
+    def __repr__(self):
+        return f"<RollupWatermark(source='{self.source}', last_id='{self.last_id}')>"
+
 class AdminSettings(Base):
     __tablename__ = 'admin_settings'
     
@@ -1,5 +1,6 @@
+import asyncio
 import pytest
-from unittest.mock import AsyncMock, patch
+from unittest.mock import AsyncMock, MagicMock, patch
 from fastapi import Request
 import json
 
@@ -30,6 +31,43 @@ class TestPaymentsWebhookHandler:
 
         mock_payment_success.assert_awaited_once_with(mock_bot, mock_db, "invoice_paid", 1)
 
+    @patch('app.api.routes.routes.payment_success', new_callable=AsyncMock)
+    @pytest.mark.asyncio
+    async def test_payments_webhook_notifies_worker(self, mock_payment_success):
+        mock_request = AsyncMock(spec=Request)
+        mock_request.json.return_value = {"update_type": "invoice_paid", "payload": {"invoice_id": "1"}}
+
+        mock_payment_success.return_value = True
+
+        mock_worker = MagicMock()
+
+        handler = Handlers(AsyncMock(), AsyncMock(), AsyncMock(), mock_worker)
+
+        response = await handler.payments_webhook(mock_request)
+
+        assert response.status_code == 200
+
+        mock_worker.notify.assert_called_once_with()
+
+    @patch('app.api.routes.routes.payment_success', new_callable=AsyncMock)
+    @pytest.mark.asyncio
+    async def test_payments_webhook_duplicate(self, mock_payment_success):
+        mock_request = AsyncMock(spec=Request)
+        mock_request.json.return_value = {"update_type": "invoice_paid", "payload": {"invoice_id": "1"}}
+
+        mock_payment_success.return_value = False
+
+        mock_worker = MagicMock()
+
+        handler = Handlers(AsyncMock(), AsyncMock(), AsyncMock(), mock_worker)
+
+        response = await handler.payments_webhook(mock_request)
+
+        assert response.body.decode('utf-8') == "OK"
+        assert response.status_code == 200
+
+        mock_worker.notify.assert_not_called()
+
     @pytest.mark.asyncio
     async def test_payments_webhook_request_error(self):
 
@@ -214,4 +252,107 @@ class TestBotWebhookHandler:
         response = await handler.bot_webhook(mock_request)
 
         assert response.status_code == 500
-        assert json.loads(response.body.decode('utf-8')) == {"message": "error"}
\ No newline at end of file
+        assert json.loads(response.body.decode('utf-8')) == {"message": "error"}
+class TestForwardedUpdate:
+    @pytest.mark.asyncio
+    async def test_forwarded_update_is_acknowledged_before_processing(self):
+        from app.api.sticky import FORWARDED_HEADER, StickyRouter
+
+        processing = asyncio.Event()
+        release = asyncio.Event()
+
+        async def feed(bot, update):
+            processing.set()
+            await release.wait()
+
+        mock_dp = AsyncMock()
+        mock_dp.feed_webhook_update.side_effect = feed
+        sticky = StickyRouter(["http://a", "http://b"], 1, "/token")
+        handler = Handlers(AsyncMock(), mock_dp, AsyncMock(), sticky=sticky)
+        mock_request = AsyncMock(spec=Request)
+        mock_request.json.return_value = {"update_id": 12345, "message": {
+            "message_id": 1, "date": 0, "chat": {"id": 7, "type": "private"}, "from": {"id": 7, "is_bot": False, "first_name": "A"}
+        }}
+        mock_request.headers = {FORWARDED_HEADER: "1"}
+
+        response = await handler.bot_webhook(mock_request)
+
+        assert response.status_code == 200
+        await asyncio.wait_for(processing.wait(), 1)
+        assert sticky._tasks
+        release.set()
+        await sticky.close()
+        mock_dp.feed_webhook_update.assert_awaited_once()
+
+class TestMetricsHandler:
+    @pytest.mark.asyncio
+    async def test_metrics(self):
+        handler = Handlers(AsyncMock(), AsyncMock(), AsyncMock(), metrics_token="secret")
+        mock_request = MagicMock(spec=Request)
+        mock_request.headers = {"Authorization": "Bearer secret"}
+
+        response = await handler.metrics(mock_request)
+
+        assert response.status_code == 200
+        assert "# TYPE bot_handler_seconds histogram" in response.body.decode('utf-8')
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("token, headers", [
+        ("secret", {}),
+        ("secret", {"Authorization": "Bearer wrong"}),
+        (None, {"Authorization": "Bearer None"}),
+    ])
+    async def test_metrics_requires_token(self, token, headers):
+        handler = Handlers(AsyncMock(), AsyncMock(), AsyncMock(), metrics_token=token)
+        mock_request = MagicMock(spec=Request)
+        mock_request.headers = headers
+
+        response = await handler.metrics(mock_request)
+
+        assert response.status_code == 401
+
+    @pytest.mark.asyncio
+    async def test_worker_zero_collects_other_workers(self, unused_tcp_port):
+        from aiohttp import web
+        from aiohttp.test_utils import TestServer
+        from app.api.sticky import FORWARDED_HEADER, StickyRouter
+
+        scrapes = []
+
+        async def worker_metrics(request):
+            scrapes.append((request.headers.get("Authorization"), request.headers.get(FORWARDED_HEADER)))
+            return web.Response(text="# HELP bot_handler_seconds Bot handler latency\n# TYPE bot_handler_seconds histogram\nbot_handler_seconds_count{handler=\"start\"} 3\n")
+
+        app = web.Application()
+        app.router.add_get("/metrics", worker_metrics)
+        server = TestServer(app)
+        await server.start_server()
+        sticky = StickyRouter(["http://a", str(server.make_url("")).rstrip("/"), f"http://127.0.0.1:{unused_tcp_port}"], 0, "/token")
+        handler = Handlers(AsyncMock(), AsyncMock(), AsyncMock(), sticky=sticky, metrics_token="secret")
+        mock_request = MagicMock(spec=Request)
+        mock_request.headers = {"Authorization": "Bearer secret"}
+
+        body = (await handler.metrics(mock_request)).body.decode('utf-8')
+
+        assert scrapes == [("Bearer secret", "1")]
+        assert body.count("# TYPE bot_handler_seconds histogram") == 1
+        assert 'bot_handler_seconds_count{worker="1",handler="start"} 3' in body
+        assert 'bot_worker_up{worker="2"} 0' in body
+
+        # Запрос от воркера 0 отдает только свои метрики
+        mock_request.headers = {"Authorization": "Bearer secret", FORWARDED_HEADER: "1"}
+        body = (await handler.metrics(mock_request)).body.decode('utf-8')
+        assert "worker=" not in body
+        assert len(scrapes) == 1
+
+        await sticky.close()
+        await server.close()
+
+    def test_metrics_route_needs_token(self):
+        from fastapi import APIRouter
+        from app.api.setup import register_routes
+
+        for token, registered in ((None, False), ("secret", True)):
+            router = APIRouter()
+            register_routes(router, AsyncMock(), AsyncMock(), AsyncMock(), "bot", "pay", metrics_token=token)
+            assert ("/metrics" in [route.path for route in router.routes]) is registered
@@ -0,0 +1,134 @@
+import asyncio
+import pytest
+from unittest.mock import AsyncMock
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from app.api.sticky import FORWARDED_HEADER, StickyRouter, update_user_id
+
+MESSAGE = {"update_id": 1, "message": {"message_id": 1, "from": {"id": 7}, "chat": {"id": 7}}}
+
+class TestUpdateUserId:
+    def test_message(self):
+        assert update_user_id(MESSAGE) == 7
+
+    def test_callback_query(self):
+        assert update_user_id({"update_id": 1, "callback_query": {"id": "q", "from": {"id": 9}}}) == 9
+
+    def test_unknown(self):
+        assert update_user_id({"update_id": 1}) is None
+
+class TestRoute:
+    @pytest.mark.asyncio
+    async def test_owned_update_is_handled_locally(self):
+        router = StickyRouter(["http://a", "http://b"], 1, "/token")
+        router.forward = AsyncMock()
+
+        assert await router.route(MESSAGE, {}) is False
+        router.forward.assert_not_awaited()
+
+    @pytest.mark.asyncio
+    async def test_foreign_update_is_forwarded(self):
+        router = StickyRouter(["http://a", "http://b", "http://c"], 0, "/token")
+        router.forward = AsyncMock(return_value=True)
+
+        assert await router.route(MESSAGE, {}) is True
+        router.forward.assert_awaited_once_with(1, MESSAGE)
+
+    @pytest.mark.asyncio
+    async def test_forwarded_update_is_not_forwarded_again(self):
+        router = StickyRouter(["http://a", "http://b", "http://c"], 0, "/token")
+        router.forward = AsyncMock()
+
+        assert await router.route(MESSAGE, {FORWARDED_HEADER: "1"}) is False
+
+    @pytest.mark.asyncio
+    async def test_undelivered_forward_falls_back_to_local(self):
+        router = StickyRouter(["http://a", "http://b"], 0, "/token")
+        router.forward = AsyncMock(return_value=False)
+
+        assert await router.route(MESSAGE, {}) is False
+
+async def owner_server(handler):
+    app = web.Application()
+    app.router.add_post("/token", handler)
+    server = TestServer(app)
+    await server.start_server()
+    return server
+
+class TestForward:
+    @pytest.mark.asyncio
+    async def test_unreachable_owner_is_not_delivered(self, unused_tcp_port):
+        router = StickyRouter(["http://a", f"http://127.0.0.1:{unused_tcp_port}"], 0, "/token")
+
+        assert await router.forward(1, MESSAGE) is False
+        await router.close()
+
+    @pytest.mark.asyncio
+    async def test_acknowledged_update_is_delivered(self):
+        received = []
+
+        async def handler(request):
+            received.append((await request.json(), request.headers.get(FORWARDED_HEADER)))
+            return web.json_response({"status": "ok"})
+
+        server = await owner_server(handler)
+        router = StickyRouter(["http://a", str(server.make_url("")).rstrip("/")], 0, "/token")
+
+        assert await router.route(MESSAGE, {}) is True
+        assert received == [(MESSAGE, "1")]
+        await router.close()
+        await server.close()
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("delay, status", [(1, 200), (0, 500)])
+    async def test_timeout_or_error_after_sending_is_not_retried_locally(self, delay, status):
+        async def handler(request):
+            await asyncio.sleep(delay)
+            return web.Response(status=status)
+
+        server = await owner_server(handler)
+        router = StickyRouter(["http://a", str(server.make_url("")).rstrip("/")], 0, "/token", timeout=0.1)
+
+        # The owner may already be processing it: handling it here too would answer and charge twice
+        assert await router.route(MESSAGE, {}) is True
+        await router.close()
+        await server.close()
+
+class TestAccept:
+    @pytest.mark.asyncio
+    async def test_updates_of_one_user_run_in_order(self):
+        router = StickyRouter(["http://a", "http://b"], 1, "/token")
+        order = []
+
+        def process(name, delay):
+            async def run():
+                await asyncio.sleep(delay)
+                order.append(name)
+            return run
+
+        router.accept(MESSAGE, process("first", 0.02))
+        router.accept(MESSAGE, process("second", 0))
+        router.accept({"update_id": 2, "message": {"from": {"id": 8}}}, process("other user", 0))
+        await router.close()
+
+        assert order == ["other user", "first", "second"]
+        assert router._tasks == set() and router._tails == {}
+
+    @pytest.mark.asyncio
+    async def test_failure_is_logged_and_does_not_block_the_user(self, caplog):
+        router = StickyRouter(["http://a", "http://b"], 1, "/token")
+        done = []
+
+        async def fail():
+            raise RuntimeError("boom")
+
+        async def succeed():
+            done.append(True)
+
+        router.accept(MESSAGE, fail)
+        router.accept(MESSAGE, succeed)
+        await router.close()
+
+        assert done == [True]
+        assert "Forwarded update 1 failed" in caplog.text
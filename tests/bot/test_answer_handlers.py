@@ -8,6 +8,7 @@ from app.bot.utils import encoding
 from app.bot.handlers.answer_handlers import AnswerHandlers
 from app.bot.utils import States
 from app.services.db import DatabaseError
+from app.services.governor import GovernorBusyError
 
 class TestChatGpt:
     @pytest.mark.asyncio
@@ -25,23 +26,24 @@ class TestChatGpt:
 
         mock_db.get_chatgpt.return_value = 1
 
-        mock_db.get_messages.return_value = [{"role": "user", "content": "question"}], 1
+        mock_context = AsyncMock()
+        mock_context.build.return_value = [{"role": "user", "content": "question"}], 1
 
-        mock_openai.get_chatgpt.return_value = 'answer'
+        mock_openai.get_chatgpt_usage.return_value = 'answer', {}
 
-        handlers = AnswerHandlers(mock_db, mock_openai, AsyncMock())
+        handlers = AnswerHandlers(mock_db, mock_openai, AsyncMock(), mock_context)
 
         await handlers.chatgpt_answer_handler(message, state)
 
         mock_db.get_chatgpt.assert_awaited_once_with(12345)
 
-        mock_openai.get_chatgpt.assert_awaited_once_with([{"role": "user", "content": "question"}])
+        mock_openai.get_chatgpt_usage.assert_awaited_once_with([{"role": "user", "content": "question"}], user_id=12345, tokens=1)
 
         mock_db.save_message.assert_has_calls([call(12345, "user", "question", len(encoding.encode("question"))), call(12345, "assistant", "answer", len(encoding.encode("answer")))])
 
         assert len(mock_db.save_message.mock_calls) == 2
 
-        mock_db.get_messages.assert_awaited_once_with(12345)
+        mock_context.build.assert_awaited_once_with(12345)
 
         mock_db.set_chatgpt.assert_awaited_once_with(12345, 0)
 
@@ -55,6 +57,34 @@ class TestChatGpt:
         )
         state.set_state.assert_awaited_once_with(States.CHATGPT_STATE)
 
+    @pytest.mark.asyncio
+    async def test_chatgpt_cached_tokens_billing(self):
+        message = AsyncMock(spec=types.Message)
+        message.answer = AsyncMock()
+        message.from_user = MagicMock(id=12345)
+        message.text = "question"
+
+        state = AsyncMock(spec=FSMContext)
+        state.set_state = AsyncMock()
+
+        mock_db = AsyncMock()
+        mock_openai = AsyncMock()
+
+        mock_db.get_chatgpt.return_value = 10000
+
+        mock_context = AsyncMock()
+        mock_context.build.return_value = [{"role": "user", "content": "question"}], 4000
+
+        mock_openai.get_chatgpt_usage.return_value = 'answer', {"prompt_tokens": 4000, "cached_tokens": 2000, "completion_tokens": 10}
+
+        handlers = AnswerHandlers(mock_db, mock_openai, AsyncMock(), mock_context)
+
+        await handlers.chatgpt_answer_handler(message, state)
+
+        mock_db.save_chat_usage.assert_awaited_once_with(12345, 4000, 2000, 10)
+
+        mock_db.set_chatgpt.assert_awaited_once_with(12345, 10000 - int(2000*0.25 + 2000*0.125 + len(encoding.encode("answer"))))
+
     @pytest.mark.asyncio
     async def test_chatgpt_safety_issue(self):
         message = AsyncMock(spec=types.Message)
@@ -70,21 +100,22 @@ class TestChatGpt:
 
         mock_db.get_chatgpt.return_value = 1
 
-        mock_db.get_messages.return_value = [{"role": "user", "content": "question"}], 1
+        mock_context = AsyncMock()
+        mock_context.build.return_value = [{"role": "user", "content": "question"}], 1
 
-        mock_openai.get_chatgpt.return_value = ''
+        mock_openai.get_chatgpt_usage.return_value = '', {}
 
-        handlers = AnswerHandlers(mock_db, mock_openai, AsyncMock())
+        handlers = AnswerHandlers(mock_db, mock_openai, AsyncMock(), mock_context)
 
         await handlers.chatgpt_answer_handler(message, state)
 
         mock_db.get_chatgpt.assert_awaited_once_with(12345)
 
-        mock_openai.get_chatgpt.assert_awaited_once_with([{"role": "user", "content": "question"}])
+        mock_openai.get_chatgpt_usage.assert_awaited_once_with([{"role": "user", "content": "question"}], user_id=12345, tokens=1)
 
         mock_db.save_message.assert_awaited_once_with(12345, "user", "question", len(encoding.encode("question")))
 
-        mock_db.get_messages.assert_awaited_once_with(12345)
+        mock_context.build.assert_awaited_once_with(12345)
 
         button = [[KeyboardButton(text="🔙Back")]]
         reply_markup = ReplyKeyboardMarkup(
@@ -96,6 +127,80 @@ class TestChatGpt:
         )
         state.set_state.assert_awaited_once_with(States.CHATGPT_STATE)
 
+    @pytest.mark.asyncio
+    async def test_chatgpt_governor_busy(self):
+        message = AsyncMock(spec=types.Message)
+        message.answer = AsyncMock()
+        message.from_user = MagicMock(id=12345)
+        message.text = "question"
+
+        state = AsyncMock(spec=FSMContext)
+        state.set_state = AsyncMock()
+
+        mock_db = AsyncMock()
+        mock_openai = AsyncMock()
+
+        mock_db.get_chatgpt.return_value = 1
+
+        mock_context = AsyncMock()
+        mock_context.build.return_value = [{"role": "user", "content": "question"}], 1
+
+        mock_openai.get_chatgpt_usage.side_effect = GovernorBusyError("openai queue is full", 5)
+
+        handlers = AnswerHandlers(mock_db, mock_openai, AsyncMock(), mock_context)
+
+        await handlers.chatgpt_answer_handler(message, state)
+
+        mock_db.set_chatgpt.assert_not_awaited()
+
+        button = [[KeyboardButton(text="🔙Back")]]
+        reply_markup = ReplyKeyboardMarkup(
+            keyboard=button, resize_keyboard=True
+        )
+        message.answer.assert_awaited_once_with(
+            text = "⏳The service is busy right now. Please retry in 5 s.",
+            reply_markup = reply_markup,
+        )
+
+    @pytest.mark.asyncio
+    async def test_chatgpt_busy_leaves_history_unchanged(self):
+        message = AsyncMock(spec=types.Message)
+        message.answer = AsyncMock()
+        message.from_user = MagicMock(id=12345)
+        message.text = "question"
+
+        state = AsyncMock(spec=FSMContext)
+
+        history = [(1, "user", "hi", 1), (2, "assistant", "hello", 1)]
+
+        async def save_message(user_id, role, content, tokens):
+            history.append((history[-1][0] + 1, role, content, tokens))
+            return history[-1][0]
+
+        async def delete_message(user_id, message_id):
+            history[:] = [row for row in history if row[0] != message_id]
+
+        mock_db = AsyncMock()
+        mock_db.get_chatgpt.return_value = 1000
+        mock_db.save_message.side_effect = save_message
+        mock_db.delete_message.side_effect = delete_message
+
+        mock_openai = AsyncMock()
+        mock_openai.get_chatgpt_usage.side_effect = GovernorBusyError("openai queue is full", 5)
+
+        mock_context = AsyncMock()
+        mock_context.build.return_value = [{"role": "user", "content": "question"}], 1
+
+        handlers = AnswerHandlers(mock_db, mock_openai, AsyncMock(), mock_context)
+
+        # Повторы после отказа не копят вопрос в истории
+        for _ in range(3):
+            await handlers.chatgpt_answer_handler(message, state)
+
+        assert history == [(1, "user", "hi", 1), (2, "assistant", "hello", 1)]
+        mock_db.delete_message.assert_awaited_with(12345, 3)
+        mock_db.set_chatgpt.assert_not_awaited()
+
     @pytest.mark.asyncio
     async def test_chatgpt_zero_tokens(self):
         message = AsyncMock(spec=types.Message)
@@ -162,26 +267,27 @@ class TestChatGpt:
 
         mock_db.get_chatgpt.return_value = 1
 
-        mock_db.get_messages.return_value = [{"role": "user", "content": "question"}], 1
+        mock_context = AsyncMock()
+        mock_context.build.return_value = [{"role": "user", "content": "question"}], 1
 
-        mock_openai.get_chatgpt.return_value = 'answer'
+        mock_openai.get_chatgpt_usage.return_value = 'answer', {}
 
         message.answer.side_effect = Exception()
 
-        handlers = AnswerHandlers(mock_db, mock_openai, AsyncMock())
+        handlers = AnswerHandlers(mock_db, mock_openai, AsyncMock(), mock_context)
 
         with pytest.raises(Exception):
             await handlers.chatgpt_answer_handler(message, state)
 
         mock_db.get_chatgpt.assert_awaited_once_with(12345)
 
-        mock_openai.get_chatgpt.assert_awaited_once_with([{"role": "user", "content": "question"}])
+        mock_openai.get_chatgpt_usage.assert_awaited_once_with([{"role": "user", "content": "question"}], user_id=12345, tokens=1)
 
         mock_db.save_message.assert_has_calls([call(12345, "user", "question", len(encoding.encode("question"))), call(12345, "assistant", "answer", len(encoding.encode("answer")))])
 
         assert len(mock_db.save_message.mock_calls) == 2
 
-        mock_db.get_messages.assert_awaited_once_with(12345)
+        mock_context.build.assert_awaited_once_with(12345)
 
         mock_db.set_chatgpt.assert_awaited_once_with(12345, 0)
 
@@ -212,7 +318,7 @@ class TestDallE:
 
         mock_db.get_dalle.assert_awaited_once_with(12345)
 
-        mock_openai.get_dalle.assert_awaited_once_with("question")
+        mock_openai.get_dalle.assert_awaited_once_with("question", user_id=12345)
 
         mock_db.set_dalle.assert_awaited_once_with(12345, 0)
 
@@ -255,7 +361,7 @@ class TestDallE:
 
         mock_db.get_dalle.assert_awaited_once_with(12345)
 
-        mock_openai.get_dalle.assert_awaited_once_with("question")
+        mock_openai.get_dalle.assert_awaited_once_with("question", user_id=12345)
 
         button = [[KeyboardButton(text="🔙Back")]]
         reply_markup = ReplyKeyboardMarkup(
@@ -348,7 +454,7 @@ class TestDallE:
 
         mock_db.get_dalle.assert_awaited_once_with(12345)
 
-        mock_openai.get_dalle.assert_awaited_once_with("question")
+        mock_openai.get_dalle.assert_awaited_once_with("question", user_id=12345)
 
         mock_db.set_dalle.assert_awaited_once_with(12345, 0)
 
@@ -382,7 +488,7 @@ class TestStable:
 
         mock_db.get_stable.assert_awaited_once_with(12345)
 
-        mock_stable.get_stable.assert_awaited_once_with("question")
+        mock_stable.get_stable.assert_awaited_once_with("question", user_id=12345)
 
         mock_db.set_stable.assert_awaited_once_with(12345, 0)
 
@@ -427,7 +533,7 @@ class TestStable:
 
         mock_db.get_stable.assert_awaited_once_with(12345)
 
-        mock_stable.get_stable.assert_awaited_once_with("question")
+        mock_stable.get_stable.assert_awaited_once_with("question", user_id=12345)
 
         button = [[KeyboardButton(text="🔙Back")]]
         reply_markup = ReplyKeyboardMarkup(
@@ -525,7 +631,7 @@ class TestStable:
 
         mock_db.get_stable.assert_awaited_once_with(12345)
 
-        mock_stable.get_stable.assert_awaited_once_with("question")
+        mock_stable.get_stable.assert_awaited_once_with("question", user_id=12345)
 
         mock_db.set_stable.assert_awaited_once_with(12345, 0)
 
@@ -0,0 +1,166 @@
+import pytest
+from unittest.mock import AsyncMock, MagicMock
+
+pytest.importorskip("telegram")
+
+from telegram.ext import ConversationHandler
+
+from bot.handlers import chat_handlers
+from bot.utils.config_manager import config
+
+def stream_of(*parts, tokens=12):
+    """stream_text_response replacement: yields parts, then (text, tokens)"""
+    def stream(prompt):
+        async def generate():
+            for part in parts:
+                yield part
+            yield "".join(parts), tokens
+        return generate()
+    return stream
+
+@pytest.fixture
+def services(monkeypatch):
+    user_service = MagicMock()
+    user_service.check_user_limits = AsyncMock(return_value=(True, 5))
+    user_service.update_user_usage = AsyncMock()
+    user_service.log_message = AsyncMock()
+    openai = MagicMock()
+    openai.transcribe_audio = AsyncMock(return_value="what time is it")
+    openai.stream_text_response = stream_of("no", "on")
+    monkeypatch.setattr(chat_handlers, "UserService", user_service)
+    monkeypatch.setattr(chat_handlers, "openai_service", openai)
+    monkeypatch.setattr(chat_handlers.AdminService, "get_advertisement", AsyncMock(return_value=None))
+    monkeypatch.setitem(config._config, 'MAX_VOICE_DURATION', 60)
+    monkeypatch.setitem(config._config, 'MAX_VOICE_FILE_SIZE', 1024 * 1024)
+    return user_service, openai
+
+def voice_update(duration=5, file_size=1000, audio=b"OggS voice"):
+    async def download_to_memory(out):
+        out.write(audio)
+
+    voice_file = MagicMock()
+    voice_file.download_to_memory = AsyncMock(side_effect=download_to_memory)
+    update = MagicMock()
+    update.message.voice.duration = duration
+    update.message.voice.file_size = file_size
+    update.message.voice.get_file = AsyncMock(return_value=voice_file)
+    update.message.reply_text = AsyncMock(return_value=MagicMock(edit_text=AsyncMock()))
+    context = MagicMock()
+    context.user_data = {'user_id': 1}
+    return update, context, voice_file
+
+def replies(update):
+    return [call.args[0] for call in update.message.reply_text.await_args_list]
+
+@pytest.mark.asyncio
+async def test_long_voice_is_rejected_before_charging(services):
+    user_service, openai = services
+    update, context, voice_file = voice_update(duration=61)
+
+    assert await chat_handlers.voice_question_process(update, context) == ConversationHandler.END
+
+    assert "слишком длинное" in replies(update)[0]
+    user_service.check_user_limits.assert_not_awaited()
+    voice_file.download_to_memory.assert_not_awaited()
+
+@pytest.mark.asyncio
+async def test_large_voice_file_gets_its_own_message(services):
+    user_service, openai = services
+    update, context, voice_file = voice_update(file_size=2 * 1024 * 1024)
+
+    assert await chat_handlers.voice_question_process(update, context) == ConversationHandler.END
+
+    assert "слишком большой" in replies(update)[0]
+    assert "1 МБ" in replies(update)[0]
+    user_service.check_user_limits.assert_not_awaited()
+
+@pytest.mark.asyncio
+async def test_voice_is_downloaded_into_memory(services):
+    user_service, openai = services
+    update, context, voice_file = voice_update(audio=b"OggS voice")
+
+    await chat_handlers.voice_question_process(update, context)
+
+    voice_file.download_to_memory.assert_awaited_once()
+    assert not voice_file.download_to_drive.called
+    openai.transcribe_audio.assert_awaited_once_with(b"OggS voice")
+    assert "🔊 Ваше сообщение: what time is it" in replies(update)
+    user_service.update_user_usage.assert_awaited_once_with(1, 'voice')
+    user_service.log_message.assert_awaited_once_with(1, 'voice', "what time is it", "noon", 12)
+
+def text_update(question="hi"):
+    answer = MagicMock(edit_text=AsyncMock())
+    update = MagicMock()
+    update.message.text = question
+    update.message.chat.send_action = AsyncMock()
+    update.message.reply_text = AsyncMock(return_value=answer)
+    context = MagicMock()
+    context.user_data = {'user_id': 1}
+    return update, context, answer
+
+@pytest.mark.asyncio
+async def test_text_answer_is_streamed_into_one_message(services, monkeypatch):
+    user_service, openai = services
+    openai.stream_text_response = stream_of("Hel", "lo", " world")
+    monkeypatch.setitem(config._config, 'STREAM_EDIT_INTERVAL', 0)
+    monkeypatch.setattr(chat_handlers.AdminService, "get_advertisement", AsyncMock(return_value="Ad"))
+    update, context, answer = text_update()
+
+    await chat_handlers.text_question_process(update, context)
+
+    # Sent with the first part, then edited as parts arrive
+    assert replies(update) == ["Hel" + chat_handlers.STREAM_CURSOR]
+    edits = [call.args[0] for call in answer.edit_text.await_args_list]
+    assert edits == ["Hello ▌", "Hello world ▌", "Hello world\n\n---\nAd"]
+    user_service.log_message.assert_awaited_once_with(1, 'text', "hi", "Hello world", 12)
+
+@pytest.mark.asyncio
+async def test_edits_are_throttled(services, monkeypatch):
+    user_service, openai = services
+    openai.stream_text_response = stream_of(*["word "] * 50)
+    monkeypatch.setitem(config._config, 'STREAM_EDIT_INTERVAL', 60)
+    update, context, answer = text_update()
+
+    await chat_handlers.text_question_process(update, context)
+
+    # First part and the final text only
+    assert replies(update) == ["word  ▌"]
+    answer.edit_text.assert_awaited_once_with("word " * 50)
+
+@pytest.mark.asyncio
+async def test_rate_limited_edit_is_skipped(services, monkeypatch):
+    from telegram.error import RetryAfter
+
+    user_service, openai = services
+    openai.stream_text_response = stream_of("a", "b", "c")
+    monkeypatch.setitem(config._config, 'STREAM_EDIT_INTERVAL', 0)
+    update, context, answer = text_update()
+    answer.edit_text.side_effect = [RetryAfter(0), None, None]
+
+    await chat_handlers.text_question_process(update, context)
+
+    assert answer.edit_text.await_args_list[-1].args[0] == "abc"
+
+@pytest.mark.asyncio
+async def test_long_answer_overflows_into_follow_up_messages(services, monkeypatch):
+    user_service, openai = services
+    long_answer = "x" * (chat_handlers.MAX_MESSAGE_LENGTH + 10)
+    openai.stream_text_response = stream_of(long_answer)
+    monkeypatch.setitem(config._config, 'STREAM_EDIT_INTERVAL', 60)
+    update, context, answer = text_update()
+
+    await chat_handlers.text_question_process(update, context)
+
+    # The first message is already full, the rest follows in a new one
+    assert replies(update) == ["x" * chat_handlers.MAX_MESSAGE_LENGTH, "x" * 10]
+    answer.edit_text.assert_not_awaited()
+
+@pytest.mark.asyncio
+async def test_voice_answer_follows_the_transcription(services, monkeypatch):
+    user_service, openai = services
+    monkeypatch.setitem(config._config, 'STREAM_EDIT_INTERVAL', 0)
+    update, context, voice_file = voice_update()
+
+    await chat_handlers.voice_question_process(update, context)
+
+    assert replies(update) == ["🔊 Ваше сообщение: what time is it", "no" + chat_handlers.STREAM_CURSOR]
@@ -6,7 +6,7 @@ from aiogram.types import KeyboardButton, ReplyKeyboardMarkup
 
 from app.bot.handlers.display_info import DisplayInfo
 from app.bot.utils import States
-from app.services.db import DatabaseError
+from app.services.db import DatabaseError, UserDashboard
 
 @pytest.mark.asyncio
 async def test_display_info_handler_success():
@@ -18,22 +18,22 @@ async def test_display_info_handler_success():
     state.set_state = AsyncMock()
 
     mock_db = AsyncMock()
-    mock_db.get_userinfo.return_value = [1, 1, 1]
+    mock_db.get_dashboard.return_value = UserDashboard(1, 1, 1, 1, ())
 
     handler = DisplayInfo(mock_db)
 
     await handler.display_info_handler(message, state)
 
-    mock_db.get_userinfo.assert_awaited_once_with(12345)
+    mock_db.get_dashboard.assert_awaited_once_with(12345)
 
-    button = [[KeyboardButton(text="💰Buy tokens and generations")], [KeyboardButton(text="🔙Back")]]
+    button = [[KeyboardButton(text="💫Buy tokens and generations")], [KeyboardButton(text="🔙Back")]]
     reply_markup = ReplyKeyboardMarkup(
         keyboard=button, resize_keyboard=True
     )
-    message.answer.assert_awaited_once_with(
-        text = "You have: \n 💭1 ChatGPT tokens \n 🌄1 DALL·E image generations \n 🌅1 Stable Diffusion image generations \n 💸 You can buy more with crypto",
-        reply_markup= reply_markup,
-    )
+    assert message.answer.await_args_list[0].kwargs == {
+        "text": "You have: \n 💭1 ChatGPT tokens \n 🌄1 DALL·E generations \n 🌅1 Stable Diffusion generations \n 🖼️1 MidJourney generations \n\n 💫 You can buy more using Telegram Stars",
+        "reply_markup": reply_markup,
+    }
     state.set_state.assert_awaited_once_with(States.INFO_STATE)
 
 @pytest.mark.asyncio
@@ -45,7 +45,7 @@ async def test_display_info_handler_database_error():
     state = AsyncMock(spec=FSMContext)
 
     mock_db = AsyncMock()
-    mock_db.get_userinfo.side_effect = DatabaseError()
+    mock_db.get_dashboard.side_effect = DatabaseError()
 
     handler = DisplayInfo(mock_db)
 
@@ -63,11 +63,11 @@ async def test_display_info_handler_telegram_error():
     state.set_state = AsyncMock()
 
     mock_db = AsyncMock()
-    mock_db.get_userinfo.return_value = [1, 1, 1]
+    mock_db.get_dashboard.return_value = UserDashboard(1, 1, 1, 1, ())
 
     handler = DisplayInfo(mock_db)
 
     with pytest.raises(Exception):
         await handler.display_info_handler(message, state)
 
-    mock_db.get_userinfo.assert_awaited_once_with(12345)
\ No newline at end of file
+    mock_db.get_dashboard.assert_awaited_once_with(12345)
\ No newline at end of file
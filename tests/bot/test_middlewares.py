@@ -0,0 +1,120 @@
+import asyncio
+import datetime
+import pytest
+from unittest.mock import AsyncMock
+
+from aiogram.dispatcher.event.handler import HandlerObject
+from aiogram.types import Chat, Message, User
+
+from app.bot.middlewares import CoalescingMiddleware, HandlerMetricsMiddleware
+from app.bot.utils import States
+from app.services.metrics import HANDLER_LATENCY
+
+def make_message(text: str, user_id: int = 12345) -> Message:
+    return Message(
+        message_id=1,
+        date=datetime.datetime.now(),
+        chat=Chat(id=user_id, type="private"),
+        from_user=User(id=user_id, is_bot=False, first_name="user"),
+        text=text,
+    )
+
+def make_data(state):
+    fsm = AsyncMock()
+    fsm.get_state.return_value = state.state
+    return {"raw_state": state.state, "state": fsm}
+
+class Recorder:
+    def __init__(self):
+        self.texts = []
+        self.release = asyncio.Event()
+
+    async def __call__(self, event, data):
+        self.texts.append(event.text)
+        if len(self.texts) == 1:
+            await self.release.wait()
+
+@pytest.mark.asyncio
+async def test_passthrough_outside_generation_states():
+    middleware = CoalescingMiddleware()
+    handler = AsyncMock()
+    message = make_message("question")
+    data = make_data(States.ENTRY_STATE)
+
+    await middleware(handler, message, data)
+
+    handler.assert_awaited_once_with(message, data)
+
+@pytest.mark.asyncio
+async def test_chatgpt_messages_coalesced():
+    middleware = CoalescingMiddleware()
+    handler = Recorder()
+
+    first = asyncio.create_task(middleware(handler, make_message("one"), make_data(States.CHATGPT_STATE)))
+    await asyncio.sleep(0)
+    await middleware(handler, make_message("two"), make_data(States.CHATGPT_STATE))
+    await middleware(handler, make_message("three"), make_data(States.CHATGPT_STATE))
+
+    handler.release.set()
+    await first
+
+    assert handler.texts == ["one", "two\nthree"]
+    assert middleware.in_flight == {}
+
+@pytest.mark.asyncio
+async def test_duplicate_image_prompts_dropped():
+    middleware = CoalescingMiddleware()
+    handler = Recorder()
+
+    first = asyncio.create_task(middleware(handler, make_message("cat"), make_data(States.DALL_E_STATE)))
+    await asyncio.sleep(0)
+    for text in ["cat", "dog", "dog"]:
+        await middleware(handler, make_message(text), make_data(States.DALL_E_STATE))
+
+    handler.release.set()
+    await first
+
+    assert handler.texts == ["cat", "dog"]
+
+@pytest.mark.asyncio
+async def test_back_button_not_delayed():
+    middleware = CoalescingMiddleware()
+    handler = Recorder()
+
+    first = asyncio.create_task(middleware(handler, make_message("one"), make_data(States.CHATGPT_STATE)))
+    await asyncio.sleep(0)
+    back = asyncio.create_task(middleware(AsyncMock(), make_message("🔙Back"), make_data(States.CHATGPT_STATE)))
+    await asyncio.wait_for(back, timeout=1)
+
+    handler.release.set()
+    await first
+
+@pytest.mark.asyncio
+async def test_pending_dropped_after_state_change():
+    middleware = CoalescingMiddleware()
+    handler = Recorder()
+
+    first = asyncio.create_task(middleware(handler, make_message("one"), make_data(States.CHATGPT_STATE)))
+    await asyncio.sleep(0)
+    data = make_data(States.CHATGPT_STATE)
+    data["state"].get_state.return_value = States.ENTRY_STATE.state
+    await middleware(handler, make_message("two"), data)
+
+    handler.release.set()
+    await first
+
+    assert handler.texts == ["one"]
+
+@pytest.mark.asyncio
+async def test_handler_metrics_recorded_per_handler():
+    async def chatgpt_answer_handler(message, state):
+        pass
+
+    middleware = HandlerMetricsMiddleware()
+    handler = AsyncMock()
+    data = {"handler": HandlerObject(chatgpt_answer_handler)}
+    before = HANDLER_LATENCY.labels(chatgpt_answer_handler.__qualname__).count
+
+    await middleware(handler, make_message("question"), data)
+
+    assert HANDLER_LATENCY.labels(chatgpt_answer_handler.__qualname__).count == before + 1
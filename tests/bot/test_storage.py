@@ -0,0 +1,39 @@
+import pytest
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+from app.bot.storage import PostgresStorage, create_storage
+from app.bot.utils import States
+from app.core.sqlite_database import SQLiteDataBaseCore
+
+KEY = StorageKey(bot_id=1, chat_id=12345, user_id=12345)
+
+@pytest.mark.asyncio
+async def test_state_and_data_shared_between_instances(tmp_path):
+    dbcore = SQLiteDataBaseCore(f"sqlite:///{tmp_path / 'fsm.db'}", readers=1)
+    await dbcore.open_pool()
+    try:
+        storage = PostgresStorage(dbcore.pool)
+        await storage.create_table()
+        await storage.set_state(KEY, States.CHATGPT_STATE)
+        await storage.update_data(KEY, {"plan": "starter"})
+
+        # Другой воркер видит то же состояние
+        other = PostgresStorage(dbcore.pool)
+
+        assert await other.get_state(KEY) == States.CHATGPT_STATE.state
+        assert await other.get_data(KEY) == {"plan": "starter"}
+        assert await other.get_state(StorageKey(bot_id=1, chat_id=1, user_id=1)) is None
+        assert await other.get_data(StorageKey(bot_id=1, chat_id=1, user_id=1)) == {}
+
+        await other.set_state(KEY, None)
+        assert await storage.get_state(KEY) is None
+        assert await storage.get_data(KEY) == {"plan": "starter"}
+    finally:
+        await dbcore.close_pool()
+
+def test_create_storage():
+    assert isinstance(create_storage(None, None), MemoryStorage)
+    assert isinstance(create_storage("database", None), PostgresStorage)
+    with pytest.raises(ValueError):
+        create_storage("mongodb://", None)
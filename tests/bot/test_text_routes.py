@@ -0,0 +1,101 @@
+import datetime
+import time
+import pytest
+from unittest.mock import AsyncMock, MagicMock
+
+from aiogram import Dispatcher
+from aiogram.types import Chat, Message, User
+
+from app.bot.routes import DuplicateRouteError, RouteFilter, TextRoutes, dispatch_route
+from app.bot.utils import States
+
+def make_message(text: str) -> Message:
+    return Message(
+        message_id=1,
+        date=datetime.datetime.now(),
+        chat=Chat(id=1, type="private"),
+        from_user=User(id=1, is_bot=False, first_name="user"),
+        text=text,
+    )
+
+async def back(message, state):
+    return "back"
+
+async def chat(message, state):
+    return "chat"
+
+def test_button_is_bound_to_state():
+    routes = TextRoutes()
+    routes.button(back, States.ENTRY_STATE, "Back")
+    routes.button(chat, States.CHATGPT_STATE, "Back")
+
+    assert routes.resolve(States.ENTRY_STATE.state, "Back") is back
+    assert routes.resolve(States.CHATGPT_STATE.state, "Back") is chat
+    assert routes.resolve(States.INFO_STATE.state, "Back") is None
+    assert routes.resolve(States.ENTRY_STATE.state, "Back ") is None
+
+def test_button_without_state_matches_any_state():
+    routes = TextRoutes()
+    routes.button(back, None, "Back")
+    routes.button(chat, States.CHATGPT_STATE, "Back")
+
+    assert routes.resolve(States.CHATGPT_STATE.state, "Back") is chat
+    assert routes.resolve(States.INFO_STATE.state, "Back") is back
+    assert routes.resolve(None, "Back") is back
+
+def test_regexp_is_a_fallback():
+    routes = TextRoutes()
+    routes.button(back, States.ENTRY_STATE, "Back")
+    routes.regexp(chat, States.ENTRY_STATE, r"^Ba")
+
+    assert routes.resolve(States.ENTRY_STATE.state, "Back") is back
+    assert routes.resolve(States.ENTRY_STATE.state, "Bar") is chat
+    assert routes.resolve(States.INFO_STATE.state, "Bar") is None
+
+def test_duplicate_button_is_rejected():
+    routes = TextRoutes()
+    routes.button(back, States.ENTRY_STATE, "Back")
+    with pytest.raises(DuplicateRouteError):
+        routes.button(chat, States.ENTRY_STATE, "Back")
+    assert routes.resolve(States.ENTRY_STATE.state, "Back") is back
+
+@pytest.mark.asyncio
+async def test_filter_injects_route():
+    routes = TextRoutes()
+    routes.button(back, States.ENTRY_STATE, "Back")
+    route_filter = RouteFilter(routes)
+
+    assert await route_filter(make_message("Back"), raw_state=States.ENTRY_STATE.state) == {"route": back}
+    assert await route_filter(make_message("Back"), raw_state=None) is False
+    assert await dispatch_route(make_message("Back"), AsyncMock(), back) == "back"
+
+def test_register_handlers_has_no_duplicate_buttons():
+    pytest.importorskip("telethon")
+    from app.bot.setup import register_handlers
+
+    dp = Dispatcher()
+    register_handlers(dp, MagicMock(), MagicMock(), MagicMock(), MagicMock(), MagicMock(), MagicMock())
+
+    # Таблица подключена первым обработчиком сообщений
+    route_filter = dp.message.handlers[0].filters[0].callback
+    routes = route_filter.routes
+    assert routes.resolve(States.ENTRY_STATE.state, "👤My account | 💰Buy").__name__ == "display_info_handler"
+    assert routes.resolve(States.ENTRY_STATE.state, "🖼️Images — MidJourney").__name__ == "midjourney_start_handler"
+    assert routes.resolve(States.TELEGRAM_STARS_MENU_STATE.state, "Back").__name__ == "start_handler"
+
+def lookup_cost(buttons: int, rounds: int = 20000) -> float:
+    routes = TextRoutes()
+    for i in range(buttons):
+        routes.button(back, States.ENTRY_STATE, f"button {i}")
+    state, text = States.ENTRY_STATE.state, f"button {buttons - 1}"
+    start = time.perf_counter()
+    for _ in range(rounds):
+        routes.resolve(state, text)
+    return time.perf_counter() - start
+
+def test_lookup_cost_does_not_grow_with_buttons():
+    lookup_cost(10)
+    small = min(lookup_cost(10) for _ in range(3))
+    large = min(lookup_cost(1000) for _ in range(3))
+    # Перебор регулярных выражений был бы в ~100 раз медленнее
+    assert large < small * 3
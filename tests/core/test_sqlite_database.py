@@ -0,0 +1,157 @@
+import asyncio
+import pytest
+from contextlib import asynccontextmanager
+
+from app.core.sqlite_database import SQLiteDataBaseCore, translate
+from app.services.db import DataBase
+
+@asynccontextmanager
+async def open_database(tmp_path):
+    dbcore = SQLiteDataBaseCore(f"sqlite:///{tmp_path / 'bot.db'}", readers=2)
+    await dbcore.open_pool()
+    try:
+        database = DataBase(dbcore.pool)
+        await database.create_tables()
+        yield dbcore, database
+    finally:
+        await dbcore.close_pool()
+
+class TestTranslate:
+    def test_placeholders(self):
+        query, is_write = translate("SELECT chatgpt FROM users WHERE user_id = %s AND role = '%s'")
+
+        assert query == "SELECT chatgpt FROM users WHERE user_id = ? AND role = '%s'"
+        assert is_write is False
+
+    def test_now_and_interval(self):
+        query, is_write = translate("UPDATE subscriptions SET end_date = NOW() + INTERVAL '%s days' WHERE end_date > NOW()")
+
+        assert query == "UPDATE subscriptions SET end_date = datetime('now', '+' || ? || ' days') WHERE end_date > CURRENT_TIMESTAMP"
+        assert is_write is True
+
+    def test_constant_interval(self):
+        query, _ = translate("SELECT id FROM chat_usage WHERE created_at > NOW() - INTERVAL '1 day'")
+
+        assert query == "SELECT id FROM chat_usage WHERE created_at > datetime('now', '-1 days')"
+
+    def test_serial_and_select_for_update(self):
+        assert translate("CREATE TABLE t (id SERIAL PRIMARY KEY)")[0] == "CREATE TABLE t (id INTEGER PRIMARY KEY AUTOINCREMENT)"
+
+        query, is_write = translate("SELECT id FROM payment_events LIMIT %s FOR UPDATE SKIP LOCKED")
+
+        assert query == "SELECT id FROM payment_events LIMIT ?"
+        assert is_write is True
+
+class TestDataBaseOnSQLite:
+    @pytest.mark.asyncio
+    async def test_users_and_payments(self, tmp_path):
+        async with open_database(tmp_path) as (_, database):
+            await database.insert_user(1)
+
+            assert await database.get_userinfo(1) == (3000, 3, 3, 3)
+            assert await database.credit_payment("telegram_stars", "charge", 1, "dall_e") is True
+            assert await database.credit_payment("telegram_stars", "charge", 1, "dall_e") is False
+            assert await database.get_dalle(1) == 53
+
+    @pytest.mark.asyncio
+    async def test_subscription_and_upsert(self, tmp_path):
+        async with open_database(tmp_path) as (_, database):
+            await database.insert_user(1)
+            await database.create_subscription(1, "chat", "starter", 10, 30)
+            await database.reserve_subscription_usage(1, "chat")
+            await database.save_summary(1, "first", 3, 0)
+            await database.save_summary(1, "second", 4, 0)
+
+            subscription = await database.check_subscription(1, "chat")
+            summary = await database.get_summary(1)
+
+        assert subscription["plan"] == "starter"
+        assert subscription["usage_today"] == 1
+        assert (subscription["end_date"] - subscription["start_date"]).days == 30
+        assert summary == ("second", 4)
+
+    @pytest.mark.asyncio
+    async def test_failed_block_is_rolled_back(self, tmp_path):
+        async with open_database(tmp_path) as (dbcore, database):
+            with pytest.raises(RuntimeError):
+                async with dbcore.pool.connection() as conn:
+                    async with conn.cursor() as cursor:
+                        await cursor.execute("INSERT INTO users(user_id, chatgpt, dall_e, stable_diffusion, midjourney) VALUES (%s, 0, 0, 0, 0)", (1,))
+                        raise RuntimeError
+
+            assert await database.is_user(1) is None
+
+    @pytest.mark.asyncio
+    async def test_reads_do_not_wait_for_writer(self, tmp_path):
+        async with open_database(tmp_path) as (dbcore, database):
+            await database.insert_user(1)
+
+            async with dbcore.pool.connection() as conn:
+                async with conn.cursor() as cursor:
+                    await cursor.execute("UPDATE users SET chatgpt = 0 WHERE user_id = %s", (1,))
+                    # Писатель занят, читатель видит последнее зафиксированное состояние
+                    assert await asyncio.wait_for(database.get_chatgpt(1), timeout=1) == 3000
+
+            assert await database.get_chatgpt(1) == 0
+
+    @pytest.mark.asyncio
+    async def test_referral_pages_and_counters(self, tmp_path):
+        async with open_database(tmp_path) as (_, database):
+            await database.insert_user(1)
+            for user_id in range(2, 27):
+                await database.insert_user(user_id, 1)
+            await database.give_referral_bonus(1, 2)
+
+            first = await database.get_referrals(1, limit=10)
+            second = await database.get_referrals(1, after_id=first[-1][3], limit=10)
+            back = await database.get_referrals(1, before_id=second[0][3], limit=10)
+            stats = await database.get_referral_stats(1)
+
+        assert [row[0] for row in first] == list(range(2, 12))
+        assert [row[0] for row in second] == list(range(12, 22))
+        assert back == first
+        assert stats == (25, 1)
+
+    @pytest.mark.asyncio
+    async def test_concurrent_reservations_respect_daily_limit(self, tmp_path):
+        async with open_database(tmp_path) as (_, database):
+            await database.insert_user(1)
+            await database.create_subscription(1, "image", "basic", 5, 30)
+
+            results = await asyncio.gather(*(database.reserve_subscription_usage(1, "image") for _ in range(20)))
+            await database.release_subscription_usage(1, "image")
+            subscription = await database.check_subscription(1, "image")
+
+        assert sum(result['reserved'] for result in results) == 5
+        assert subscription["usage_today"] == 4
+
+    @pytest.mark.asyncio
+    async def test_reservation_rolls_over_day(self, tmp_path):
+        async with open_database(tmp_path) as (dbcore, database):
+            await database.insert_user(1)
+            await database.create_subscription(1, "image", "basic", 1, 30)
+            async with dbcore.pool.connection() as conn:
+                async with conn.cursor() as cursor:
+                    await cursor.execute("UPDATE subscriptions SET usage_today = 1, last_usage_reset = datetime('now', '-1 days')")
+
+            assert (await database.check_subscription(1, "image"))["usage_today"] == 0
+            assert (await database.reserve_subscription_usage(1, "image"))['reserved'] is True
+            assert (await database.reserve_subscription_usage(1, "image"))['reserved'] is False
+            assert await database.reserve_subscription_usage(1, "chat") is None
+
+    @pytest.mark.asyncio
+    async def test_dashboard(self, tmp_path):
+        async with open_database(tmp_path) as (_, database):
+            await database.insert_user(1)
+            await database.insert_user(2)
+            await database.create_subscription(1, "image", "basic", 5, 30)
+            await database.reserve_subscription_usage(1, "image")
+
+            dashboard = await database.get_dashboard(1)
+            empty = await database.get_dashboard(2)
+            missing = await database.get_dashboard(3)
+
+        assert dashboard[:4] == (3000, 3, 3, 3)
+        assert [(plan.type, plan.plan, plan.daily_limit, plan.usage_today) for plan in dashboard.plans] == [("image", "basic", 5, 1)]
+        assert empty.plans == ()
+        assert missing is None
@@ -0,0 +1,102 @@
+import asyncio
+import pytest
+from unittest.mock import patch
+
+from common.cache import TTLCache
+
+class TestTTLCache:
+    def test_hit_and_miss(self):
+        cache = TTLCache(max_size=10, ttl=60)
+        cache.set(1, "a")
+
+        assert cache.get(1) == "a"
+        assert cache.get(2) is None
+        assert cache.stats()["hits"] == 1
+        assert cache.stats()["misses"] == 1
+
+    def test_evicts_least_recently_used(self):
+        cache = TTLCache(max_size=2, ttl=60)
+        cache[1] = "a"
+        cache[2] = "b"
+        cache.get(1)
+        cache[3] = "c"
+
+        assert 2 not in cache
+        assert cache[1] == "a"
+        assert cache[3] == "c"
+        assert cache.stats()["evictions"] == 1
+
+    def test_expired_entry_is_a_miss(self):
+        cache = TTLCache(max_size=10, ttl=60)
+        with patch("common.cache.time.time", return_value=1000):
+            cache[1] = "a"
+        with patch("common.cache.time.time", return_value=1061):
+            assert cache.get(1) is None
+            assert 1 not in cache
+
+        assert len(cache) == 0
+        assert cache.stats()["expirations"] == 1
+
+    def test_sweep_removes_expired(self):
+        cache = TTLCache(max_size=10, ttl=60)
+        with patch("common.cache.time.time", return_value=1000):
+            cache[1] = "a"
+            cache.set(2, "b", ttl=600)
+        with patch("common.cache.time.time", return_value=1100):
+            assert cache.sweep() == 1
+
+        assert list(cache) == [2]
+
+    @pytest.mark.asyncio
+    async def test_background_sweep(self):
+        cache = TTLCache(max_size=10, ttl=0.01, sweep_interval=0.01)
+        cache[1] = "a"
+        cache.start()
+        await asyncio.sleep(0.05)
+        await cache.close()
+
+        assert len(cache) == 0
+
+    def test_persistence(self, tmp_path):
+        path = str(tmp_path / "payments.json")
+        cache = TTLCache(max_size=10, ttl=60, persist_path=path)
+        cache["p1"] = {"user_id": 1, "status": "pending"}
+        cache["p2"] = {"user_id": 2, "status": "pending"}
+        del cache["p2"]
+
+        restored = TTLCache(max_size=10, ttl=60, persist_path=path)
+
+        assert restored["p1"] == {"user_id": 1, "status": "pending"}
+        assert "p2" not in restored
+
+    def test_persistence_skips_expired(self, tmp_path):
+        path = str(tmp_path / "payments.json")
+        with patch("common.cache.time.time", return_value=1000):
+            TTLCache(max_size=10, ttl=60, persist_path=path)["p1"] = "a"
+        with patch("common.cache.time.time", return_value=1100):
+            restored = TTLCache(max_size=10, ttl=60, persist_path=path)
+
+        assert len(restored) == 0
+
+    @pytest.mark.asyncio
+    async def test_persistence_is_batched_off_the_loop(self, tmp_path):
+        path = str(tmp_path / "payments.json")
+        cache = TTLCache(max_size=10, ttl=60, persist_path=path, persist_delay=0.01)
+        with patch.object(TTLCache, "_write", autospec=True, side_effect=TTLCache._write) as write:
+            for i in range(50):
+                cache[f"p{i}"] = i
+            # Nothing is written by set() itself
+            assert write.call_count == 0
+            await asyncio.sleep(0.05)
+
+        assert write.call_count == 1
+        assert len(TTLCache(max_size=100, ttl=60, persist_path=path)) == 10
+
+    @pytest.mark.asyncio
+    async def test_close_writes_pending_changes(self, tmp_path):
+        path = str(tmp_path / "payments.json")
+        cache = TTLCache(max_size=10, ttl=60, persist_path=path, persist_delay=60)
+        cache["p1"] = "a"
+        await cache.close()
+
+        assert TTLCache(max_size=10, ttl=60, persist_path=path)["p1"] == "a"
@@ -0,0 +1,75 @@
+import pytest
+from unittest.mock import AsyncMock
+
+from app.bot.utils import encoding
+from app.services.context import ContextBuilder, SYSTEM_PROMPT, SYSTEM_TOKENS
+
+class TestBuild:
+    @pytest.mark.asyncio
+    async def test_build_within_budget(self):
+        database = AsyncMock()
+        database.check_subscription.return_value = None
+        database.get_history.return_value = [(1, "user", "question", 10), (2, "assistant", "answer", 20)]
+        database.get_summary.return_value = None
+        openai = AsyncMock()
+
+        context = ContextBuilder(database, openai, budgets={None: 100})
+
+        messages, tokens = await context.build(1)
+
+        assert messages == [{"role": "system", "content": SYSTEM_PROMPT},
+                            {"role": "user", "content": "question"},
+                            {"role": "assistant", "content": "answer"}]
+        assert tokens == SYSTEM_TOKENS + 30
+        openai.summarize.assert_not_awaited()
+        database.save_summary.assert_not_awaited()
+
+    @pytest.mark.asyncio
+    async def test_build_uses_plan_budget(self):
+        database = AsyncMock()
+        database.check_subscription.return_value = {'plan': 'expert'}
+        database.get_history.return_value = [(1, "user", "question", 150)]
+        database.get_summary.return_value = None
+        openai = AsyncMock()
+
+        context = ContextBuilder(database, openai, budgets={None: 100, "expert": 200})
+
+        await context.build(1)
+
+        database.check_subscription.assert_awaited_once_with(1, "chat")
+        openai.summarize.assert_not_awaited()
+
+    @pytest.mark.asyncio
+    async def test_build_compacts_old_turns(self):
+        database = AsyncMock()
+        database.check_subscription.return_value = None
+        database.get_history.return_value = [(1, "user", "q1", 40), (2, "assistant", "a1", 40), (3, "user", "q2", 30)]
+        database.get_summary.return_value = ("old summary", 5)
+        openai = AsyncMock()
+        openai.summarize.return_value = "summary"
+
+        context = ContextBuilder(database, openai, budgets={None: 100})
+
+        messages, tokens = await context.build(1)
+
+        openai.summarize.assert_awaited_once_with("Earlier summary:\nold summary\n\nuser: q1\nassistant: a1", 1, 85)
+        database.save_summary.assert_awaited_once_with(1, "summary", len(encoding.encode("summary")), 2)
+        assert messages == [{"role": "system", "content": SYSTEM_PROMPT},
+                            {"role": "system", "content": "Summary of the earlier conversation:\nsummary"},
+                            {"role": "user", "content": "q2"}]
+        assert tokens == SYSTEM_TOKENS + len(encoding.encode("summary")) + 30
+
+    @pytest.mark.asyncio
+    async def test_build_keeps_last_turn(self):
+        database = AsyncMock()
+        database.check_subscription.return_value = None
+        database.get_history.return_value = [(1, "user", "long question", 500)]
+        database.get_summary.return_value = None
+        openai = AsyncMock()
+
+        context = ContextBuilder(database, openai, budgets={None: 100})
+
+        messages, _ = await context.build(1)
+
+        assert messages[-1] == {"role": "user", "content": "long question"}
+        openai.summarize.assert_not_awaited()
@@ -1,3 +1,4 @@
+import asyncio
 import pytest
 from unittest.mock import AsyncMock
 
@@ -31,6 +32,8 @@ class TestGetPrice:
 
         assert cost == 5
 
+        await crypto.close()
+
     @pytest.mark.asyncio
     async def test_getprice_cryptopay_error(self):
         crypto = CryptoPay('token')
@@ -43,6 +46,102 @@ class TestGetPrice:
         with pytest.raises(Exception):
             _ = await crypto.getprice(5, 'TON')
 
+    @pytest.mark.asyncio
+    async def test_getprice_cached(self):
+        crypto = CryptoPay('token')
+        crypto.crypto = AsyncMock()
+
+        crypto.crypto.get_exchange_rates = AsyncMock()
+        crypto.crypto.get_exchange_rates.return_value = [Rate('TON', 'USD', 5), Rate('NOT', 'USD', 0.5), Rate('TON', 'RUB', 400)]
+
+        assert await crypto.getprice(5, 'TON') == 1
+        assert await crypto.getprice(5, 'NOT') == 10
+        assert await crypto.getprice(5, 'USDT') == 5
+
+        crypto.crypto.get_exchange_rates.assert_awaited_once_with()
+
+        await crypto.close()
+
+    @pytest.mark.asyncio
+    async def test_getprice_single_flight(self):
+        crypto = CryptoPay('token')
+        crypto.crypto = AsyncMock()
+
+        async def get_exchange_rates():
+            await asyncio.sleep(0.01)
+            return [Rate('BTC', 'USD', 50000)]
+
+        crypto.crypto.get_exchange_rates = AsyncMock(side_effect=get_exchange_rates)
+
+        costs = await asyncio.gather(*[crypto.getprice(5, 'BTC') for _ in range(5)])
+
+        assert costs == [5 / 50000] * 5
+        crypto.crypto.get_exchange_rates.assert_awaited_once_with()
+
+        await crypto.close()
+
+    @pytest.mark.asyncio
+    async def test_getprice_stale_rates_refreshed(self):
+        crypto = CryptoPay('token', max_age=0)
+        crypto.crypto = AsyncMock()
+
+        crypto.crypto.get_exchange_rates = AsyncMock()
+        crypto.crypto.get_exchange_rates.return_value = [Rate('ETH', 'USD', 1)]
+
+        await crypto.getprice(5, 'ETH')
+        await crypto.getprice(5, 'ETH')
+
+        assert len(crypto.crypto.get_exchange_rates.mock_calls) == 2
+
+        await crypto.close()
+
+    def test_max_age_follows_refresh_interval(self):
+        assert CryptoPay('token').max_age == 300
+        assert CryptoPay('token', refresh_interval=600).max_age == 1200
+        assert CryptoPay('token', refresh_interval=600, max_age=30).max_age == 30
+
+    @pytest.mark.asyncio
+    async def test_long_refresh_interval_serves_cached_rates(self):
+        crypto = CryptoPay('token', refresh_interval=600)
+        crypto.crypto = AsyncMock()
+        crypto.crypto.get_exchange_rates = AsyncMock(return_value=[Rate('TON', 'USD', 1)])
+
+        await crypto.getprice(5, 'TON')
+        # Чуть позже обычного предела в 300 с, но до следующего фонового обновления
+        crypto.rates_updated -= 400
+        await crypto.getprice(5, 'TON')
+
+        crypto.crypto.get_exchange_rates.assert_awaited_once_with()
+
+        await crypto.close()
+
+    @pytest.mark.asyncio
+    async def test_close_cancels_background_refresh(self):
+        crypto = CryptoPay('token')
+        crypto.crypto = AsyncMock()
+        crypto.crypto.get_exchange_rates = AsyncMock(return_value=[Rate('TON', 'USD', 1)])
+
+        await crypto.getprice(5, 'TON')
+        task = crypto._background_task
+        await crypto.close()
+        await asyncio.sleep(0)
+
+        assert task.cancelled()
+        assert crypto._background_task is None
+
+    @pytest.mark.asyncio
+    async def test_getprice_unknown_currency(self):
+        crypto = CryptoPay('token')
+        crypto.crypto = AsyncMock()
+
+        crypto.crypto.get_exchange_rates = AsyncMock()
+        crypto.crypto.get_exchange_rates.return_value = [Rate('TON', 'USD', 1)]
+
+        with pytest.raises(Exception):
+            _ = await crypto.getprice(5, 'DOGE')
+
+        await crypto.close()
+
 class TestCreateInvoice:
     @pytest.mark.asyncio
     async def test_create_invoice_success(self):
@@ -0,0 +1,114 @@
+import asyncio
+import datetime
+from collections import defaultdict
+from contextlib import contextmanager
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from database.models import Base, User, UserLimit, Subscription, SubscriptionPlan
+from bot.utils import session_utils
+from bot.services.dashboard_service import DashboardService, PlanInfo
+from bot.services.message_log_buffer import MessageLogBuffer
+
+NOW = datetime.datetime.utcnow()
+
+@pytest.fixture
+def scope(tmp_path, monkeypatch):
+    engine = create_engine(f"sqlite:///{tmp_path / 'dashboard.db'}")
+    Base.metadata.create_all(engine)
+    factory = sessionmaker(bind=engine)
+
+    @contextmanager
+    def session_scope():
+        session = factory()
+        try:
+            yield session
+            session.commit()
+        finally:
+            session.close()
+
+    monkeypatch.setattr(session_utils, "session_scope", session_scope)
+    monkeypatch.setattr(MessageLogBuffer, "_usage", defaultdict(lambda: defaultdict(int)))
+    monkeypatch.setattr(MessageLogBuffer, "_inflight_usage", {})
+    with session_scope() as session:
+        session.add_all([
+            User(id=1, telegram_id="100", referral_code="R1", stars=42),
+            SubscriptionPlan(id=1, name="Starter", stars_cost=100, duration_days=7, daily_limit=20, plan_type="text"),
+            SubscriptionPlan(id=2, name="Super", stars_cost=450, duration_days=30, daily_limit=-1, plan_type="text"),
+            SubscriptionPlan(id=3, name="Mini", stars_cost=80, duration_days=7, daily_limit=5, plan_type="image"),
+        ])
+    return session_scope
+
+def add_limits(scope, reset_date):
+    with scope() as session:
+        session.add(UserLimit(
+            user_id=1, reset_date=reset_date,
+            text_messages_used=3, text_messages_limit=5,
+            voice_messages_used=1, voice_messages_limit=5,
+            image_generations_used=1, image_generations_limit=1,
+        ))
+
+def dashboard(telegram_id=100):
+    return asyncio.run(DashboardService.get_dashboard(telegram_id))
+
+def test_unknown_user(scope):
+    assert dashboard(999) is None
+
+def test_usage_of_today_includes_pending_buffer(scope):
+    add_limits(scope, NOW)
+    MessageLogBuffer._usage[1]['text'] += 2
+    MessageLogBuffer._inflight_usage = {1: {'image': 1}}
+
+    result = dashboard()
+
+    assert (result.user_id, result.stars) == (1, 42)
+    assert (result.text_messages_used, result.text_messages_limit) == (5, 5)
+    assert (result.voice_messages_used, result.voice_messages_limit) == (1, 5)
+    assert (result.image_generations_used, result.image_generations_limit) == (2, 1)
+    assert result.plans == ()
+
+def test_stale_reset_date_counts_as_zero(scope):
+    add_limits(scope, NOW - datetime.timedelta(days=1))
+    MessageLogBuffer._usage[1]['voice'] += 1
+
+    result = dashboard()
+
+    assert result.text_messages_used == 0
+    assert result.image_generations_used == 0
+    # Only what was used since, still in the buffer
+    assert result.voice_messages_used == 1
+    assert result.text_messages_limit == 5
+
+def test_user_without_limits_row(scope):
+    result = dashboard()
+
+    assert result.user_id == 1
+    assert (result.text_messages_used, result.text_messages_limit) == (0, 0)
+    assert (result.voice_messages_used, result.voice_messages_limit) == (0, 0)
+    assert (result.image_generations_used, result.image_generations_limit) == (0, 0)
+
+def test_multiple_active_plans(scope):
+    add_limits(scope, NOW)
+    soon, later, latest = (NOW + datetime.timedelta(days=days) for days in (1, 5, 20))
+    with scope() as session:
+        session.add_all([
+            Subscription(user_id=1, plan_id=2, end_date=latest, is_active=True),
+            Subscription(user_id=1, plan_id=1, end_date=soon, is_active=True),
+            Subscription(user_id=1, plan_id=3, end_date=later, is_active=True),
+            # Neither ended nor inactive subscriptions are shown
+            Subscription(user_id=1, plan_id=1, end_date=NOW - datetime.timedelta(days=1), is_active=True),
+            Subscription(user_id=1, plan_id=2, end_date=latest, is_active=False),
+        ])
+
+    result = dashboard()
+
+    assert result.plans == (
+        PlanInfo("Starter", "text", 20, soon),
+        PlanInfo("Mini", "image", 5, later),
+        PlanInfo("Super", "text", -1, latest),
+    )
+    assert [plan.name for plan in result.plans_of("text")] == ["Starter", "Super"]
+    # One row per plan does not multiply the usage
+    assert result.text_messages_used == 3
@@ -703,13 +703,14 @@ class TestSaveMessage:
         mock_connection = AsyncContextManager()
 
         mock_cursor = AsyncContextManager()
+        mock_cursor.fetchone.return_value = (7,)
         mock_connection.cursor.return_value = mock_cursor
 
         database.pool.connection.return_value = mock_connection
 
-        await database.save_message(1,'user', 'message', 1)
+        assert await database.save_message(1,'user', 'message', 1) == 7
 
-        mock_cursor.execute.assert_awaited_once_with("INSERT INTO messages(user_id, role, content, tokens) VALUES (%s, %s, %s, %s)", (1,'user', 'message', 1))
+        mock_cursor.execute.assert_awaited_once_with("INSERT INTO messages(user_id, role, content, tokens) VALUES (%s, %s, %s, %s) RETURNING id", (1,'user', 'message', 1))
 
         mock_connection.commit.assert_awaited_once_with()
 
@@ -731,7 +732,27 @@ class TestSaveMessage:
         with pytest.raises(Exception):
             await database.save_message(1,'user', 'message', 1)
 
-        mock_cursor.execute.assert_awaited_once_with("INSERT INTO messages(user_id, role, content, tokens) VALUES (%s, %s, %s, %s)", (1,'user', 'message', 1))
+        mock_cursor.execute.assert_awaited_once_with("INSERT INTO messages(user_id, role, content, tokens) VALUES (%s, %s, %s, %s) RETURNING id", (1,'user', 'message', 1))
+
+        mock_connection.commit.assert_awaited_once_with()
+
+class TestDeleteMessage:
+    @pytest.mark.asyncio
+    async def test_delete_message_success(self):
+        database = DataBase(AsyncMock())
+
+        database.pool = MagicMock()
+
+        mock_connection = AsyncContextManager()
+
+        mock_cursor = AsyncContextManager()
+        mock_connection.cursor.return_value = mock_cursor
+
+        database.pool.connection.return_value = mock_connection
+
+        await database.delete_message(1, 7)
+
+        mock_cursor.execute.assert_awaited_once_with("DELETE FROM messages WHERE user_id = %s AND id = %s", (1, 7))
 
         mock_connection.commit.assert_awaited_once_with()
 
@@ -751,7 +772,8 @@ class TestDeleteMessages:
 
         await database.delete_messages(1)
 
-        mock_cursor.execute.assert_awaited_once_with("DELETE FROM messages WHERE user_id = %s", (1,))
+        mock_cursor.execute.assert_has_calls([call("DELETE FROM messages WHERE user_id = %s", (1,)),
+                                              call("DELETE FROM summaries WHERE user_id = %s", (1,))])
 
         mock_connection.commit.assert_awaited_once_with()
 
@@ -773,7 +795,8 @@ class TestDeleteMessages:
         with pytest.raises(Exception):
             await database.delete_messages(1)
 
-        mock_cursor.execute.assert_awaited_once_with("DELETE FROM messages WHERE user_id = %s", (1,))
+        mock_cursor.execute.assert_has_calls([call("DELETE FROM messages WHERE user_id = %s", (1,)),
+                                              call("DELETE FROM summaries WHERE user_id = %s", (1,))])
 
         mock_connection.commit.assert_awaited_once_with()
 
@@ -849,4 +872,97 @@ class TestGetMessages:
                     WHERE tokens_total <= 128000
                     ORDER BY id ASC;""", (1,))
 
-        mock_cursor.fetchall.assert_awaited_once_with()
\ No newline at end of file
+        mock_cursor.fetchall.assert_awaited_once_with()
+class TestCreditPayment:
+    @pytest.mark.asyncio
+    async def test_credit_payment_success(self):
+        database = DataBase(AsyncMock())
+
+        database.pool = MagicMock()
+
+        mock_connection = AsyncContextManager()
+
+        mock_cursor = AsyncContextManager()
+        mock_connection.cursor.return_value = mock_cursor
+
+        mock_cursor.fetchone.return_value = (1,)
+
+        database.pool.connection.return_value = mock_connection
+
+        result = await database.credit_payment("telegram_stars", "charge", 1, "dall_e")
+
+        assert len(mock_cursor.execute.mock_calls) == 2
+
+        mock_cursor.execute.assert_awaited_with("UPDATE users SET dall_e = dall_e + %s WHERE user_id = %s", (50, 1))
+
+        mock_connection.commit.assert_awaited_once_with()
+
+        assert result == True
+
+    @pytest.mark.asyncio
+    async def test_credit_payment_duplicate(self):
+        database = DataBase(AsyncMock())
+
+        database.pool = MagicMock()
+
+        mock_connection = AsyncContextManager()
+
+        mock_cursor = AsyncContextManager()
+        mock_connection.cursor.return_value = mock_cursor
+
+        mock_cursor.fetchone.return_value = None
+
+        database.pool.connection.return_value = mock_connection
+
+        result = await database.credit_payment("telegram_stars", "charge", 1, "dall_e")
+
+        assert len(mock_cursor.execute.mock_calls) == 1
+
+        mock_connection.commit.assert_not_awaited()
+
+        assert result == False
+
+    @pytest.mark.asyncio
+    async def test_credit_payment_database_error(self):
+        database = DataBase(AsyncMock())
+
+        database.pool = MagicMock()
+
+        mock_connection = AsyncContextManager()
+        mock_connection.commit.side_effect = Exception()
+
+        mock_cursor = AsyncContextManager()
+        mock_connection.cursor.return_value = mock_cursor
+
+        mock_cursor.fetchone.return_value = (1,)
+
+        database.pool.connection.return_value = mock_connection
+
+        with pytest.raises(Exception):
+            await database.credit_payment("telegram_stars", "charge", 1, "chatgpt")
+
+class TestApplyPendingPayments:
+    @pytest.mark.asyncio
+    async def test_apply_pending_payments_success(self):
+        database = DataBase(AsyncMock())
+
+        database.pool = MagicMock()
+
+        mock_connection = AsyncContextManager()
+
+        mock_cursor = AsyncContextManager()
+        mock_connection.cursor.return_value = mock_cursor
+
+        mock_cursor.fetchall.return_value = [(5, 'cryptopay', '10', 1, 'stable')]
+
+        database.pool.connection.return_value = mock_connection
+
+        result = await database.apply_pending_payments(10)
+
+        mock_cursor.execute.assert_has_calls([call("UPDATE users SET stable_diffusion = stable_diffusion + %s WHERE user_id = %s", (50, 1)),
+                                              call("DELETE FROM orders WHERE invoice_id = %s", (10,)),
+                                              call("UPDATE payment_events SET status = 'applied', applied_at = NOW() WHERE id = %s", (5,))])
+
+        mock_connection.commit.assert_awaited_once_with()
+
+        assert result == [(1, 'stable')]
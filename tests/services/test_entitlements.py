@@ -0,0 +1,154 @@
+import asyncio
+import datetime
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+pytest.importorskip("telethon")
+pytest.importorskip("telegram")
+
+from common.cache import TTLCache
+from database.models import Base, User, Subscription, SubscriptionPlan, Entitlement
+from bot.services import subscription_service
+from bot.services.subscription_service import SubscriptionService
+
+NOW = datetime.datetime.utcnow()
+
+@pytest.fixture
+def session_factory(tmp_path, monkeypatch):
+    engine = create_engine(f"sqlite:///{tmp_path / 'entitlements.db'}")
+    Base.metadata.create_all(engine)
+    factory = sessionmaker(bind=engine)
+    monkeypatch.setattr(subscription_service, "get_session", factory)
+    monkeypatch.setattr(SubscriptionService, "_entitlement_cache", TTLCache(max_size=100, ttl=60))
+
+    session = factory()
+    session.add(User(id=1, telegram_id="1", referral_code="R1", stars=1000))
+    session.add_all([
+        SubscriptionPlan(id=1, name="Starter", stars_cost=100, duration_days=7, daily_limit=20, plan_type="text"),
+        SubscriptionPlan(id=2, name="Super", stars_cost=450, duration_days=30, daily_limit=-1, plan_type="text"),
+        SubscriptionPlan(id=3, name="Mini", stars_cost=80, duration_days=7, daily_limit=5, plan_type="image"),
+    ])
+    session.commit()
+    session.close()
+    return factory
+
+def entitlements(factory):
+    session = factory()
+    try:
+        return {
+            row.plan_type: (row.daily_limit, row.unlimited, row.subscription_id, row.expires_at)
+            for row in session.query(Entitlement).filter(Entitlement.user_id == 1)
+        }
+    finally:
+        session.close()
+
+def add_subscription(factory, plan_id, end_date, is_active=True):
+    session = factory()
+    subscription = Subscription(user_id=1, plan_id=plan_id, start_date=NOW - datetime.timedelta(days=1), end_date=end_date, is_active=is_active)
+    session.add(subscription)
+    session.commit()
+    subscription_id = subscription.id
+    session.close()
+    return subscription_id
+
+def check(message_type='text'):
+    return asyncio.run(SubscriptionService.check_subscription_limit(1, message_type))
+
+def test_subscribe_writes_the_entitlement(session_factory):
+    assert asyncio.run(SubscriptionService.subscribe_user(1, 1))[0]
+
+    limit, unlimited, subscription_id, expires_at = entitlements(session_factory)['text']
+    assert (limit, unlimited) == (20, False)
+    assert check() == (True, 20, subscription_id)
+    assert check('voice') == (True, 20, subscription_id)
+    assert check('image') == (False, 0, None)
+
+    # The unlimited plan wins, the entitlement expires with the first subscription that ends
+    assert asyncio.run(SubscriptionService.subscribe_user(1, 2))[0]
+    limit, unlimited, unlimited_id, new_expires_at = entitlements(session_factory)['text']
+    assert (limit, unlimited) == (-1, True)
+    assert unlimited_id != subscription_id
+    assert new_expires_at == expires_at
+    # subscribe_user invalidates the cached entry
+    assert check() == (True, -1, unlimited_id)
+
+def test_expiry_removes_or_downgrades_the_entitlement(session_factory):
+    short = add_subscription(session_factory, 2, NOW + datetime.timedelta(seconds=1))
+    long = add_subscription(session_factory, 1, NOW + datetime.timedelta(days=5))
+    image = add_subscription(session_factory, 3, NOW + datetime.timedelta(seconds=1))
+    asyncio.run(SubscriptionService.rebuild_entitlements())
+    assert check() == (True, -1, short)
+    assert check('image') == (True, 5, image)
+
+    session = session_factory()
+    session.query(Subscription).filter(Subscription.id.in_([short, image])).update(
+        {Subscription.end_date: NOW - datetime.timedelta(minutes=1)}, synchronize_session=False
+    )
+    session.commit()
+    session.close()
+
+    assert asyncio.run(SubscriptionService.expire_subscriptions()) == 2
+
+    assert entitlements(session_factory)['text'][:3] == (20, False, long)
+    assert 'image' not in entitlements(session_factory)
+    # The expired entries were dropped from the cache
+    assert check() == (True, 20, long)
+    assert check('image') == (False, 0, None)
+
+def test_expired_entitlement_is_refreshed_on_read(session_factory):
+    add_subscription(session_factory, 1, NOW + datetime.timedelta(days=5))
+    asyncio.run(SubscriptionService.rebuild_entitlements())
+
+    # The subscription ended and the sweeper has not run yet
+    session = session_factory()
+    session.query(Subscription).update({Subscription.end_date: NOW - datetime.timedelta(minutes=1)}, synchronize_session=False)
+    session.query(Entitlement).update({Entitlement.expires_at: NOW - datetime.timedelta(minutes=1)}, synchronize_session=False)
+    session.commit()
+    session.close()
+
+    assert check() == (False, 0, None)
+    assert entitlements(session_factory) == {}
+
+def test_cached_entitlement_is_served_without_the_database(session_factory, monkeypatch):
+    subscription_id = add_subscription(session_factory, 1, NOW + datetime.timedelta(days=5))
+    asyncio.run(SubscriptionService.rebuild_entitlements())
+    assert check() == (True, 20, subscription_id)
+
+    def no_session():
+        raise AssertionError("database used for a cached entitlement")
+
+    monkeypatch.setattr(subscription_service, "get_session", no_session)
+    assert check() == (True, 20, subscription_id)
+
+def test_cached_entry_expires_with_the_entitlement(session_factory):
+    subscription_id = add_subscription(session_factory, 1, NOW + datetime.timedelta(days=5))
+    asyncio.run(SubscriptionService.rebuild_entitlements())
+    assert check() == (True, 20, subscription_id)
+
+    # A cached entry past expires_at is read again even within the cache TTL
+    key = (1, 'text')
+    limit, cached_id, _ = SubscriptionService._entitlement_cache.get(key)
+    SubscriptionService._entitlement_cache.set(key, (limit, cached_id, NOW - datetime.timedelta(seconds=1)))
+    session = session_factory()
+    session.query(Entitlement).delete()
+    session.commit()
+    session.close()
+
+    assert check() == (False, 0, None)
+
+def test_rebuild_recomputes_every_entitlement(session_factory):
+    text = add_subscription(session_factory, 1, NOW + datetime.timedelta(days=5))
+    add_subscription(session_factory, 2, NOW + datetime.timedelta(days=5), is_active=False)
+    session = session_factory()
+    # A stale row left behind for a plan type without subscriptions
+    session.add(Entitlement(user_id=1, plan_type='image', daily_limit=30, expires_at=NOW + datetime.timedelta(days=1)))
+    session.commit()
+    session.close()
+    SubscriptionService._entitlement_cache.set((1, 'text'), (0, None, None))
+
+    asyncio.run(SubscriptionService.rebuild_entitlements())
+
+    assert set(entitlements(session_factory)) == {'text'}
+    assert check() == (True, 20, text)
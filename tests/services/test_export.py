@@ -0,0 +1,98 @@
+import csv
+import datetime
+import gzip
+import io
+import json
+import tracemalloc
+from contextlib import contextmanager
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from database.models import Base, User
+from bot.services import export_service
+from bot.services.export_service import ExportService, ExportError
+
+JOINED = datetime.datetime(2024, 5, 1, 12, 0)
+
+@pytest.fixture
+def fill(tmp_path, monkeypatch):
+    engine = create_engine(f"sqlite:///{tmp_path / 'export.db'}")
+    Base.metadata.create_all(engine)
+    factory = sessionmaker(bind=engine)
+
+    @contextmanager
+    def session_scope():
+        session = factory()
+        try:
+            yield session
+        finally:
+            session.close()
+
+    monkeypatch.setattr(export_service, "session_scope", session_scope)
+
+    def fill_users(count, start=1):
+        with engine.begin() as connection:
+            connection.execute(User.__table__.insert(), [
+                dict(id=i, telegram_id=str(1000 + i), username=f"user{i}", first_name="Имя, \"с\" запятой",
+                     join_date=JOINED, stars=i, referral_code=f"R{i}")
+                for i in range(start, count + 1)
+            ])
+    return fill_users
+
+def test_csv_export(fill):
+    fill(3)
+    chunks = list(ExportService.iter_chunks('users', 'csv', chunk_size=2))
+    # Header with the first batch, then one chunk per batch
+    assert len(chunks) == 2
+
+    rows = list(csv.DictReader(io.StringIO(b"".join(chunks).decode('utf-8'))))
+    assert [row['telegram_id'] for row in rows] == ['1001', '1002', '1003']
+    assert rows[0]['first_name'] == 'Имя, "с" запятой'
+    assert rows[0]['join_date'] == JOINED.isoformat()
+    assert rows[0]['last_name'] == ''
+
+def test_jsonl_gzip_export(fill):
+    fill(5)
+    document = ExportService.to_temporary_file('users', 'jsonl', compress=True, chunk_size=2)
+    with gzip.open(document, 'rt', encoding='utf-8') as lines:
+        records = [json.loads(line) for line in lines]
+
+    assert [record['id'] for record in records] == [1, 2, 3, 4, 5]
+    assert records[4]['stars'] == 5
+    assert records[0]['last_name'] is None
+
+def test_empty_table_exports_header_only(fill):
+    assert b"".join(ExportService.iter_chunks('messages')).decode().strip() == ",".join(
+        ['id', 'user_id', 'message_type', 'user_message', 'bot_response', 'tokens_used', 'timestamp']
+    )
+
+def test_unknown_export_or_format():
+    with pytest.raises(ExportError):
+        ExportService.validate('secrets', 'csv')
+    with pytest.raises(ExportError):
+        list(ExportService.iter_chunks('users', 'xml'))
+
+def test_streaming_response_headers(fill):
+    fill(2)
+    response = ExportService.streaming_response('users', 'csv', compress=True)
+    assert response.media_type == 'application/gzip'
+    assert response.headers['content-disposition'].startswith('attachment; filename="users-')
+    assert response.headers['content-disposition'].endswith('.csv.gz"')
+
+def peak_memory():
+    tracemalloc.start()
+    try:
+        size = sum(len(chunk) for chunk in ExportService.iter_chunks('users', 'csv', compress=True, chunk_size=500))
+        return tracemalloc.get_traced_memory()[1], size
+    finally:
+        tracemalloc.stop()
+
+def test_memory_does_not_grow_with_table_size(fill):
+    fill(2000)
+    small, small_size = peak_memory()
+    fill(20000, start=2001)
+    large, large_size = peak_memory()
+    assert large_size > small_size * 5
+    assert large < small * 2
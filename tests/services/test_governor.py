@@ -0,0 +1,147 @@
+import asyncio
+import pytest
+
+from app.services.governor import Governor, GovernorBusyError, ProviderLimits, TokenBucket, share_limits
+
+class TestTokenBucket:
+    def test_reserve_within_capacity(self):
+        bucket = TokenBucket(60)
+
+        assert bucket.reserve(30) == 0
+        assert bucket.reserve(30) == 0
+
+    def test_reserve_over_capacity_returns_wait(self):
+        bucket = TokenBucket(60)
+
+        bucket.reserve(60)
+        wait = bucket.reserve(2)
+
+        assert 1.9 < wait <= 2
+
+    def test_refund(self):
+        bucket = TokenBucket(60)
+
+        bucket.reserve(60)
+        bucket.refund(60)
+
+        assert bucket.reserve(60) == 0
+
+class TestGovernor:
+    @pytest.mark.asyncio
+    async def test_unknown_provider_is_not_limited(self):
+        governor = Governor()
+
+        async with governor.slot("openai", 1, 100000):
+            pass
+
+    @pytest.mark.asyncio
+    async def test_slot_released(self):
+        governor = Governor({"openai": ProviderLimits(rpm=60, max_concurrency=1)})
+
+        async with governor.slot("openai", 1):
+            assert governor.stats()["openai"]["active"] == 1
+
+        assert governor.stats()["openai"] == {"active": 0, "queued": 0}
+
+    @pytest.mark.asyncio
+    async def test_rate_limit_sheds_load(self):
+        governor = Governor({"openai": ProviderLimits(rpm=60, tpm=600, max_wait=5)})
+
+        async with governor.slot("openai", 1, 600):
+            pass
+
+        with pytest.raises(GovernorBusyError) as e:
+            async with governor.slot("openai", 1, 600):
+                pass
+
+        assert e.value.retry_after >= 5
+        assert governor.stats()["openai"]["active"] == 0
+
+    @pytest.mark.asyncio
+    async def test_queue_full_sheds_load(self):
+        governor = Governor({"openai": ProviderLimits(rpm=600, max_concurrency=1, max_queue_per_user=1)})
+        release = asyncio.Event()
+
+        async def hold(user_id):
+            async with governor.slot("openai", user_id):
+                await release.wait()
+
+        holder = asyncio.create_task(hold(1))
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(hold(2))
+        await asyncio.sleep(0)
+
+        with pytest.raises(GovernorBusyError):
+            async with governor.slot("openai", 2):
+                pass
+
+        release.set()
+        await asyncio.gather(holder, waiter)
+
+    @pytest.mark.asyncio
+    async def test_fair_order_between_users(self):
+        governor = Governor({"openai": ProviderLimits(rpm=6000, max_concurrency=1, max_queue_per_user=3)})
+        release = asyncio.Event()
+        order = []
+
+        async def run(user_id, tag):
+            async with governor.slot("openai", user_id):
+                order.append(tag)
+                if tag == "first":
+                    await release.wait()
+
+        tasks = [asyncio.create_task(run(1, "first"))]
+        await asyncio.sleep(0)
+        for user_id, tag in [(1, "a1"), (1, "a2"), (2, "b1")]:
+            tasks.append(asyncio.create_task(run(user_id, tag)))
+            await asyncio.sleep(0)
+
+        release.set()
+        await asyncio.gather(*tasks)
+
+        assert order == ["first", "a1", "b1", "a2"]
+
+class TestShareLimits:
+    def test_single_worker_keeps_limits(self):
+        limits = {"openai": ProviderLimits(rpm=500, tpm=30000)}
+
+        assert share_limits(limits, 1) == limits
+
+    def test_share_is_rounded_down(self):
+        limits = share_limits({"novita": ProviderLimits(rpm=61, tpm=0, max_concurrency=5, max_queue=9, max_queue_per_user=2)}, 2)["novita"]
+
+        assert (limits.rpm, limits.tpm, limits.max_concurrency, limits.max_queue) == (30, 0, 2, 4)
+        assert limits.max_queue_per_user == 2
+
+    @pytest.mark.asyncio
+    async def test_workers_together_stay_within_limits(self):
+        limits = {"openai": ProviderLimits(rpm=10, tpm=1000, max_concurrency=4, max_queue=10, max_wait=0)}
+        workers = [Governor(share_limits(limits, 2)) for _ in range(2)]
+
+        # Одновременные вызовы: сверх доли воркера запросы ждут в очереди
+        release = asyncio.Event()
+        async def hold(governor, user_id):
+            async with governor.slot("openai", user_id):
+                await release.wait()
+
+        holders = [asyncio.create_task(hold(governor, user_id)) for governor in workers for user_id in range(4)]
+        await asyncio.sleep(0)
+        assert sum(governor.stats()["openai"]["active"] for governor in workers) == 4
+        release.set()
+        await asyncio.gather(*holders, return_exceptions=True)
+
+        # Запросы и токены в минуту: вместе не больше лимита провайдера
+        workers = [Governor(share_limits(limits, 2)) for _ in range(2)]
+        granted = 0
+        tokens = 0
+        for governor in workers:
+            for user_id in range(20):
+                try:
+                    async with governor.slot("openai", user_id, 100):
+                        granted += 1
+                        tokens += 100
+                except GovernorBusyError:
+                    pass
+
+        assert granted <= 10
+        assert tokens <= 1000
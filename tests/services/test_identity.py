@@ -0,0 +1,158 @@
+import asyncio
+import datetime
+from contextlib import contextmanager
+from unittest.mock import AsyncMock
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from common.cache import TTLCache
+from database.models import Base, User, UserLimit
+from bot.services import identity_service
+from bot.services.admin_service import AdminService
+from bot.services.identity_service import IdentityService
+
+@pytest.fixture
+def scope(tmp_path, monkeypatch):
+    engine = create_engine(f"sqlite:///{tmp_path / 'identity.db'}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(engine)
+    factory = sessionmaker(bind=engine)
+
+    @contextmanager
+    def session_scope():
+        session = factory()
+        try:
+            yield session
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+    monkeypatch.setattr(identity_service, "session_scope", session_scope)
+    monkeypatch.setattr(identity_service, "engine", engine)
+    # Class level state is shared by the whole process
+    monkeypatch.setattr(IdentityService, "_cache", TTLCache(max_size=100, ttl=60))
+    monkeypatch.setattr(IdentityService, "_activity", {})
+    monkeypatch.setattr(IdentityService, "_profiles", {})
+    monkeypatch.setattr(AdminService, "get_setting", AsyncMock(side_effect=lambda name, default=None: {
+        'FREE_TEXT_MESSAGES_LIMIT': '7',
+        'FREE_IMAGE_GENERATION_LIMIT': '2',
+    }.get(name, default)))
+    return session_scope
+
+def users(scope):
+    with scope() as session:
+        return [
+            (row.telegram_id, row.username, row.first_name, row.last_name, row.last_activity)
+            for row in session.query(User).order_by(User.id)
+        ]
+
+def resolve(telegram_id=100, username="alice", first_name="Alice", last_name=None):
+    return asyncio.run(IdentityService.resolve(telegram_id, username, first_name, last_name))
+
+def no_session():
+    raise AssertionError("database used for a cached user")
+
+def test_first_contact_creates_the_user_with_limits(scope):
+    user_id = resolve()
+
+    assert [row[:4] for row in users(scope)] == [("100", "alice", "Alice", None)]
+    with scope() as session:
+        limits = session.query(UserLimit).filter(UserLimit.user_id == user_id).one()
+        assert (limits.text_messages_limit, limits.image_generations_limit) == (7, 2)
+    assert IdentityService._cache.get("100") == (user_id, "alice", "Alice", None)
+
+def test_known_user_is_resolved_from_the_cache(scope, monkeypatch):
+    user_id = resolve()
+    monkeypatch.setattr(identity_service, "session_scope", no_session)
+
+    # Same profile and a missing field: no database work, nothing to write but activity
+    assert resolve() == user_id
+    assert resolve(username=None) == user_id
+    assert IdentityService._profiles == {}
+    assert set(IdentityService._activity) == {user_id}
+
+def test_user_loaded_once_from_the_database(scope, monkeypatch):
+    with scope() as session:
+        session.add(User(id=5, telegram_id="100", referral_code="R5", username="alice", first_name="Alice"))
+
+    assert resolve() == 5
+    monkeypatch.setattr(identity_service, "session_scope", no_session)
+    assert resolve() == 5
+    AdminService.get_setting.assert_not_awaited()
+
+def test_profile_change_is_buffered_until_flush(scope, monkeypatch):
+    user_id = resolve()
+
+    real_scope = identity_service.session_scope
+    monkeypatch.setattr(identity_service, "session_scope", no_session)
+    assert resolve(username="alice2", last_name="Smith") == user_id
+    assert IdentityService._profiles == {user_id: ("alice2", "Alice", "Smith")}
+    assert IdentityService._cache.get("100") == (user_id, "alice2", "Alice", "Smith")
+    seen = IdentityService._activity[user_id]
+
+    monkeypatch.setattr(identity_service, "session_scope", real_scope)
+    assert users(scope)[0][1] == "alice"
+    assert asyncio.run(IdentityService.flush()) == 1
+
+    telegram_id, username, first_name, last_name, last_activity = users(scope)[0]
+    assert (username, first_name, last_name) == ("alice2", "Alice", "Smith")
+    assert last_activity == seen
+    assert IdentityService._activity == {} and IdentityService._profiles == {}
+    assert asyncio.run(IdentityService.flush()) == 0
+
+def test_failed_flush_requeues_with_newer_values_winning(scope, monkeypatch):
+    user_id = resolve()
+    IdentityService._profiles = {user_id: ("old", "Alice", None)}
+    stale = IdentityService._activity[user_id]
+    newer = stale + datetime.timedelta(minutes=1)
+
+    def failing_write(activity, profiles):
+        # An update arrives while the batch is being written
+        IdentityService._activity[user_id] = newer
+        raise RuntimeError("database is down")
+
+    monkeypatch.setattr(IdentityService, "_write", staticmethod(failing_write))
+    with pytest.raises(RuntimeError):
+        asyncio.run(IdentityService.flush())
+
+    assert IdentityService._activity == {user_id: newer}
+    assert IdentityService._profiles == {user_id: ("old", "Alice", None)}
+
+def test_concurrent_create_returns_the_existing_user(scope):
+    # Another update of the same user inserted it after our cache miss
+    with scope() as session:
+        session.add(User(id=9, telegram_id="100", referral_code="R9"))
+
+    assert IdentityService._create_user("100", "alice", "Alice", None, {'text_messages_limit': 7}) == 9
+
+    assert len(users(scope)) == 1
+    with scope() as session:
+        # The winner creates the limits, the loser adds nothing
+        assert session.query(UserLimit).count() == 0
+
+def test_taken_referral_code_is_retried(scope, monkeypatch):
+    with scope() as session:
+        session.add(User(id=1, telegram_id="1", referral_code="TAKEN"))
+    codes = iter(["TAKEN", "TAKEN", "FREE"])
+    monkeypatch.setattr(IdentityService, "generate_referral_code", staticmethod(lambda length=8: next(codes)))
+
+    user_id = resolve()
+
+    with scope() as session:
+        assert session.query(User.referral_code).filter(User.id == user_id).scalar() == "FREE"
+        assert session.query(UserLimit).filter(UserLimit.user_id == user_id).count() == 1
+
+def test_gives_up_when_every_referral_code_is_taken(scope, monkeypatch):
+    with scope() as session:
+        session.add(User(id=1, telegram_id="1", referral_code="TAKEN"))
+    monkeypatch.setattr(IdentityService, "generate_referral_code", staticmethod(lambda length=8: "TAKEN"))
+
+    with pytest.raises(RuntimeError):
+        resolve()
+
+    assert len(users(scope)) == 1
+    assert IdentityService._cache.get("100") is None
@@ -0,0 +1,108 @@
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from database.models import Base, User, Transaction, BalanceSnapshot
+from bot.services import ledger_service
+from bot.services.ledger_service import LedgerService
+
+@pytest.fixture
+def session_scope(tmp_path, monkeypatch):
+    engine = create_engine(
+        f"sqlite:///{tmp_path / 'ledger.db'}",
+        connect_args={"check_same_thread": False, "timeout": 30},
+        pool_size=20,
+    )
+    Base.metadata.create_all(engine)
+    factory = sessionmaker(bind=engine)
+
+    @contextmanager
+    def scope():
+        session = factory()
+        try:
+            yield session
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+    monkeypatch.setattr(ledger_service, "session_scope", scope)
+    with scope() as session:
+        session.add(User(id=1, telegram_id="1", referral_code="R1", stars=0))
+    return scope
+
+def balance(scope, user_id=1):
+    with scope() as session:
+        return session.query(User.stars).filter(User.id == user_id).scalar()
+
+def test_debit_requires_balance(session_scope):
+    assert LedgerService.credit(1, 10, "top up") == 10
+    assert LedgerService.debit(1, 4, "chat") == 6
+    assert LedgerService.debit(1, 7, "image") is None
+    assert LedgerService.credit(2, 5, "unknown user") is None
+
+    with session_scope() as session:
+        amounts = [amount for amount, in session.query(Transaction.amount).order_by(Transaction.id)]
+    assert amounts == [10, -4]
+    assert balance(session_scope) == 6
+
+def test_concurrent_debits_never_overdraw(session_scope):
+    LedgerService.credit(1, 50, "top up")
+
+    with ThreadPoolExecutor(max_workers=20) as pool:
+        results = list(pool.map(lambda i: LedgerService.debit(1, 1, f"debit {i}"), range(100)))
+
+    granted = [result for result in results if result is not None]
+    assert len(granted) == 50
+    # Every successful debit saw a distinct balance
+    assert sorted(granted) == list(range(50))
+    assert balance(session_scope) == 0
+    with session_scope() as session:
+        assert session.query(Transaction).filter(Transaction.amount == -1).count() == 50
+    assert LedgerService.verify(1).ok
+
+def test_snapshots_bound_verification(session_scope):
+    LedgerService.credit(1, 30, "top up")
+    assert LedgerService.take_snapshots() == 1
+    # No new transactions, nothing to snapshot
+    assert LedgerService.take_snapshots() == 0
+
+    LedgerService.debit(1, 5, "chat")
+    check = LedgerService.verify(1)
+    assert check.ok and check.expected == 25
+
+    # A balance change that bypassed the ledger is reported
+    with session_scope() as session:
+        session.query(User).filter(User.id == 1).update({User.stars: 100})
+    check = LedgerService.verify(1)
+    assert not check.ok
+    assert (check.expected, check.actual) == (25, 100)
+
+def test_drift_does_not_become_the_baseline(session_scope, caplog):
+    LedgerService.credit(1, 30, "top up")
+    assert LedgerService.take_snapshots() == 1
+    LedgerService.debit(1, 5, "chat")
+    with session_scope() as session:
+        session.query(User).filter(User.id == 1).update({User.stars: 100})
+        # Paid by invoice, not part of users.stars
+        session.add(Transaction(user_id=1, amount=450, description="plan", transaction_type="telegram_stars_subscription"))
+
+    assert LedgerService.take_snapshots() == 1
+
+    assert "Balance of user 1 is 100, the ledger says 25" in caplog.text
+    with session_scope() as session:
+        stars = [stars for stars, in session.query(BalanceSnapshot.stars).order_by(BalanceSnapshot.id)]
+    assert stars == [30, 25]
+    # Still reported after the snapshot
+    check = LedgerService.verify(1)
+    assert (check.expected, check.actual) == (25, 100)
+
+    LedgerService.debit(1, 10, "image")
+    caplog.clear()
+    assert LedgerService.take_snapshots() == 1
+    assert "the ledger says 15" in caplog.text
@@ -0,0 +1,130 @@
+import asyncio
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from database.models import Base, User, UserLimit, MessageLog
+from bot.services import message_log_buffer
+from bot.services.message_log_buffer import MessageLogBuffer
+from bot.utils.config_manager import config
+
+@pytest.fixture
+def scope(tmp_path, monkeypatch):
+    engine = create_engine(f"sqlite:///{tmp_path / 'buffer.db'}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(engine)
+    factory = sessionmaker(bind=engine)
+
+    @contextmanager
+    def session_scope():
+        session = factory()
+        try:
+            yield session
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+    monkeypatch.setattr(message_log_buffer, "session_scope", session_scope)
+    # Class level state is shared by the whole process
+    monkeypatch.setattr(MessageLogBuffer, "_rows", [])
+    monkeypatch.setattr(MessageLogBuffer, "_usage", defaultdict(lambda: defaultdict(int)))
+    monkeypatch.setattr(MessageLogBuffer, "_inflight_usage", {})
+    monkeypatch.setattr(MessageLogBuffer, "_task", None)
+    monkeypatch.setattr(MessageLogBuffer, "_flush_task", None)
+    monkeypatch.setattr(MessageLogBuffer, "_lock", None)
+    with session_scope() as session:
+        session.add(User(id=1, telegram_id="1", referral_code="R1"))
+        session.add(UserLimit(user_id=1, text_messages_used=2, image_generations_used=0, voice_messages_used=0))
+    return session_scope
+
+def text_used(scope):
+    with scope() as session:
+        return session.query(UserLimit.text_messages_used).filter(UserLimit.user_id == 1).scalar()
+
+def test_flush_writes_rows_and_counters(scope):
+    MessageLogBuffer.add_message(1, 'text', 'hi', 'hello', 5)
+    MessageLogBuffer.add_usage(1, 'text')
+    MessageLogBuffer.add_usage(1, 'text')
+    MessageLogBuffer.add_usage(1, 'unknown')
+    assert MessageLogBuffer.pending_usage(1, 'text') == 2
+
+    assert asyncio.run(MessageLogBuffer.flush()) == 1
+
+    assert MessageLogBuffer.pending_usage(1, 'text') == 0
+    assert text_used(scope) == 4
+    with scope() as session:
+        assert session.query(MessageLog.tokens_used).scalar() == 5
+
+@pytest.mark.asyncio
+async def test_batch_being_written_is_still_pending(scope, monkeypatch):
+    started, release = threading.Event(), threading.Event()
+    write = MessageLogBuffer._write
+
+    def slow_write(rows, usage):
+        started.set()
+        release.wait(5)
+        write(rows, usage)
+
+    monkeypatch.setattr(MessageLogBuffer, "_write", staticmethod(slow_write))
+    MessageLogBuffer.add_usage(1, 'text')
+    flush = asyncio.create_task(MessageLogBuffer.flush())
+    await asyncio.to_thread(started.wait, 5)
+
+    # Not committed yet: the database still says 2, the buffer must add 1
+    assert text_used(scope) == 2
+    assert MessageLogBuffer.pending_usage(1, 'text') == 1
+    MessageLogBuffer.add_usage(1, 'text')
+    assert MessageLogBuffer.pending_usage(1, 'text') == 2
+
+    release.set()
+    await flush
+    assert text_used(scope) + MessageLogBuffer.pending_usage(1, 'text') == 4
+
+@pytest.mark.asyncio
+async def test_failed_flush_requeues_the_batch(scope, monkeypatch):
+    write = MessageLogBuffer._write
+
+    def failing_write(rows, usage):
+        raise RuntimeError("database is down")
+
+    monkeypatch.setattr(MessageLogBuffer, "_write", staticmethod(failing_write))
+    MessageLogBuffer.add_message(1, 'text', 'hi', 'hello')
+    MessageLogBuffer.add_usage(1, 'text')
+
+    with pytest.raises(RuntimeError):
+        await MessageLogBuffer.flush()
+    assert MessageLogBuffer.pending_usage(1, 'text') == 1
+    assert len(MessageLogBuffer._rows) == 1
+
+    monkeypatch.setattr(MessageLogBuffer, "_write", staticmethod(write))
+    assert await MessageLogBuffer.flush() == 1
+    assert text_used(scope) == 3
+
+@pytest.mark.asyncio
+async def test_full_batch_flushes_early_and_logs_failures(scope, monkeypatch, caplog):
+    monkeypatch.setitem(config._config, 'MESSAGE_LOG_BATCH_SIZE', 2)
+    MessageLogBuffer.add_usage(1, 'text')
+    assert MessageLogBuffer._flush_task is None
+    MessageLogBuffer.add_usage(1, 'text')
+    assert MessageLogBuffer._flush_task is not None
+    await MessageLogBuffer._flush_task
+    assert text_used(scope) == 4
+
+    def failing_write(rows, usage):
+        raise RuntimeError("database is down")
+
+    monkeypatch.setattr(MessageLogBuffer, "_write", staticmethod(failing_write))
+    MessageLogBuffer.add_usage(1, 'text')
+    MessageLogBuffer.add_usage(1, 'text')
+    await asyncio.wait([MessageLogBuffer._flush_task])
+    await asyncio.sleep(0)
+
+    assert "database is down" in caplog.text
+    assert MessageLogBuffer.pending_usage(1, 'text') == 2
+    MessageLogBuffer._task.cancel()
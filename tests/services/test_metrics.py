@@ -0,0 +1,97 @@
+import pytest
+from unittest.mock import MagicMock
+
+from app.services.metrics import _Metric, Counter, Histogram, Registry, merge_workers, instrument_database, register_pool, track_upstream, DB_LATENCY, DB_ERRORS, UPSTREAM_ERRORS, UPSTREAM_LATENCY
+
+class Database:
+    async def get_chatgpt(self, user_id):
+        return 100
+
+    async def set_chatgpt(self, user_id, result):
+        raise RuntimeError("fail")
+
+class TestRender:
+    def test_metric_kind_must_define_samples(self):
+        class Incomplete(_Metric):
+            def _child(self):
+                return None
+
+        with pytest.raises(TypeError):
+            Incomplete("incomplete", "Incomplete")
+
+    def test_counter_and_histogram(self):
+        registry = Registry()
+        counter = registry.register(Counter("requests", "Requests", ("route",)))
+        histogram = registry.register(Histogram("latency_seconds", "Latency", ("route",), buckets=(0.1, 1)))
+
+        counter.labels("chat").inc()
+        histogram.labels("chat").observe(0.05)
+        histogram.labels("chat").observe(0.5)
+
+        text = registry.render()
+
+        assert 'requests_total{route="chat"} 1.0' in text
+        assert 'latency_seconds_bucket{route="chat",le="0.1"} 1' in text
+        assert 'latency_seconds_bucket{route="chat",le="1"} 2' in text
+        assert 'latency_seconds_bucket{route="chat",le="+Inf"} 2' in text
+        assert 'latency_seconds_count{route="chat"} 2' in text
+        assert "# TYPE latency_seconds histogram" in text
+
+    def test_merge_workers(self):
+        registry = Registry()
+        counter = registry.register(Counter("requests", "Requests", ("route",)))
+        histogram = registry.register(Histogram("latency_seconds", "Latency", buckets=(1,)))
+        counter.labels("chat").inc()
+        histogram.observe(0.5)
+
+        text = merge_workers({"0": registry.render(), "1": registry.render(), "2": None})
+
+        # Заголовки один раз, выборки каждого воркера со своей меткой
+        assert text.count("# TYPE requests counter") == 1
+        assert text.count("# TYPE latency_seconds histogram") == 1
+        assert 'requests_total{worker="0",route="chat"} 1.0' in text
+        assert 'requests_total{worker="1",route="chat"} 1.0' in text
+        assert 'latency_seconds_sum{worker="1"} 0.5' in text
+        assert 'latency_seconds_bucket{worker="0",le="+Inf"} 1' in text
+        assert 'bot_worker_up{worker="1"} 1' in text
+        assert 'bot_worker_up{worker="2"} 0' in text
+        lines = text.splitlines()
+        assert lines.index('requests_total{worker="1",route="chat"} 1.0') < lines.index("# HELP latency_seconds Latency")
+
+    def test_pool_gauge(self):
+        registry = Registry()
+        core = MagicMock()
+        core.stats.return_value = {"pool_size": 4, "requests_waiting": 1}
+
+        register_pool(core, registry)
+
+        text = registry.render()
+        assert 'db_pool{stat="pool_size"} 4' in text
+        assert 'db_pool{stat="requests_waiting"} 1' in text
+
+class TestInstrumentation:
+    @pytest.mark.asyncio
+    async def test_database_methods_are_timed(self):
+        database = instrument_database(Database())
+        before = DB_LATENCY.labels("get_chatgpt").count
+        errors = DB_ERRORS.labels("set_chatgpt").value
+
+        assert await database.get_chatgpt(1) == 100
+        with pytest.raises(RuntimeError):
+            await database.set_chatgpt(1, 5)
+
+        assert DB_LATENCY.labels("get_chatgpt").count == before + 1
+        assert DB_ERRORS.labels("set_chatgpt").value == errors + 1
+
+    @pytest.mark.asyncio
+    async def test_track_upstream_counts_errors(self):
+        errors = UPSTREAM_ERRORS.labels("openai", "test").value
+
+        async with track_upstream("openai", "test"):
+            pass
+        with pytest.raises(ValueError):
+            async with track_upstream("openai", "test"):
+                raise ValueError
+
+        assert UPSTREAM_LATENCY.labels("openai", "test").count >= 2
+        assert UPSTREAM_ERRORS.labels("openai", "test").value == errors + 1
@@ -0,0 +1,81 @@
+import asyncio
+import time
+import pytest
+from unittest.mock import AsyncMock, MagicMock
+
+from bot.services.openai_service import OpenAIService
+
+class SlowCompletions:
+    """Отвечает через delay секунд, как медленный upstream"""
+    def __init__(self, delay: float):
+        self.delay = delay
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def create(self, **kwargs):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        await asyncio.sleep(self.delay)
+        self.in_flight -= 1
+        response = MagicMock()
+        response.choices[0].message.content = "answer"
+        response.usage.total_tokens = 10
+        return response
+
+@pytest.fixture
+def client(monkeypatch):
+    client = MagicMock()
+    monkeypatch.setattr(OpenAIService, "_client", client)
+    return client
+
+class TestOpenAIService:
+    def test_client_is_shared(self, monkeypatch):
+        monkeypatch.setattr("bot.services.openai_service.OPENAI_API_KEY", "token")
+        monkeypatch.setattr(OpenAIService, "_client", None)
+
+        assert OpenAIService().client is OpenAIService().client
+
+    @pytest.mark.asyncio
+    async def test_concurrent_users_are_served_in_parallel(self, client):
+        users, delay = 50, 0.1
+        client.chat.completions = SlowCompletions(delay)
+        service = OpenAIService()
+
+        start = time.perf_counter()
+        results = await asyncio.gather(*(service.generate_text_response(f"question {i}") for i in range(users)))
+        elapsed = time.perf_counter() - start
+
+        assert results == [("answer", 10)] * users
+        assert client.chat.completions.max_in_flight == users
+        # Последовательно это заняло бы users * delay = 5 секунд
+        assert elapsed < delay * 5
+
+    @pytest.mark.asyncio
+    async def test_generate_image(self, client):
+        response = MagicMock()
+        response.data[0].url = "https://image"
+        client.images.generate = AsyncMock(return_value=response)
+
+        assert await OpenAIService().generate_image("cat") == "https://image"
+
+    @pytest.mark.asyncio
+    async def test_transcribe_audio_from_memory(self, client):
+        client.audio.transcriptions.create = AsyncMock(return_value=MagicMock(text="hello"))
+
+        assert await OpenAIService().transcribe_audio(b"ogg") == "hello"
+        assert client.audio.transcriptions.create.call_args.kwargs["file"] == ("voice.ogg", b"ogg")
+
+    @pytest.mark.asyncio
+    async def test_stream_text_response(self, client):
+        async def stream():
+            for content, usage in (("Hel", None), ("lo", None), (None, MagicMock(total_tokens=7))):
+                chunk = MagicMock(usage=usage)
+                chunk.choices = [MagicMock()] if content else []
+                if content:
+                    chunk.choices[0].delta.content = content
+                yield chunk
+        client.chat.completions.create = AsyncMock(return_value=stream())
+
+        parts = [part async for part in OpenAIService().stream_text_response("hi")]
+
+        assert parts == ["Hel", "lo", ("Hello", 7)]
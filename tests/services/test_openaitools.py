@@ -58,6 +58,47 @@ class TestGetChatgpt:
 
         assert answer == None
 
+class Usage:
+    def __init__(self, prompt_tokens: int, cached_tokens: int, completion_tokens: int):
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = completion_tokens
+        self.prompt_tokens_details = Details(cached_tokens)
+
+class Details:
+    def __init__(self, cached_tokens: int):
+        self.cached_tokens = cached_tokens
+
+class TestGetChatgptUsage:
+    @pytest.mark.asyncio
+    async def test_get_chatgpt_usage_success(self):
+        openai = OpenAiTools('token')
+        openai.client = MagicMock()
+        openai.client.chat = MagicMock()
+        openai.client.chat.completions = MagicMock()
+        openai.client.chat.completions.create = AsyncMock()
+        response = Response('answer')
+        response.usage = Usage(2048, 1024, 10)
+        openai.client.chat.completions.create.return_value = response
+
+        answer, usage = await openai.get_chatgpt_usage([])
+
+        assert answer == 'answer'
+        assert usage == {"prompt_tokens": 2048, "cached_tokens": 1024, "completion_tokens": 10}
+
+    @pytest.mark.asyncio
+    async def test_get_chatgpt_usage_error(self):
+        openai = OpenAiTools('token')
+        openai.client = MagicMock()
+        openai.client.chat = MagicMock()
+        openai.client.chat.completions = MagicMock()
+        openai.client.chat.completions.create = AsyncMock()
+        openai.client.chat.completions.create.side_effect = Exception()
+
+        answer, usage = await openai.get_chatgpt_usage([])
+
+        assert answer == None
+        assert usage == {}
+
 class TestGetDallE:
     @pytest.mark.asyncio
     async def test_get_dalle_success(self):
@@ -1,7 +1,7 @@
 import pytest
-from unittest.mock import AsyncMock
+from unittest.mock import AsyncMock, call
 
-from app.services.payment_successful import payment_success
+from app.services.payment_successful import payment_success, apply_pending_payments
 
 from app.services.db import DatabaseError
 
@@ -14,15 +14,39 @@ async def test_payment_success_success():
 
     invoice_id = 1
 
-    mock_db.get_orderdata.return_value = (1, 'chatgpt')
+    mock_db.record_cryptopay_payment.return_value = True
 
-    await payment_success(mock_bot, mock_db, update_type, invoice_id)
+    result = await payment_success(mock_bot, mock_db, update_type, invoice_id)
 
-    mock_db.get_orderdata.assert_awaited_once_with(1)
+    mock_db.record_cryptopay_payment.assert_awaited_once_with(1)
 
-    mock_db.update_chatgpt.assert_awaited_once_with(1, 1)
+    mock_db.update_chatgpt.assert_not_awaited()
 
-    mock_bot.send_message.assert_awaited_once_with(1, "✅You have received 100000 ChatGPT tokens!")
+    mock_bot.send_message.assert_not_awaited()
+
+    assert result == True
+
+@pytest.mark.asyncio
+async def test_payment_success_duplicate():
+    mock_bot = AsyncMock()
+    mock_db = AsyncMock()
+
+    mock_db.record_cryptopay_payment.return_value = False
+
+    result = await payment_success(mock_bot, mock_db, "invoice_paid", 1)
+
+    assert result == False
+
+@pytest.mark.asyncio
+async def test_payment_success_other_update():
+    mock_bot = AsyncMock()
+    mock_db = AsyncMock()
+
+    result = await payment_success(mock_bot, mock_db, "invoice_expired", 1)
+
+    mock_db.record_cryptopay_payment.assert_not_awaited()
+
+    assert result == False
 
 @pytest.mark.asyncio
 async def test_payment_success_database_error():
@@ -33,31 +57,52 @@ async def test_payment_success_database_error():
 
     invoice_id = 1
 
-    mock_db.get_orderdata.side_effect = DatabaseError()
+    mock_db.record_cryptopay_payment.side_effect = DatabaseError()
 
     with pytest.raises(DatabaseError):
         await payment_success(mock_bot, mock_db, update_type, invoice_id)
 
-    mock_db.get_orderdata.assert_awaited_once_with(1)
+    mock_db.record_cryptopay_payment.assert_awaited_once_with(1)
 
 @pytest.mark.asyncio
-async def test_payment_success_telegram_error():
+async def test_apply_pending_payments_success():
     mock_bot = AsyncMock()
     mock_db = AsyncMock()
 
-    update_type = "invoice_paid"
+    mock_db.apply_pending_payments.return_value = [(1, 'chatgpt'), (2, 'dall_e')]
 
-    invoice_id = 1
+    applied = await apply_pending_payments(mock_bot, mock_db, 10)
+
+    mock_db.apply_pending_payments.assert_awaited_once_with(10)
+
+    mock_bot.send_message.assert_has_calls([call(1, "✅You have received 100000 ChatGPT tokens!"),
+                                            call(2, "✅You have received 50 DALL·E image generations!")])
+
+    assert applied == 2
+
+@pytest.mark.asyncio
+async def test_apply_pending_payments_telegram_error():
+    mock_bot = AsyncMock()
+    mock_db = AsyncMock()
 
-    mock_db.get_orderdata.return_value = (1, 'dall_e')
+    mock_db.apply_pending_payments.return_value = [(1, 'stable'), (2, 'midjourney')]
 
     mock_bot.send_message.side_effect = Exception()
 
-    with pytest.raises(Exception):
-        await payment_success(mock_bot, mock_db, update_type, invoice_id)
+    applied = await apply_pending_payments(mock_bot, mock_db)
+
+    assert len(mock_bot.send_message.mock_calls) == 2
+
+    assert applied == 2
+
+@pytest.mark.asyncio
+async def test_apply_pending_payments_database_error():
+    mock_bot = AsyncMock()
+    mock_db = AsyncMock()
 
-    mock_db.get_orderdata.assert_awaited_once_with(1)
+    mock_db.apply_pending_payments.side_effect = DatabaseError()
 
-    mock_db.update_dalle.assert_awaited_once_with(1, 1)
+    with pytest.raises(DatabaseError):
+        await apply_pending_payments(mock_bot, mock_db)
 
-    mock_bot.send_message.assert_awaited_once_with(1, "✅You have received 50 DALL·E image generations!")
\ No newline at end of file
+    mock_bot.send_message.assert_not_awaited()
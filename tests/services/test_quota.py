@@ -0,0 +1,49 @@
+import pytest
+from unittest.mock import AsyncMock
+
+from app.services.quota import QuotaService
+
+@pytest.fixture
+def database():
+    database = AsyncMock()
+    database.reserve_subscription_usage.return_value = None
+    database.reserve_credit.return_value = 2
+    return database
+
+class TestQuotaService:
+    @pytest.mark.asyncio
+    async def test_subscription_is_used_first(self, database):
+        database.reserve_subscription_usage.return_value = {'reserved': True, 'usage_today': 3, 'daily_limit': 5}
+
+        reservation = await QuotaService(database).reserve(1, "image", "midjourney")
+
+        assert (reservation.kind, reservation.granted, reservation.remaining) == ("subscription", True, 2)
+        database.reserve_credit.assert_not_awaited()
+
+    @pytest.mark.asyncio
+    async def test_balance_without_subscription(self, database):
+        database.reserve_credit.return_value = None
+
+        reservation = await QuotaService(database).reserve(1, "image", "midjourney")
+
+        assert (reservation.kind, reservation.granted) == ("balance", False)
+
+    @pytest.mark.asyncio
+    async def test_release_refunds_once(self, database):
+        quota = QuotaService(database)
+        reservation = await quota.reserve(1, "image", "midjourney")
+
+        await quota.release(reservation)
+        await quota.release(reservation)
+
+        database.release_credit.assert_awaited_once_with(1, "midjourney")
+
+    @pytest.mark.asyncio
+    async def test_release_after_commit_keeps_quota(self, database):
+        quota = QuotaService(database)
+        reservation = await quota.reserve(1, "image", "midjourney")
+
+        await quota.commit(reservation)
+        await quota.release(reservation)
+
+        database.release_credit.assert_not_awaited()
@@ -0,0 +1,60 @@
+import datetime
+from contextlib import contextmanager
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from database.models import Base, User, SubscriptionPlan
+from bot.services import records
+from bot.services.records import PlanRecord, UserRecord, fetch_records, select_records, stream_records
+
+@pytest.fixture
+def session_factory(tmp_path, monkeypatch):
+    engine = create_engine(f"sqlite:///{tmp_path / 'records.db'}")
+    Base.metadata.create_all(engine)
+    factory = sessionmaker(bind=engine)
+
+    @contextmanager
+    def session_scope():
+        session = factory()
+        try:
+            yield session
+        finally:
+            session.close()
+
+    monkeypatch.setattr(records, "session_scope", session_scope)
+    now = datetime.datetime.utcnow()
+    with session_scope() as session:
+        session.execute(User.__table__.insert(), [
+            dict(telegram_id=str(i), username=f"user{i}", join_date=now, last_activity=now,
+                 is_active=True, is_blocked=False, stars=i, referral_code=f"R{i}")
+            for i in range(1, 26)
+        ])
+        session.add_all([
+            SubscriptionPlan(name="Big", stars_cost=20, duration_days=30, daily_limit=-1, plan_type="text", is_active=True),
+            SubscriptionPlan(name="Small", stars_cost=5, duration_days=30, daily_limit=10, plan_type="text", is_active=True),
+        ])
+        session.commit()
+    return session_scope
+
+def test_fetch_records_returns_plain_tuples(session_factory):
+    with session_factory() as session:
+        plans = fetch_records(session, PlanRecord, select_records(PlanRecord).order_by(SubscriptionPlan.stars_cost))
+
+    # Usable after the session is closed, no ORM state attached
+    assert [plan.name for plan in plans] == ["Small", "Big"]
+    assert isinstance(plans[0], PlanRecord)
+    assert not hasattr(plans[0], "__dict__")
+
+def test_stream_records_pages_by_id(session_factory):
+    users = list(stream_records(UserRecord, select_records(UserRecord), batch_size=10))
+
+    assert [user.id for user in users] == list(range(1, 26))
+    assert users[4].stars == 5
+
+def test_stream_records_keeps_filters(session_factory):
+    statement = select_records(UserRecord).where(User.stars > 20)
+    users = list(stream_records(UserRecord, statement, batch_size=2))
+
+    assert [user.telegram_id for user in users] == ["21", "22", "23", "24", "25"]
@@ -0,0 +1,113 @@
+import asyncio
+import pytest
+from unittest.mock import AsyncMock, MagicMock, patch
+
+pytest.importorskip("telethon")
+
+from telethon.errors import FloodWaitError
+
+from common.telethon_manager import TelethonManager
+
+@pytest.fixture
+def manager():
+    manager = TelethonManager(1, "hash", "token")
+    manager.client = MagicMock()
+    manager.client.is_connected.return_value = True
+    return manager
+
+class TestRun:
+    @pytest.mark.asyncio
+    async def test_flood_wait_is_retried(self, manager):
+        operation = AsyncMock(side_effect=[FloodWaitError(request=None, capture=0), "ok"])
+
+        result = await manager.run(operation)
+
+        assert result == "ok"
+        assert operation.await_count == 2
+
+    @pytest.mark.asyncio
+    async def test_flood_wait_blocks_other_calls(self, manager):
+        with patch("common.telethon_manager.asyncio.sleep", new=AsyncMock()) as sleep:
+            operation = AsyncMock(side_effect=[FloodWaitError(request=None, capture=5), "ok"])
+            await manager.run(operation)
+            sleep.reset_mock()
+            manager.flood_until += 100
+
+            await manager.run(AsyncMock(return_value="ok"))
+
+        sleep.assert_awaited_once()
+
+    @pytest.mark.asyncio
+    async def test_long_flood_wait_raises(self, manager):
+        manager.max_flood_wait = 10
+        operation = AsyncMock(side_effect=FloodWaitError(request=None, capture=60))
+
+        with pytest.raises(FloodWaitError):
+            await manager.run(operation)
+
+    @pytest.mark.asyncio
+    async def test_reconnects_with_backoff(self, manager):
+        manager.client.is_connected.return_value = False
+        manager.client.start = AsyncMock(side_effect=[ConnectionError("down"), None])
+        manager.base_delay = 0
+
+        client = await manager.get_client()
+
+        assert client is manager.client
+        assert manager.client.start.await_count == 2
+
+class TestCoalesce:
+    @pytest.mark.asyncio
+    async def test_concurrent_calls_share_one_request(self, manager):
+        calls = 0
+
+        async def fetch():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.01)
+            return 42
+
+        results = await asyncio.gather(*(manager.coalesce(("balance", 1), fetch) for _ in range(5)))
+
+        assert results == [42] * 5
+        assert calls == 1
+        assert manager._inflight == {}
+
+class FakeWalletChat:
+    """@wallet that answers each /balance with the id of the command it replies to"""
+    def __init__(self):
+        self.messages = []
+
+    def _add(self, text, out):
+        message = MagicMock(id=len(self.messages) + 1, text=text, out=out)
+        self.messages.append(message)
+        return message
+
+    async def _reply(self, sent):
+        await asyncio.sleep(0.01)
+        self._add(f"Balance: {sent.id} stars", out=False)
+
+    async def send_message(self, chat, text):
+        sent = self._add(text, out=True)
+        asyncio.ensure_future(self._reply(sent))
+        return sent
+
+    async def iter_messages(self, chat, min_id=0, reverse=False):
+        for message in list(self.messages):
+            if message.id > min_id:
+                yield message
+
+class TestFetchBalance:
+    @pytest.mark.asyncio
+    async def test_concurrent_requests_read_their_own_reply(self):
+        from app.services.telegram_stars import TelegramStarsService
+
+        service = TelegramStarsService(1, "hash", "token", session="test_fetch_balance")
+        service.stars_bot = 777000
+        service.reply_interval = 0.005
+        chat = FakeWalletChat()
+
+        balances = await asyncio.gather(service._fetch_balance(chat), service._fetch_balance(chat))
+
+        # Each reply names the /balance it answers: messages 1 and 3 are the commands
+        assert balances == [1, 3]
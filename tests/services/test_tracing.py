@@ -0,0 +1,80 @@
+import json
+import pytest
+from unittest.mock import MagicMock, patch
+
+from app.services.tracing import JsonlExporter, Tracer, current_trace_id
+
+class TestTracer:
+    @pytest.mark.asyncio
+    async def test_spans_share_trace_and_parent(self):
+        exporter = MagicMock()
+        tracer = Tracer(exporter, sample_rate=1)
+
+        async with tracer.trace("update", update_id=1):
+            trace_id = current_trace_id()
+            async with tracer.span("db.get_chatgpt"):
+                async with tracer.span("openai.chat"):
+                    pass
+
+        spans = exporter.export.call_args.args[0]
+        root = spans[-1]
+        db_span = next(span for span in spans if span.name == "db.get_chatgpt")
+        openai_span = next(span for span in spans if span.name == "openai.chat")
+
+        assert {span.trace_id for span in spans} == {trace_id}
+        assert root.parent_id is None
+        assert db_span.parent_id == root.span_id
+        assert openai_span.parent_id == db_span.span_id
+
+    @pytest.mark.asyncio
+    async def test_unsampled_fast_trace_is_dropped(self):
+        exporter = MagicMock()
+        tracer = Tracer(exporter, sample_rate=0, slow_threshold=10)
+
+        async with tracer.trace("update"):
+            pass
+
+        exporter.export.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_slow_trace_is_always_kept(self):
+        exporter = MagicMock()
+        tracer = Tracer(exporter, sample_rate=0, slow_threshold=1)
+
+        with patch("app.services.tracing.time.time_ns", side_effect=[0, 2_000_000_000]):
+            async with tracer.trace("update"):
+                pass
+
+        exporter.export.assert_called_once()
+
+    @pytest.mark.asyncio
+    async def test_failed_trace_is_kept(self):
+        exporter = MagicMock()
+        tracer = Tracer(exporter, sample_rate=0)
+
+        with pytest.raises(ValueError):
+            async with tracer.trace("update"):
+                raise ValueError("boom")
+
+        assert exporter.export.call_args.args[0][0].error == "ValueError: boom"
+
+    @pytest.mark.asyncio
+    async def test_span_outside_trace_is_noop(self):
+        tracer = Tracer(MagicMock())
+
+        async with tracer.span("db.get_chatgpt") as span:
+            assert span is None
+
+class TestJsonlExporter:
+    @pytest.mark.asyncio
+    async def test_otlp_lines(self, tmp_path):
+        path = tmp_path / "traces.jsonl"
+        tracer = Tracer(JsonlExporter(str(path)), sample_rate=1)
+
+        async with tracer.trace("update", update_id=7):
+            pass
+
+        line = json.loads(path.read_text().splitlines()[0])
+        assert line["name"] == "update"
+        assert len(line["traceId"]) == 32
+        assert line["attributes"] == [{"key": "update_id", "value": {"stringValue": "7"}}]
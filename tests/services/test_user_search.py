@@ -0,0 +1,114 @@
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm import sessionmaker
+
+from database.models import Base, User
+from bot.services.user_search import UserSearch
+
+@pytest.fixture(autouse=True)
+def indexed(monkeypatch):
+    # Index availability is recorded per process
+    monkeypatch.setattr(UserSearch, "_indexed", {})
+    return UserSearch._indexed
+
+@pytest.fixture
+def session(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'search.db'}")
+    Base.metadata.create_all(engine)
+    factory = sessionmaker(bind=engine)
+    with factory() as session:
+        # Users created before the index exists are picked up by the rebuild
+        session.add(User(id=1, telegram_id="1001", username="alice_smith", first_name="Alice", referral_code="R1"))
+        session.commit()
+    assert UserSearch.ensure_index(engine)
+    # Idempotent on restart
+    assert UserSearch.ensure_index(engine)
+
+    with factory() as session:
+        session.add_all([
+            User(id=2, telegram_id="1002", username="smith", first_name="John", last_name="Smith", referral_code="R2"),
+            User(id=3, telegram_id="1003", username=None, first_name="Anna", last_name="Smithson", referral_code="R3"),
+            User(id=4, telegram_id="1004", username="bob", first_name="Bob", referral_code="R4"),
+        ])
+        session.commit()
+        yield session
+
+def ids(records):
+    return [record.id for record in records]
+
+def test_exact_telegram_id_first(session):
+    assert ids(UserSearch.search(session, "1003")) == [3]
+    assert ids(UserSearch.search(session, "1003", offset=20)) == []
+
+def test_substring_search_is_ranked(session):
+    results = UserSearch.search(session, "@Smith")
+    # Exact username first, then the other substring matches
+    assert ids(results)[0] == 2
+    assert sorted(ids(results)) == [1, 2, 3]
+    assert UserSearch.search(session, "nobody") == []
+
+def test_pagination(session):
+    first = UserSearch.search(session, "smith", limit=2)
+    second = UserSearch.search(session, "smith", limit=2, offset=2)
+    assert len(first) == 2 and len(second) == 1
+    assert set(ids(first)).isdisjoint(ids(second))
+
+def test_index_follows_updates_and_deletes(session):
+    session.query(User).filter(User.id == 4).update({User.username: "bobsmith"})
+    session.query(User).filter(User.id == 1).delete()
+    session.commit()
+
+    assert sorted(ids(UserSearch.search(session, "smith"))) == [2, 3, 4]
+    assert ids(UserSearch.search(session, "alice")) == []
+
+def test_short_query_falls_back_to_like(session):
+    assert ids(UserSearch.search(session, "bo")) == [4]
+
+def postgres_session():
+    session = sessionmaker()()
+    captured = {}
+    session.get_bind = lambda: type("Bind", (), {"dialect": postgresql.dialect()})()
+    session.execute = lambda statement: captured.setdefault("sql", str(statement.compile(dialect=postgresql.dialect()))) and []
+    return session, captured
+
+def test_postgres_query_uses_trigram_expression(indexed):
+    indexed['postgresql'] = True
+    session, captured = postgres_session()
+
+    assert UserSearch.search(session, "smith") == []
+    assert "similarity(" in captured["sql"]
+    assert "coalesce(username, '')" in captured["sql"]
+
+def test_postgres_without_pg_trgm_scans_with_like(indexed):
+    indexed['postgresql'] = False
+    session, captured = postgres_session()
+
+    assert UserSearch.search(session, "smith") == []
+    assert "similarity(" not in captured["sql"]
+    assert "ILIKE" in captured["sql"].upper()
+
+def test_failed_index_creation_falls_back_to_like(tmp_path, monkeypatch, indexed):
+    engine = create_engine(f"sqlite:///{tmp_path / 'search.db'}")
+    Base.metadata.create_all(engine)
+    # As if the extension could not be created
+    monkeypatch.setattr("bot.services.user_search.SQLITE_INDEX", ["CREATE EXTENSION pg_trgm"])
+
+    with pytest.raises(Exception):
+        UserSearch.ensure_index(engine)
+    assert indexed == {'sqlite': False}
+
+    with sessionmaker(bind=engine)() as session:
+        session.add(User(id=1, telegram_id="1001", username="alice_smith", referral_code="R1"))
+        session.commit()
+        assert ids(UserSearch.search(session, "smith")) == [1]
+
+def test_index_is_looked_up_when_not_ensured(tmp_path, indexed):
+    engine = create_engine(f"sqlite:///{tmp_path / 'search.db'}")
+    Base.metadata.create_all(engine)
+
+    with sessionmaker(bind=engine)() as session:
+        session.add(User(id=1, telegram_id="1001", username="alice_smith", referral_code="R1"))
+        session.commit()
+        assert ids(UserSearch.search(session, "smith")) == [1]
+    assert indexed == {'sqlite': False}